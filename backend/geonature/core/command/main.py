@@ -202,3 +202,231 @@ def update_configuration(conf_file, build, prod):
     # Recréation du fichier de routing car il dépend de la conf
     frontend_routes_templating()
     update_app_configuration(conf_file, build, prod)
+
+
+@main.command()
+def refresh_generic_tables():
+    """
+        Reflète à nouveau les vues utilisées par les GenericTable (vues d'export...)
+        dans tous les processus de l'API, à lancer après la modification d'une vue
+    """
+    from geonature.utils.reflection import refresh_generic_tables as refresh
+
+    refresh()
+    log.info("Generic tables will be reflected again at their next use")
+
+
+@main.command()
+def refresh_taxons_autocomplete():
+    """
+        Reconstruit l'index en mémoire des taxons de l'autocomplétion de la synthèse
+        dans tous les processus de l'API (après la suppression d'observations
+        ou une mise à jour de TAXREF)
+    """
+    from geonature.core.gn_synthese.utils.taxons_index import refresh_index
+
+    refresh_index()
+    log.info("The taxa autocomplete index will be rebuilt at the next search")
+
+
+@main.command()
+def refresh_taxref_tree():
+    """
+        Calcule à nouveau les intervalles de l'arbre de TAXREF
+        (filtre par taxon parent de la synthèse), à lancer après une mise à jour de TAXREF
+    """
+    from geonature.core.gn_synthese.utils.taxref_tree import refresh_taxref_tree as refresh
+
+    app = get_app_for_cmd(with_flask_admin=False)
+    with app.app_context():
+        refresh()
+    log.info("The TAXREF tree has been computed again")
+
+
+@main.command()
+def export_dem():
+    """
+        Exporte le MNT (ref_geo.dem) dans une grille lue par l'API (paramètre USE_DEM_SAMPLER),
+        à lancer après chaque mise à jour du MNT
+    """
+    from geonature.core.ref_geo.dem import export_dem as export, DEM_DIR
+
+    app = get_app_for_cmd(with_flask_admin=False)
+    with app.app_context():
+        height, width = export()
+    log.info("DEM exported in %s (%s x %s pixels)", DEM_DIR, width, height)
+
+
+@main.command()
+@click.option("--dry-run", is_flag=True, help="Liste les médias et fichiers à supprimer")
+@click.option("--time-budget", default=0, help="Durée max (en secondes) du parcours des fichiers")
+def sync_medias(dry_run, time_budget):
+    """
+        Synchronise les médias et les fichiers : supprime les médias temporaires
+        de plus de 24h et les fichiers dont le média n'existe plus
+        (seuls les répertoires modifiés depuis la dernière synchronisation sont relus)
+    """
+    from geonature.core.gn_commons.medias_sync import sync_medias as sync
+
+    app = get_app_for_cmd(with_flask_admin=False)
+    with app.app_context():
+        report = sync(dry_run=dry_run, time_budget=time_budget)
+    if dry_run:
+        for id_media in report["temp_medias"]:
+            click.echo("temporary media {}".format(id_media))
+        for path in report["deleted_thumbnails"] + report["renamed_files"]:
+            click.echo("file without media {}".format(path))
+    log.info(
+        "%s temporary medias, %s thumbnails and %s files without media%s, %s directories read%s",
+        len(report["temp_medias"]),
+        len(report["deleted_thumbnails"]),
+        len(report["renamed_files"]),
+        " (dry run)" if dry_run else "",
+        report["nb_dirs_read"],
+        "" if report["complete"] else " (incomplete, continued at the next synchronization)",
+    )
+
+
+@main.command()
+@click.option(
+    "--id-role",
+    "id_roles",
+    multiple=True,
+    type=int,
+    help="Utilisateur à synchroniser (par défaut : les utilisateurs actifs)",
+)
+@click.option("--force", is_flag=True, help="Relit tous les documents, même non modifiés")
+@click.option(
+    "--interval", default=0, help="Relance la synchronisation toutes les <interval> secondes"
+)
+def sync_mtd(id_roles, force, interval):
+    """
+        Synchronise les cadres d'acquisition et JDD des utilisateurs depuis le webservice MTD
+        (seuls les documents modifiés depuis la dernière synchronisation sont relus),
+        à lancer par une tâche planifiée ou en continu avec --interval
+    """
+    import time
+    from geonature.core.gn_meta.mtd_sync import sync_users
+
+    app = get_app_for_cmd(with_flask_admin=False)
+    while True:
+        with app.app_context():
+            report = sync_users(id_roles=list(id_roles) or None, force=force)
+        log.info(
+            "MTD sync: %s users (%s unchanged), %s documents (%s unchanged), "
+            "%s acquisition frameworks and %s datasets upserted, %s actors added, %s errors",
+            report["nb_users"],
+            report["nb_unchanged_users"],
+            report["nb_documents"],
+            report["nb_unchanged_documents"],
+            report["nb_acquisition_frameworks"],
+            report["nb_datasets"],
+            report["nb_actors"],
+            len(report["errors"]),
+        )
+        if not interval:
+            break
+        time.sleep(interval)
+
+
+@main.command()
+@click.option("--full", is_flag=True, help="Recalcule les statistiques de tous les JDD")
+def refresh_synthese_stats(full):
+    """
+        Calcule les statistiques par JDD de la synthèse (JDD modifiés depuis
+        le dernier calcul, ou tous les JDD avec --full, un lot de JDD par transaction)
+    """
+    from geonature.core.gn_synthese.utils.stats import refresh_all_stats, refresh_dirty_stats
+
+    app = get_app_for_cmd(with_flask_admin=False)
+    with app.app_context():
+        if full:
+            refresh_all_stats()
+        else:
+            refresh_dirty_stats()
+    log.info("Synthese stats computed")
+
+
+@main.command()
+@click.option("--limit", default=20, help="Nombre de combinaisons (route, filtres) affichées")
+@click.option(
+    "--order-by",
+    default="total_ms",
+    type=click.Choice(["total_ms", "mean_ms", "max_ms", "nb_slow", "nb_queries"]),
+    help="Classement des combinaisons",
+)
+@click.option("--plans", is_flag=True, help="Affiche les plans EXPLAIN des requêtes lentes")
+@click.option("--reset", is_flag=True, help="Supprime les durées et plans enregistrés")
+def query_stats(limit, order_by, plans, reset):
+    """
+        Affiche la durée des requêtes des routes de la synthèse, de la validation
+        et des exports par route et combinaison de filtres (paramètre QUERY_STATS)
+    """
+    import json
+    from geonature.utils.env import DB
+    from geonature.core.gn_synthese.models import TQueryStats, TQuerySamples
+    from geonature.core.gn_synthese.utils.query_stats import get_report
+
+    app = get_app_for_cmd(with_flask_admin=False)
+    with app.app_context():
+        if reset:
+            DB.session.query(TQuerySamples).delete()
+            DB.session.query(TQueryStats).delete()
+            DB.session.commit()
+            log.info("Query stats deleted")
+            return
+        report = get_report(limit=limit, order_by=order_by, with_plans=plans)
+    for row in report:
+        log.info(
+            "%s [%s]: %s queries, total %.0f ms, mean %.0f ms, max %.0f ms, %s slow",
+            row["endpoint"],
+            row["fingerprint"],
+            row["nb_queries"],
+            row["total_ms"],
+            row["mean_ms"] or 0,
+            row["max_ms"],
+            row["nb_slow"],
+        )
+        for sample in row["samples"]:
+            log.info("    %s: %.0f ms", sample["sample_date"], sample["duration_ms"])
+            if plans:
+                log.info("%s\n%s", sample["statement"], json.dumps(sample["plan"], indent=2))
+
+
+@main.command()
+@click.argument("schema_name")
+@click.argument("table_name")
+@click.argument("field_name")
+@click.argument("value")
+@click.option("--batch-size", default=1000, help="Nombre de lignes par lot")
+@click.option("--workers", default=4, help="Nombre de lots importés en parallèle")
+@click.option("--pk", default=None, help="Colonne de découpage en lots (clé primaire par défaut)")
+def import_synthese_from_table(
+    schema_name, table_name, field_name, value, batch_size, workers, pk
+):
+    """
+        Importe dans la synthèse les lignes de la table <schema_name>.<table_name>
+        dont la colonne <field_name> vaut <value>
+        (par lots de clés primaires importés en parallèle)
+    """
+    from geonature.core.gn_synthese.utils.process import import_from_table
+
+    def progress(nb_rows_done, nb_rows, elapsed):
+        click.echo(
+            "{} / {} lignes importées en {:.1f} s ({:.0f} lignes/s)".format(
+                nb_rows_done, nb_rows, elapsed, nb_rows_done / elapsed if elapsed else 0
+            )
+        )
+
+    app = get_app_for_cmd(with_flask_admin=False)
+    with app.app_context():
+        import_from_table(
+            schema_name,
+            table_name,
+            field_name,
+            value,
+            limit=batch_size,
+            nb_workers=workers,
+            pk_name=pk,
+            progress=progress,
+        )
@@ -4,7 +4,7 @@
 """
 import json
 
-from flask import Blueprint, request, current_app, redirect
+from flask import Blueprint, request, current_app, send_file
 
 from geonature.core.gn_commons.repositories import TMediaRepository, TMediumRepository
 from geonature.core.gn_commons.models import TMedias
@@ -119,6 +119,7 @@ def delete_media(id_media):
 def get_media_thumb(id_media, size):
     """
         Retourne le thumbnail d'un media
+        (créé par le pool de processus des thumbnails s'il n'existe pas encore)
         .. :quickref: Commons;
     """
     media_repo = TMediaRepository(id_media=id_media)
@@ -127,8 +128,18 @@ def get_media_thumb(id_media, size):
         return {"msg": "Media introuvable"}, 404
 
     try:
-        url_thumb = media_repo.get_thumbnail_url(size)
+        thumb_path = media_repo.get_thumbnail_path(size)
     except GeoNatureError as e:
         return {"msg": str(e)}, 500
 
-    return redirect(url_thumb)
+    # ETag (date de modification et taille du fichier) : réponse 304 si la vignette
+    # n'a pas changé depuis la dernière requête du navigateur
+    response = send_file(
+        thumb_path,
+        mimetype="image/jpeg",
+        conditional=True,
+        add_etags=True,
+        cache_timeout=current_app.config["MEDIAS"]["THUMBNAIL_CACHE_MAX_AGE"],
+    )
+    response.cache_control.public = True
+    return response
@@ -0,0 +1,236 @@
+"""
+    Synchronisation incrémentale des médias et des fichiers
+
+        - suppression des médias temporaires (sans uuid_attached_row) de plus de 24h
+        - suppression des fichiers dont le média n'existe plus en base
+          (les thumbnails sont supprimés, les fichiers renommés en deleted_<nom>)
+
+    Le contenu des répertoires de UPLOAD_FOLDER est gardé dans un manifeste
+    (var/medias_sync.json) avec leur date de modification : un répertoire
+    dont la date n'a pas changé n'est pas relu. Les identifiants des fichiers sont
+    comparés aux médias de la base en une requête, les suppressions sont faites par lots.
+    La durée d'une synchronisation peut être bornée (time_budget) : les répertoires
+    non parcourus le seront à la synchronisation suivante.
+"""
+import datetime
+import json
+import logging
+import os
+import time
+
+from flask import current_app
+from sqlalchemy import and_, func, select
+from sqlalchemy.sql import text
+
+from geonature.utils.env import DB, ROOT_DIR
+from geonature.core.gn_commons.models import TMedias
+
+log = logging.getLogger(__name__)
+
+MANIFEST_FILE = ROOT_DIR / "var" / "medias_sync.json"
+# identifiant du verrou postgresql (pg_try_advisory_xact_lock) de la synchronisation
+MEDIAS_SYNC_LOCK_ID = 4270
+BATCH_SIZE = 1000
+# durée de vie des médias temporaires (sans uuid_attached_row)
+TEMP_MEDIAS_HOURS = 24
+
+MISSING_IDS_QUERY = text(
+    """
+    SELECT f.id_media
+    FROM unnest(CAST(:ids AS integer[])) AS f(id_media)
+    WHERE NOT EXISTS (
+        SELECT 1 FROM gn_commons.t_medias m WHERE m.id_media = f.id_media
+    )
+    """
+)
+
+
+def _batches(values, size=BATCH_SIZE):
+    for i in range(0, len(values), size):
+        yield values[i : i + size]
+
+
+def _media_id(file_name):
+    """
+    Id of the media of a file (<id_media>_<name>), None for the other files
+    """
+    try:
+        return int(file_name.split("_")[0])
+    except ValueError:
+        return None
+
+
+def load_manifest():
+    try:
+        with open(str(MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest):
+    MANIFEST_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(MANIFEST_FILE, os.getpid())
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, str(MANIFEST_FILE))
+
+
+def scan_upload_dir(root, manifest, deadline=None):
+    """
+    List the media files of the upload directory, reading only the directories
+    modified since the manifest
+
+    Parameters:
+        root (str): absolute path of the upload directory
+        manifest (dict): {relative dir: {"mtime", "dirs": [names], "files": {name: id_media}}}
+        deadline (float): time.monotonic() value after which the scan stops
+    Returns:
+        tuple: (new manifest, number of directories read, complete)
+            the directories not reached before the deadline are kept from the old manifest
+    """
+    new_manifest = {}
+    nb_read = 0
+    stack = [""]
+    while stack:
+        if deadline is not None and time.monotonic() > deadline:
+            for rel_dir, entry in manifest.items():
+                new_manifest.setdefault(rel_dir, entry)
+            return new_manifest, nb_read, False
+        rel_dir = stack.pop()
+        abs_dir = os.path.join(root, rel_dir)
+        try:
+            mtime = os.stat(abs_dir).st_mtime
+        except FileNotFoundError:
+            continue
+        entry = manifest.get(rel_dir)
+        if entry is None or entry["mtime"] != mtime:
+            dirs, files = [], {}
+            with os.scandir(abs_dir) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        dirs.append(e.name)
+                    else:
+                        id_media = _media_id(e.name)
+                        if id_media is not None:
+                            files[e.name] = id_media
+            entry = {"mtime": mtime, "dirs": dirs, "files": files}
+            nb_read += 1
+        new_manifest[rel_dir] = entry
+        stack.extend(os.path.join(rel_dir, d) for d in entry["dirs"])
+    return new_manifest, nb_read, True
+
+
+def _delete_temp_medias(dry_run):
+    """
+    Delete the temporary medias older than TEMP_MEDIAS_HOURS: their files are renamed
+    and their thumbnails deleted one by one, the rows are deleted by batches
+    """
+    medias = (
+        DB.session.query(TMedias)
+        .filter(
+            and_(
+                TMedias.meta_update_date
+                < (datetime.datetime.now() - datetime.timedelta(hours=TEMP_MEDIAS_HOURS)),
+                TMedias.uuid_attached_row == None,
+            )
+        )
+        .all()
+    )
+    id_medias = [m.id_media for m in medias]
+    if dry_run or not id_medias:
+        return id_medias
+    for media in medias:
+        try:
+            media.__before_commit_delete__()
+        except Exception:
+            log.warning("sync media: unable to remove the files of the media %s", media.id_media)
+        DB.session.expunge(media)
+    for batch in _batches(id_medias):
+        DB.session.query(TMedias).filter(TMedias.id_media.in_(batch)).delete(
+            synchronize_session=False
+        )
+    return id_medias
+
+
+def _orphan_files(manifest):
+    """
+    Files of the manifest whose media does not exist in the database
+    (one query for all the ids of the files)
+
+    Returns:
+        list<tuple>: (relative dir, file name)
+    """
+    files_by_id = {}
+    for rel_dir, entry in manifest.items():
+        for name, id_media in entry["files"].items():
+            files_by_id.setdefault(id_media, []).append((rel_dir, name))
+    if not files_by_id:
+        return []
+    missing_ids = [r[0] for r in DB.session.execute(MISSING_IDS_QUERY, {"ids": list(files_by_id)})]
+    return [f for id_media in missing_ids for f in files_by_id[id_media]]
+
+
+def sync_medias(dry_run=False, time_budget=None):
+    """
+    Synchronize the medias and the files (see the module documentation)
+    Another synchronization already running is not waited for
+
+    Parameters:
+        dry_run (bool): only report the medias and files to delete
+        time_budget (float): maximum duration (seconds) of the scan of the files (None or 0:
+            no limit), the directories not scanned are scanned at the next synchronization
+    Returns:
+        dict: report of the synchronization
+    """
+    start = time.monotonic()
+    report = {
+        "dry_run": dry_run,
+        "temp_medias": [],
+        "deleted_thumbnails": [],
+        "renamed_files": [],
+        "nb_dirs_read": 0,
+        "complete": True,
+    }
+    if not DB.session.execute(
+        select([func.pg_try_advisory_xact_lock(MEDIAS_SYNC_LOCK_ID)])
+    ).scalar():
+        report["complete"] = False
+        return report
+
+    report["temp_medias"] = _delete_temp_medias(dry_run)
+
+    root = os.path.join(current_app.config["BASE_DIR"], current_app.config["UPLOAD_FOLDER"])
+    deadline = start + time_budget if time_budget else None
+    manifest, report["nb_dirs_read"], report["complete"] = scan_upload_dir(
+        root, load_manifest(), deadline
+    )
+    for rel_dir, name in _orphan_files(manifest):
+        path = os.path.join(root, rel_dir, name)
+        is_thumbnail = "thumbnail" in os.path.join(rel_dir, name)
+        (report["deleted_thumbnails"] if is_thumbnail else report["renamed_files"]).append(
+            os.path.join(rel_dir, name)
+        )
+        if dry_run:
+            continue
+        try:
+            if is_thumbnail:
+                os.remove(path)
+            else:
+                os.rename(path, os.path.join(root, rel_dir, "deleted_" + name))
+        except FileNotFoundError:
+            pass
+        # le répertoire est relu à la prochaine synchronisation
+        manifest[rel_dir]["mtime"] = None
+    save_manifest(manifest)
+    # fin de la transaction : suppression des médias temporaires et libération du verrou
+    DB.session.commit()
+    if report["temp_medias"] or report["deleted_thumbnails"] or report["renamed_files"]:
+        log.info(
+            "sync media%s: %s temporary medias, %s thumbnails and %s files without media",
+            " (dry run)" if dry_run else "",
+            len(report["temp_medias"]),
+            len(report["deleted_thumbnails"]),
+            len(report["renamed_files"]),
+        )
+    return report
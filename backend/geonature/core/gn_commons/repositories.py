@@ -1,12 +1,10 @@
 import os
-import datetime
 import requests
-import pathlib
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 from PIL import Image
 from io import BytesIO
 from flask import current_app, url_for
-from sqlalchemy import and_
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 from pypnnomenclature.models import TNomenclatures
@@ -14,6 +12,12 @@ from pypnnomenclature.models import TNomenclatures
 from geonature.utils.env import DB
 from geonature.core.gn_commons.models import TMedias, BibTablesLocation
 from geonature.core.gn_commons.file_manager import upload_file, remove_file, rename_file
+from geonature.core.gn_commons.thumbnails import (
+    DOWNLOAD_TIMEOUT,
+    make_thumbnails,
+    submit_thumbnails,
+)
+from geonature.core.gn_commons.medias_sync import sync_medias
 from geonature.utils.errors import GeoNatureError
 
 
@@ -29,6 +33,8 @@ class TMediaRepository:
     file = None
     media = None
     new = False
+    # contenu de l'image distante téléchargée par check_image
+    image_content = None
 
     def __init__(self, data=None, file=None, id_media=None):
         self.data = data or {}
@@ -96,10 +102,13 @@ class TMediaRepository:
         for k in self.media_data:
             setattr(self.media, k, self.media_data[k])
 
+        if self.is_img():
+            self.check_image()
+
         self._persist_media_db()
 
         if self.is_img():
-            self.create_thumbnails()
+            self.submit_thumbnails()
 
         return self.media
 
@@ -294,6 +303,56 @@ class TMediaRepository:
             return False
         return True
 
+    def check_image(self):
+        """
+            Test si le fichier ou l'URL est une image
+            (lecture de l'en-tête seulement, sans décodage)
+        """
+        try:
+            if self.media.media_path:
+                Image.open(self.absolute_file_path()).verify()
+            else:
+                response = requests.get(self.media.media_url, timeout=DOWNLOAD_TIMEOUT)
+                response.raise_for_status()
+                Image.open(BytesIO(response.content)).verify()
+                self.image_content = response.content
+        except Exception:
+            if self.media.media_path:
+                raise GeoNatureError(
+                    "Le fichier fournit ne contient pas une image valide"
+                ) from Exception
+            else:
+                raise GeoNatureError(
+                    "L'URL renseignée ne contient pas une image valide"
+                ) from Exception
+
+    def thumbnails_source(self):
+        """
+            Chemin absolu, contenu (image distante déjà téléchargée)
+            ou url de l'image des thumbnails
+        """
+        if self.media.media_path:
+            return self.absolute_file_path()
+        if self.image_content is not None:
+            return self.image_content
+        return self.media.media_url
+
+    def submit_thumbnails(self, sizes=None, force=False):
+        """
+            Création des thumbnails manquants (tailles de la config par défaut)
+            par le pool de processus des thumbnails
+
+            Retourne la création en cours (Future) ou None s'il n'y a rien à créer
+        """
+        thumbnails = [
+            (size, self.absolute_file_path(size))
+            for size in (sizes or self.thumbnail_sizes)
+            if not self.has_thumbnail(size)
+        ]
+        if not thumbnails:
+            return None
+        return submit_thumbnails(self.thumbnails_source(), thumbnails, force=force)
+
     def create_thumbnails(self):
         """
             Creation automatique des thumbnails
@@ -303,37 +362,49 @@ class TMediaRepository:
         if self.has_thumbnails():
             return
 
-        image = self.get_image_with_exp()
-
-        for thumbnail_height in self.thumbnail_sizes:
-            self.create_thumbnail(thumbnail_height, image)
-
-    def create_thumbnail(self, size, image=None):
-        if not image:
-            image = self.get_image_with_exp()
-
-        image_thumb = image.copy()
-        width = size / image.size[1] * image.size[0]
-        image_thumb.thumbnail((width, size))
-        thumb_path = self.absolute_file_path(size)
-        pathlib.Path("/".join(thumb_path.split("/")[:-1])).mkdir(parents=True, exist_ok=True)
+        try:
+            make_thumbnails(
+                self.thumbnails_source(),
+                [(size, self.absolute_file_path(size)) for size in self.thumbnail_sizes],
+            )
+        except Exception:
+            raise GeoNatureError("Le média ne contient pas une image valide") from Exception
 
-        if image.mode in ("RGBA", "P"):
-            image_thumb = image_thumb.convert("RGB")
-        image_thumb.save(thumb_path, "JPEG")
+    def create_thumbnail(self, size):
+        try:
+            return make_thumbnails(
+                self.thumbnails_source(), [(size, self.absolute_file_path(size))]
+            )[0]
+        except Exception:
+            raise GeoNatureError("Le média ne contient pas une image valide") from Exception
 
-        return thumb_path
+    def get_thumbnail_path(self, size):
+        """
+            Chemin absolu d'un thumbnail
+            S'il n'existe pas, il est créé par le pool de processus
+            (avec les autres tailles manquantes) et son attente est bornée
+            par MEDIAS.THUMBNAIL_TIMEOUT
+        """
+        if not self.has_thumbnail(size):
+            sizes = set(self.thumbnail_sizes) | {size}
+            future = self.submit_thumbnails(sizes, force=True)
+            if future is not None:
+                try:
+                    future.result(timeout=current_app.config["MEDIAS"]["THUMBNAIL_TIMEOUT"])
+                except FutureTimeoutError:
+                    raise GeoNatureError("La création du thumbnail est trop longue")
+                except Exception:
+                    raise GeoNatureError(
+                        "Le média ne contient pas une image valide"
+                    ) from Exception
+        return self.absolute_file_path(size)
 
     def get_thumbnail_url(self, size):
         """
             Fonction permettant de récupérer l'url d'un thumbnail
-            Si le thumbnail n'existe pas il est créé à la volé
+            Si le thumbnail n'existe pas il est créé
         """
-        # Get Thumb path and create if not exists
-        if not self.has_thumbnail(size):
-            thumb_path = self.create_thumbnail(size)
-        else:
-            thumb_path = self.absolute_file_path(size)
+        thumb_path = self.get_thumbnail_path(size)
 
         # Get relative path
         relative_path = os.path.relpath(
@@ -389,74 +460,20 @@ class TMediumRepository:
         return medium
 
     @staticmethod
-    def sync_medias():
+    def sync_medias(dry_run=False, time_budget=None):
         """
             Met à jour les médias
               - supprime les médias sans uuid_attached_row plus vieux que 24h
-              - supprime les médias dont l'object attaché n'existe plus
-        """
-
-        # delete media temp > 24h
-        res_medias_temp = (
-            DB.session.query(TMedias.id_media)
-            .filter(
-                and_(
-                    TMedias.meta_update_date < (datetime.datetime.now() - datetime.timedelta(hours=24)),
-                    TMedias.uuid_attached_row == None
-                )
-            )
-            .all()
-        )
+              - supprime les fichiers dont le média n'existe plus en base
+            (synchronisation incrémentale, cf geonature.core.gn_commons.medias_sync)
 
-        id_medias_temp = [res.id_media for res in res_medias_temp]
-
-        if (id_medias_temp):
-            print('sync media remove temp media with ids : ', id_medias_temp)
-
-        for id_media in id_medias_temp:
-            TMediaRepository(id_media=id_media).delete()
-
-        # SYNCRONISATION media - fichiers
+            La durée du parcours des fichiers est bornée par MEDIAS.SYNC_TIME_BUDGET
+            par défaut
+        """
+        if time_budget is None:
+            time_budget = current_app.config["MEDIAS"]["SYNC_TIME_BUDGET"]
+        return sync_medias(dry_run=dry_run, time_budget=time_budget)
 
-        # liste des id des medias fichiers
-        liste_fichiers = []
-        search_path = pathlib.Path(current_app.config["BASE_DIR"],current_app.config["UPLOAD_FOLDER"])
-        for (repertoire, sous_repertoires, fichiers) in os.walk(search_path):
-            for f in fichiers:
-                id_media = f.split('_')[0]
-                try:
-                    id_media = int(id_media)
-                    f_data = {
-                        'id_media': id_media,
-                        'path': pathlib.Path(repertoire, f)
-                    }
-                    liste_fichiers.append(f_data)
-                except ValueError:
-                    pass
-
-
-        # liste des media fichier supprimés en base
-        ids_media_file = [x['id_media'] for x in liste_fichiers]
-        ids_media_file = list(dict.fromkeys(ids_media_file))
-
-        # suppression des fichiers dont le media n'existe plpus en base
-        ids_media_base = DB.session.query(TMedias.id_media).filter(TMedias.id_media.in_(ids_media_file)).all()
-        ids_media_base = [x[0] for x in ids_media_base]
-
-        ids_media_to_delete = [x for x in ids_media_file if x not in ids_media_base]
-
-        if (ids_media_to_delete):
-            print('sync media remove unassociated medias with ids : ', ids_media_to_delete)
-
-        for f_data in liste_fichiers:
-            if f_data['id_media'] not in ids_media_to_delete:
-                continue
-            if 'thumbnail' in str(f_data['path']):
-                os.remove(f_data['path'])
-            else:
-                deleted_paths = str(f_data['path']).split('/')
-                deleted_paths[-1] = 'deleted_' + deleted_paths[-1]
-                rename_file(f_data['path'], "/".join(deleted_paths))
 
 def get_table_location_id(schema_name, table_name):
     try:
@@ -0,0 +1,117 @@
+"""
+    Génération des vignettes (thumbnails) des médias en tâche de fond
+
+    Les vignettes ne sont plus créées pendant l'affichage de la galerie
+    (téléchargement des images distantes et décodage de l'image pour chaque taille) :
+        - l'enregistrement d'une photo (TMediaRepository.create_or_update_media)
+          confie la création de toutes ses vignettes à un pool de processus
+        - l'image est décodée une seule fois, directement à une résolution réduite
+          (mode draft des JPEG), puis chaque taille est calculée à partir de la précédente
+        - la route /media/thumbnails/<id_media>/<size> sert la vignette (ETag, Cache-Control)
+          et attend au besoin celle en cours de création
+    La génération est une fonction sans contexte Flask : les chemins des fichiers
+    sont calculés par le processus de l'API.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import requests
+from flask import current_app
+from PIL import Image
+
+log = logging.getLogger(__name__)
+
+# délai (en secondes) de téléchargement d'une image distante
+DOWNLOAD_TIMEOUT = 30
+
+_executor = None
+# vignettes en cours de création : {chemin de la plus grande vignette: future}
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def make_thumbnails(source, thumbnails):
+    """
+    Create the thumbnails of an image from one decoding
+
+    Parameters:
+        source (str|bytes): absolute path or url of the image, or its content
+        thumbnails (list<tuple>): (height, absolute path) of the thumbnails
+    Returns:
+        list<str>: the paths of the created thumbnails
+    """
+    if isinstance(source, bytes):
+        image = Image.open(BytesIO(source))
+    elif os.path.isfile(source):
+        image = Image.open(source)
+    else:
+        response = requests.get(source, timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+        image = Image.open(BytesIO(response.content))
+
+    thumbnails = sorted(thumbnails, reverse=True)
+    max_height = thumbnails[0][0]
+    max_width = max_height * image.size[0] / image.size[1]
+    # décodage (JPEG) à la plus petite réduction (1/2, 1/4, 1/8) plus grande que la vignette
+    image.draft("RGB", (max_width, max_height))
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    paths = []
+    for height, path in thumbnails:
+        width = height * image.size[0] / image.size[1]
+        image = image.copy()
+        image.thumbnail((width, height))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # écriture puis renommage : une vignette n'est jamais servie à moitié écrite
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        image.save(tmp_path, "JPEG")
+        os.replace(tmp_path, path)
+        paths.append(path)
+    return paths
+
+
+def get_executor():
+    """
+    Return the thumbnails process pool of the current process
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=current_app.config["MEDIAS"]["THUMBNAIL_NB_PROCESSES"]
+        )
+    return _executor
+
+
+def submit_thumbnails(source, thumbnails, force=False):
+    """
+    Create the thumbnails in the process pool
+
+    The thumbnails already pending are not submitted again (their future is returned).
+    Beyond MEDIAS.THUMBNAIL_MAX_PENDING pending creations, the thumbnails are not submitted
+    (None is returned) unless `force`: they will be created at their first display.
+
+    Returns:
+        Future: the creation of the thumbnails (result: their paths)
+    """
+    key = max(thumbnails)[1]
+    with _pending_lock:
+        future = _pending.get(key)
+        if future is not None:
+            return future
+        if not force and len(_pending) >= current_app.config["MEDIAS"]["THUMBNAIL_MAX_PENDING"]:
+            log.warning("Too many pending thumbnails, %s will be created on display", key)
+            return None
+        future = get_executor().submit(make_thumbnails, source, thumbnails)
+        _pending[key] = future
+
+    def _done(f):
+        with _pending_lock:
+            if _pending.get(key) is f:
+                del _pending[key]
+
+    future.add_done_callback(_done)
+    return future
@@ -0,0 +1,347 @@
+"""
+    File d'attente des exports exécutés en tâche de fond
+
+    Les exports volumineux (Synthèse, Occtax, Occhab) ne sont plus générés
+    pendant la requête HTTP : la demande est enregistrée dans la table
+    gn_exports.t_export_jobs puis le fichier est écrit par un pool de processus.
+    Le client suit l'avancement et télécharge le fichier via les routes
+    de gn_exports (cf routes.py).
+
+    Chaque module déclare comment construire la requête de son export
+    avec le décorateur `register_export`.
+"""
+import datetime
+import json
+import logging
+import os
+import shutil
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from geoalchemy2.shape import to_shape
+from shapely.geometry import mapping
+from sqlalchemy import func, select
+
+from geonature.utils.env import DB
+from geonature.utils.errors import GeonatureApiError
+from geonature.utils.utilsgeometry import create_shapes_generic
+from geonature.utils.utilsstream import generate_csv_content_stream, DEFAULT_CHUNK_SIZE
+from geonature.core.gn_exports.models import TExportJobs
+from geonature.core.gn_permissions.models import VUsersPermissions
+from geonature.core.gn_synthese.utils import query_stats
+
+log = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("csv", "geojson", "shapefile")
+# identifiant du verrou postgresql (pg_advisory_xact_lock) de prise en charge des exports
+EXPORT_JOBS_LOCK_ID = 4268
+
+# attributs de VUsersPermissions utilisés par les filtres CRUVED
+USER_PERMISSIONS_ATTRIBUTES = (
+    "id_role",
+    "nom_role",
+    "prenom_role",
+    "id_organisme",
+    "module_code",
+    "code_action",
+    "value_filter",
+)
+
+"""
+Definition of the query of an export:
+    export_view (GenericTableGeo): the exported view
+    query (Query): the query, filtered with the CRUVED and the export parameters
+    columns (list<str>): the exported columns
+    db_cols (list): the columns of the shapefile (without the geometry)
+    geom_col (str): WKB geometry column (used if geojson_col is None)
+    geojson_col (str): geojson geometry column in the srid of the view (shapefile)
+    geojson_4326_col (str): geojson geometry column in WGS84 (geojson)
+        if None, geojson_col (or geom_col) is used
+"""
+ExportQuery = namedtuple(
+    "ExportQuery",
+    ["export_view", "query", "columns", "db_cols", "geom_col", "geojson_col", "geojson_4326_col"],
+)
+
+# {module_code: function(info_role, params) -> ExportQuery}
+EXPORT_QUERY_BUILDERS = {}
+
+_executor = None
+_worker_app = None
+
+
+def register_export(module_code):
+    """
+    Decorator to register the function which build the query of the export of a module
+    The decorated function take the user (VUsersPermissions) and the export parameters
+    (dict stored as json in the job) and return an ExportQuery
+    """
+
+    def _register_export(fn):
+        EXPORT_QUERY_BUILDERS[module_code] = fn
+        return fn
+
+    return _register_export
+
+
+def get_export_dir():
+    config = current_app.config
+    export_dir = os.path.join(config["BASE_DIR"], config["EXPORT_JOBS"]["EXPORT_DIR"])
+    os.makedirs(export_dir, exist_ok=True)
+    return export_dir
+
+
+def get_executor():
+    """
+    Return the process pool of the current process (one per API worker)
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=current_app.config["EXPORT_JOBS"]["NB_PROCESSES"]
+        )
+    return _executor
+
+
+def enqueue_export_job(info_role, module_code, export_format, params):
+    """
+    Register an export job and wake up the process pool
+
+    Parameters:
+        info_role (VUsersPermissions): the user with its CRUVED scope for the E action
+        module_code (str): module of the export (a key of EXPORT_QUERY_BUILDERS)
+        export_format (str): csv, geojson or shapefile
+        params (dict): json serializable parameters given to the query builder
+    Returns:
+        TExportJobs
+    """
+    if module_code not in EXPORT_QUERY_BUILDERS:
+        raise GeonatureApiError("No export registered for the module {}".format(module_code))
+    if export_format not in EXPORT_FORMATS:
+        raise GeonatureApiError(
+            "Export format must be one of {}".format(", ".join(EXPORT_FORMATS)), 400
+        )
+    clean_export_jobs()
+    job = TExportJobs(
+        id_role=info_role.id_role,
+        module_code=module_code,
+        export_format=export_format,
+        params=params,
+        user_permissions={
+            attr: getattr(info_role, attr, None) for attr in USER_PERMISSIONS_ATTRIBUTES
+        },
+        status="pending",
+        meta_create_date=datetime.datetime.now(),
+    )
+    DB.session.add(job)
+    DB.session.commit()
+    get_executor().submit(run_pending_jobs)
+    return job
+
+
+def resume_pending_jobs():
+    """
+    Wake up the process pool if jobs are pending
+    (jobs enqueued before a restart of the API)
+    """
+    try:
+        pending = TExportJobs.query.filter_by(status="pending").first() is not None
+    except Exception:
+        log.exception("Unable to read the pending export jobs")
+        DB.session.rollback()
+        return
+    if pending:
+        get_executor().submit(run_pending_jobs)
+
+
+def init_app(app):
+    """
+    Run the jobs left pending by a previous API process when the API process starts
+    (first request: the processes of the pool and the commands do not run them)
+    """
+    app.before_first_request(resume_pending_jobs)
+
+
+def clean_export_jobs():
+    """
+    Cleanup policy of the export jobs:
+        - the jobs (and their files) older than EXPORT_JOBS.RETENTION_DAYS are deleted
+        - the running jobs older than EXPORT_JOBS.TIMEOUT are set in error
+          (their process has been killed: API restart...)
+    """
+    config = current_app.config["EXPORT_JOBS"]
+    now = datetime.datetime.now()
+    expired_jobs = TExportJobs.query.filter(
+        TExportJobs.meta_create_date < now - datetime.timedelta(days=config["RETENTION_DAYS"])
+    ).all()
+    for job in expired_jobs:
+        if job.file_path and os.path.exists(job.file_path):
+            os.unlink(job.file_path)
+        DB.session.delete(job)
+    TExportJobs.query.filter(
+        TExportJobs.status == "running",
+        TExportJobs.start_date < now - datetime.timedelta(seconds=config["TIMEOUT"]),
+    ).update(
+        {"status": "error", "error_message": "Export interrupted", "end_date": now},
+        synchronize_session=False,
+    )
+    DB.session.commit()
+
+
+def _get_worker_app():
+    """
+    Flask app of the process of the pool, created at the first job
+    (the engine and its connections are not shared with the API process)
+    """
+    global _worker_app
+    if _worker_app is None:
+        from geonature.utils.command import get_app_for_cmd
+
+        _worker_app = get_app_for_cmd(with_flask_admin=False)
+    return _worker_app
+
+
+def run_pending_jobs():
+    """
+    Entry point of the processes of the pool:
+    run the pending jobs until there is no one left
+    or the maximum number of running jobs (all API processes) is reached
+    """
+    app = _get_worker_app()
+    with app.app_context():
+        try:
+            while True:
+                job = claim_next_job()
+                if job is None:
+                    return
+                run_export_job(job)
+        finally:
+            DB.session.remove()
+
+
+def claim_next_job():
+    """
+    Set the oldest pending job as running if the number of running jobs
+    is lower than EXPORT_JOBS.MAX_RUNNING_JOBS
+    The advisory lock serialize the claims of all the processes
+    """
+    DB.session.execute(select([func.pg_advisory_xact_lock(EXPORT_JOBS_LOCK_ID)]))
+    nb_running = TExportJobs.query.filter_by(status="running").count()
+    if nb_running >= current_app.config["EXPORT_JOBS"]["MAX_RUNNING_JOBS"]:
+        DB.session.commit()
+        return None
+    job = (
+        TExportJobs.query.filter_by(status="pending")
+        .order_by(TExportJobs.meta_create_date, TExportJobs.id_export_job)
+        .first()
+    )
+    if job is not None:
+        job.status = "running"
+        job.start_date = datetime.datetime.now()
+    DB.session.commit()
+    return job
+
+
+def _set_progress(id_export_job, nb_rows_done):
+    # connexion dédiée : l'avancement est visible sans attendre la fin de l'export
+    DB.engine.execute(
+        TExportJobs.__table__.update()
+        .where(TExportJobs.id_export_job == id_export_job)
+        .values(nb_rows_done=nb_rows_done)
+    )
+
+
+def _iter_with_progress(id_export_job, rows):
+    nb_rows = 0
+    for row in rows:
+        yield row
+        nb_rows += 1
+        if nb_rows % DEFAULT_CHUNK_SIZE == 0:
+            _set_progress(id_export_job, nb_rows)
+    _set_progress(id_export_job, nb_rows)
+
+
+def run_export_job(job):
+    """
+    Write the file of a job from its query
+    Its queries are timed by query_stats (route export_job.<module_code>)
+    """
+    with query_stats.measure("export_job.{}".format(job.module_code), job.params):
+        _run_export_job(job)
+
+
+def _run_export_job(job):
+    id_export_job = job.id_export_job
+    try:
+        info_role = VUsersPermissions(**job.user_permissions)
+        export_query = EXPORT_QUERY_BUILDERS[job.module_code](info_role, job.params)
+        query = export_query.query.limit(current_app.config["EXPORT_JOBS"]["NB_MAX_ROWS"])
+        job.nb_rows_total = query.count()
+        DB.session.commit()
+
+        file_name = "{}_{}_{}".format(
+            job.module_code.lower(),
+            id_export_job,
+            datetime.datetime.now().strftime("%Y_%m_%d_%Hh%Mm%S"),
+        )
+        extension = "zip" if job.export_format == "shapefile" else job.export_format
+        file_path = os.path.join(get_export_dir(), "{}.{}".format(file_name, extension))
+        # server side cursor: the rows are never all in memory
+        rows = _iter_with_progress(id_export_job, query.yield_per(DEFAULT_CHUNK_SIZE))
+        write_export_file(job.export_format, export_query, rows, file_path, file_name)
+
+        job.status = "done"
+        job.file_name = "{}.{}".format(file_name, extension)
+        job.file_path = file_path
+    except Exception as e:
+        log.exception("Export job %s failed", id_export_job)
+        DB.session.rollback()
+        job = TExportJobs.query.get(id_export_job)
+        job.status = "error"
+        job.error_message = str(e)
+    job.end_date = datetime.datetime.now()
+    DB.session.commit()
+
+
+def write_export_file(export_format, export_query, rows, file_path, file_name):
+    """
+    Write the rows of an export in `file_path` with the formatters of the synchronous exports
+    """
+    export_view = export_query.export_view
+    columns = export_query.columns
+    if export_format == "csv":
+        with open(file_path, "w") as f:
+            data = (export_view.as_dict(r, columns=columns) for r in rows)
+            for chunk in generate_csv_content_stream(columns, data, separator=";"):
+                f.write(chunk)
+    elif export_format == "geojson":
+        with open(file_path, "w") as f:
+            f.write('{"type": "FeatureCollection", "features": [')
+            for i, r in enumerate(rows):
+                geojson_col = export_query.geojson_4326_col or export_query.geojson_col
+                if geojson_col:
+                    geometry = json.loads(getattr(r, geojson_col))
+                else:
+                    geometry = mapping(to_shape(getattr(r, export_query.geom_col)))
+                feature = {
+                    "type": "Feature",
+                    "geometry": geometry,
+                    "properties": export_view.as_dict(r, columns=columns),
+                }
+                if i > 0:
+                    f.write(",")
+                f.write(json.dumps(feature, default=str))
+            f.write("]}")
+    else:
+        shape_service = create_shapes_generic(
+            view=export_view,
+            srid=export_view.srid,
+            db_cols=export_query.db_cols,
+            data=rows,
+            file_name=file_name,
+            geom_col=export_query.geom_col,
+            geojson_col=export_query.geojson_col,
+        )
+        shutil.move(shape_service.zip_path, file_path)
+        shape_service.delete_files()
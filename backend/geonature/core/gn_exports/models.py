@@ -0,0 +1,62 @@
+"""
+    Modèles du schéma gn_exports
+"""
+from sqlalchemy import ForeignKey
+from sqlalchemy.dialects.postgresql import JSONB
+
+from utils_flask_sqla.serializers import serializable
+
+from geonature.utils.env import DB
+
+
+@serializable
+class TExportJobs(DB.Model):
+    """
+    Export run in background by the export job queue (see gn_exports.jobs)
+    """
+
+    __tablename__ = "t_export_jobs"
+    __table_args__ = {"schema": "gn_exports"}
+    id_export_job = DB.Column(DB.Integer, primary_key=True)
+    id_role = DB.Column(DB.Integer, ForeignKey("utilisateurs.t_roles.id_role"))
+    module_code = DB.Column(DB.Unicode)
+    export_format = DB.Column(DB.Unicode)
+    # paramètres de l'export (filtres) et utilisateur (CRUVED) au moment de la demande
+    params = DB.Column(JSONB)
+    user_permissions = DB.Column(JSONB)
+    # pending | running | done | error
+    status = DB.Column(DB.Unicode, default="pending")
+    nb_rows_total = DB.Column(DB.Integer)
+    nb_rows_done = DB.Column(DB.Integer, default=0)
+    file_name = DB.Column(DB.Unicode)
+    file_path = DB.Column(DB.Unicode)
+    error_message = DB.Column(DB.Unicode)
+    meta_create_date = DB.Column(DB.DateTime)
+    start_date = DB.Column(DB.DateTime)
+    end_date = DB.Column(DB.DateTime)
+
+    def as_status(self):
+        """
+        Serialize the job for the status route (without internal paths and params)
+        """
+        job = self.as_dict(
+            columns=[
+                "id_export_job",
+                "module_code",
+                "export_format",
+                "status",
+                "nb_rows_total",
+                "nb_rows_done",
+                "file_name",
+                "error_message",
+                "meta_create_date",
+                "start_date",
+                "end_date",
+            ]
+        )
+        job["progress"] = (
+            round(100 * (self.nb_rows_done or 0) / self.nb_rows_total)
+            if self.nb_rows_total
+            else (100 if self.status == "done" else 0)
+        )
+        return job
@@ -1,10 +1,16 @@
+import os
+
 from flask import Blueprint, request
+from werkzeug.exceptions import NotFound
 
 from sqlalchemy import or_
 
 from geonature.utils.env import DB
 from utils_flask_sqla.response import json_resp
 from geonature.utils import filemanager
+from geonature.utils.utilsstream import stream_file_resp
+from geonature.core.gn_permissions import decorators as permissions
+from geonature.core.gn_exports.models import TExportJobs
 
 
 routes = Blueprint("gn_exports", __name__)
@@ -49,3 +55,59 @@ Paramètres:
 #     data = q.all()
 #     data = serializeQueryTest(data, q.column_descriptions)
 #     return (cleanViewName, data, viewSINP.columns, ';')
+
+
+def get_user_job_or_404(id_export_job, info_role):
+    job = TExportJobs.query.get(id_export_job)
+    # un utilisateur ne voit que ses propres exports
+    if job is None or job.id_role != info_role.id_role:
+        raise NotFound("The export job {} does not exist".format(id_export_job))
+    return job
+
+
+@routes.route("/jobs", methods=["GET"])
+@permissions.check_cruved_scope("R", True)
+@json_resp
+def get_export_jobs(info_role):
+    """
+    List the export jobs of the user
+
+    .. :quickref: Exports;
+    """
+    jobs = (
+        TExportJobs.query.filter_by(id_role=info_role.id_role)
+        .order_by(TExportJobs.meta_create_date.desc())
+        .all()
+    )
+    return [job.as_status() for job in jobs]
+
+
+@routes.route("/jobs/<int:id_export_job>", methods=["GET"])
+@permissions.check_cruved_scope("R", True)
+@json_resp
+def get_export_job(info_role, id_export_job):
+    """
+    Status and progress of an export job
+
+    .. :quickref: Exports;
+    """
+    return get_user_job_or_404(id_export_job, info_role).as_status()
+
+
+@routes.route("/jobs/<int:id_export_job>/download", methods=["GET"])
+@permissions.check_cruved_scope("R", True)
+def download_export_job(info_role, id_export_job):
+    """
+    Download the file of a finished export job
+
+    .. :quickref: Exports;
+    """
+    job = get_user_job_or_404(id_export_job, info_role)
+    if job.status != "done" or not job.file_path or not os.path.exists(job.file_path):
+        raise NotFound("The export job {} has no file to download".format(id_export_job))
+    mimetypes = {
+        "csv": "text/csv",
+        "geojson": "application/geo+json",
+        "shapefile": "application/zip",
+    }
+    return stream_file_resp(job.file_path, job.file_name, mimetypes[job.export_format])
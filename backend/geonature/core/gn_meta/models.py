@@ -1,6 +1,10 @@
-from sqlalchemy import ForeignKey, or_
-from sqlalchemy.sql import select, func
-from sqlalchemy.orm import relationship, exc
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import ForeignKey, or_, event
+from sqlalchemy.sql import select, func, union, union_all, literal
+from sqlalchemy.orm import relationship, exc, Session
 from sqlalchemy.dialects.postgresql import UUID
 from werkzeug.exceptions import NotFound
 
@@ -154,6 +158,58 @@ class CorDatasetActor(DB.Model):
             return None
 
 
+# Cache des jeux de données autorisés par utilisateur, propre à chaque processus :
+# {(id_role, id_organisme, only_user): (version, timestamp, frozenset<id_dataset>)}
+# La version est incrémentée à chaque commit modifiant un acteur ou un jeu de données
+_USER_DATASETS_CACHE = {}
+_USER_DATASETS_CACHE_LOCK = threading.Lock()
+_user_datasets_version = 0
+
+
+def clear_user_datasets_cache():
+    """
+    Invalidate the allowed datasets of all the users in the current process
+    (the others processes are invalidated after PERMISSIONS_CACHE_TTL seconds)
+    """
+    global _user_datasets_version
+    with _USER_DATASETS_CACHE_LOCK:
+        _user_datasets_version += 1
+        _USER_DATASETS_CACHE.clear()
+
+
+def _split_actor_ids(rows):
+    """
+    Split the rows (id_object, is_user) of an actors query in two sets:
+    the objects where the user is actor himself and all the objects of the rows
+    """
+    ids_object_user = set()
+    ids_object_organism = set()
+    for id_object, is_user in rows:
+        ids_object_organism.add(id_object)
+        if is_user:
+            ids_object_user.add(id_object)
+    return ids_object_user, ids_object_organism
+
+
+@event.listens_for(Session, "after_flush")
+def _flag_user_datasets_changes(session, flush_context):
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, (CorDatasetActor, TDatasets)):
+            session.info["user_datasets_changed"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_user_datasets_cache(session):
+    if session.info.pop("user_datasets_changed", False):
+        clear_user_datasets_cache()
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_user_datasets_changes(session):
+    session.info.pop("user_datasets_changed", None)
+
+
 class CruvedHelper(DB.Model):
     """
     Classe abstraite permettant d'ajouter des méthodes de
@@ -162,8 +218,8 @@ class CruvedHelper(DB.Model):
 
     __abstract__ = True
 
+    @staticmethod
     def user_is_allowed_to(
-        self,
         id_object: int,
         id_object_users_actor: list,
         id_object_organism_actor: list,
@@ -220,6 +276,45 @@ class CruvedHelper(DB.Model):
             for action, level in user_cruved.items()
         }
 
+    @classmethod
+    def get_objects_cruved(
+        cls, user_cruved, ids_object, ids_object_user, ids_object_organism,
+    ):
+        """
+        Return the user's cruved for a list of objects, in one pass
+        (same result as get_object_cruved for each object)
+        params:
+            - user_cruved: {'C': '2', 'R':'3' etc...}
+            - ids_object (list): ids of the objects
+            - ids_object_user (set): ids of the objects where the user is actor himself
+            - ids_object_organism (set): ids of the objects where the user or its organism
+                are actors
+
+        Return: dict {id_object: {'C': True, 'R': False ...}}
+        """
+        ids_object_user = set(ids_object_user)
+        ids_object_organism = set(ids_object_organism)
+        # le CRUVED d'un objet ne dépend que du lien de l'utilisateur avec l'objet :
+        # il est calculé pour le premier objet de chacun des trois liens possibles
+        cruved_by_link = {}
+        objects_cruved = {}
+        for id_object in ids_object:
+            if id_object in ids_object_user:
+                link = "user"
+            elif id_object in ids_object_organism:
+                link = "organism"
+            else:
+                link = "other"
+            if link not in cruved_by_link:
+                cruved_by_link[link] = {
+                    action: cls.user_is_allowed_to(
+                        id_object, ids_object_user, ids_object_organism, level
+                    )
+                    for action, level in user_cruved.items()
+                }
+            objects_cruved[id_object] = dict(cruved_by_link[link])
+        return objects_cruved
+
 
 @serializable
 class TDatasets(CruvedHelper):
@@ -314,28 +409,83 @@ class TDatasets(CruvedHelper):
               - only_query: boolean (return the query not the id_datasets allowed if true)
               - only_user: boolean: return only the dataset where user himself is actor (not with its organoism)
 
+            The list of id_dataset is cached per (role, organism) and invalidated
+            when an actor or a dataset is modified (see clear_user_datasets_cache)
+
             return: a list of id_dataset or a query"""
-        q = DB.session.query(TDatasets).outerjoin(
-            CorDatasetActor, CorDatasetActor.id_dataset == TDatasets.id_dataset
-        )
-        if user.id_organisme is None or only_user:
-            q = q.filter(
-                or_(
-                    CorDatasetActor.id_role == user.id_role,
-                    TDatasets.id_digitizer == user.id_role,
-                )
+        if only_query:
+            q = DB.session.query(TDatasets).outerjoin(
+                CorDatasetActor, CorDatasetActor.id_dataset == TDatasets.id_dataset
             )
-        else:
-            q = q.filter(
-                or_(
-                    CorDatasetActor.id_organism == user.id_organisme,
-                    CorDatasetActor.id_role == user.id_role,
-                    TDatasets.id_digitizer == user.id_role,
+            if user.id_organisme is None or only_user:
+                q = q.filter(
+                    or_(
+                        CorDatasetActor.id_role == user.id_role,
+                        TDatasets.id_digitizer == user.id_role,
+                    )
+                )
+            else:
+                q = q.filter(
+                    or_(
+                        CorDatasetActor.id_organism == user.id_organisme,
+                        CorDatasetActor.id_role == user.id_role,
+                        TDatasets.id_digitizer == user.id_role,
+                    )
                 )
-            )
-        if only_query:
             return q
-        return list(set([d.id_dataset for d in q.all()]))
+
+        key = (user.id_role, None if only_user else user.id_organisme, only_user)
+        ttl = current_app.config.get("PERMISSIONS_CACHE_TTL", 0)
+        now = time.monotonic()
+        version = _user_datasets_version
+        cached = _USER_DATASETS_CACHE.get(key)
+        if cached and cached[0] == version and now - cached[1] < ttl:
+            return list(cached[2])
+        ids_dataset = frozenset(
+            r[0]
+            for r in DB.session.execute(TDatasets.select_user_datasets(user, only_user=only_user))
+        )
+        if ttl > 0:
+            with _USER_DATASETS_CACHE_LOCK:
+                _USER_DATASETS_CACHE[key] = (version, now, ids_dataset)
+        return list(ids_dataset)
+
+    @staticmethod
+    def get_user_actor_ids(user):
+        """
+        Return with one query the id_dataset where the user is actor himself (or digitizer)
+        and those where the user or its organism are actors:
+        (set(get_user_datasets(user, only_user=True)), set(get_user_datasets(user)))
+        """
+        is_user = CorDatasetActor.id_role == user.id_role
+        actor_filter = is_user
+        if user.id_organisme is not None:
+            actor_filter = or_(is_user, CorDatasetActor.id_organism == user.id_organisme)
+        q = union_all(
+            select([CorDatasetActor.id_dataset, is_user]).where(actor_filter),
+            select([TDatasets.id_dataset, literal(True)]).where(
+                TDatasets.id_digitizer == user.id_role
+            ),
+        )
+        return _split_actor_ids(DB.session.execute(q))
+
+    @staticmethod
+    def select_user_datasets(user, only_user=False):
+        """
+        Return a select of the id_dataset where the user is actor
+        (himself or with its organism - only himself if only_user=True) or digitizer
+
+        Use it as a semi-join (`model.id_dataset.in_(TDatasets.select_user_datasets(user))`)
+        rather than inlining the list of id_dataset in the query:
+        the query plan stay the same whatever the number of datasets of the organism
+        """
+        actor_filter = CorDatasetActor.id_role == user.id_role
+        if user.id_organisme is not None and not only_user:
+            actor_filter = or_(actor_filter, CorDatasetActor.id_organism == user.id_organisme)
+        return union(
+            select([CorDatasetActor.id_dataset]).where(actor_filter),
+            select([TDatasets.id_dataset]).where(TDatasets.id_digitizer == user.id_role),
+        )
 
 
 @serializable
@@ -427,6 +577,29 @@ class TAcquisitionFramework(CruvedHelper):
             return a_f[0]
         return a_f
 
+    @staticmethod
+    def get_user_actor_ids(user):
+        """
+        Return with one query the id_acquisition_framework where the user is actor himself
+        (or digitizer) and those where the user or its organism are actors:
+        (set(get_user_af(user, only_user=True)), set(get_user_af(user)))
+        """
+        is_user = CorAcquisitionFrameworkActor.id_role == user.id_role
+        actor_filter = is_user
+        if user.id_organisme is not None:
+            actor_filter = or_(
+                is_user, CorAcquisitionFrameworkActor.id_organism == user.id_organisme
+            )
+        q = union_all(
+            select([CorAcquisitionFrameworkActor.id_acquisition_framework, is_user]).where(
+                actor_filter
+            ),
+            select([TAcquisitionFramework.id_acquisition_framework, literal(True)]).where(
+                TAcquisitionFramework.id_digitizer == user.id_role
+            ),
+        )
+        return _split_actor_ids(DB.session.execute(q))
+
     @staticmethod
     def get_user_af(user, only_query=False, only_user=False):
         """get the af(s) where the user is actor (himself or with its organism - only himelsemf id only_use=True) or digitizer
@@ -522,3 +695,33 @@ class TAcquisitionFrameworkDetails(TAcquisitionFramework):
             TNomenclatures.id_nomenclature == TAcquisitionFramework.id_nomenclature_financing_type
         ),
     )
+
+
+class TMtdSyncUsers(DB.Model):
+    """
+    User whose datasets are synchronized from the MTD web service (see gn_meta.mtd_sync)
+    """
+
+    __tablename__ = "t_mtd_sync_users"
+    __table_args__ = {"schema": "gn_meta"}
+    id_role = DB.Column(DB.Integer, ForeignKey("utilisateurs.t_roles.id_role"), primary_key=True)
+    id_organism = DB.Column(DB.Integer)
+    # dernière consultation des métadonnées par l'utilisateur et dernière synchronisation
+    request_date = DB.Column(DB.DateTime)
+    sync_date = DB.Column(DB.DateTime)
+    sync_error = DB.Column(DB.Unicode)
+
+
+class TMtdSyncDocuments(DB.Model):
+    """
+    Validators (ETag, Last-Modified) and hash of the last XML document synchronized
+    from an url of the MTD web service
+    """
+
+    __tablename__ = "t_mtd_sync_documents"
+    __table_args__ = {"schema": "gn_meta"}
+    url = DB.Column(DB.Unicode, primary_key=True)
+    etag = DB.Column(DB.Unicode)
+    last_modified = DB.Column(DB.Unicode)
+    content_hash = DB.Column(DB.Unicode)
+    sync_date = DB.Column(DB.DateTime)
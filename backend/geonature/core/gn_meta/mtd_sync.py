@@ -0,0 +1,621 @@
+"""
+    Synchronisation en tâche de fond des cadres d'acquisition (CA) et jeux de données (JDD)
+    du webservice MTD (authentification CAS)
+
+    Les routes des métadonnées n'interrogent plus le webservice : elles enregistrent
+    l'utilisateur (gn_meta.t_mtd_sync_users) et, si sa dernière synchronisation date de plus
+    de MTD_SYNC.USER_SYNC_INTERVAL secondes, la lancent dans un thread de l'API.
+    La première synchronisation d'un utilisateur est attendue (au plus MTD_SYNC.TIMEOUT
+    secondes) pour qu'il voie ses JDD dès sa première connexion.
+    La commande `geonature sync_mtd` synchronise les utilisateurs actifs
+    (tâche planifiée, ou en boucle avec --interval).
+    Une synchronisation :
+        - télécharge en parallèle (MTD_SYNC.NB_THREADS threads) les listes de JDD
+          des utilisateurs puis les CA de ces JDD, par des requêtes conditionnelles
+          (If-None-Match / If-Modified-Since) : un document non modifié (réponse 304
+          ou même sha256 que le précédent) n'est pas relu
+        - ne met à jour en base que les champs modifiés des CA et des JDD
+          et n'ajoute que les acteurs manquants
+    Les threads ne font que les requêtes HTTP : la base est mise à jour par le thread
+    appelant, les CA dans une transaction puis les JDD et acteurs d'un utilisateur
+    dans une transaction par utilisateur.
+"""
+import datetime
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import requests
+from flask import current_app
+from sqlalchemy import func, or_, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from geonature.utils.env import DB
+from geonature.core.gn_commons.models import TModules
+from geonature.core.gn_meta import mtd_utils
+from geonature.core.gn_meta.models import (
+    TDatasets,
+    CorDatasetActor,
+    TAcquisitionFramework,
+    CorAcquisitionFrameworkActor,
+    TMtdSyncUsers,
+    TMtdSyncDocuments,
+)
+
+log = logging.getLogger(__name__)
+
+# identifiant du verrou postgresql (pg_try_advisory_xact_lock) de la synchronisation
+# d'un utilisateur (clé : MTD_SYNC_LOCK_ID, id_role)
+MTD_SYNC_LOCK_ID = 4271
+
+MtdDocument = namedtuple(
+    "MtdDocument", ["url", "content", "etag", "last_modified", "content_hash", "changed"]
+)
+
+_executor = None
+# synchronisations en cours dans ce processus : {id_role: future}
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def fetch_document(url, state=None, timeout=None):
+    """
+    Fetch a XML document of the MTD web service with a conditional request
+
+    Parameters:
+        state (dict): {etag, last_modified, content_hash} of the last synchronized document
+    Returns:
+        MtdDocument: `changed` is False if the document has not been modified
+            (`content` is None for a 304 response)
+    Raises:
+        requests.exceptions.RequestException
+    """
+    headers = {}
+    if state:
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+    response = requests.get(url, headers=headers, timeout=timeout)
+    if state and response.status_code == 304:
+        return MtdDocument(
+            url, None, state.get("etag"), state.get("last_modified"), state["content_hash"], False
+        )
+    response.raise_for_status()
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    return MtdDocument(
+        url,
+        response.content,
+        response.headers.get("ETag"),
+        response.headers.get("Last-Modified"),
+        content_hash,
+        state is None or state.get("content_hash") != content_hash,
+    )
+
+
+def fetch_documents(urls, states, nb_threads, timeout=None):
+    """
+    Fetch the documents concurrently with a pool of `nb_threads` threads
+
+    Parameters:
+        urls (iterable<str>)
+        states (dict): {url: state} (see fetch_document)
+    Returns:
+        tuple: ({url: MtdDocument}, {url: error})
+    """
+    urls = list(dict.fromkeys(urls))
+    documents, errors = {}, {}
+    if not urls:
+        return documents, errors
+    with ThreadPoolExecutor(max_workers=max(1, min(nb_threads, len(urls)))) as executor:
+        futures = {
+            url: executor.submit(fetch_document, url, states.get(url), timeout) for url in urls
+        }
+        for url, future in futures.items():
+            try:
+                documents[url] = future.result()
+            except requests.exceptions.RequestException as e:
+                errors[url] = e
+    return documents, errors
+
+
+def _load_states(urls):
+    if not urls:
+        return {}
+    return {
+        d.url: {
+            "etag": d.etag,
+            "last_modified": d.last_modified,
+            "content_hash": d.content_hash,
+        }
+        for d in DB.session.query(TMtdSyncDocuments).filter(TMtdSyncDocuments.url.in_(urls))
+    }
+
+
+def _save_state(document):
+    DB.session.merge(
+        TMtdSyncDocuments(
+            url=document.url,
+            etag=document.etag,
+            last_modified=document.last_modified,
+            content_hash=document.content_hash,
+            sync_date=datetime.datetime.now(),
+        )
+    )
+
+
+def _parse_date(value):
+    if isinstance(value, str):
+        try:
+            return datetime.datetime.strptime(value[:10], "%Y-%m-%d").date()
+        except ValueError:
+            pass
+    return value
+
+
+def _comparable(value):
+    # colonnes date mappées en DateTime : la base renvoie une date
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+def _update_changed(obj, values):
+    """
+    Set only the attributes whose value differs (no UPDATE for an unchanged row)
+
+    Returns:
+        bool: True if at least one attribute has been modified
+    """
+    changed = False
+    for key, value in values.items():
+        if _comparable(getattr(obj, key)) != _comparable(value):
+            setattr(obj, key, value)
+            changed = True
+    return changed
+
+
+def _uuid_key(value):
+    return str(value).lower()
+
+
+def _add_missing_actors(model, id_column, ids, id_role, id_organism, id_actor_role):
+    """
+    Add the user and its organism as actors of the objects where they are not
+    (one query for all the objects)
+
+    Returns:
+        int: the number of added actors
+    """
+    column = getattr(model, id_column)
+    roles, organisms = set(), set()
+    for id_object, actor_role, actor_organism in DB.session.query(
+        column, model.id_role, model.id_organism
+    ).filter(
+        column.in_(ids),
+        model.id_nomenclature_actor_role == id_actor_role,
+        or_(model.id_role == id_role, model.id_organism == id_organism),
+    ):
+        if actor_role == id_role:
+            roles.add(id_object)
+        if id_organism is not None and actor_organism == id_organism:
+            organisms.add(id_object)
+    nb_added = 0
+    for id_object in ids:
+        actor = {id_column: id_object, "id_nomenclature_actor_role": id_actor_role}
+        if id_object not in roles:
+            DB.session.add(model(id_role=id_role, **actor))
+            nb_added += 1
+        if id_organism is not None and id_object not in organisms:
+            DB.session.add(model(id_organism=id_organism, **actor))
+            nb_added += 1
+    return nb_added
+
+
+class MtdSync:
+    """
+    Synchronization of the datasets of a list of users (see the module documentation)
+    """
+
+    def __init__(self, force=False):
+        config = current_app.config["MTD_SYNC"]
+        self.nb_threads = config["NB_THREADS"]
+        self.timeout = config["TIMEOUT"]
+        self.force = force
+        self.api_endpoint = current_app.config["MTD_API_ENDPOINT"]
+        self._nomenclatures = {}
+        self._modules = None
+        self.report = {
+            "nb_users": 0,
+            "nb_unchanged_users": 0,
+            "nb_documents": 0,
+            "nb_unchanged_documents": 0,
+            "nb_acquisition_frameworks": 0,
+            "nb_datasets": 0,
+            "nb_actors": 0,
+            "errors": {},
+        }
+
+    def af_url(self, uuid_af):
+        return mtd_utils.AF_URL.format(self.api_endpoint, uuid_af)
+
+    def jdd_url(self, id_role):
+        return mtd_utils.JDD_URL.format(self.api_endpoint, id_role)
+
+    def nomenclature_id(self, nomenclature_type, code):
+        key = (nomenclature_type, code)
+        if key not in self._nomenclatures:
+            self._nomenclatures[key] = DB.session.execute(
+                select([func.ref_nomenclatures.get_id_nomenclature(nomenclature_type, code)])
+            ).scalar()
+        return self._nomenclatures[key]
+
+    def add_modules(self, dataset):
+        if self._modules is None:
+            self._modules = (
+                DB.session.query(TModules)
+                .filter(
+                    TModules.module_code.in_(
+                        current_app.config["CAS"]["JDD_MODULE_CODE_ASSOCIATION"]
+                    )
+                )
+                .all()
+            )
+        if not dataset.modules:
+            dataset.modules.extend(self._modules)
+
+    def fetch(self, urls, known_urls=()):
+        """
+        Fetch the documents; the state of the last synchronization is only used
+        for the `known_urls` (documents whose objects are in the database)
+        """
+        urls = list(urls)
+        states = {} if self.force else _load_states([url for url in urls if url in known_urls])
+        documents, errors = fetch_documents(urls, states, self.nb_threads, self.timeout)
+        self.report["nb_documents"] += len(documents)
+        self.report["nb_unchanged_documents"] += sum(
+            1 for d in documents.values() if not d.changed
+        )
+        for url, error in errors.items():
+            log.warning("MTD sync: unable to fetch %s: %s", url, error)
+        return documents, errors
+
+    def run(self, id_roles):
+        users = (
+            DB.session.query(
+                TMtdSyncUsers.id_role, TMtdSyncUsers.id_organism, TMtdSyncUsers.sync_date
+            )
+            .filter(TMtdSyncUsers.id_role.in_(id_roles))
+            .all()
+        )
+        # pas de transaction ouverte pendant les requêtes HTTP
+        DB.session.commit()
+        self.report["nb_users"] += len(users)
+        jdd_urls = {user.id_role: self.jdd_url(user.id_role) for user in users}
+        jdd_documents, jdd_errors = self.fetch(
+            jdd_urls.values(),
+            # la liste des JDD d'un utilisateur jamais synchronisé est toujours relue
+            known_urls={jdd_urls[user.id_role] for user in users if user.sync_date is not None},
+        )
+
+        users_datasets = {}
+        for user in users:
+            document = jdd_documents.get(jdd_urls[user.id_role])
+            if document is None:
+                self.set_error(user.id_role, jdd_errors[jdd_urls[user.id_role]])
+            elif not document.changed:
+                self.report["nb_unchanged_users"] += 1
+            else:
+                try:
+                    users_datasets[user] = mtd_utils.parse_jdd_xml(document.content)
+                except Exception as e:
+                    self.set_error(user.id_role, "Invalid XML: {}".format(e))
+
+        # CA des JDD des listes modifiées et CA des autres utilisateurs (un CA peut être
+        # modifié sans que la liste des JDD le soit)
+        af_uuids = {
+            _uuid_key(ds["uuid_acquisition_framework"])
+            for datasets in users_datasets.values()
+            for ds in datasets
+        }
+        unchanged_users = [user.id_role for user in users if user not in users_datasets]
+        if unchanged_users:
+            af_uuids.update(
+                _uuid_key(uuid_af)
+                for (uuid_af,) in DB.session.query(
+                    TAcquisitionFramework.unique_acquisition_framework_id
+                )
+                .join(
+                    CorAcquisitionFrameworkActor,
+                    CorAcquisitionFrameworkActor.id_acquisition_framework
+                    == TAcquisitionFramework.id_acquisition_framework,
+                )
+                .filter(CorAcquisitionFrameworkActor.id_role.in_(unchanged_users))
+                .distinct()
+            )
+        known_afs = set()
+        if af_uuids:
+            known_afs = {
+                _uuid_key(uuid_af)
+                for (uuid_af,) in DB.session.query(
+                    TAcquisitionFramework.unique_acquisition_framework_id
+                ).filter(TAcquisitionFramework.unique_acquisition_framework_id.in_(list(af_uuids)))
+            }
+        DB.session.commit()
+        af_urls = {uuid_af: self.af_url(uuid_af) for uuid_af in af_uuids}
+        af_documents, af_errors = self.fetch(
+            af_urls.values(), known_urls={af_urls[uuid_af] for uuid_af in known_afs}
+        )
+
+        try:
+            self.sync_acquisition_frameworks(
+                {
+                    uuid_af: af_documents[url]
+                    for uuid_af, url in af_urls.items()
+                    if url in af_documents and af_documents[url].changed
+                }
+            )
+            DB.session.commit()
+        except (SQLAlchemyError, ValueError) as e:
+            DB.session.rollback()
+            log.error("MTD sync of the acquisition frameworks: %s", e)
+            self.report["errors"]["acquisition_frameworks"] = str(e)
+
+        for user, datasets in users_datasets.items():
+            try:
+                if self.sync_user(user, datasets, jdd_documents[jdd_urls[user.id_role]]):
+                    DB.session.commit()
+            except (SQLAlchemyError, ValueError) as e:
+                DB.session.rollback()
+                self.set_error(user.id_role, e)
+
+        # liste des JDD inchangée : utilisateur à jour jusqu'à la prochaine synchronisation
+        up_to_date_users = [
+            user.id_role
+            for user in users
+            if jdd_urls[user.id_role] in jdd_documents
+            and not jdd_documents[jdd_urls[user.id_role]].changed
+        ]
+        if up_to_date_users:
+            DB.session.query(TMtdSyncUsers).filter(
+                TMtdSyncUsers.id_role.in_(up_to_date_users)
+            ).update(
+                {"sync_date": datetime.datetime.now(), "sync_error": None},
+                synchronize_session=False,
+            )
+            DB.session.commit()
+        return self.report
+
+    def sync_acquisition_frameworks(self, documents):
+        """
+        Upsert the acquisition frameworks of the modified documents in the current transaction
+
+        Parameters:
+            documents (dict): {uuid of the acquisition framework: MtdDocument}
+        """
+        if not documents:
+            return
+        # un CA créé par une autre synchronisation en cours ne doit pas être créé en double
+        DB.session.execute(select([func.pg_advisory_xact_lock(MTD_SYNC_LOCK_ID)]))
+        afs = {
+            _uuid_key(af.unique_acquisition_framework_id): af
+            for af in DB.session.query(TAcquisitionFramework).filter(
+                TAcquisitionFramework.unique_acquisition_framework_id.in_(list(documents))
+            )
+        }
+        for uuid_af, document in documents.items():
+            try:
+                values = mtd_utils.parse_acquisition_framwork_xml(document.content)
+            except Exception as e:
+                # document relu à la prochaine synchronisation
+                log.warning("MTD sync: invalid XML %s: %s", document.url, e)
+                continue
+            af = afs.get(uuid_af)
+            if af is None:
+                DB.session.add(TAcquisitionFramework(**values))
+                self.report["nb_acquisition_frameworks"] += 1
+            else:
+                values.pop("unique_acquisition_framework_id")
+                # date de lancement absente du document : celle de la base est gardée
+                if isinstance(values["acquisition_framework_start_date"], datetime.datetime):
+                    values.pop("acquisition_framework_start_date")
+                for key in ("acquisition_framework_start_date", "acquisition_framework_end_date"):
+                    if key in values:
+                        values[key] = _parse_date(values[key])
+                if _update_changed(af, values):
+                    self.report["nb_acquisition_frameworks"] += 1
+            _save_state(document)
+
+    def sync_user(self, user, datasets, jdd_document):
+        """
+        Upsert the datasets of a user and add the user and its organism as actors
+        of the datasets and their acquisition frameworks, in the current transaction
+
+        Returns:
+            bool: False if the user is being synchronized by another process
+        """
+        if not DB.session.execute(
+            select([func.pg_try_advisory_xact_lock(MTD_SYNC_LOCK_ID, user.id_role)])
+        ).scalar():
+            DB.session.rollback()
+            return False
+        afs = {
+            _uuid_key(uuid_af): id_af
+            for uuid_af, id_af in DB.session.query(
+                TAcquisitionFramework.unique_acquisition_framework_id,
+                TAcquisitionFramework.id_acquisition_framework,
+            ).filter(
+                TAcquisitionFramework.unique_acquisition_framework_id.in_(
+                    list({_uuid_key(ds["uuid_acquisition_framework"]) for ds in datasets})
+                )
+            )
+        }
+        existing = {
+            _uuid_key(ds.unique_dataset_id): ds
+            for ds in DB.session.query(TDatasets).filter(
+                TDatasets.unique_dataset_id.in_([ds["unique_dataset_id"] for ds in datasets])
+            )
+        }
+        user_datasets = []
+        missing_afs = set()
+        for values in datasets:
+            uuid_af = _uuid_key(values.pop("uuid_acquisition_framework"))
+            if uuid_af not in afs:
+                missing_afs.add(uuid_af)
+                continue
+            values["id_acquisition_framework"] = afs[uuid_af]
+            for key, nomenclature_type in mtd_utils.NOMENCLATURE_MAPPING.items():
+                if key in values:
+                    values[key] = self.nomenclature_id(nomenclature_type, values[key])
+            values["validable"] = True
+            dataset = existing.get(_uuid_key(values["unique_dataset_id"]))
+            if dataset is None:
+                dataset = TDatasets(**values)
+                DB.session.add(dataset)
+                self.report["nb_datasets"] += 1
+            else:
+                values.pop("unique_dataset_id")
+                if _update_changed(dataset, values):
+                    self.report["nb_datasets"] += 1
+            self.add_modules(dataset)
+            user_datasets.append(dataset)
+        DB.session.flush()
+
+        id_actor_role = self.nomenclature_id("ROLE_ACTEUR", "1")
+        self.report["nb_actors"] += _add_missing_actors(
+            CorAcquisitionFrameworkActor,
+            "id_acquisition_framework",
+            list({ds.id_acquisition_framework for ds in user_datasets}),
+            user.id_role,
+            user.id_organism,
+            id_actor_role,
+        )
+        self.report["nb_actors"] += _add_missing_actors(
+            CorDatasetActor,
+            "id_dataset",
+            [ds.id_dataset for ds in user_datasets],
+            user.id_role,
+            user.id_organism,
+            id_actor_role,
+        )
+        sync_user = DB.session.query(TMtdSyncUsers).get(user.id_role)
+        sync_user.sync_date = datetime.datetime.now()
+        if missing_afs:
+            # la liste des JDD sera relue à la prochaine synchronisation
+            sync_user.sync_error = "Acquisition frameworks not found: {}".format(
+                ", ".join(sorted(missing_afs))
+            )
+            self.report["errors"][user.id_role] = sync_user.sync_error
+        else:
+            sync_user.sync_error = None
+            _save_state(jdd_document)
+        return True
+
+    def set_error(self, id_role, error):
+        log.error("MTD sync of the user %s: %s", id_role, error)
+        self.report["errors"][id_role] = str(error)
+        # date de la tentative : pas de nouvelle tentative avant USER_SYNC_INTERVAL
+        DB.session.query(TMtdSyncUsers).filter(TMtdSyncUsers.id_role == id_role).update(
+            {"sync_date": datetime.datetime.now(), "sync_error": str(error)},
+            synchronize_session=False,
+        )
+        DB.session.commit()
+
+
+def sync_users(id_roles=None, force=False):
+    """
+    Synchronize the datasets and acquisition frameworks of users from the MTD web service
+
+    Parameters:
+        id_roles (list<int>): users to synchronize (registered with register_user),
+            by default the users who consulted the metadata in the last
+            MTD_SYNC.ACTIVE_USER_DAYS days
+        force (bool): read all the documents, even the unchanged ones
+    Returns:
+        dict: report of the synchronization
+    """
+    if id_roles is None:
+        since = datetime.datetime.now() - datetime.timedelta(
+            days=current_app.config["MTD_SYNC"]["ACTIVE_USER_DAYS"]
+        )
+        id_roles = [
+            id_role
+            for (id_role,) in DB.session.query(TMtdSyncUsers.id_role).filter(
+                TMtdSyncUsers.request_date >= since
+            )
+        ]
+    if not id_roles:
+        return MtdSync(force).report
+    return MtdSync(force).run(id_roles)
+
+
+def register_user(id_role, id_organism=None):
+    """
+    Register the user for the synchronization and update its last request date
+
+    Returns:
+        tuple: (date of the last synchronization, error of the last synchronization)
+    """
+    stmt = insert(TMtdSyncUsers.__table__).values(
+        id_role=id_role, id_organism=id_organism, request_date=func.now()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["id_role"],
+        set_={
+            "id_organism": stmt.excluded.id_organism,
+            "request_date": stmt.excluded.request_date,
+        },
+    ).returning(TMtdSyncUsers.__table__.c.sync_date, TMtdSyncUsers.__table__.c.sync_error)
+    sync_date, sync_error = DB.session.execute(stmt).first()
+    DB.session.commit()
+    return sync_date, sync_error
+
+
+def _sync_in_background(app, id_role):
+    with app.app_context():
+        try:
+            sync_users([id_role])
+        except Exception:
+            log.exception("MTD sync of the user %s", id_role)
+        finally:
+            with _pending_lock:
+                _pending.pop(id_role, None)
+
+
+def request_user_sync(id_role, id_organism=None):
+    """
+    Register the user and start its synchronization in a thread of the API process
+    if its last synchronization is older than MTD_SYNC.USER_SYNC_INTERVAL.
+    The first synchronization of the user is waited for, at most MTD_SYNC.TIMEOUT seconds
+
+    Returns:
+        str: the error of the last synchronization of the user (None if it succeeded)
+    """
+    global _executor
+    sync_date, sync_error = register_user(id_role, id_organism)
+    config = current_app.config["MTD_SYNC"]
+    interval = datetime.timedelta(seconds=config["USER_SYNC_INTERVAL"])
+    if sync_date is not None and datetime.datetime.now() - sync_date < interval:
+        return sync_error
+    with _pending_lock:
+        future = _pending.get(id_role)
+        if future is None:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=1)
+            future = _executor.submit(
+                _sync_in_background, current_app._get_current_object(), id_role
+            )
+            _pending[id_role] = future
+    if sync_date is not None:
+        return sync_error
+    try:
+        future.result(timeout=config["TIMEOUT"])
+    except TimeoutError:
+        # synchronisation poursuivie en tâche de fond
+        return sync_error
+    return (
+        DB.session.query(TMtdSyncUsers.sync_error)
+        .filter(TMtdSyncUsers.id_role == id_role)
+        .scalar()
+    )
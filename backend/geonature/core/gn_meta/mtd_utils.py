@@ -27,6 +27,9 @@ from geonature.core.gn_commons.models import TModules
 namespace = current_app.config["XML_NAMESPACE"]
 api_endpoint = current_app.config["MTD_API_ENDPOINT"]
 
+AF_URL = "{}/cadre/export/xml/GetRecordById?id={}"
+JDD_URL = "{}/cadre/jdd/export/xml/GetRecordsByUserId?id={}"
+
 NOMENCLATURE_MAPPING = {
     "id_nomenclature_data_type": "DATA_TYP",
     "id_nomenclature_dataset_objectif": "JDD_OBJECTIFS",
@@ -50,9 +53,8 @@ def get_acquisition_framework(uuid_af):
         Returns:
             byte: the xml of the AF as byte
     """
-    url = "{}/cadre/export/xml/GetRecordById?id={}"
     try:
-        r = utilsrequests.get(url.format(api_endpoint, uuid_af))
+        r = utilsrequests.get(AF_URL.format(api_endpoint, uuid_af))
     except AssertionError:
         raise GeonatureApiError(
             message="Error with the MTD Web Service while getting Acquisition Framwork"
@@ -110,9 +112,8 @@ def get_jdd_by_user_id(id_user):
         Return:
             byte: a XML as byte 
     """
-    url = "{}/cadre/jdd/export/xml/GetRecordsByUserId?id={}"
     try:
-        r = utilsrequests.get(url.format(api_endpoint, str(id_user)))
+        r = utilsrequests.get(JDD_URL.format(api_endpoint, str(id_user)))
         assert r.status_code == 200
     except AssertionError:
         raise GeonatureApiError(
@@ -0,0 +1,143 @@
+"""
+    Cache des exports PDF des JDD et cadres d'acquisition
+
+    Le PDF d'un objet est enregistré dans var/pdf sous un nom contenant la version
+    de son contenu : hash de la date de modification de l'objet, de ses acteurs,
+    du nombre et de la date de modification de ses observations dans la synthèse,
+    de l'image des taxons envoyée par le frontend (static/images/taxa.png)
+    et de la date du jour (pied de page). Un export d'un objet non modifié
+    est servi directement depuis le disque.
+    Sinon le template est rendu par le processus de l'API et le PDF écrit par
+    un pool de processus (PDF_EXPORTS.NB_PROCESSES) : les demandes simultanées
+    du même PDF attendent le même rendu. Les anciennes versions d'un objet sont
+    supprimées après chaque rendu, les PDF non demandés depuis
+    PDF_EXPORTS.RETENTION_DAYS jours aussi.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from flask import current_app
+from sqlalchemy import func
+
+from geonature.utils.env import DB, ROOT_DIR, BACKEND_DIR
+from geonature.utils import filemanager as fm
+from geonature.core.gn_synthese.models import Synthese
+
+log = logging.getLogger(__name__)
+
+PDF_DIR = ROOT_DIR / "var" / "pdf"
+TAXA_IMAGE = BACKEND_DIR / "static" / "images" / "taxa.png"
+
+_executor = None
+# PDF en cours de rendu : {chemin du fichier: future}
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def _file_hash(path):
+    try:
+        with open(str(path), "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def synthese_version(id_datasets):
+    """
+    Return the number of observations of the datasets and their last modification date
+    """
+    if not id_datasets:
+        return (0, None)
+    return tuple(
+        DB.session.query(func.count(Synthese.id_synthese), func.max(Synthese.meta_update_date))
+        .filter(Synthese.id_dataset.in_(id_datasets))
+        .one()
+    )
+
+
+def content_version(*parts):
+    """
+    Return the version of the pdf of an object from the values its content depends on
+    (with the taxa image and the date of the footer)
+    """
+    parts = parts + (_file_hash(TAXA_IMAGE), datetime.date.today())
+    return hashlib.sha1(json.dumps(parts, default=str, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def get_executor():
+    """
+    Return the pdf process pool of the current process
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=current_app.config["PDF_EXPORTS"]["NB_PROCESSES"]
+        )
+    return _executor
+
+
+def _remove_stale_files(prefix, current_path):
+    """
+    Remove the other versions of the object and the pdf not requested
+    since PDF_EXPORTS.RETENTION_DAYS days
+    """
+    min_mtime = time.time() - current_app.config["PDF_EXPORTS"]["RETENTION_DAYS"] * 86400
+    with os.scandir(str(PDF_DIR)) as it:
+        for entry in it:
+            if entry.path == current_path or not entry.is_file():
+                continue
+            try:
+                if entry.name.startswith(prefix) or entry.stat().st_mtime < min_mtime:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def get_pdf(name, version, render_html):
+    """
+    Return the path of the pdf of an object, rendered if its version is not in the cache
+
+    Parameters:
+        name (str): name of the object (prefix of its files), ex: jdd_12
+        version (str): version of the content of the object (see content_version)
+        render_html (function): return the rendered template (None if the object is not found)
+    Returns:
+        str: absolute path of the pdf (None if the object is not found)
+    """
+    path = str(PDF_DIR / "{}_{}.pdf".format(name, version))
+    if os.path.isfile(path):
+        # date de dernière demande (nettoyage des PDF non demandés)
+        os.utime(path)
+        return path
+    timeout = current_app.config["PDF_EXPORTS"]["TIMEOUT"]
+    with _pending_lock:
+        future = _pending.get(path)
+        owner = future is None
+        if owner:
+            future = Future()
+            _pending[path] = future
+    if not owner:
+        return future.result(timeout)
+
+    try:
+        html = render_html()
+        if html is None:
+            result = None
+        else:
+            PDF_DIR.mkdir(parents=True, exist_ok=True)
+            result = get_executor().submit(fm.write_pdf, html, path).result(timeout)
+            _remove_stale_files(name + "_", path)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _pending_lock:
+            del _pending[path]
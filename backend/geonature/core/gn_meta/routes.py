@@ -39,8 +39,7 @@ from geonature.core.gn_meta.repositories import (
 from utils_flask_sqla.response import json_resp
 from geonature.core.gn_permissions import decorators as permissions
 from geonature.core.gn_permissions.tools import cruved_scope_for_user_in_module
-from geonature.core.gn_meta import mtd_utils
-import geonature.utils.filemanager as fm
+from geonature.core.gn_meta import mtd_utils, mtd_sync, pdf_exports
 
 
 routes = Blueprint("gn_meta", __name__)
@@ -50,6 +49,25 @@ log = logging.getLogger()
 gunicorn_error_logger = logging.getLogger("gunicorn.error")
 
 
+def request_mtd_sync(info_role):
+    """
+    With the CAS authentication, start the synchronization of the CA and JDD
+    of the user from the MTD WS in background (see gn_meta.mtd_sync).
+    The first synchronization of the user is waited for (MTD_SYNC.TIMEOUT)
+
+    Returns:
+        bool: True if the last synchronization of the user failed
+    """
+    if not current_app.config["CAS_PUBLIC"]["CAS_AUTHENTIFICATION"]:
+        return False
+    try:
+        return mtd_sync.request_user_sync(info_role.id_role, info_role.id_organisme) is not None
+    except Exception as e:
+        gunicorn_error_logger.info(e)
+        log.error(e)
+        return True
+
+
 @routes.route("/list/datasets", methods=["GET"])
 @json_resp
 def get_datasets_list():
@@ -75,17 +93,7 @@ def get_datasets(info_role):
     :query int id_acquisition_framework: get only dataset of given AF
     :returns:  `dict{'data':list<TDatasets>, 'with_erros': <boolean>}`
     """
-    with_mtd_error = False
-    if current_app.config["CAS_PUBLIC"]["CAS_AUTHENTIFICATION"]:
-        # synchronise the CA and JDD from the MTD WS
-        try:
-            mtd_utils.post_jdd_from_user(
-                id_user=info_role.id_role, id_organism=info_role.id_organisme
-            )
-        except Exception as e:
-            gunicorn_error_logger.info(e)
-            log.error(e)
-            with_mtd_error = True
+    with_mtd_error = request_mtd_sync(info_role)
     params = request.args.to_dict()
     datasets = get_datasets_cruved(info_role, params)
     datasets_resp = {"data": datasets}
@@ -113,62 +121,47 @@ def get_af_and_ds_metadata(info_role):
     :type info_role: TRole
     :returns:  `dict{'data':list<AF with Datasets>, 'with_erros': <boolean>}`
     """
-    with_mtd_error = False
-    if current_app.config["CAS_PUBLIC"]["CAS_AUTHENTIFICATION"]:
-        # synchronise the CA and JDD from the MTD WS
-        try:
-            mtd_utils.post_jdd_from_user(
-                id_user=info_role.id_role, id_organism=info_role.id_organisme
-            )
-        except Exception as e:
-            gunicorn_error_logger.info(e)
-            log.error(e)
-            with_mtd_error = True
+    with_mtd_error = request_mtd_sync(info_role)
     params = request.args.to_dict()
     params["orderby"] = "dataset_name"
     datasets = get_datasets_cruved(info_role, params, as_model=True)
-    ids_dataset_user = TDatasets.get_user_datasets(info_role, only_user=True)
-    ids_dataset_organisms = TDatasets.get_user_datasets(info_role, only_user=False)
-    ids_afs_user = TAcquisitionFramework.get_user_af(info_role, only_user=True)
-    ids_afs_org = TAcquisitionFramework.get_user_af(info_role, only_user=False)
+    ids_dataset_user, ids_dataset_organisms = TDatasets.get_user_actor_ids(info_role)
+    ids_afs_user, ids_afs_org = TAcquisitionFramework.get_user_actor_ids(info_role)
     user_cruved = cruved_scope_for_user_in_module(
         id_role=info_role.id_role, module_code="METADATA",
     )[0]
 
-    #  get all af from the JDD filtered with cruved or af where users has rights
-    ids_afs_cruved = [d.id_acquisition_framework for d in get_af_cruved(info_role, as_model=True)]
-    list_id_af = [d.id_acquisition_framework for d in datasets] + ids_afs_cruved
-    afs = (
-        DB.session.query(TAcquisitionFramework)
-        .filter(TAcquisitionFramework.id_acquisition_framework.in_(list_id_af))
-        .order_by(TAcquisitionFramework.acquisition_framework_name)
-        .all()
+    #  get all af from the JDD filtered with cruved or af where users has rights
+    q = DB.session.query(TAcquisitionFramework)
+    if info_role.value_filter in ("1", "2"):
+        ids_afs_cruved = ids_afs_user if info_role.value_filter == "1" else ids_afs_org
+        list_id_af = {d.id_acquisition_framework for d in datasets} | ids_afs_cruved
+        q = q.filter(TAcquisitionFramework.id_acquisition_framework.in_(list_id_af))
+    afs = q.order_by(TAcquisitionFramework.acquisition_framework_name).all()
+
+    afs_cruved = TAcquisitionFramework.get_objects_cruved(
+        user_cruved,
+        [af.id_acquisition_framework for af in afs],
+        ids_afs_user,
+        ids_afs_org,
     )
-
     afs_dict = []
-    #  get cruved for each AF and prepare dataset
+    afs_by_id = {}
     for af in afs:
         af_dict = af.as_dict()
-        af_dict["cruved"] = af.get_object_cruved(
-            user_cruved=user_cruved,
-            id_object=af.id_acquisition_framework,
-            ids_object_user=ids_afs_user,
-            ids_object_organism=ids_afs_org,
-        )
+        af_dict["cruved"] = afs_cruved[af.id_acquisition_framework]
         af_dict["datasets"] = []
         afs_dict.append(af_dict)
+        afs_by_id[af.id_acquisition_framework] = af_dict
 
-    #  get cruved for each ds and push them in the af
+    #  get cruved for each ds and push them in the af
+    datasets_cruved = TDatasets.get_objects_cruved(
+        user_cruved, [d.id_dataset for d in datasets], ids_dataset_user, ids_dataset_organisms,
+    )
     for d in datasets:
         dataset_dict = d.as_dict()
-        dataset_dict["cruved"] = d.get_object_cruved(
-            user_cruved=user_cruved,
-            id_object=d.id_dataset,
-            ids_object_user=ids_dataset_user,
-            ids_object_organism=ids_dataset_organisms,
-        )
-        af_of_dataset = get_af_from_id(d.id_acquisition_framework, afs_dict)
-        af_of_dataset["datasets"].append(dataset_dict)
+        dataset_dict["cruved"] = datasets_cruved[d.id_dataset]
+        afs_by_id[d.id_acquisition_framework]["datasets"].append(dataset_dict)
 
     afs_resp = {"data": afs_dict}
     if with_mtd_error:
@@ -178,15 +171,6 @@ def get_af_and_ds_metadata(info_role):
     return afs_resp
 
 
-def get_af_from_id(id_af, af_list):
-    found_af = None
-    for af in af_list:
-        if af["id_acquisition_framework"] == id_af:
-            found_af = af
-            break
-    return found_af
-
-
 @routes.route("/dataset/<id_dataset>", methods=["GET"])
 @json_resp
 def get_dataset(id_dataset):
@@ -285,6 +269,28 @@ def post_dataset(info_role):
     return dataset.as_dict(True)
 
 
+def is_allowed_to_export(info_role, id_digitizer, actors):
+    """
+    Rules of repositories.cruved_filter for one dataset or acquisition framework:
+    the user is its digitizer or one of its actors, or with scope 2 its organism is an actor
+
+    Parameters:
+        actors (list): (id_role, id_organism, ...) of the actors
+    """
+    if info_role.value_filter == "3":
+        return True
+    if info_role.value_filter not in ("1", "2"):
+        return False
+    if id_digitizer == info_role.id_role or info_role.id_role in [a[0] for a in actors]:
+        return True
+    # sans organisme, l'utilisateur n'a pas de droit par organisme
+    return (
+        info_role.value_filter == "2"
+        and info_role.id_organisme is not None
+        and info_role.id_organisme in [a[1] for a in actors]
+    )
+
+
 @routes.route("/dataset/export_pdf/<id_dataset>", methods=["GET"])
 @permissions.check_cruved_scope("E", True, module_code="METADATA")
 def get_export_pdf_dataset(id_dataset, info_role):
@@ -298,58 +304,79 @@ def get_export_pdf_dataset(id_dataset, info_role):
             ('User "{}" cannot "{}" a dataset').format(info_role.id_role, "export"), 403,
         )
 
-    df = get_dataset_details_dict(id_dataset, info_role)
-
-    if info_role.value_filter != "3":
-        try:
-            if info_role.value_filter == "1":
-                actors = [cor["id_role"] for cor in df["cor_dataset_actor"]]
-                assert info_role.id_role in actors
-            elif info_role.value_filter == "2":
-                actors = [cor["id_role"] for cor in df["cor_dataset_actor"]]
-                organisms = [cor["id_organism"] for cor in df["cor_dataset_actor"]]
-                assert info_role.id_role in actors or info_role.id_organisme in organisms
-        except AssertionError:
-            raise InsufficientRightsError(
-                ('User "{}" cannot read this current dataset').format(info_role.id_role), 403,
-            )
-
-    if not df:
-        return (
-            render_template(
-                "error.html",
-                error="Le dataset presente des erreurs",
-                redirect=current_app.config["URL_APPLICATION"] + "/#/metadata",
-            ),
-            404,
+    not_found = (
+        render_template(
+            "error.html",
+            error="Le dataset presente des erreurs",
+            redirect=current_app.config["URL_APPLICATION"] + "/#/metadata",
+        ),
+        404,
+    )
+    dataset = (
+        DB.session.query(
+            TDatasets.meta_update_date, TDatasets.dataset_shortname, TDatasets.id_digitizer
+        )
+        .filter(TDatasets.id_dataset == id_dataset)
+        .first()
+    )
+    if dataset is None:
+        return not_found
+    actors = [
+        (a.id_role, a.id_organism, a.id_nomenclature_actor_role)
+        for a in DB.session.query(CorDatasetActor).filter(CorDatasetActor.id_dataset == id_dataset)
+    ]
+
+    # le PDF en cache est commun à tous les utilisateurs : droits vérifiés avant de le servir
+    if not is_allowed_to_export(info_role, dataset.id_digitizer, actors):
+        raise InsufficientRightsError(
+            ('User "{}" cannot read this current dataset').format(info_role.id_role), 403,
         )
 
-    if len(df["dataset_desc"]) > 240:
-        df["dataset_desc"] = df["dataset_desc"][:240] + "..."
+    def render_html():
+        df = get_dataset_details_dict(id_dataset, info_role)
+        if not df:
+            return None
 
-    df["css"] = {
-        "logo": "Logo_pdf.png",
-        "bandeau": "Bandeau_pdf.png",
-        "entite": "sinp",
-    }
+        if len(df["dataset_desc"]) > 240:
+            df["dataset_desc"] = df["dataset_desc"][:240] + "..."
+
+        df["css"] = {
+            "logo": "Logo_pdf.png",
+            "bandeau": "Bandeau_pdf.png",
+            "entite": "sinp",
+        }
 
-    date = dt.datetime.now().strftime("%d/%m/%Y")
+        date = dt.datetime.now().strftime("%d/%m/%Y")
 
-    df["footer"] = {
-        "url": current_app.config["URL_APPLICATION"] + "/#/metadata/dataset_detail/" + id_dataset,
-        "date": date,
-    }
+        df["footer"] = {
+            "url": current_app.config["URL_APPLICATION"]
+            + "/#/metadata/dataset_detail/"
+            + id_dataset,
+            "date": date,
+        }
+        return render_template("dataset_template_pdf.html", data=df)
 
+    # PDF rendu seulement si le JDD, ses acteurs ou ses observations ont été modifiés
+    version = pdf_exports.content_version(
+        dataset.meta_update_date,
+        sorted(actors, key=str),
+        pdf_exports.synthese_version([id_dataset]),
+    )
+    pdf_file = pdf_exports.get_pdf("jdd_{}".format(id_dataset), version, render_html)
+    if pdf_file is None:
+        return not_found
     filename = "jdd_{}_{}_{}.pdf".format(
         id_dataset,
-        df["dataset_shortname"].replace(" ", "_"),
+        dataset.dataset_shortname.replace(" ", "_"),
         dt.datetime.now().strftime("%d%m%Y_%H%M%S"),
     )
-
-    # Appel de la methode pour generer un pdf
-    pdf_file = fm.generate_pdf("dataset_template_pdf.html", df, filename)
     pdf_file_posix = Path(pdf_file)
-    return send_from_directory(str(pdf_file_posix.parent), pdf_file_posix.name, as_attachment=True)
+    return send_from_directory(
+        str(pdf_file_posix.parent),
+        pdf_file_posix.name,
+        as_attachment=True,
+        attachment_filename=filename,
+    )
 
 
 @routes.route("/acquisition_frameworks", methods=["GET"])
@@ -379,25 +406,42 @@ def get_export_pdf_acquisition_frameworks(id_acquisition_framework, info_role):
             ('User "{}" cannot "{}" a dataset').format(info_role.id_role, "export"), 403,
         )
 
-    # Recuperation des données
-    af = DB.session.query(TAcquisitionFrameworkDetails).get(id_acquisition_framework)
-    acquisition_framework = af.as_dict(True)
-
-    q = DB.session.query(TDatasets).distinct()
-    data = q.filter(TDatasets.id_acquisition_framework == id_acquisition_framework).all()
-    dataset_ids = [d.id_dataset for d in data]
-    acquisition_framework["datasets"] = [d.as_dict(True) for d in data]
-
-    nb_data = len(dataset_ids)
-    nb_taxons = (
-        DB.session.query(Synthese.cd_nom)
-        .filter(Synthese.id_dataset.in_(dataset_ids))
-        .distinct()
-        .count()
+    not_found = (
+        render_template(
+            "error.html",
+            error="Le dataset presente des erreurs",
+            redirect=current_app.config["URL_APPLICATION"] + "/#/metadata",
+        ),
+        404,
     )
-    nb_observations = (
-        DB.session.query(Synthese.cd_nom).filter(Synthese.id_dataset.in_(dataset_ids)).count()
+    af = (
+        DB.session.query(
+            TAcquisitionFramework.meta_update_date,
+            TAcquisitionFramework.acquisition_framework_name,
+            TAcquisitionFramework.id_digitizer,
+        )
+        .filter(TAcquisitionFramework.id_acquisition_framework == id_acquisition_framework)
+        .first()
+    )
+    if af is None:
+        return not_found
+    af_actors = [
+        (a.id_role, a.id_organism, a.id_nomenclature_actor_role)
+        for a in DB.session.query(CorAcquisitionFrameworkActor).filter(
+            CorAcquisitionFrameworkActor.id_acquisition_framework == id_acquisition_framework
+        )
+    ]
+    if not is_allowed_to_export(info_role, af.id_digitizer, af_actors):
+        raise InsufficientRightsError(
+            ('User "{}" cannot read this acquisition framework').format(info_role.id_role), 403,
+        )
+    datasets = (
+        DB.session.query(TDatasets.id_dataset, TDatasets.meta_update_date)
+        .filter(TDatasets.id_acquisition_framework == id_acquisition_framework)
+        .order_by(TDatasets.id_dataset)
+        .all()
     )
+    dataset_ids = [d.id_dataset for d in datasets]
     nb_habitat = 0
 
     # Check if pr_occhab exist
@@ -407,7 +451,7 @@ def get_export_pdf_acquisition_frameworks(id_acquisition_framework, info_role):
         .where(text("schema_name = 'pr_occhab'"))
     )
 
-    if DB.session.query(check_schema_query).scalar() and nb_data > 0:
+    if DB.session.query(check_schema_query).scalar() and dataset_ids:
         query = (
             "SELECT count(*) FROM pr_occhab.t_stations s, pr_occhab.t_habitats h WHERE s.id_station = h.id_station AND s.id_dataset in \
         ("
@@ -417,20 +461,38 @@ def get_export_pdf_acquisition_frameworks(id_acquisition_framework, info_role):
 
         nb_habitat = DB.engine.execute(text(query)).first()[0]
 
-    acquisition_framework["stats"] = {
-        "nb_data": nb_data,
-        "nb_taxons": nb_taxons,
-        "nb_observations": nb_observations,
-        "nb_habitats": nb_habitat,
-    }
+    def render_html():
+        # Recuperation des données
+        af_details = DB.session.query(TAcquisitionFrameworkDetails).get(id_acquisition_framework)
+        acquisition_framework = af_details.as_dict(True)
+
+        q = DB.session.query(TDatasets).distinct()
+        data = q.filter(TDatasets.id_acquisition_framework == id_acquisition_framework).all()
+        acquisition_framework["datasets"] = [d.as_dict(True) for d in data]
+
+        nb_taxons = (
+            DB.session.query(Synthese.cd_nom)
+            .filter(Synthese.id_dataset.in_(dataset_ids))
+            .distinct()
+            .count()
+        )
+        nb_observations = (
+            DB.session.query(Synthese.cd_nom).filter(Synthese.id_dataset.in_(dataset_ids)).count()
+        )
+
+        acquisition_framework["stats"] = {
+            "nb_data": len(dataset_ids),
+            "nb_taxons": nb_taxons,
+            "nb_observations": nb_observations,
+            "nb_habitats": nb_habitat,
+        }
 
-    if acquisition_framework:
         acquisition_framework[
             "nomenclature_territorial_level"
-        ] = af.nomenclature_territorial_level.as_dict()
+        ] = af_details.nomenclature_territorial_level.as_dict()
         acquisition_framework[
             "nomenclature_financing_type"
-        ] = af.nomenclature_financing_type.as_dict()
+        ] = af_details.nomenclature_financing_type.as_dict()
         if acquisition_framework["acquisition_framework_start_date"]:
             start_date = dt.datetime.strptime(
                 acquisition_framework["acquisition_framework_start_date"], "%Y-%m-%d"
@@ -455,30 +517,31 @@ def get_export_pdf_acquisition_frameworks(id_acquisition_framework, info_role):
             + id_acquisition_framework,
             "date": date,
         }
-        params = {"id_acquisition_frameworks": id_acquisition_framework}
-
-    else:
-        return (
-            render_template(
-                "error.html",
-                error="Le dataset presente des erreurs",
-                redirect=current_app.config["URL_APPLICATION"] + "/#/metadata",
-            ),
-            404,
+        return render_template(
+            "acquisition_framework_template_pdf.html", data=acquisition_framework
         )
 
+    # PDF rendu seulement si le CA, ses acteurs, ses JDD ou leurs observations ont été modifiés
+    version = pdf_exports.content_version(
+        af.meta_update_date,
+        sorted(af_actors, key=str),
+        [tuple(d) for d in datasets],
+        pdf_exports.synthese_version(dataset_ids),
+        nb_habitat,
+    )
+    pdf_file = pdf_exports.get_pdf("ca_{}".format(id_acquisition_framework), version, render_html)
     filename = "{}_{}_{}.pdf".format(
         id_acquisition_framework,
-        acquisition_framework["acquisition_framework_name"][0:31].replace(" ", "_"),
+        af.acquisition_framework_name[0:31].replace(" ", "_"),
         dt.datetime.now().strftime("%d%m%Y_%H%M%S"),
     )
-
-    # Appel de la methode pour generer un pdf
-    pdf_file = fm.generate_pdf(
-        "acquisition_framework_template_pdf.html", acquisition_framework, filename
-    )
     pdf_file_posix = Path(pdf_file)
-    return send_from_directory(str(pdf_file_posix.parent), pdf_file_posix.name, as_attachment=True)
+    return send_from_directory(
+        str(pdf_file_posix.parent),
+        pdf_file_posix.name,
+        as_attachment=True,
+        attachment_filename=filename,
+    )
 
 
 @routes.route("/acquisition_frameworks_metadata", methods=["GET"])
@@ -495,20 +558,17 @@ def get_acquisition_frameworks_metadata(info_role):
     """
     params = request.args
     afs = get_af_cruved(info_role, params, as_model=True)
-    id_afs_user = TAcquisitionFramework.get_user_af(info_role, only_user=True)
-    id_afs_org = TAcquisitionFramework.get_user_af(info_role, only_user=False)
+    id_afs_user, id_afs_org = TAcquisitionFramework.get_user_actor_ids(info_role)
     user_cruved = cruved_scope_for_user_in_module(
         id_role=info_role.id_role, module_code="METADATA",
     )[0]
+    afs_cruved = TAcquisitionFramework.get_objects_cruved(
+        user_cruved, [af.id_acquisition_framework for af in afs], id_afs_user, id_afs_org
+    )
     afs_dict = []
     for af in afs:
         af_dict = af.as_dict()
-        af_dict["cruved"] = af.get_object_cruved(
-            user_cruved=user_cruved,
-            id_object=af.id_acquisition_framework,
-            ids_object_user=id_afs_user,
-            ids_object_organism=id_afs_org,
-        )
+        af_dict["cruved"] = afs_cruved[af.id_acquisition_framework]
         afs_dict.append(af_dict)
     return afs_dict
 
@@ -22,6 +22,7 @@ from geonature.core.gn_permissions.backoffice.forms import (
 from geonature.core.gn_permissions.tools import (
     cruved_scope_for_user_in_module,
     beautifulize_cruved,
+    clear_user_permissions_cache,
 )
 from geonature.core.gn_permissions.models import (
     TFilters,
@@ -142,6 +143,8 @@ def permission_form(info_role, id_module, id_role, id_object=None):
                     )
                     DB.session.add(permission_row)
                 DB.session.commit()
+            # the role could be a group: invalidate the permissions of all the roles
+            clear_user_permissions_cache()
             flash("CRUVED mis à jour pour le role {}".format(user.id_role))
         return redirect(url_for("gn_permissions_backoffice.user_cruved", id_role=id_role))
 
@@ -325,6 +328,7 @@ def other_permissions_form(id_role, id_filter_type, id_permission=None):
         else:
             DB.session.add(permInstance)
         DB.session.commit()
+        clear_user_permissions_cache()
 
         return redirect(
             url_for("gn_permissions_backoffice.user_other_permissions", id_role=id_role)
@@ -373,6 +377,7 @@ def filter_form(id_filter_type, id_filter=None):
             DB.session.add(filter_instance)
             flash("Filtre ajouté avec succès")
         DB.session.commit()
+        clear_user_permissions_cache()
         return redirect(
             url_for("gn_permissions_backoffice.filter_list", id_filter_type=id_filter_type)
         )
@@ -411,6 +416,7 @@ def delete_filter(id_filter):
     my_filter = DB.session.query(TFilters).get(id_filter)
     DB.session.delete(my_filter)
     DB.session.commit()
+    clear_user_permissions_cache()
     flash("Filtre supprimé avec succès")
     return redirect(
         url_for("gn_permissions_backoffice.filter_list", id_filter_type=my_filter.id_filter_type,)
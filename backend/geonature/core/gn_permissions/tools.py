@@ -1,6 +1,8 @@
 import logging, json
+import threading
+import time
 
-from flask import current_app, redirect, Response
+from flask import current_app, redirect, Response, g, has_request_context
 
 from itsdangerous import (
     TimedJSONWebSignatureSerializer as Serializer,
@@ -8,7 +10,6 @@ from itsdangerous import (
     BadSignature,
 )
 
-import sqlalchemy as sa
 from sqlalchemy.sql.expression import func
 
 
@@ -132,25 +133,95 @@ class UserCruved:
             return get_max_perm(geonature_permission)
 
 
+# Cache des permissions des rôles, propre à chaque processus (worker) :
+# {id_role: (timestamp, [VUsersPermissions])}
+# Les permissions sont également mémorisées le temps d'une requête dans flask.g
+_USER_PERMISSIONS_CACHE = {}
+_USER_PERMISSIONS_CACHE_LOCK = threading.Lock()
+
+
+def clear_user_permissions_cache(id_role=None):
+    """
+    Invalidate the permissions cache of a role (or of all the roles if id_role is None)
+    Must be called after each write on the permissions.
+    The cache of the others workers expires after PERMISSIONS_CACHE_TTL seconds
+    """
+    with _USER_PERMISSIONS_CACHE_LOCK:
+        if id_role is None:
+            _USER_PERMISSIONS_CACHE.clear()
+        else:
+            _USER_PERMISSIONS_CACHE.pop(int(id_role), None)
+    if has_request_context() and "_user_permissions" in g:
+        if id_role is None:
+            g._user_permissions.clear()
+        else:
+            g._user_permissions.pop(int(id_role), None)
+
+
+def get_all_user_permissions(id_role):
+    """
+    Return all the permissions (every filter types, actions, modules and objects)
+    of a role from the VUsersPermissions view.
+
+    The result is cached for the current request and in the process
+    for PERMISSIONS_CACHE_TTL seconds (0 to disable the process cache).
+    The instances are expunged from the session so they can be shared between requests
+
+    Return:
+        Array<VUsersPermissions>
+    """
+    id_role = int(id_role)
+    request_cache = None
+    if has_request_context():
+        request_cache = g.setdefault("_user_permissions", {})
+        if id_role in request_cache:
+            return request_cache[id_role]
+
+    ttl = current_app.config.get("PERMISSIONS_CACHE_TTL", 0)
+    now = time.monotonic()
+    cached = _USER_PERMISSIONS_CACHE.get(id_role)
+    if ttl > 0 and cached and now - cached[0] < ttl:
+        user_permissions = cached[1]
+    else:
+        user_permissions = VUsersPermissions.query.filter(
+            VUsersPermissions.id_role == id_role
+        ).all()
+        for perm in user_permissions:
+            DB.session.expunge(perm)
+        if ttl > 0:
+            with _USER_PERMISSIONS_CACHE_LOCK:
+                _USER_PERMISSIONS_CACHE[id_role] = (now, user_permissions)
+
+    if request_cache is not None:
+        request_cache[id_role] = user_permissions
+    return user_permissions
+
+
 def query_user_perm(
     id_role, code_filter_type, code_action=None, module_code=None, object_code=None
 ):
+    """
+    Filter the permissions of a role (see get_all_user_permissions)
+    Same filters as the query on VUsersPermissions:
+        - the module GEONATURE, the module `module_code` or the object `object_code`
+        - if object_code is None only the permissions on the object "ALL"
+    """
 
-    ors = [VUsersPermissions.module_code.ilike("GEONATURE")]
+    def match(perm):
+        if perm.code_filter_type != code_filter_type:
+            return False
+        if code_action and perm.code_action != code_action:
+            return False
+        if not object_code and perm.code_object != "ALL":
+            return False
+        perm_module_code = (perm.module_code or "").upper()
+        return (
+            perm_module_code == "GEONATURE"
+            or (module_code and perm_module_code == module_code.upper())
+            or (object_code and perm.code_object == object_code)
+        )
 
-    q = VUsersPermissions.query.filter(VUsersPermissions.id_role == id_role).filter(
-        VUsersPermissions.code_filter_type == code_filter_type
-    )
-    if code_action:
-        q = q.filter(VUsersPermissions.code_action == code_action)
-    if module_code:
-        ors.append(VUsersPermissions.module_code.ilike(module_code))
-    if object_code:
-        ors.append(VUsersPermissions.code_object == object_code)
-    # if object code is None, only take ALL
-    else:
-        q = q.filter(VUsersPermissions.code_object == "ALL")
-    return q.filter(sa.or_(*ors)).all()
+    return [perm for perm in get_all_user_permissions(id_role) if match(perm)]
 
 
 def get_user_permissions(
@@ -237,6 +237,104 @@ class CorAreaSynthese(DB.Model):
     id_area = DB.Column(DB.Integer)
 
 
+class TaxrefTree(DB.Model):
+    """
+    Nested set numbering of the TAXREF tree (see gn_synthese.refresh_taxref_tree):
+    the descendants of a taxon have a lft in ]lft, rgt] of the taxon
+    """
+
+    __tablename__ = "taxref_tree"
+    __table_args__ = {"schema": "gn_synthese"}
+    cd_nom = DB.Column(DB.Integer, primary_key=True)
+    cd_ref = DB.Column(DB.Integer)
+    lft = DB.Column(DB.Integer)
+    rgt = DB.Column(DB.Integer)
+    id_regne = DB.Column(DB.Integer)
+    id_embranchement = DB.Column(DB.Integer)
+    id_classe = DB.Column(DB.Integer)
+    id_ordre = DB.Column(DB.Integer)
+    id_famille = DB.Column(DB.Integer)
+
+
+class TDatasetStats(DB.Model):
+    """
+    Number of observations of a dataset (see gn_synthese.refresh_dataset_stats)
+    """
+
+    __tablename__ = "t_dataset_stats"
+    __table_args__ = {"schema": "gn_synthese"}
+    id_dataset = DB.Column(DB.Integer, primary_key=True)
+    nb_obs = DB.Column(DB.Integer)
+
+
+class CorDatasetTaxonStats(DB.Model):
+    """
+    Number of observations of a taxon in a dataset
+    """
+
+    __tablename__ = "cor_dataset_taxon_stats"
+    __table_args__ = {"schema": "gn_synthese"}
+    id_dataset = DB.Column(DB.Integer, primary_key=True)
+    cd_nom = DB.Column(DB.Integer, primary_key=True)
+    nb_obs = DB.Column(DB.Integer)
+
+
+class CorDatasetObserversStats(DB.Model):
+    """
+    Number of observations of the observers (synthese.observers) in a dataset
+    """
+
+    __tablename__ = "cor_dataset_observers_stats"
+    __table_args__ = {"schema": "gn_synthese"}
+    id_dataset = DB.Column(DB.Integer, primary_key=True)
+    observers = DB.Column(DB.Unicode, primary_key=True)
+    nb_obs = DB.Column(DB.Integer)
+
+
+class TDatasetStatsDirty(DB.Model):
+    """
+    Datasets whose observations changed since the last computation of their stats
+    """
+
+    __tablename__ = "t_dataset_stats_dirty"
+    __table_args__ = {"schema": "gn_synthese"}
+    id_dataset = DB.Column(DB.Integer, primary_key=True)
+
+
+@serializable
+class TQueryStats(DB.Model):
+    """
+    Duration of the queries of a route for a combination of filters (see QUERY_STATS)
+    """
+
+    __tablename__ = "t_query_stats"
+    __table_args__ = {"schema": "gn_synthese"}
+    endpoint = DB.Column(DB.Unicode, primary_key=True)
+    fingerprint = DB.Column(DB.Unicode, primary_key=True)
+    nb_queries = DB.Column(DB.BigInteger)
+    total_ms = DB.Column(DB.Float)
+    max_ms = DB.Column(DB.Float)
+    nb_slow = DB.Column(DB.BigInteger)
+    last_date = DB.Column(DB.DateTime)
+
+
+@serializable
+class TQuerySamples(DB.Model):
+    """
+    EXPLAIN (ANALYZE, BUFFERS) of a slow query (see QUERY_STATS)
+    """
+
+    __tablename__ = "t_query_samples"
+    __table_args__ = {"schema": "gn_synthese"}
+    id_sample = DB.Column(DB.Integer, primary_key=True)
+    endpoint = DB.Column(DB.Unicode)
+    fingerprint = DB.Column(DB.Unicode)
+    sample_date = DB.Column(DB.DateTime)
+    duration_ms = DB.Column(DB.Float)
+    statement = DB.Column(DB.Unicode)
+    plan = DB.Column(JSONB)
+
+
 @serializable
 class DefaultsNomenclaturesValue(DB.Model):
     __tablename__ = "defaults_nomenclatures_value"
@@ -4,10 +4,16 @@ import datetime
 import ast
 import time
 
-from collections import OrderedDict
-
-from flask import Blueprint, request, current_app, send_from_directory, render_template
-from sqlalchemy import distinct, func, desc, select, text
+from flask import (
+    Blueprint,
+    request,
+    current_app,
+    render_template,
+    Response,
+    stream_with_context,
+)
+from sqlalchemy import distinct, func, desc, select, text, cast, Text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import exc
 from geojson import FeatureCollection, Feature
 
@@ -17,9 +23,17 @@ from utils_flask_sqla_geo.generic import GenericTableGeo
 
 
 from geonature.utils import filemanager
-from geonature.utils.env import DB, ROOT_DIR
+from geonature.utils.env import DB
 from geonature.utils.errors import GeonatureApiError
+from geonature.utils.reflection import get_generic_table
+from geonature.utils.utilsgeometry import create_shapes_generic
+from geonature.utils.utilsstream import (
+    stream_csv_resp,
+    stream_shapefiles_resp,
+    DEFAULT_CHUNK_SIZE,
+)
 
+from geonature.core.gn_exports.jobs import register_export, enqueue_export_job, ExportQuery
 from geonature.core.gn_meta.models import TDatasets
 from geonature.core.gn_meta.repositories import get_datasets_cruved
 
@@ -34,17 +48,21 @@ from geonature.core.gn_synthese.models import (
 from geonature.core.gn_synthese.synthese_config import MANDATORY_COLUMNS
 from geonature.core.taxonomie.models import (
     Taxref,
-    TaxrefProtectionArticles,
-    TaxrefProtectionEspeces,
     VMTaxrefListForautocomplete,
 )
 from geonature.core.ref_geo.models import LAreas, BibAreasTypes
 from geonature.core.gn_synthese.utils import query as synthese_query
 from geonature.core.gn_synthese.utils.query_select_sqla import SyntheseQuery
+from geonature.core.gn_synthese.utils.tiles import build_tile_query, is_valid_tile
+from geonature.core.gn_synthese.utils import taxons_index
+from geonature.core.gn_synthese.utils import stats as synthese_stats
+from geonature.core.gn_synthese.utils import protections as synthese_protections
+from geonature.core.gn_synthese.utils import query_stats
 
 
 from geonature.core.gn_permissions import decorators as permissions
 from geonature.core.gn_permissions.tools import cruved_scope_for_user_in_module
+from pypnusershub.db.tools import InsufficientRightsError
 
 
 # debug
@@ -65,9 +83,48 @@ def current_milli_time():
 ############################################
 
 
+def build_for_web_feature():
+    """
+    Return the SQLA expression which build one feature of the /for_web route in PostgreSQL
+
+    The geometry (st_asgeojson) is merged with the properties object and serialized
+    as text so it can be sent to the client without being parsed by Python.
+    The shape of the feature is the same as the one historically built in Python::
+
+        {"type": "Point", "coordinates": [...], "properties": {...}}
+    """
+    properties = func.json_build_object(
+        "id",
+        VSyntheseForWebApp.id_synthese,
+        "date_min",
+        cast(VSyntheseForWebApp.date_min, Text),
+        "cd_nom",
+        VSyntheseForWebApp.cd_nom,
+        "nom_vern_or_lb_nom",
+        func.coalesce(func.nullif(VSyntheseForWebApp.nom_vern, ""), VSyntheseForWebApp.lb_nom),
+        "lb_nom",
+        VSyntheseForWebApp.lb_nom,
+        "dataset_name",
+        VSyntheseForWebApp.dataset_name,
+        "observers",
+        VSyntheseForWebApp.observers,
+        "url_source",
+        VSyntheseForWebApp.url_source,
+        "unique_id_sinp",
+        cast(VSyntheseForWebApp.unique_id_sinp, Text),
+        "entity_source_pk_value",
+        VSyntheseForWebApp.entity_source_pk_value,
+    )
+    return cast(
+        cast(VSyntheseForWebApp.st_asgeojson, JSONB).op("||")(
+            func.jsonb_build_object("properties", properties)
+        ),
+        Text,
+    ).label("feature")
+
+
 @routes.route("/for_web", methods=["GET", "POST"])
 @permissions.check_cruved_scope("R", True, module_code="SYNTHESE")
-@json_resp
 def get_observations_for_web(info_role):
     """Optimized route to serve data for the frontend with all filters.
 
@@ -91,6 +148,9 @@ def get_observations_for_web(info_role):
         geojson = ast.literal_eval(r["st_asgeojson"])
         geojson["properties"] = properties
 
+    The features are built by PostgreSQL (see build_for_web_feature)
+    and streamed as raw JSON: no parsing nor re-serialization in Python
+
     :param str info_role: Role used to get the associated filters, **TBC**
     :qparam str limit: Limit number of synthese returned. Defaults to NB_MAX_OBS_MAP.
     :qparam str cd_ref: Filter by TAXREF cd_ref attribute
@@ -132,50 +192,70 @@ def get_observations_for_web(info_role):
     else:
         result_limit = current_app.config["SYNTHESE"]["NB_MAX_OBS_MAP"]
     query = (
-        select(
-            [
-                VSyntheseForWebApp.id_synthese,
-                VSyntheseForWebApp.date_min,
-                VSyntheseForWebApp.lb_nom,
-                VSyntheseForWebApp.cd_nom,
-                VSyntheseForWebApp.nom_vern,
-                VSyntheseForWebApp.st_asgeojson,
-                VSyntheseForWebApp.observers,
-                VSyntheseForWebApp.dataset_name,
-                VSyntheseForWebApp.url_source,
-                VSyntheseForWebApp.entity_source_pk_value,
-                VSyntheseForWebApp.unique_id_sinp,
-            ]
-        )
+        select([build_for_web_feature()])
         .where(VSyntheseForWebApp.the_geom_4326.isnot(None))
         .order_by(VSyntheseForWebApp.date_min.desc())
     )
     synthese_query_class = SyntheseQuery(VSyntheseForWebApp, query, filters)
     synthese_query_class.filter_query_all_filters(info_role)
-    result = DB.engine.execute(synthese_query_class.query.limit(result_limit))
-    geojson_features = []
-    for r in result:
-        properties = {
-            "id": r["id_synthese"],
-            "date_min": str(r["date_min"]),
-            "cd_nom": r["cd_nom"],
-            "nom_vern_or_lb_nom": r["nom_vern"] if r["nom_vern"] else r["lb_nom"],
-            "lb_nom": r["lb_nom"],
-            "dataset_name": r["dataset_name"],
-            "observers": r["observers"],
-            "url_source": r["url_source"],
-            "unique_id_sinp": str(r["unique_id_sinp"]),
-            "entity_source_pk_value": r["entity_source_pk_value"],
-        }
-        geojson = ast.literal_eval(r["st_asgeojson"])
-        geojson["properties"] = properties
-        geojson_features.append(geojson)
-    return {
-        "data": FeatureCollection(geojson_features),
-        "nb_total": len(geojson_features),
-        "nb_obs_limited": len(geojson_features)
-        == current_app.config["SYNTHESE"]["NB_MAX_OBS_MAP"],
-    }
+    result = DB.engine.execute(
+        synthese_query_class.query.limit(result_limit).execution_options(stream_results=True)
+    )
+
+    def generate_response():
+        yield '{"data": {"type": "FeatureCollection", "features": ['
+        nb_total = 0
+        try:
+            for rows in iter(lambda: result.fetchmany(DEFAULT_CHUNK_SIZE), []):
+                if nb_total:
+                    yield ","
+                yield ",".join(r[0] for r in rows)
+                nb_total += len(rows)
+        finally:
+            # release the server side cursor even if the client disconnect
+            result.close()
+        yield ']}}, "nb_total": {}, "nb_obs_limited": {}}}'.format(
+            nb_total,
+            json.dumps(nb_total == current_app.config["SYNTHESE"]["NB_MAX_OBS_MAP"]),
+        )
+
+    return Response(stream_with_context(generate_response()), mimetype="application/json")
+
+
+@routes.route("/tiles/<int:z>/<int:x>/<int:y>.mvt", methods=["GET"])
+@permissions.check_cruved_scope("R", True, module_code="SYNTHESE")
+def get_observations_tile(info_role, z, x, y):
+    """Return the observations of a tile as Mapbox Vector Tile (MVT)
+
+    .. :quickref: Synthese; Get filtered observations as vector tile
+
+    Accept the same filters (query string) and the same CRUVED than the /for_web route
+    but without limit: the payload is bounded by the tile.
+    Under the zoom level MVT_CLUSTER_MAX_ZOOM (configuration) the observations
+    are clustered server-side and each feature have a `nb_obs` property.
+    Otherwise each feature is an observation with the properties
+    `id_synthese`, `cd_nom`, `nom_vern_or_lb_nom` and `date_min`.
+
+    :param int z: zoom level
+    :param int x: tile column
+    :param int y: tile row
+    :qparam str *: same filters as /for_web
+    """
+    if not is_valid_tile(z, x, y):
+        return Response("Invalid tile {}/{}/{}".format(z, x, y), 400)
+    filters = {key: request.args.getlist(key) for key, value in request.args.items()}
+    filters.pop("limit", None)
+    query = build_tile_query(
+        z,
+        x,
+        y,
+        filters,
+        info_role,
+        cluster_max_zoom=current_app.config["SYNTHESE"]["MVT_CLUSTER_MAX_ZOOM"],
+        cluster_grid=current_app.config["SYNTHESE"]["MVT_CLUSTER_GRID"],
+    )
+    tile = DB.engine.execute(query).scalar()
+    return Response(bytes(tile or b""), mimetype="application/vnd.mapbox-vector-tile")
 
 
 @routes.route("", methods=["GET"])
@@ -238,8 +318,8 @@ def get_one_synthese(id_synthese):
     :param int id_synthese:Synthese to be queried
     :>jsonarr array synthese_as_dict: One synthese with geojson key, see above
     """
-    metadata_view = GenericTable(
-        tableName="v_metadata_for_export", schemaName="gn_synthese", engine=DB.engine
+    metadata_view = get_generic_table(
+        GenericTable, tableName="v_metadata_for_export", schemaName="gn_synthese", engine=DB.engine
     )
     q = (
         DB.session.query(
@@ -290,8 +370,11 @@ def export_taxon_web(info_role):
 
     """
 
-    taxon_view = GenericTable(
-        tableName="v_synthese_taxon_for_export_view", schemaName="gn_synthese", engine=DB.engine,
+    taxon_view = get_generic_table(
+        GenericTable,
+        tableName="v_synthese_taxon_for_export_view",
+        schemaName="gn_synthese",
+        engine=DB.engine,
     )
     columns = taxon_view.tableDef.columns
     # Test de conformité de la vue v_synthese_for_export_view
@@ -356,36 +439,26 @@ def export_taxon_web(info_role):
     )
 
 
-@routes.route("/export_observations", methods=["POST"])
-@permissions.check_cruved_scope("E", True, module_code="SYNTHESE")
-def export_observations_web(info_role):
-    """Optimized route for observations web export.
-
-    .. :quickref: Synthese;
-
-    This view is customisable by the administrator
-    Some columns are mandatory: id_synthese, geojson and geojson_local to generate the exported files
-
-    POST parameters: Use a list of id_synthese (in POST parameters) to filter the v_synthese_for_export_view
-
-    :query str export_format: str<'csv', 'geojson', 'shapefiles'>
+@register_export("SYNTHESE")
+def build_export_observations_query(info_role, params):
+    """
+    Build the query of the observations export
+    (used by the export route and the export job queue)
 
+    Parameters:
+        info_role (VUsersPermissions): the user with its CRUVED scope for the E action
+        params (dict): {"id_synthese": list of the exported id_synthese}
+    Returns:
+        ExportQuery
     """
-    params = request.args
-    # set default to csv
-    export_format = "csv"
-    export_view = GenericTableGeo(
+    export_view = get_generic_table(
+        GenericTableGeo,
         tableName="v_synthese_for_export",
         schemaName="gn_synthese",
         engine=DB.engine,
         geometry_field=None,
         srid=current_app.config["LOCAL_SRID"],
     )
-    if "export_format" in params:
-        export_format = params["export_format"]
-
-    # get list of id synthese from POST
-    id_list = request.get_json()
 
     db_cols_for_shape = []
     columns_to_serialize = []
@@ -397,7 +470,7 @@ def export_observations_web(info_role):
 
     q = DB.session.query(export_view.tableDef).filter(
         export_view.tableDef.columns[current_app.config["SYNTHESE"]["EXPORT_ID_SYNTHESE_COL"]].in_(
-            id_list
+            params["id_synthese"]
         )
     )
     # check R and E CRUVED to know if we filter with cruved
@@ -415,7 +488,43 @@ def export_observations_web(info_role):
             id_digitiser_column=current_app.config["SYNTHESE"]["EXPORT_ID_DIGITISER_COL"],
             with_generic_table=True,
         )
-    results = q.limit(current_app.config["SYNTHESE"]["NB_MAX_OBS_EXPORT"])
+    return ExportQuery(
+        export_view=export_view,
+        query=q,
+        columns=columns_to_serialize,
+        db_cols=db_cols_for_shape,
+        geom_col=None,
+        geojson_col=current_app.config["SYNTHESE"]["EXPORT_GEOJSON_LOCAL_COL"],
+        geojson_4326_col=current_app.config["SYNTHESE"]["EXPORT_GEOJSON_4326_COL"],
+    )
+
+
+@routes.route("/export_observations", methods=["POST"])
+@permissions.check_cruved_scope("E", True, module_code="SYNTHESE")
+def export_observations_web(info_role):
+    """Optimized route for observations web export.
+
+    .. :quickref: Synthese;
+
+    This view is customisable by the administrator
+    Some columns are mandatory: id_synthese, geojson and geojson_local to generate the exported files
+
+    POST parameters: Use a list of id_synthese (in POST parameters) to filter the v_synthese_for_export_view
+
+    :query str export_format: str<'csv', 'geojson', 'shapefiles'>
+
+    """
+    params = request.args
+    # set default to csv
+    export_format = "csv"
+    if "export_format" in params:
+        export_format = params["export_format"]
+
+    # get list of id synthese from POST
+    export_query = build_export_observations_query(info_role, {"id_synthese": request.get_json()})
+    export_view = export_query.export_view
+    columns_to_serialize = export_query.columns
+    results = export_query.query.limit(current_app.config["SYNTHESE"]["NB_MAX_OBS_EXPORT"])
 
     file_name = datetime.datetime.now().strftime("%Y_%m_%d_%Hh%Mm%S")
     file_name = filemanager.removeDisallowedFilenameChars(file_name)
@@ -423,15 +532,20 @@ def export_observations_web(info_role):
     # columns = [db_col.key for db_col in export_view.db_cols]
 
     if export_format == "csv":
-        formated_data = [export_view.as_dict(d, columns=columns_to_serialize) for d in results]
-        return to_csv_resp(file_name, formated_data, separator=";", columns=columns_to_serialize)
+        # server side cursor: rows are fetched and written by chunk
+        # so the memory stay constant whatever the number of exported rows
+        formated_data = (
+            export_view.as_dict(d, columns=columns_to_serialize)
+            for d in results.yield_per(DEFAULT_CHUNK_SIZE)
+        )
+        return stream_csv_resp(
+            file_name, formated_data, separator=";", columns=columns_to_serialize
+        )
 
     elif export_format == "geojson":
         features = []
         for r in results:
-            geometry = ast.literal_eval(
-                getattr(r, current_app.config["SYNTHESE"]["EXPORT_GEOJSON_4326_COL"])
-            )
+            geometry = ast.literal_eval(getattr(r, export_query.geojson_4326_col))
             feature = Feature(
                 geometry=geometry, properties=export_view.as_dict(r, columns=columns_to_serialize),
             )
@@ -440,20 +554,17 @@ def export_observations_web(info_role):
         return to_json_resp(results, as_file=True, filename=file_name, indent=4)
     else:
         try:
-            filemanager.delete_recursively(
-                str(ROOT_DIR / "backend/static/shapefiles"), excluded_files=[".gitkeep"]
-            )
-
-            dir_path = str(ROOT_DIR / "backend/static/shapefiles")
-
-            export_view.as_shape(
-                db_cols=db_cols_for_shape,
-                data=results,
-                geojson_col=current_app.config["SYNTHESE"]["EXPORT_GEOJSON_LOCAL_COL"],
-                dir_path=dir_path,
+            # the shapefiles are written in a temporary directory owned by the request
+            shape_service = create_shapes_generic(
+                view=export_view,
+                srid=export_view.srid,
+                db_cols=export_query.db_cols,
+                data=results.yield_per(DEFAULT_CHUNK_SIZE),
                 file_name=file_name,
+                geom_col=None,
+                geojson_col=export_query.geojson_col,
             )
-            return send_from_directory(dir_path, file_name + ".zip", as_attachment=True)
+            return stream_shapefiles_resp(shape_service, file_name)
 
         except GeonatureApiError as e:
             message = str(e)
@@ -465,6 +576,44 @@ def export_observations_web(info_role):
         )
 
 
+@routes.route("/export_observations/jobs", methods=["POST"])
+@permissions.check_cruved_scope("E", True, module_code="SYNTHESE")
+@json_resp
+def enqueue_export_observations(info_role):
+    """Run the observations export in background (export job queue)
+
+    .. :quickref: Synthese;
+
+    Same parameters as /export_observations.
+    Follow the job and download its file with the /exports/jobs routes
+
+    :query str export_format: str<'csv', 'geojson', 'shapefile'>
+    """
+    job = enqueue_export_job(
+        info_role,
+        "SYNTHESE",
+        request.args.get("export_format", "csv"),
+        {"id_synthese": request.get_json()},
+    )
+    return job.as_status()
+
+
+def get_search_datasets(info_role, filters):
+    """
+    Return the ids of the datasets having observations in a synthese search
+
+    Each dataset is tested with a correlated EXISTS on the filtered observations
+    (index on id_dataset): the search stops at the first observation of each dataset
+    instead of reading all the observations for a DISTINCT id_dataset
+    """
+    datasets = TDatasets.__table__.alias("search_datasets")
+    q = DB.session.query(VSyntheseForWebApp.id_dataset).filter(
+        VSyntheseForWebApp.id_dataset == datasets.c.id_dataset
+    )
+    q = synthese_query.filter_query_all_filters(VSyntheseForWebApp, q, filters, info_role)
+    return [r[0] for r in DB.session.query(datasets.c.id_dataset).filter(q.exists())]
+
+
 @routes.route("/export_metadata", methods=["GET", "POST"])
 @permissions.check_cruved_scope("E", True, module_code="SYNTHESE")
 def export_metadata(info_role):
@@ -485,23 +634,23 @@ def export_metadata(info_role):
     else:
         filters = {key: request.args.getlist(key) for key, value in request.args.items()}
 
-    metadata_view = GenericTable(
-        tableName="v_metadata_for_export", schemaName="gn_synthese", engine=DB.engine
+    metadata_view = get_generic_table(
+        GenericTable, tableName="v_metadata_for_export", schemaName="gn_synthese", engine=DB.engine
     )
-    q = DB.session.query(distinct(VSyntheseForWebApp.id_dataset), metadata_view.tableDef).join(
-        metadata_view.tableDef,
-        getattr(
-            metadata_view.tableDef.columns,
-            current_app.config["SYNTHESE"]["EXPORT_METADATA_ID_DATASET_COL"],
+    id_datasets = get_search_datasets(info_role, filters)
+    data = []
+    if id_datasets:
+        q = DB.session.query(metadata_view.tableDef).filter(
+            getattr(
+                metadata_view.tableDef.columns,
+                current_app.config["SYNTHESE"]["EXPORT_METADATA_ID_DATASET_COL"],
+            ).in_(id_datasets)
         )
-        == VSyntheseForWebApp.id_dataset,
-    )
-
-    q = synthese_query.filter_query_all_filters(VSyntheseForWebApp, q, filters, info_role)
+        data = [metadata_view.as_dict(d) for d in q.all()]
 
     return to_csv_resp(
         datetime.datetime.now().strftime("%Y_%m_%d_%Hh%Mm%S"),
-        data=[metadata_view.as_dict(d) for d in q.all()],
+        data=data,
         separator=";",
         columns=[db_col.key for db_col in metadata_view.tableDef.columns],
     )
@@ -528,75 +677,26 @@ def export_status(info_role):
     else:
         filters = {key: request.args.getlist(key) for key, value in request.args.items()}
 
-    # initalize the select object
-    q = select(
-        [
-            distinct(VSyntheseForWebApp.cd_nom),
-            Taxref.nom_complet,
-            Taxref.cd_ref,
-            Taxref.nom_vern,
-            TaxrefProtectionArticles.type_protection,
-            TaxrefProtectionArticles.article,
-            TaxrefProtectionArticles.intitule,
-            TaxrefProtectionArticles.arrete,
-            TaxrefProtectionArticles.date_arrete,
-            TaxrefProtectionArticles.url,
-        ]
-    )
-
-    synthese_query_class = SyntheseQuery(VSyntheseForWebApp, q, filters)
-
-    # add join
-    synthese_query_class.add_join(Taxref, Taxref.cd_nom, VSyntheseForWebApp.cd_nom)
-    synthese_query_class.add_join(
-        TaxrefProtectionEspeces, TaxrefProtectionEspeces.cd_nom, VSyntheseForWebApp.cd_nom,
-    )
-    synthese_query_class.add_join(
-        TaxrefProtectionArticles,
-        TaxrefProtectionArticles.cd_protection,
-        TaxrefProtectionEspeces.cd_protection,
-    )
-    # filter with all get params
-    q = synthese_query_class.filter_query_all_filters(info_role)
-
-    data = DB.engine.execute(q)
-
-    protection_status = []
-    for d in data:
-        row = OrderedDict(
-            [
-                ("nom_complet", d["nom_complet"]),
-                ("nom_vern", d["nom_vern"]),
-                ("cd_nom", d["cd_nom"]),
-                ("cd_ref", d["cd_ref"]),
-                ("type_protection", d["type_protection"]),
-                ("article", d["article"]),
-                ("intitule", d["intitule"]),
-                ("arrete", d["arrete"]),
-                ("date_arrete", d["date_arrete"]),
-                ("url", d["url"]),
-            ]
+    # taxons distincts de la recherche, sans jointure aux protections
+    q = select([distinct(VSyntheseForWebApp.cd_nom)])
+    q = SyntheseQuery(VSyntheseForWebApp, q, filters).filter_query_all_filters(info_role)
+    protections = synthese_protections.get_protections()
+    cd_noms = [r[0] for r in DB.engine.execute(q) if r[0] in protections.by_cd_nom]
+
+    taxa = []
+    if cd_noms:
+        taxa = (
+            DB.session.query(Taxref.cd_nom, Taxref.nom_complet, Taxref.cd_ref, Taxref.nom_vern)
+            .filter(Taxref.cd_nom.in_(cd_noms))
+            .order_by(Taxref.nom_complet)
+            .all()
         )
-        protection_status.append(row)
 
-    export_columns = [
-        "nom_complet",
-        "nom_vern",
-        "cd_nom",
-        "cd_ref",
-        "type_protection",
-        "article",
-        "intitule",
-        "arrete",
-        "date_arrete",
-        "url",
-    ]
-
-    return to_csv_resp(
+    return stream_csv_resp(
         datetime.datetime.now().strftime("%Y_%m_%d_%Hh%Mm%S"),
-        protection_status,
+        synthese_protections.protection_rows(taxa, protections),
         separator=";",
-        columns=export_columns,
+        columns=synthese_protections.EXPORT_COLUMNS,
     )
 
 
@@ -605,6 +705,34 @@ def export_status(info_role):
 ######################################
 
 
+@routes.route("/query_stats", methods=["GET"])
+@permissions.check_cruved_scope("R", True, module_code="ADMIN")
+@json_resp
+def get_query_stats(info_role):
+    """
+    Duration of the queries of the synthese, validation and exports routes
+    by route and combination of filters, the slowest first (see QUERY_STATS)
+
+    .. :quickref: Synthese;
+
+    :query int limit: number of (route, filters) returned (default 50)
+    :query str order_by: <'total_ms', 'mean_ms', 'max_ms', 'nb_slow', 'nb_queries'>
+    :query bool with_plans: add the EXPLAIN plans of the slow queries
+    """
+    if info_role.value_filter != "3":
+        raise InsufficientRightsError(
+            'User "{}" cannot read the query stats'.format(info_role.id_role), 403
+        )
+    try:
+        return query_stats.get_report(
+            limit=int(request.args.get("limit", 50)),
+            order_by=request.args.get("order_by", "total_ms"),
+            with_plans=request.args.get("with_plans", "false").lower() == "true",
+        )
+    except ValueError as e:
+        raise GeonatureApiError(str(e), 400)
+
+
 @routes.route("/general_stats", methods=["GET"])
 @permissions.check_cruved_scope("R", True)
 @json_resp
@@ -619,13 +747,8 @@ def general_stats(info_role):
         - nb ob datasets
     """
     allowed_datasets = get_datasets_cruved(info_role)
-    q = DB.session.query(
-        func.count(Synthese.id_synthese),
-        func.count(func.distinct(Synthese.cd_nom)),
-        func.count(func.distinct(Synthese.observers)),
-    )
-    q = synthese_query.filter_query_with_cruved(Synthese, q, info_role)
-    data = q.one()
+    # agrégats par JDD (cf gn_synthese.utils.stats)
+    data = synthese_stats.general_stats(info_role)
     data = {
         "nb_data": data[0],
         "nb_species": data[1],
@@ -642,8 +765,11 @@ def get_taxon_tree():
 
     .. :quickref: Synthese;
     """
-    taxon_tree_table = GenericTable(
-        tableName="v_tree_taxons_synthese", schemaName="gn_synthese", engine=DB.engine
+    taxon_tree_table = get_generic_table(
+        GenericTable,
+        tableName="v_tree_taxons_synthese",
+        schemaName="gn_synthese",
+        engine=DB.engine,
     )
     data = DB.session.query(taxon_tree_table.tableDef).all()
     return [taxon_tree_table.as_dict(d) for d in data]
@@ -661,8 +787,21 @@ def get_autocomplete_taxons_synthese():
     :query str search_name: the search name (use sql ilike statement and puts "%" for spaces)
     :query str regne: filter with kingdom
     :query str group2_inpn : filter with INPN group 2
+    :query int limit: number of results (default 20)
+
+    The taxa are searched in an in-memory index of each API process
+    (see gn_synthese.utils.taxons_index) unless SYNTHESE.TAXONS_AUTOCOMPLETE_REFRESH is 0
     """
     search_name = request.args.get("search_name", "")
+    regne = request.args.get("regne")
+    group2_inpn = request.args.get("group2_inpn")
+    limit = int(request.args.get("limit", 20))
+
+    if current_app.config["SYNTHESE"]["TAXONS_AUTOCOMPLETE_REFRESH"] > 0:
+        return taxons_index.get_index().search(
+            search_name, regne=regne, group2_inpn=group2_inpn, limit=limit
+        )
+
     q = (
         DB.session.query(
             VMTaxrefListForautocomplete,
@@ -675,17 +814,14 @@ def get_autocomplete_taxons_synthese():
     )
     search_name = search_name.replace(" ", "%")
     q = q.filter(VMTaxrefListForautocomplete.search_name.ilike("%" + search_name + "%"))
-    regne = request.args.get("regne")
     if regne:
         q = q.filter(VMTaxrefListForautocomplete.regne == regne)
 
-    group2_inpn = request.args.get("group2_inpn")
     if group2_inpn:
         q = q.filter(VMTaxrefListForautocomplete.group2_inpn == group2_inpn)
 
     q = q.order_by(desc(VMTaxrefListForautocomplete.cd_nom == VMTaxrefListForautocomplete.cd_ref))
-    limit = request.args.get("limit", 20)
-    data = q.order_by(desc("idx_trgm")).limit(20).all()
+    data = q.order_by(desc("idx_trgm")).limit(limit).all()
     return [d[0].as_dict() for d in data]
 
 
@@ -790,12 +926,7 @@ def get_taxa_count():
     :returns int: the number of taxa found
     """
     params = request.args
-
-    query = DB.session.query(func.count(distinct(Synthese.cd_nom))).select_from(Synthese)
-
-    if "id_dataset" in params:
-        query = query.filter(Synthese.id_dataset == params["id_dataset"])
-    return query.one()
+    return [synthese_stats.taxa_count(params.get("id_dataset"))]
 
 
 @routes.route("/observation_count", methods=["GET"])
@@ -803,13 +934,7 @@ def get_taxa_count():
 def get_observation_count():
     """Get observations found in a given dataset"""
     params = request.args
-
-    query = DB.session.query(func.count(Synthese.cd_nom)).select_from(Synthese)
-
-    if "id_dataset" in params:
-        query = query.filter(Synthese.id_dataset == params["id_dataset"])
-
-    return query.one()
+    return [synthese_stats.observation_count(params.get("id_dataset"))]
 
 
 @routes.route("/taxa_distribution", methods=["GET"])
@@ -829,23 +954,7 @@ def get_taxa_distribution():
 
     rank = getattr(Taxref.__table__.columns, rank)
 
-    Taxref.group2_inpn
-
-    query = (
-        DB.session.query(func.count(distinct(Synthese.cd_nom)), rank)
-        .select_from(Synthese)
-        .outerjoin(Taxref, Taxref.cd_nom == Synthese.cd_nom)
-    )
-
-    if id_dataset:
-        query = query.filter(Synthese.id_dataset == id_dataset)
-
-    elif id_af:
-        query = query.outerjoin(TDatasets, TDatasets.id_dataset == Synthese.id_dataset).filter(
-            TDatasets.id_acquisition_framework == id_af
-        )
-
-    data = query.group_by(rank).all()
+    data = synthese_stats.taxa_distribution(rank, id_dataset=id_dataset, id_af=id_af)
     return [{"count": d[0], "group": d[1]} for d in data]
 
 
@@ -1,55 +1,171 @@
 """
     functions to insert update or delete data in table gn_synthese.synthese
 """
-from sqlalchemy.exc import IntegrityError, ProgrammingError
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from sqlalchemy import MetaData, Table, String, and_, cast, func, literal_column, select
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.exc import IntegrityError, ProgrammingError, NoSuchTableError, OperationalError
+
 from geonature.utils.env import DB
 from geonature.utils.errors import GeonatureApiError
 
+log = logging.getLogger(__name__)
+
+# code postgresql d'un interblocage (mise à jour concurrente de cor_area_taxon...)
+DEADLOCK_PGCODE = "40P01"
+NB_BATCH_ATTEMPTS = 3
+
 
-def import_from_table(schema_name, table_name, field_name, value, limit=50):
+def get_source_table(schema_name, table_name, field_name, pk_name=None):
     """
-    insert and/or update data in table gn_synthese.synthese
-    from table <schema_name>.<table_name>
-    for all rows satisfying the condition : <field_name> = <value>
+    Reflect the source table
+
+    Returns:
+        tuple: the table aliased as "c" (the rows are serialized with row_to_json(c)),
+        the filter column and the primary key column
     """
     try:
+        table = Table(table_name, MetaData(), schema=schema_name, autoload_with=DB.engine)
+    except NoSuchTableError:
+        raise ValueError("Undefined table : '{}.{}'".format(schema_name, table_name))
+    if field_name not in table.c:
+        raise ValueError(
+            "Undefined column {} in table '{}.{}'".format(field_name, schema_name, table_name)
+        )
+    if pk_name is None:
+        pk_columns = list(table.primary_key.columns)
+        if len(pk_columns) != 1:
+            raise ValueError(
+                "Table '{}.{}' must have a single column primary key (or give pk_name)".format(
+                    schema_name, table_name
+                )
+            )
+        pk_name = pk_columns[0].name
+    elif pk_name not in table.c:
+        raise ValueError(
+            "Undefined column {} in table '{}.{}'".format(pk_name, schema_name, table_name)
+        )
+    source = table.alias("c")
+    return source, source.c[field_name], source.c[pk_name]
 
-        # TODO get nb
-        txt = """SELECT COUNT(*) FROM {}.{} WHERE {}::varchar = '{}'""".format(
-            schema_name, table_name, field_name, value
+
+def get_batches(source, where, pk_column, batch_size):
+    """
+    Return the primary key ranges [start, end[ of the batches (end is None for the last one)
+    The first key of each batch is read with one scan of the table (and not with OFFSET)
+    """
+    numbered = (
+        select([pk_column.label("pk"), func.row_number().over(order_by=pk_column).label("rn")])
+        .where(where)
+        .alias("numbered")
+    )
+    starts = [
+        r.pk
+        for r in DB.engine.execute(
+            select([numbered.c.pk])
+            .where((numbered.c.rn - 1) % batch_size == 0)
+            .order_by(numbered.c.pk)
         )
+    ]
+    return list(zip(starts, starts[1:] + [None]))
 
-        nb_data = DB.engine.execute(txt).first()[0]
 
-        # request : call of function gn_synthese.import_row_from_table
-        i = 0
+def import_batch(engine, source, where, pk_column, start, end):
+    """
+    Import the rows of a primary key range with gn_synthese.import_json_row,
+    in its own connection and transaction
+    The transaction is tried again if it is chosen as the victim of a deadlock
 
-        # on procède ici par boucle pour traiter un nombre raisonnable de donnée à la fois
-        while limit * i < nb_data:
+    The engine is given by the caller: the worker threads have no application context
+    to resolve DB.engine
 
-            txt = """SELECT gn_synthese.import_row_from_table(
-                    '{}',
-                    '{}',
-                    '{}.{}',
-                    {},
-                    {});""".format(
-                field_name, value, schema_name, table_name, limit, i * limit  # offset
-            )
-            DB.engine.execution_options(autocommit=True).execute(txt)
+    Returns:
+        int: the number of imported rows
+    """
+    conditions = [where, pk_column >= start]
+    if end is not None:
+        conditions.append(pk_column < end)
+    query = (
+        select(
+            [func.gn_synthese.import_json_row(cast(func.row_to_json(literal_column("c")), JSONB))]
+        )
+        .select_from(source)
+        .where(and_(*conditions))
+    )
+    for attempt in range(1, NB_BATCH_ATTEMPTS + 1):
+        try:
+            with engine.begin() as conn:
+                return len(conn.execute(query).fetchall())
+        except OperationalError as e:
+            if getattr(e.orig, "pgcode", None) != DEADLOCK_PGCODE or attempt == NB_BATCH_ATTEMPTS:
+                raise
+            log.warning("Deadlock while importing the batch [%s, %s[, retry", start, end)
+
+
+def import_from_table(
+    schema_name,
+    table_name,
+    field_name,
+    value,
+    limit=50,
+    nb_workers=1,
+    pk_name=None,
+    progress=None,
+):
+    """
+    insert and/or update data in table gn_synthese.synthese
+    from table <schema_name>.<table_name>
+    for all rows satisfying the condition : <field_name> = <value>
+
+    The rows are imported by batches of `limit` rows delimited by ranges
+    of the primary key (`pk_name`, the primary key of the table by default).
+    The batches are run by a pool of `nb_workers` threads, each batch with its own
+    connection and transaction.
+    `progress(nb_rows_done, nb_rows, elapsed_seconds)`, if given, is called after each batch
 
-            i = i + 1
+    Returns:
+        int: the number of imported rows
+    """
+    try:
+        source, field_column, pk_column = get_source_table(
+            schema_name, table_name, field_name, pk_name
+        )
+        # comparaison en texte pour des questions de généricité (cf import_row_from_table)
+        where = cast(field_column, String) == str(value)
+        batches = get_batches(source, where, pk_column, limit)
+        nb_data = DB.engine.execute(
+            select([func.count()]).select_from(source).where(where)
+        ).scalar()
 
-            print("process synthese {} / {} ".format(min(i * limit, nb_data), nb_data))
+        # résolu dans le contexte d'application de l'appelant, absent des threads
+        engine = DB.engine
+        start_time = time.perf_counter()
+        nb_rows_done = 0
+        with ThreadPoolExecutor(max_workers=nb_workers) as executor:
+            futures = [
+                executor.submit(import_batch, engine, source, where, pk_column, start, end)
+                for start, end in batches
+            ]
+            for future in as_completed(futures):
+                nb_rows_done += future.result()
+                if progress:
+                    progress(nb_rows_done, nb_data, time.perf_counter() - start_time)
+        return nb_rows_done
 
     except (IntegrityError, ProgrammingError) as e:
-        if e.orig.pgcode == "42703":
+        if e.orig.pgcode == "42P01":
             raise ValueError("Undefined table : '{}.{}'".format(schema_name, table_name))
-        elif e.orig.pgcode == "42P01":
+        elif e.orig.pgcode == "42703":
             raise ValueError(
                 "Undefined column {} in table '{}.{}'".format(field_name, schema_name, table_name)
             )
         else:
             raise e
+    except ValueError:
+        raise
     except Exception as e:
         raise GeonatureApiError(
             """ Error while executing import_from_table with parameters :
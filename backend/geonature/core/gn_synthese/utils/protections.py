@@ -0,0 +1,103 @@
+"""
+    Cache en mémoire des statuts de protection des taxons (export /synthese/export_statuts)
+
+    Les tables taxonomie.taxref_protection_especes et taxref_protection_articles
+    ne changent qu'aux mises à jour de TAXREF : chaque processus de l'API garde
+    les protections de chaque cd_nom et les articles de protection, relus toutes les
+    SYNTHESE.PROTECTION_CACHE_REFRESH secondes.
+    L'export calcule d'abord les taxons distincts de la recherche puis leur associe
+    les articles du cache, au lieu de joindre les protections à chaque observation
+    avant le DISTINCT.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from geonature.utils.env import DB
+from geonature.core.taxonomie.models import TaxrefProtectionArticles, TaxrefProtectionEspeces
+
+EXPORT_COLUMNS = [
+    "nom_complet",
+    "nom_vern",
+    "cd_nom",
+    "cd_ref",
+    "type_protection",
+    "article",
+    "intitule",
+    "arrete",
+    "date_arrete",
+    "url",
+]
+ARTICLE_COLUMNS = ["type_protection", "article", "intitule", "arrete", "date_arrete", "url"]
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class ProtectionCache:
+    """
+    Protections of the taxa: {cd_nom: [cd_protection]} and {cd_protection: article}
+    """
+
+    def __init__(self):
+        self.loaded_at = time.monotonic()
+        self.by_cd_nom = {}
+        for cd_nom, cd_protection in (
+            DB.session.query(TaxrefProtectionEspeces.cd_nom, TaxrefProtectionEspeces.cd_protection)
+            .distinct()
+            .all()
+        ):
+            self.by_cd_nom.setdefault(int(cd_nom), []).append(cd_protection)
+        self.articles = {
+            a.cd_protection: {column: getattr(a, column) for column in ARTICLE_COLUMNS}
+            for a in DB.session.query(TaxrefProtectionArticles).all()
+        }
+
+    def is_expired(self, refresh):
+        return time.monotonic() - self.loaded_at > refresh
+
+
+def get_protections():
+    """
+    Return the protection cache of the process, reloaded after
+    SYNTHESE.PROTECTION_CACHE_REFRESH seconds (0: reloaded at each call)
+    """
+    global _cache
+    refresh = current_app.config["SYNTHESE"]["PROTECTION_CACHE_REFRESH"]
+    with _cache_lock:
+        if _cache is None or _cache.is_expired(refresh):
+            _cache = ProtectionCache()
+        return _cache
+
+
+def clear_cache():
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+def protection_rows(taxa, protections):
+    """
+    Rows of the export of the protection status: one row per taxon and article
+
+    Parameters:
+        taxa (iterable): rows (cd_nom, nom_complet, cd_ref, nom_vern) of the taxa
+        protections (ProtectionCache): the protections of the taxa
+    """
+    for taxon in taxa:
+        for cd_protection in protections.by_cd_nom.get(taxon.cd_nom, []):
+            article = protections.articles.get(cd_protection)
+            if article is None:
+                continue
+            row = OrderedDict(
+                [
+                    ("nom_complet", taxon.nom_complet),
+                    ("nom_vern", taxon.nom_vern),
+                    ("cd_nom", taxon.cd_nom),
+                    ("cd_ref", taxon.cd_ref),
+                ]
+            )
+            row.update(article)
+            yield row
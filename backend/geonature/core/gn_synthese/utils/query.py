@@ -10,13 +10,13 @@ from flask import current_app, request
 from shapely.wkt import loads
 from geoalchemy2.shape import from_shape
 from sqlalchemy import func, or_, and_, select
-from sqlalchemy.sql import text
 from sqlalchemy.orm import aliased
 
 from utils_flask_sqla_geo.utilsgeometry import circle_from_point
 
 from geonature.utils.env import DB
 from geonature.core.taxonomie.models import Taxref, CorTaxonAttribut, TaxrefLR
+from geonature.core.gn_synthese.utils.taxref_tree import filter_descendants
 from geonature.core.gn_synthese.models import (
     Synthese,
     CorObserverSynthese,
@@ -49,7 +49,6 @@ def filter_query_with_cruved(
         model_temp = model.columns
     else:
         model_temp = model
-    allowed_datasets = TDatasets.get_user_datasets(user)
     # get the mandatory column
     try:
         model_id_syn_col = getattr(model_temp, id_synthese_column)
@@ -84,7 +83,9 @@ def filter_query_with_cruved(
         if user.value_filter == "1":
             q = q.filter(or_(*ors_filters))
         elif user.value_filter == "2":
-            ors_filters.append(model_id_dataset_column.in_(allowed_datasets))
+            ors_filters.append(
+                model_id_dataset_column.in_(TDatasets.select_user_datasets(user))
+            )
             q = q.filter(or_(*ors_filters))
     return q
 
@@ -98,30 +99,22 @@ def filter_taxonomy(model, q, filters):
     Returns:
         -Tuple: the SQLAlchemy query and the filter dictionnary
     """
-    cd_ref_childs = []
+    taxa_filters = []
     if "cd_ref_parent" in filters:
-        # find all taxon child from cd_ref parent
-        cd_ref_parent_int = list(map(lambda x: int(x), filters.pop("cd_ref_parent")))
-        sql = text(
-            """SELECT DISTINCT cd_ref FROM taxonomie.find_all_taxons_children(:id_parent)"""
-        )
-        result = DB.engine.execute(sql, id_parent=cd_ref_parent_int)
-        if result:
-            cd_ref_childs = [r[0] for r in result]
+        # descendants des taxons parents (intervalles de l'arbre de TAXREF)
+        taxa_filters.append(filter_descendants(model.cd_nom, filters.pop("cd_ref_parent")))
 
-    cd_ref_selected = []
     if "cd_ref" in filters:
-        cd_ref_selected = filters.pop("cd_ref")
-    # concat cd_ref child and just selected cd_ref
-    cd_ref_childs.extend(cd_ref_selected)
-
-    if len(cd_ref_childs) > 0:
+        # taxons sélectionnés et leurs synonymes
         sub_query_synonym = (
             DB.session.query(Taxref.cd_nom)
-            .filter(Taxref.cd_ref.in_(cd_ref_childs))
+            .filter(Taxref.cd_ref.in_(filters.pop("cd_ref")))
             .subquery("sub_query_synonym")
         )
-        q = q.filter(model.cd_nom.in_(sub_query_synonym))
+        taxa_filters.append(model.cd_nom.in_(sub_query_synonym))
+
+    if taxa_filters:
+        q = q.filter(or_(*taxa_filters))
 
     if "taxonomy_group2_inpn" in filters:
         q = q.filter(Taxref.group2_inpn.in_(filters.pop("taxonomy_group2_inpn")))
@@ -184,13 +177,10 @@ def filter_query_all_filters(model, q, filters, user):
         q = q.filter(model.observers.ilike("%" + filters.pop("observers")[0] + "%"))
 
     if "id_organism" in filters:
-        id_datasets = (
-            DB.session.query(CorDatasetActor.id_dataset)
-            .filter(CorDatasetActor.id_organism.in_(filters.pop("id_organism")))
-            .all()
+        id_datasets = DB.session.query(CorDatasetActor.id_dataset).filter(
+            CorDatasetActor.id_organism.in_(filters.pop("id_organism"))
         )
-        formated_datasets = [d[0] for d in id_datasets]
-        q = q.filter(model.id_dataset.in_(formated_datasets))
+        q = q.filter(model.id_dataset.in_(id_datasets))
 
     if "date_min" in filters:
         q = q.filter(model.date_min >= filters.pop("date_min")[0])
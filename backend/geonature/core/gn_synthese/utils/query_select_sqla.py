@@ -9,15 +9,15 @@ import datetime
 
 from flask import current_app, request
 from sqlalchemy import func, or_, and_, select, join
-from sqlalchemy.sql import text
 from sqlalchemy.orm import aliased
 from shapely.wkt import loads
 from geoalchemy2.shape import from_shape
 
 from utils_flask_sqla_geo.utilsgeometry import circle_from_point
 
-from geonature.utils.env import DB
 from geonature.core.taxonomie.models import Taxref, CorTaxonAttribut, TaxrefLR
+from geonature.core.gn_synthese.utils.taxref_tree import filter_descendants
+from geonature.core.gn_synthese.utils import query_stats
 from geonature.core.gn_synthese.models import (
     Synthese,
     CorObserverSynthese,
@@ -50,6 +50,8 @@ class SyntheseQuery:
         self.model = model
         self._already_joined_table = []
         self.query_joins = None
+        # empreinte des filtres pour la mesure des requêtes (QUERY_STATS)
+        query_stats.set_filters(filters)
 
     def add_join(self, right_table, right_column, left_column, join_type="right"):
         if self.first:
@@ -85,7 +87,6 @@ class SyntheseQuery:
         """
         Filter the query with the cruved authorization of a user
         """
-        allowed_datasets = TDatasets.get_user_datasets(user)
         if user.value_filter in ("1", "2"):
             # get id synthese where user is observer
             subquery_observers = (
@@ -106,7 +107,9 @@ class SyntheseQuery:
             if user.value_filter == "1":
                 self.query = self.query.where(or_(*ors_filters))
             elif user.value_filter == "2":
-                ors_filters.append(self.model.id_dataset.in_(allowed_datasets))
+                ors_filters.append(
+                    self.model.id_dataset.in_(TDatasets.select_user_datasets(user))
+                )
                 self.query = self.query.where(or_(*ors_filters))
 
     def filter_taxonomy(self):
@@ -118,27 +121,22 @@ class SyntheseQuery:
         Returns:
             -Tuple: the SQLAlchemy query and the filter dictionnary
         """
-        cd_ref_childs = []
+        taxa_filters = []
         if "cd_ref_parent" in self.filters:
-            # find all taxon child from cd_ref parent
-            cd_ref_parent_int = list(map(lambda x: int(x), self.filters.pop("cd_ref_parent")))
-            sql = text(
-                """SELECT DISTINCT cd_ref FROM taxonomie.find_all_taxons_children(:id_parent)"""
+            # descendants des taxons parents (intervalles de l'arbre de TAXREF)
+            taxa_filters.append(
+                filter_descendants(self.model.cd_nom, self.filters.pop("cd_ref_parent"))
             )
-            result = DB.engine.execute(sql, id_parent=cd_ref_parent_int)
-            if result:
-                cd_ref_childs = [r[0] for r in result]
 
-        cd_ref_selected = []
         if "cd_ref" in self.filters:
-            cd_ref_selected = self.filters.pop("cd_ref")
-
-        # concat cd_ref child and just selected cd_ref
-        cd_ref_childs.extend(cd_ref_selected)
+            # taxons sélectionnés et leurs synonymes
+            sub_query_synonym = select([Taxref.cd_nom]).where(
+                Taxref.cd_ref.in_(self.filters.pop("cd_ref"))
+            )
+            taxa_filters.append(self.model.cd_nom.in_(sub_query_synonym))
 
-        if len(cd_ref_childs) > 0:
-            sub_query_synonym = select([Taxref.cd_nom]).where(Taxref.cd_ref.in_(cd_ref_childs))
-            self.query = self.query.where(self.model.cd_nom.in_(sub_query_synonym))
+        if taxa_filters:
+            self.query = self.query.where(or_(*taxa_filters))
         if "taxonomy_group2_inpn" in self.filters:
             self.add_join(Taxref, Taxref.cd_nom, self.model.cd_nom)
             self.query = self.query.where(
@@ -210,13 +208,10 @@ class SyntheseQuery:
             )
 
         if "id_organism" in self.filters:
-            datasets = (
-                DB.session.query(CorDatasetActor.id_dataset)
-                .filter(CorDatasetActor.id_organism.in_(self.filters.pop("id_organism")))
-                .all()
+            datasets = select([CorDatasetActor.id_dataset]).where(
+                CorDatasetActor.id_organism.in_(self.filters.pop("id_organism"))
             )
-            formated_datasets = [d[0] for d in datasets]
-            self.query = self.query.where(self.model.id_dataset.in_(formated_datasets))
+            self.query = self.query.where(self.model.id_dataset.in_(datasets))
         if "date_min" in self.filters:
             self.query = self.query.where(self.model.date_min >= self.filters.pop("date_min")[0])
 
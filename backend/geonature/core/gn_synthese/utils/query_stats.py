@@ -0,0 +1,347 @@
+"""
+    Mesure de la durée des requêtes des routes de la synthèse, de la validation
+    et des exports (paramètre QUERY_STATS)
+
+    Chaque requête SQL exécutée pendant une requête HTTP de ces routes est chronométrée
+    (événements before/after_cursor_execute du moteur SQLAlchemy). Les durées sont agrégées
+    par chaque processus de l'API par route et par empreinte des filtres : les noms des
+    filtres utilisés, triés, sans leurs valeurs (données par SyntheseQuery ou, à défaut,
+    par les paramètres de la requête HTTP). Elles sont ajoutées à gn_synthese.t_query_stats
+    toutes les FLUSH_INTERVAL secondes.
+    Les requêtes des exports exécutés en tâche de fond (processus de gn_exports.jobs, hors
+    requête HTTP) sont chronométrées de la même façon par le bloc `measure`, par module
+    et empreinte des paramètres de l'export, et enregistrées à la fin de chaque export.
+    Le plan EXPLAIN (ANALYZE, BUFFERS) d'un SELECT plus long que SLOW_QUERY_MS est calculé
+    en tâche de fond (la requête est exécutée une seconde fois, dans une transaction en lecture
+    seule annulée : une fonction qui écrit échoue au lieu de refaire ses écritures),
+    au plus une fois toutes les EXPLAIN_INTERVAL secondes par route et empreinte,
+    et enregistré dans gn_synthese.t_query_samples (MAX_SAMPLES plans gardés).
+    Les résultats sont lus par la route /synthese/query_stats
+    et la commande `geonature query_stats`.
+"""
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event, func
+from sqlalchemy.dialects.postgresql import insert
+
+from geonature.utils.env import DB
+from geonature.core.gn_synthese.models import TQueryStats, TQuerySamples
+
+log = logging.getLogger(__name__)
+
+INSTRUMENTED_BLUEPRINTS = ("gn_synthese", "validation", "gn_exports")
+# empreinte d'une recherche sans filtre
+NO_FILTER = "-"
+# paramètres de pagination et de format, qui ne sont pas des filtres
+IGNORED_PARAMETERS = {
+    "limit",
+    "offset",
+    "cursor",
+    "count",
+    "order",
+    "orderby",
+    "export_format",
+}
+FINGERPRINT_MAX_LENGTH = 1000
+
+# durées agrégées par le processus :
+# {(route, empreinte): [nombre, total (ms), max (ms), nombre de requêtes lentes, date]}
+_stats = {}
+# date du dernier plan : {(route, empreinte): time.monotonic()}
+_last_explain = {}
+_last_flush = time.monotonic()
+_lock = threading.Lock()
+_executor = None
+# mesure en cours hors requête HTTP (cf measure)
+_local = threading.local()
+
+
+def fingerprint(filters):
+    """
+    Fingerprint of the filters of a search: the sorted names of the filters used
+    """
+    if not filters:
+        return NO_FILTER
+    keys = sorted(
+        key
+        for key, value in filters.items()
+        if key not in IGNORED_PARAMETERS and value not in (None, "", [], {})
+    )
+    return ",".join(keys)[:FINGERPRINT_MAX_LENGTH] or NO_FILTER
+
+
+def _new_state(endpoint, filters):
+    return {"endpoint": endpoint, "fingerprint": fingerprint(filters), "samples": []}
+
+
+def _current_state():
+    state = getattr(_local, "state", None)
+    if state is None and has_request_context():
+        state = g.get("query_stats")
+    return state
+
+
+def set_filters(filters):
+    """
+    Set the fingerprint of the queries of the current request from the filters of a search
+    """
+    state = _current_state()
+    if state is not None:
+        state["fingerprint"] = fingerprint(filters)
+
+
+@contextmanager
+def measure(endpoint, filters=None):
+    """
+    Time the queries executed in the block outside of a HTTP request (export jobs):
+    they are recorded for `endpoint` and the fingerprint of `filters`, and saved
+    in the current thread at the end of the block
+    """
+    _local.state = _new_state(endpoint, filters)
+    try:
+        yield
+    finally:
+        state = _local.state
+        _local.state = None
+        with _lock:
+            stats = dict(_stats)
+            _stats.clear()
+        _save(stats, state["samples"])
+
+
+def _is_select(statement):
+    return statement.lstrip().upper().startswith(("SELECT", "WITH"))
+
+
+def _before_request():
+    if request.blueprint not in INSTRUMENTED_BLUEPRINTS:
+        return
+    filters = dict(request.args)
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        filters.update(data)
+    g.query_stats = _new_state(request.endpoint, filters)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current_state() is not None:
+        context._query_stats_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_query_stats_start", None)
+    state = _current_state()
+    if start is None or state is None:
+        return
+    duration = (time.perf_counter() - start) * 1000
+    config = current_app.config["QUERY_STATS"]
+    key = (state["endpoint"], state["fingerprint"])
+    slow = duration >= config["SLOW_QUERY_MS"]
+    with _lock:
+        stats = _stats.setdefault(key, [0, 0.0, 0.0, 0, None])
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] = max(stats[2], duration)
+        stats[3] += int(slow)
+        stats[4] = datetime.datetime.now()
+        if not slow or executemany or not _is_select(statement):
+            return
+        last = _last_explain.get(key)
+        if last is not None and time.monotonic() - last < config["EXPLAIN_INTERVAL"]:
+            return
+        _last_explain[key] = time.monotonic()
+    state["samples"].append((key, statement, parameters, duration))
+
+
+def _teardown_request(exception):
+    global _executor, _last_flush
+    state = g.pop("query_stats", None)
+    if state is None:
+        return
+    stats = None
+    with _lock:
+        if time.monotonic() - _last_flush >= current_app.config["QUERY_STATS"]["FLUSH_INTERVAL"]:
+            stats = dict(_stats)
+            _stats.clear()
+            _last_flush = time.monotonic()
+        if not stats and not state["samples"]:
+            return
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1)
+    _executor.submit(
+        _save_in_background, current_app._get_current_object(), stats, state["samples"]
+    )
+
+
+def _save(stats, samples):
+    try:
+        if stats:
+            save_stats(stats)
+        for key, statement, parameters, duration in samples:
+            save_sample(key, statement, parameters, duration)
+    except Exception:
+        log.exception("Unable to save the query stats")
+        DB.session.rollback()
+
+
+def _save_in_background(app, stats, samples):
+    with app.app_context():
+        _save(stats, samples)
+
+
+def save_stats(stats):
+    """
+    Add the durations measured by the process to gn_synthese.t_query_stats
+    """
+    table = TQueryStats.__table__
+    stmt = insert(table).values(
+        [
+            {
+                "endpoint": endpoint,
+                "fingerprint": fp,
+                "nb_queries": nb,
+                "total_ms": total,
+                "max_ms": max_ms,
+                "nb_slow": nb_slow,
+                "last_date": last_date,
+            }
+            for (endpoint, fp), (nb, total, max_ms, nb_slow, last_date) in stats.items()
+        ]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.endpoint, table.c.fingerprint],
+        set_={
+            "nb_queries": table.c.nb_queries + stmt.excluded.nb_queries,
+            "total_ms": table.c.total_ms + stmt.excluded.total_ms,
+            "max_ms": func.greatest(table.c.max_ms, stmt.excluded.max_ms),
+            "nb_slow": table.c.nb_slow + stmt.excluded.nb_slow,
+            "last_date": stmt.excluded.last_date,
+        },
+    )
+    DB.session.execute(stmt)
+    DB.session.commit()
+
+
+def explain(statement, parameters, timeout_ms):
+    """
+    Return the plan EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) of a statement
+    executed with the same DBAPI parameters, in a read only transaction rolled back:
+    a SELECT calling a function which writes fails instead of writing again
+    """
+    connection = DB.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SET TRANSACTION READ ONLY")
+        cursor.execute(
+            "SELECT set_config('statement_timeout', %(timeout)s, true)",
+            {"timeout": str(int(timeout_ms))},
+        )
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters)
+        return cursor.fetchone()[0]
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def save_sample(key, statement, parameters, duration):
+    """
+    Save the plan of a slow query, only the last QUERY_STATS.MAX_SAMPLES plans
+    of a route and fingerprint are kept
+    """
+    endpoint, fp = key
+    try:
+        # la requête peut être plus longue la seconde fois : délai max large
+        plan = explain(statement, parameters, max(60000, duration * 5))
+    except Exception as e:
+        log.warning("Unable to explain a slow query of %s: %s", endpoint, e)
+        plan = {"error": str(e)}
+    DB.session.add(
+        TQuerySamples(
+            endpoint=endpoint,
+            fingerprint=fp,
+            sample_date=datetime.datetime.now(),
+            duration_ms=duration,
+            statement=statement,
+            plan=plan,
+        )
+    )
+    DB.session.flush()
+    kept = (
+        DB.session.query(TQuerySamples.id_sample)
+        .filter(TQuerySamples.endpoint == endpoint, TQuerySamples.fingerprint == fp)
+        .order_by(TQuerySamples.sample_date.desc(), TQuerySamples.id_sample.desc())
+        .limit(current_app.config["QUERY_STATS"]["MAX_SAMPLES"])
+    )
+    DB.session.query(TQuerySamples).filter(
+        TQuerySamples.endpoint == endpoint,
+        TQuerySamples.fingerprint == fp,
+        ~TQuerySamples.id_sample.in_(kept.subquery()),
+    ).delete(synchronize_session=False)
+    DB.session.commit()
+
+
+def get_report(limit=50, order_by="total_ms", with_plans=False):
+    """
+    Return the durations of the queries by route and fingerprint, the slowest first
+
+    Parameters:
+        limit (int): number of (route, fingerprint) returned
+        order_by (str): <'total_ms', 'mean_ms', 'max_ms', 'nb_slow', 'nb_queries'>
+        with_plans (bool): add the plans of the slow queries (else only their dates and durations)
+    Returns:
+        list<dict>
+    """
+    mean_ms = (TQueryStats.total_ms / func.nullif(TQueryStats.nb_queries, 0)).label("mean_ms")
+    order_columns = {
+        "total_ms": TQueryStats.total_ms,
+        "mean_ms": mean_ms,
+        "max_ms": TQueryStats.max_ms,
+        "nb_slow": TQueryStats.nb_slow,
+        "nb_queries": TQueryStats.nb_queries,
+    }
+    if order_by not in order_columns:
+        raise ValueError("Unknown order: {}".format(order_by))
+    rows = (
+        DB.session.query(TQueryStats, mean_ms)
+        .order_by(order_columns[order_by].desc().nullslast())
+        .limit(limit)
+        .all()
+    )
+    samples = {}
+    if rows:
+        keys = {(s.endpoint, s.fingerprint) for s, _ in rows}
+        for sample in (
+            DB.session.query(TQuerySamples)
+            .filter(TQuerySamples.endpoint.in_({endpoint for endpoint, _ in keys}))
+            .order_by(TQuerySamples.sample_date.desc())
+        ):
+            key = (sample.endpoint, sample.fingerprint)
+            if key in keys:
+                columns = () if with_plans else ("sample_date", "duration_ms", "statement")
+                samples.setdefault(key, []).append(sample.as_dict(columns=columns))
+    report = []
+    for stats, mean in rows:
+        row = stats.as_dict()
+        row["mean_ms"] = mean
+        row["samples"] = samples.get((stats.endpoint, stats.fingerprint), [])
+        report.append(row)
+    return report
+
+
+def init_app(app):
+    """
+    Time the queries of the synthese, validation and exports routes if QUERY_STATS.ENABLED
+    """
+    if not app.config["QUERY_STATS"]["ENABLED"]:
+        return
+    engine = DB.get_engine(app)
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
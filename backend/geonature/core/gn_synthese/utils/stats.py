@@ -0,0 +1,243 @@
+"""
+    Statistiques de la synthèse calculées par JDD
+
+    Les tables gn_synthese.t_dataset_stats, cor_dataset_taxon_stats et
+    cor_dataset_observers_stats gardent pour chaque JDD le nombre d'observations
+    par taxon et par observateurs. Un trigger sur la synthèse marque les JDD modifiés
+    (t_dataset_stats_dirty) : leurs statistiques sont recalculées en tâche de fond,
+    au plus une fois toutes les SYNTHESE.STATS_REFRESH_INTERVAL secondes par processus
+    de l'API, ou par la commande `geonature refresh_synthese_stats`.
+    Les routes de statistiques ne font que lire les agrégats des JDD, au lieu
+    de parcourir toutes les observations : elles n'attendent pas le recalcul,
+    qui bloque les écritures des observations du JDD recalculé dans la synthèse.
+    Le recalcul est fait par petits lots de JDD, un lot par transaction.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import distinct, func, or_, select, union, cast
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from geonature.utils.env import DB
+from geonature.core.gn_meta.models import TDatasets
+from geonature.core.taxonomie.models import Taxref
+from geonature.core.gn_synthese.models import (
+    Synthese,
+    TDatasetStats,
+    CorDatasetTaxonStats,
+    CorDatasetObserversStats,
+    TDatasetStatsDirty,
+)
+from geonature.core.gn_synthese.utils.query import filter_query_with_cruved
+from geonature.core.gn_permissions.models import VUsersPermissions
+
+log = logging.getLogger(__name__)
+
+# identifiant du verrou postgresql (pg_try_advisory_xact_lock) du calcul des statistiques
+STATS_LOCK_ID = 4269
+# nombre de JDD recalculés par transaction (--full)
+STATS_BATCH_SIZE = 10
+
+_executor = None
+_last_refresh = None
+_refresh_lock = threading.Lock()
+
+
+def refresh_stats(id_datasets=None):
+    """
+    Compute the stats of the datasets (of all the datasets if id_datasets is None)
+    The caller commits the transaction
+    """
+    DB.session.execute(
+        select([func.gn_synthese.refresh_dataset_stats(cast(id_datasets, ARRAY(DB.Integer)))])
+    )
+
+
+def refresh_dirty_stats():
+    """
+    Compute the stats of the datasets modified since their last computation,
+    one transaction per dataset: the synthese writes of a dataset only wait
+    for the computation of this dataset
+    Another process already computing them is not waited for
+    """
+    id_datasets = [r[0] for r in DB.session.query(TDatasetStatsDirty.id_dataset).all()]
+    for id_dataset in id_datasets:
+        if not DB.session.execute(
+            select([func.pg_try_advisory_xact_lock(STATS_LOCK_ID)])
+        ).scalar():
+            DB.session.rollback()
+            return
+        refresh_stats([id_dataset])
+        DB.session.commit()
+
+
+def refresh_all_stats(batch_size=STATS_BATCH_SIZE):
+    """
+    Compute the stats of all the datasets, by batches of `batch_size` datasets
+    each in its own transaction: the synthese writes of a dataset only wait
+    for the computation of its batch
+    A computation already running in another process is waited for
+    """
+    id_datasets = [
+        r[0] for r in DB.session.query(TDatasets.id_dataset).order_by(TDatasets.id_dataset)
+    ]
+    DB.session.commit()
+    for i in range(0, len(id_datasets), batch_size):
+        DB.session.execute(select([func.pg_advisory_xact_lock(STATS_LOCK_ID)]))
+        refresh_stats(id_datasets[i : i + batch_size])
+        DB.session.commit()
+
+
+def _refresh_in_background(app):
+    with app.app_context():
+        try:
+            refresh_dirty_stats()
+        except Exception:
+            log.exception("Unable to compute the synthese stats")
+            DB.session.rollback()
+
+
+def request_refresh():
+    """
+    Start the computation of the modified datasets in a thread of the API process,
+    at most once every SYNTHESE.STATS_REFRESH_INTERVAL seconds (0: never, the
+    refresh_synthese_stats command must be scheduled). The routes do not wait for it
+    """
+    global _executor, _last_refresh
+    interval = current_app.config["SYNTHESE"]["STATS_REFRESH_INTERVAL"]
+    if not interval:
+        return
+    with _refresh_lock:
+        now = time.monotonic()
+        if _last_refresh is not None and now - _last_refresh < interval:
+            return
+        _last_refresh = now
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1)
+    _executor.submit(_refresh_in_background, current_app._get_current_object())
+
+
+def _own_observations_filter(info_role, q):
+    """
+    Filter the query on the observations of the user (CRUVED scope 1)
+    """
+    user = VUsersPermissions(
+        id_role=info_role.id_role,
+        nom_role=info_role.nom_role,
+        prenom_role=info_role.prenom_role,
+        id_organisme=info_role.id_organisme,
+        value_filter="1",
+    )
+    return filter_query_with_cruved(Synthese, q, user)
+
+
+def general_stats(info_role):
+    """
+    Return the number of observations, taxa and observers
+    that the user can read (CRUVED), from the stats of the datasets
+
+    Scope 3: all the datasets
+    Scope 2: the allowed datasets plus the observations of the user in the other datasets
+    Scope 1: the observations of the user (not stored by dataset, counted in the synthese)
+    """
+    if info_role.value_filter not in ("2", "3"):
+        q = DB.session.query(
+            func.count(Synthese.id_synthese),
+            func.count(distinct(Synthese.cd_nom)),
+            func.count(distinct(Synthese.observers)),
+        )
+        return tuple(_own_observations_filter(info_role, q).one())
+
+    request_refresh()
+    if info_role.value_filter == "3":
+        return (
+            DB.session.execute(select([func.sum(TDatasetStats.nb_obs)])).scalar() or 0,
+            DB.session.execute(
+                select([func.count(distinct(CorDatasetTaxonStats.cd_nom))])
+            ).scalar(),
+            DB.session.execute(
+                select([func.count(distinct(CorDatasetObserversStats.observers))])
+            ).scalar(),
+        )
+
+    allowed_datasets = TDatasets.select_user_datasets(info_role)
+    # observations de l'utilisateur hors des JDD autorisés : lues dans la synthèse
+    own_q = _own_observations_filter(
+        info_role,
+        DB.session.query(Synthese.id_synthese, Synthese.cd_nom, Synthese.observers).filter(
+            or_(Synthese.id_dataset.is_(None), ~Synthese.id_dataset.in_(allowed_datasets))
+        ),
+    ).subquery()
+    nb_data = (
+        DB.session.execute(
+            select([func.sum(TDatasetStats.nb_obs)]).where(
+                TDatasetStats.id_dataset.in_(allowed_datasets)
+            )
+        ).scalar()
+        or 0
+    )
+    nb_data += DB.session.execute(select([func.count()]).select_from(own_q)).scalar()
+    # UNION : un taxon (ou observateur) présent dans plusieurs JDD n'est compté qu'une fois
+    taxa = union(
+        select([CorDatasetTaxonStats.cd_nom]).where(
+            CorDatasetTaxonStats.id_dataset.in_(allowed_datasets)
+        ),
+        select([own_q.c.cd_nom]).where(own_q.c.cd_nom.isnot(None)),
+    ).alias("taxa")
+    observers = union(
+        select([CorDatasetObserversStats.observers]).where(
+            CorDatasetObserversStats.id_dataset.in_(allowed_datasets)
+        ),
+        select([own_q.c.observers]).where(own_q.c.observers.isnot(None)),
+    ).alias("observers")
+    return (
+        nb_data,
+        DB.session.execute(select([func.count()]).select_from(taxa)).scalar(),
+        DB.session.execute(select([func.count()]).select_from(observers)).scalar(),
+    )
+
+
+def taxa_count(id_dataset=None):
+    """
+    Return the number of taxa of a dataset (of the synthese if id_dataset is None)
+    """
+    request_refresh()
+    q = DB.session.query(func.count(distinct(CorDatasetTaxonStats.cd_nom)))
+    if id_dataset is not None:
+        q = q.filter(CorDatasetTaxonStats.id_dataset == id_dataset)
+    return q.scalar()
+
+
+def observation_count(id_dataset=None):
+    """
+    Return the number of observations with a taxon of a dataset
+    (of the synthese if id_dataset is None)
+    """
+    request_refresh()
+    q = DB.session.query(func.coalesce(func.sum(CorDatasetTaxonStats.nb_obs), 0))
+    if id_dataset is not None:
+        q = q.filter(CorDatasetTaxonStats.id_dataset == id_dataset)
+    return q.scalar()
+
+
+def taxa_distribution(rank, id_dataset=None, id_af=None):
+    """
+    Return the number of taxa of a dataset or an acquisition framework
+    grouped by a taxonomic rank column of Taxref
+    """
+    request_refresh()
+    q = (
+        DB.session.query(func.count(distinct(CorDatasetTaxonStats.cd_nom)), rank)
+        .select_from(CorDatasetTaxonStats)
+        .outerjoin(Taxref, Taxref.cd_nom == CorDatasetTaxonStats.cd_nom)
+    )
+    if id_dataset:
+        q = q.filter(CorDatasetTaxonStats.id_dataset == id_dataset)
+    elif id_af:
+        q = q.join(TDatasets, TDatasets.id_dataset == CorDatasetTaxonStats.id_dataset).filter(
+            TDatasets.id_acquisition_framework == id_af
+        )
+    return q.group_by(rank).all()
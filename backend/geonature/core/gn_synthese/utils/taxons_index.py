@@ -0,0 +1,254 @@
+"""
+    Index en mémoire des taxons présents dans la synthèse
+    pour l'autocomplétion (route /synthese/taxons_autocomplete)
+
+    La recherche en base (similarity + ilike sur taxonomie.vm_taxref_list_forautocomplete
+    jointe à toute la synthèse avec un DISTINCT) coûte plusieurs centaines de ms
+    à chaque frappe sur une synthèse volumineuse.
+    Chaque processus de l'API garde les noms des taxons présents dans la synthèse
+    avec un index des trigrammes de ces noms :
+        - construit au premier appel à partir des cd_nom distincts de la synthèse
+          (parcours de l'index i_synthese_cd_nom)
+        - complété toutes les SYNTHESE.TAXONS_AUTOCOMPLETE_REFRESH secondes
+          avec les taxons des observations ajoutées depuis (id_synthese > au dernier lu)
+        - reconstruit entièrement après `geonature refresh_taxons_autocomplete`
+          (suppression d'observations, mise à jour de TAXREF)
+    Le filtre (ilike) et le classement (cd_nom = cd_ref puis similarité des trigrammes)
+    sont ceux de la requête SQL.
+"""
+import heapq
+import os
+import re
+import threading
+import time
+from array import array
+
+from flask import current_app
+from sqlalchemy import func, select, text
+
+from geonature.utils.env import DB, ROOT_DIR
+from geonature.core.taxonomie.models import VMTaxrefListForautocomplete
+from geonature.core.gn_synthese.models import Synthese
+
+# fichier dont la date de modification indique la dernière demande de reconstruction
+REFRESH_MARKER_FILE = ROOT_DIR / "var" / "taxons_autocomplete.refresh"
+
+# cd_nom distincts de la synthèse en sautant d'une valeur à la suivante dans l'index
+# (loose index scan) : une lecture d'index par taxon et non par observation
+DISTINCT_CD_NOM_QUERY = text(
+    """
+    WITH RECURSIVE t AS (
+        (SELECT cd_nom FROM gn_synthese.synthese ORDER BY cd_nom LIMIT 1)
+        UNION ALL
+        SELECT (
+            SELECT s.cd_nom FROM gn_synthese.synthese s
+            WHERE s.cd_nom > t.cd_nom ORDER BY s.cd_nom LIMIT 1
+        )
+        FROM t WHERE t.cd_nom IS NOT NULL
+    )
+    SELECT cd_nom FROM t WHERE cd_nom IS NOT NULL
+    """
+)
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def trigrams(word):
+    """
+    Trigrams of a word as computed by pg_trgm: lower case, padded with
+    two spaces before and one after
+    """
+    padded = "  " + word + " "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def trigrams_set(value):
+    """
+    Trigrams of a string as computed by pg_trgm (each alphanumeric word apart)
+    """
+    result = set()
+    for word in re.findall(r"\w+", value.lower()):
+        result |= trigrams(word.replace("_", ""))
+    return result
+
+
+def similarity(search_trigrams, value_trigrams):
+    """
+    pg_trgm similarity of two sets of trigrams
+    """
+    if not search_trigrams or not value_trigrams:
+        return 0.0
+    nb_common = len(search_trigrams & value_trigrams)
+    return nb_common / (len(search_trigrams) + len(value_trigrams) - nb_common)
+
+
+def like_to_regex(pattern):
+    """
+    Case insensitive regex equivalent to `ilike '%pattern%'`
+    """
+    regex = "".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern)
+    return re.compile(regex, re.IGNORECASE | re.DOTALL)
+
+
+class TaxonsAutocompleteIndex:
+    """
+    Index of the names of the taxa: the names of an index are never modified,
+    a refresh adding taxa builds a new index which replaces the previous one
+    """
+
+    def __init__(self, taxa, max_id_synthese):
+        # dict de VMTaxrefListForautocomplete (un par nom de taxon)
+        self.taxa = taxa
+        self.max_id_synthese = max_id_synthese
+        self.cd_noms = {t["cd_nom"] for t in taxa}
+        self.names = [t["search_name"].lower() for t in taxa]
+        self.name_trigrams = [trigrams_set(t["search_name"]) for t in taxa]
+        # trigramme (sans espaces ajoutés) -> indices des noms qui le contiennent
+        postings = {}
+        for i, name in enumerate(self.names):
+            for trigram in {name[j : j + 3] for j in range(len(name) - 2)}:
+                postings.setdefault(trigram, array("I")).append(i)
+        self.postings = postings
+        self.load_time = time.time()
+
+    def candidates(self, pattern):
+        """
+        Indices of the names which may match the pattern: the names containing
+        all the trigrams of the literal parts of the pattern (all the names if none)
+        """
+        required = set()
+        for part in re.split("[%_]", pattern.lower()):
+            required |= {part[j : j + 3] for j in range(len(part) - 2)}
+        if not required:
+            return range(len(self.names))
+        postings = []
+        for trigram in required:
+            posting = self.postings.get(trigram)
+            if posting is None:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        result = set(postings[0])
+        for posting in postings[1:]:
+            result.intersection_update(posting)
+            if not result:
+                break
+        return result
+
+    def search(self, search_name, regne=None, group2_inpn=None, limit=20):
+        """
+        Same results as the SQL query of the route:
+            search_name ilike '%search%name%' ordered by cd_nom = cd_ref
+            then similarity(search_name, 'search name')
+        """
+        pattern = search_name.replace(" ", "%")
+        regex = like_to_regex(pattern)
+        search_trigrams = trigrams_set(search_name)
+        results = []
+        for i in self.candidates(pattern):
+            taxon = self.taxa[i]
+            if regne and taxon["regne"] != regne:
+                continue
+            if group2_inpn and taxon["group2_inpn"] != group2_inpn:
+                continue
+            if not regex.search(self.names[i]):
+                continue
+            results.append(
+                (
+                    taxon["cd_nom"] == taxon["cd_ref"],
+                    similarity(search_trigrams, self.name_trigrams[i]),
+                    -i,
+                    taxon,
+                )
+            )
+        return [r[3] for r in heapq.nlargest(limit, results, key=lambda r: r[:3])]
+
+
+def _load_taxa(cd_noms):
+    if not cd_noms:
+        return []
+    q = DB.session.query(VMTaxrefListForautocomplete).filter(
+        VMTaxrefListForautocomplete.cd_nom.in_(cd_noms)
+    )
+    return [t.as_dict() for t in q.all()]
+
+
+def _max_id_synthese():
+    return DB.session.execute(select([func.max(Synthese.id_synthese)])).scalar() or 0
+
+
+def build_index():
+    """
+    Build the index of all the taxa present in the synthese
+    """
+    max_id_synthese = _max_id_synthese()
+    cd_noms = [r[0] for r in DB.session.execute(DISTINCT_CD_NOM_QUERY)]
+    return TaxonsAutocompleteIndex(_load_taxa(cd_noms), max_id_synthese)
+
+
+def update_index(index):
+    """
+    Return the index completed with the taxa of the observations
+    added since its construction (the same index if there is none)
+    """
+    max_id_synthese = _max_id_synthese()
+    if max_id_synthese <= index.max_id_synthese:
+        index.load_time = time.time()
+        return index
+    new_cd_noms = [
+        r[0]
+        for r in DB.session.execute(
+            select([Synthese.cd_nom])
+            .where(Synthese.id_synthese > index.max_id_synthese)
+            .where(Synthese.id_synthese <= max_id_synthese)
+            .distinct()
+        )
+        if r[0] not in index.cd_noms
+    ]
+    if not new_cd_noms:
+        index.max_id_synthese = max_id_synthese
+        index.load_time = time.time()
+        return index
+    return TaxonsAutocompleteIndex(index.taxa + _load_taxa(new_cd_noms), max_id_synthese)
+
+
+def _last_refresh_time():
+    try:
+        return os.path.getmtime(str(REFRESH_MARKER_FILE))
+    except OSError:
+        return 0
+
+
+def get_index():
+    """
+    Return the index of the current process, built or completed if needed
+    """
+    global _index
+    refresh = current_app.config["SYNTHESE"]["TAXONS_AUTOCOMPLETE_REFRESH"]
+    index = _index
+    if (
+        index is not None
+        and index.load_time >= _last_refresh_time()
+        and time.time() - index.load_time < refresh
+    ):
+        return index
+    with _index_lock:
+        # un autre thread a pu le mettre à jour pendant l'attente du verrou
+        if _index is not None and _index is not index and _index.load_time >= _last_refresh_time():
+            return _index
+        if index is None or index.load_time < _last_refresh_time():
+            _index = build_index()
+        else:
+            _index = update_index(index)
+        return _index
+
+
+def refresh_index():
+    """
+    Ask all the processes of the API to rebuild their index at the next search
+    """
+    global _index
+    REFRESH_MARKER_FILE.parent.mkdir(parents=True, exist_ok=True)
+    REFRESH_MARKER_FILE.touch()
+    _index = None
@@ -0,0 +1,85 @@
+"""
+    Filtre "descendants d'un taxon" à partir de l'arbre de TAXREF
+    numéroté en intervalles (table gn_synthese.taxref_tree)
+
+    Les descendants d'un taxon sont les taxons dont le lft est compris
+    dans ]lft, rgt] du taxon : le filtre est un intervalle sur un index
+    et non plus la liste de tous les cd_ref descendants.
+    Les intervalles des taxons demandés sont gardés par chaque processus de l'API
+    jusqu'au prochain `geonature refresh_taxref_tree` (mise à jour de TAXREF).
+"""
+import os
+import threading
+
+from sqlalchemy import and_, false, or_, select
+
+from geonature.utils.env import DB, ROOT_DIR
+from geonature.core.gn_synthese.models import TaxrefTree
+
+# fichier dont la date de modification indique le dernier calcul des intervalles
+REFRESH_MARKER_FILE = ROOT_DIR / "var" / "taxref_tree.refresh"
+
+# {cd_ref: (lft, rgt) ou None si le taxon n'est pas dans l'arbre}
+_INTERVALS = {}
+_intervals_time = 0
+_intervals_lock = threading.Lock()
+
+
+def _last_refresh_time():
+    try:
+        return os.path.getmtime(str(REFRESH_MARKER_FILE))
+    except OSError:
+        return 0
+
+
+def get_intervals(cd_refs):
+    """
+    Return the (lft, rgt) interval of each cd_ref (None if unknown)
+    """
+    global _intervals_time
+    cd_refs = [int(cd_ref) for cd_ref in cd_refs]
+    with _intervals_lock:
+        if _intervals_time < _last_refresh_time():
+            _INTERVALS.clear()
+            _intervals_time = _last_refresh_time()
+        missing = [cd_ref for cd_ref in cd_refs if cd_ref not in _INTERVALS]
+    if missing:
+        loaded = dict.fromkeys(missing)
+        for r in DB.session.execute(
+            select([TaxrefTree.cd_nom, TaxrefTree.lft, TaxrefTree.rgt]).where(
+                TaxrefTree.cd_nom.in_(missing)
+            )
+        ):
+            loaded[r.cd_nom] = (r.lft, r.rgt)
+        with _intervals_lock:
+            _INTERVALS.update(loaded)
+    return {cd_ref: _INTERVALS.get(cd_ref) for cd_ref in cd_refs}
+
+
+def descendants_clause(cd_refs):
+    """
+    Return the where clause on TaxrefTree selecting the descendants
+    (synonyms included, the taxa themselves excluded) of the cd_refs
+    """
+    intervals = [i for i in get_intervals(cd_refs).values() if i is not None]
+    if not intervals:
+        return false()
+    return or_(*[and_(TaxrefTree.lft > lft, TaxrefTree.lft <= rgt) for lft, rgt in intervals])
+
+
+def filter_descendants(cd_nom_column, cd_refs):
+    """
+    Return the where clause filtering `cd_nom_column` on the descendants of the cd_refs
+    """
+    return cd_nom_column.in_(select([TaxrefTree.cd_nom]).where(descendants_clause(cd_refs)))
+
+
+def refresh_taxref_tree():
+    """
+    Compute again the intervals of the TAXREF tree and ask all the processes
+    of the API to forget the intervals they keep
+    """
+    DB.session.execute("SELECT gn_synthese.refresh_taxref_tree()")
+    DB.session.commit()
+    REFRESH_MARKER_FILE.parent.mkdir(parents=True, exist_ok=True)
+    REFRESH_MARKER_FILE.touch()
@@ -0,0 +1,102 @@
+"""
+Utility functions to build the Mapbox Vector Tiles (MVT) of the synthese
+with ST_AsMVT (PostGIS >= 2.4)
+"""
+from sqlalchemy import func, select, cast, Text
+from sqlalchemy.sql import literal_column
+
+from geonature.core.gn_synthese.models import VSyntheseForWebApp
+from geonature.core.gn_synthese.utils.query_select_sqla import SyntheseQuery
+
+# demi-circonférence de la terre en Web Mercator (EPSG:3857)
+WEB_MERCATOR_HALF_WORLD = 20037508.342789244
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+MVT_LAYER_NAME = "synthese"
+
+
+def tile_bounds(z, x, y):
+    """
+    Return the bounds (xmin, ymin, xmax, ymax) in EPSG:3857 of the tile z/x/y
+    (same as ST_TileEnvelope which is only available from PostGIS 3)
+    """
+    tile_size = 2 * WEB_MERCATOR_HALF_WORLD / (2**z)
+    xmin = -WEB_MERCATOR_HALF_WORLD + x * tile_size
+    ymax = WEB_MERCATOR_HALF_WORLD - y * tile_size
+    return xmin, ymax - tile_size, xmin + tile_size, ymax
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= 30 and 0 <= x < 2**z and 0 <= y < 2**z
+
+
+def build_tile_query(z, x, y, filters, user, cluster_max_zoom, cluster_grid):
+    """
+    Build the SQLA select which return the tile z/x/y as MVT (bytea)
+    The observations are filtered with the same filters (and CRUVED)
+    than the /for_web route.
+
+    Under (or equal to) `cluster_max_zoom`, the observations are clustered on a grid
+    of `cluster_grid` x `cluster_grid` cells per tile: each feature is a cell
+    with the number of observations (nb_obs). Above, each feature is an observation.
+
+    Parameters:
+        z, x, y (int): tile coordinates
+        filters (dict): the synthese filters (dict of list)
+        user (VUsersPermissions): the user with its CRUVED scope
+        cluster_max_zoom (int): max zoom level where the observations are clustered
+        cluster_grid (int): number of cluster cells on a tile side
+    Return:
+        SQLA select
+    """
+    xmin, ymin, xmax, ymax = tile_bounds(z, x, y)
+    envelope = func.ST_MakeEnvelope(xmin, ymin, xmax, ymax, 3857)
+    geom_3857 = func.ST_Transform(VSyntheseForWebApp.the_geom_4326, 3857)
+    in_tile = VSyntheseForWebApp.the_geom_4326.op("&&")(func.ST_Transform(envelope, 4326))
+
+    clustered = z <= cluster_max_zoom
+    if clustered:
+        cell_size = (xmax - xmin) / cluster_grid
+        columns = [
+            VSyntheseForWebApp.id_synthese,
+            func.ST_SnapToGrid(func.ST_Centroid(geom_3857), cell_size).label("geom"),
+        ]
+    else:
+        columns = [
+            VSyntheseForWebApp.id_synthese,
+            VSyntheseForWebApp.cd_nom,
+            func.coalesce(
+                func.nullif(VSyntheseForWebApp.nom_vern, ""), VSyntheseForWebApp.lb_nom
+            ).label("nom_vern_or_lb_nom"),
+            cast(VSyntheseForWebApp.date_min, Text).label("date_min"),
+            geom_3857.label("geom"),
+        ]
+    synthese_query_class = SyntheseQuery(
+        VSyntheseForWebApp, select(columns).where(in_tile), filters
+    )
+    observations = synthese_query_class.filter_query_all_filters(user).alias("obs")
+
+    mvt_geom = func.ST_AsMVTGeom(observations.c.geom, envelope, MVT_EXTENT, MVT_BUFFER, True)
+    if clustered:
+        tile = select(
+            [
+                mvt_geom.label("geom"),
+                func.count(observations.c.id_synthese).label("nb_obs"),
+            ]
+        ).group_by(observations.c.geom)
+    else:
+        tile = select(
+            [
+                mvt_geom.label("geom"),
+                observations.c.id_synthese,
+                observations.c.cd_nom,
+                observations.c.nom_vern_or_lb_nom,
+                observations.c.date_min,
+            ]
+        )
+    tile = tile.alias("tile")
+    return (
+        select([func.ST_AsMVT(literal_column("tile"), MVT_LAYER_NAME, MVT_EXTENT, "geom")])
+        .select_from(tile)
+        .where(tile.c.geom.isnot(None))
+    )
@@ -0,0 +1,277 @@
+"""
+    Calcul des altitudes dans le processus de l'API à partir d'une copie du MNT
+
+    La fonction ref_geo.fct_get_altitude_intersection découpe les tuiles de ref_geo.dem
+    (ST_Clip puis ST_DumpAsPolygons) à chaque appel.
+    La commande `geonature export_dem` exporte le MNT dans une grille NumPy
+    (var/dem/dem.npy et ses métadonnées var/dem/dem.json) ouverte en mémoire partagée
+    (mmap) par chaque processus de l'API : seules les pages lues sont chargées.
+    Si USE_DEM_SAMPLER est activé, les routes de ref_geo lisent les altitudes min/max
+    des pixels de la géométrie dans cette grille :
+        - point : pixel contenant le point
+        - ligne : pixels traversés par la ligne
+        - polygone : pixels dont le centre est dans le polygone (comme ST_Clip)
+    Les triggers de calcul d'altitude restent calculés par PostgreSQL.
+    NumPy est une dépendance optionnelle, nécessaire seulement si USE_DEM_SAMPLER est activé.
+"""
+import json
+import logging
+import math
+import os
+import threading
+
+from flask import current_app
+from sqlalchemy.sql import text
+
+from geonature.utils.env import DB, ROOT_DIR
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = logging.getLogger(__name__)
+
+DEM_DIR = ROOT_DIR / "var" / "dem"
+GRID_FILE = "dem.npy"
+METADATA_FILE = "dem.json"
+# nombre de lignes de pixels testées à la fois pour un polygone
+POLYGON_CHUNK_ROWS = 256
+# pas d'échantillonnage d'une ligne, en fraction de pixel
+LINE_SAMPLING_STEP = 0.25
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def pg_round(value):
+    """
+    Round half to even, as the cast of a double precision into an integer in PostgreSQL (rint)
+    """
+    return round(value)
+
+
+class DemSampler:
+    """
+    Altitude min/max of geometries read in a memory mapped grid of the DEM
+    (the geometries must be in the SRID of the DEM)
+    """
+
+    def __init__(self, grid, metadata):
+        self.grid = grid
+        self.upper_left_x = metadata["upper_left_x"]
+        self.upper_left_y = metadata["upper_left_y"]
+        self.scale_x = metadata["scale_x"]
+        self.scale_y = metadata["scale_y"]
+        self.srid = metadata["srid"]
+        self.height, self.width = grid.shape
+
+    @classmethod
+    def load(cls, directory=DEM_DIR):
+        with open(os.path.join(str(directory), METADATA_FILE)) as f:
+            metadata = json.load(f)
+        grid = np.load(os.path.join(str(directory), GRID_FILE), mmap_mode="r")
+        return cls(grid, metadata)
+
+    def _pixels(self, xs, ys):
+        cols = np.floor((np.asarray(xs) - self.upper_left_x) / self.scale_x).astype(np.int64)
+        rows = np.floor((np.asarray(ys) - self.upper_left_y) / self.scale_y).astype(np.int64)
+        inside = (cols >= 0) & (cols < self.width) & (rows >= 0) & (rows < self.height)
+        return rows[inside], cols[inside]
+
+    def _points_values(self, coords):
+        xs, ys = np.asarray(coords, dtype=np.float64)[:, :2].T
+        rows, cols = self._pixels(xs, ys)
+        return self.grid[rows, cols]
+
+    def _line_values(self, coords):
+        coords = np.asarray(coords, dtype=np.float64)[:, :2]
+        step = LINE_SAMPLING_STEP * min(abs(self.scale_x), abs(self.scale_y))
+        xs = [coords[:1, 0]]
+        ys = [coords[:1, 1]]
+        for (x0, y0), (x1, y1) in zip(coords[:-1], coords[1:]):
+            nb_samples = int(math.ceil(math.hypot(x1 - x0, y1 - y0) / step)) + 1
+            xs.append(np.linspace(x0, x1, nb_samples))
+            ys.append(np.linspace(y0, y1, nb_samples))
+        rows, cols = self._pixels(np.concatenate(xs), np.concatenate(ys))
+        # un pixel traversé plusieurs fois n'est lu qu'une fois
+        pixels = np.unique(rows * self.width + cols)
+        return self.grid[pixels // self.width, pixels % self.width]
+
+    def _polygon_values(self, polygon):
+        rings = [np.asarray(polygon.exterior.coords, dtype=np.float64)[:, :2]] + [
+            np.asarray(ring.coords, dtype=np.float64)[:, :2] for ring in polygon.interiors
+        ]
+        minx, miny, maxx, maxy = polygon.bounds
+        # fenêtre de pixels de l'emprise du polygone, bornée à la grille
+        col_min = max(0, int(math.floor((minx - self.upper_left_x) / self.scale_x)))
+        col_max = min(self.width - 1, int(math.floor((maxx - self.upper_left_x) / self.scale_x)))
+        row_min = max(0, int(math.floor((maxy - self.upper_left_y) / self.scale_y)))
+        row_max = min(self.height - 1, int(math.floor((miny - self.upper_left_y) / self.scale_y)))
+        if col_min > col_max or row_min > row_max:
+            return np.empty(0)
+        center_xs = self.upper_left_x + (np.arange(col_min, col_max + 1) + 0.5) * self.scale_x
+        values = []
+        for chunk_start in range(row_min, row_max + 1, POLYGON_CHUNK_ROWS):
+            chunk_end = min(chunk_start + POLYGON_CHUNK_ROWS, row_max + 1)
+            center_ys = (
+                self.upper_left_y + (np.arange(chunk_start, chunk_end) + 0.5) * self.scale_y
+            )
+            xs, ys = np.meshgrid(center_xs, center_ys)
+            # règle pair-impair sur tous les anneaux (les trous sont exclus)
+            inside = np.zeros(xs.shape, dtype=bool)
+            for ring in rings:
+                for (x0, y0), (x1, y1) in zip(ring[:-1], ring[1:]):
+                    if y0 == y1:
+                        continue
+                    crosses = (y0 > ys) != (y1 > ys)
+                    x_cross = x0 + (ys - y0) * (x1 - x0) / (y1 - y0)
+                    inside ^= crosses & (xs < x_cross)
+            window = self.grid[chunk_start:chunk_end, col_min : col_max + 1]
+            values.append(window[inside])
+        return np.concatenate(values) if values else np.empty(0)
+
+    def _values(self, geom):
+        geom_type = geom.geom_type
+        if geom_type == "Point":
+            return self._points_values(geom.coords)
+        if geom_type == "MultiPoint":
+            return self._points_values([p.coords[0] for p in geom.geoms])
+        if geom_type in ("LineString", "LinearRing"):
+            return self._line_values(geom.coords)
+        if geom_type == "Polygon":
+            return self._polygon_values(geom)
+        if geom_type.startswith("Multi") or geom_type == "GeometryCollection":
+            parts = [self._values(part) for part in geom.geoms]
+            return np.concatenate(parts) if parts else np.empty(0)
+        raise ValueError("Unsupported geometry type {}".format(geom_type))
+
+    def altitude(self, geom):
+        """
+        Return the altitude min/max of a shapely geometry (in the SRID of the DEM)
+        as fct_get_altitude_intersection: {altitude_min, altitude_max}, None without data
+        """
+        values = self._values(geom)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return {"altitude_min": None, "altitude_max": None}
+        return {
+            "altitude_min": pg_round(float(values.min())),
+            "altitude_max": pg_round(float(values.max())),
+        }
+
+
+def export_dem(directory=DEM_DIR, table="ref_geo.dem", connection=None):
+    """
+    Export the first band of a raster table (tiles of the same alignment and scale)
+    in a NumPy grid and its metadata. The files are replaced at the end of the export:
+    the processes of the API load the new grid at their next lookup
+
+    Returns:
+        tuple: (height, width) of the grid
+    """
+    if np is None:
+        raise RuntimeError("numpy is required to export the DEM")
+    if connection is None:
+        with DB.engine.connect() as connection:
+            return export_dem(directory, table, connection)
+    extent = connection.execute(
+        text(
+            """
+            SELECT
+                min(ST_UpperLeftX(rast)) AS xmin,
+                max(ST_UpperLeftY(rast)) AS ymax,
+                max(ST_UpperLeftX(rast) + ST_Width(rast) * ST_ScaleX(rast)) AS xmax,
+                min(ST_UpperLeftY(rast) + ST_Height(rast) * ST_ScaleY(rast)) AS ymin,
+                min(ST_ScaleX(rast)) AS scale_x,
+                max(ST_ScaleY(rast)) AS scale_y,
+                min(ST_SRID(rast)) AS srid
+            FROM {}
+            """.format(
+                table
+            )
+        )
+    ).first()
+    if extent.xmin is None:
+        raise ValueError("The raster table {} is empty".format(table))
+    width = int(round((extent.xmax - extent.xmin) / extent.scale_x))
+    height = int(round((extent.ymin - extent.ymax) / extent.scale_y))
+
+    directory = str(directory)
+    os.makedirs(directory, exist_ok=True)
+    grid_path = os.path.join(directory, GRID_FILE)
+    grid = np.lib.format.open_memmap(
+        grid_path + ".tmp.npy", mode="w+", dtype=np.float32, shape=(height, width)
+    )
+    grid[:] = np.nan
+    # valeurs des pixels (NULL pour les pixels sans donnée) tuile par tuile
+    tiles = connection.execution_options(stream_results=True).execute(
+        text(
+            """
+            SELECT ST_UpperLeftX(rast) AS x, ST_UpperLeftY(rast) AS y,
+                ST_DumpValues(rast, 1) AS tile_values
+            FROM {}
+            """.format(
+                table
+            )
+        )
+    )
+    for tile in tiles:
+        values = np.array(tile.tile_values, dtype=np.float32)
+        row = int(round((tile.y - extent.ymax) / extent.scale_y))
+        col = int(round((tile.x - extent.xmin) / extent.scale_x))
+        grid[row : row + values.shape[0], col : col + values.shape[1]] = values
+    grid.flush()
+    del grid
+    os.replace(grid_path + ".tmp.npy", grid_path)
+
+    metadata_path = os.path.join(directory, METADATA_FILE)
+    with open(metadata_path + ".tmp", "w") as f:
+        json.dump(
+            {
+                "upper_left_x": extent.xmin,
+                "upper_left_y": extent.ymax,
+                "scale_x": extent.scale_x,
+                "scale_y": extent.scale_y,
+                "srid": extent.srid,
+            },
+            f,
+        )
+    os.replace(metadata_path + ".tmp", metadata_path)
+    return height, width
+
+
+def metadata_mtime():
+    """
+    Modification date of the exported DEM (None if it has not been exported)
+    """
+    try:
+        return os.path.getmtime(str(DEM_DIR / METADATA_FILE))
+    except OSError:
+        return None
+
+
+def get_sampler():
+    """
+    Return the DEM sampler of the current process
+    (None if USE_DEM_SAMPLER is disabled or the DEM has not been exported)
+    """
+    global _sampler
+    if not current_app.config.get("USE_DEM_SAMPLER", False):
+        return None
+    mtime = metadata_mtime()
+    sampler = _sampler
+    if sampler is not None and sampler[0] == mtime:
+        return sampler[1]
+    with _sampler_lock:
+        if _sampler is not None and _sampler[0] == mtime:
+            return _sampler[1]
+        if mtime is None or np is None:
+            log.warning(
+                "USE_DEM_SAMPLER is enabled but %s: the altitudes are computed by PostgreSQL",
+                "numpy is not installed" if np is None else "the DEM has not been exported",
+            )
+            _sampler = (mtime, None)
+        else:
+            _sampler = (mtime, DemSampler.load())
+        return _sampler[1]
@@ -4,6 +4,8 @@ from sqlalchemy.sql import text
 from geonature.utils.env import DB
 from utils_flask_sqla.response import json_resp
 from geonature.core.ref_geo.models import BibAreasTypes, LiMunicipalities, LAreas
+from geonature.core.ref_geo.utils import get_geo_info, get_altitude
+from geonature.utils.errors import GeonatureApiError
 
 routes = Blueprint("ref_geo", __name__)
 
@@ -18,39 +20,28 @@ def getGeoInfo():
     .. :quickref: Ref Geo;
     """
     data = dict(request.get_json())
-    sql = text(
-        """SELECT (ref_geo.fct_get_area_intersection(
-        st_setsrid(ST_GeomFromGeoJSON(:geom),4326), :id_type)).*"""
-    )
-    try:
-        result = DB.engine.execute(
-            sql, geom=str(data["geometry"]), id_type=data.get("id_type", None),
-        )
-    except Exception as e:
-        DB.session.rollback()
-        raise
+    return get_geo_info({0: data["geometry"]}, data.get("id_type", None))[0]
 
-    municipality = []
-    for row in result:
-        municipality.append(
-            {"id_area": row[0], "id_type": row[1], "area_code": row[2], "area_name": row[3],}
-        )
 
-    sql = text(
-        """SELECT (ref_geo.fct_get_altitude_intersection(
-        st_setsrid(ST_GeomFromGeoJSON(:geom),4326))).*
-        """
-    )
-    try:
-        result = DB.engine.execute(sql, geom=str(data["geometry"]))
-    except Exception as e:
-        DB.session.rollback()
-        raise
-    alt = {}
-    for row in result:
-        alt = {"altitude_min": row[0], "altitude_max": row[1]}
+@routes.route("/info/batch", methods=["POST"])
+@json_resp
+def getGeoInfoBatch():
+    """
+    From a list of posted geojson geometries, the route return for each one
+    the areas intersected and the altitude min/max, computed in one query.
+    The body is {"id_type": <optional>, "geometries": [{"id": <id>, "geometry": <geojson>}]}
+    and the result is keyed by the ids of the geometries
 
-    return {"areas": municipality, "altitude": alt}
+    .. :quickref: Ref Geo;
+    """
+    data = dict(request.get_json())
+    try:
+        geometries = {g["id"]: g["geometry"] for g in data["geometries"]}
+    except (KeyError, TypeError):
+        raise GeonatureApiError(
+            "geometries must be a list of objects with an id and a geometry", 400
+        )
+    return get_geo_info(geometries, data.get("id_type", None))
 
 
 @routes.route("/altitude", methods=["POST"])
@@ -62,22 +53,7 @@ def getaltitide():
     .. :quickref: Ref Geo;
     """
     data = dict(request.get_json())
-
-    sql = text(
-        """SELECT (ref_geo.fct_get_altitude_intersection(
-        st_setsrid(ST_GeomFromGeoJSON(:geom),4326))).*
-        """
-    )
-    try:
-        result = DB.engine.execute(sql, geom=str(data["geometry"]))
-    except Exception as e:
-        DB.session.rollback()
-        raise
-    alt = {}
-    for row in result:
-        alt = {"altitude_min": row[0], "altitude_max": row[1]}
-
-    return alt
+    return get_altitude(data["geometry"])
 
 
 @routes.route("/areas", methods=["POST"])
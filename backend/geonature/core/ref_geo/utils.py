@@ -0,0 +1,235 @@
+"""
+    Intersection de géométries avec le référentiel géographique
+    (zonages de ref_geo.l_areas et altitudes du MNT)
+
+    Les zonages et altitudes de plusieurs géométries sont calculés par une seule requête.
+    Les altitudes sont lues dans le MNT exporté localement si USE_DEM_SAMPLER est activé
+    (cf geonature.core.ref_geo.dem).
+    Les résultats sont gardés par chaque processus de l'API dans un cache LRU
+    dont la clé est le hash du WKB de la géométrie normalisée (coordonnées arrondies),
+    le type de zonage demandé et la source des altitudes (USE_DEM_SAMPLER et date de l'export
+    du MNT) : le même point saisi plusieurs fois n'est calculé qu'une fois.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from shapely import wkb
+from shapely.geometry import shape
+from shapely.ops import transform
+from sqlalchemy.sql import text
+
+from geonature.utils.env import DB
+from geonature.utils.errors import GeonatureApiError
+from geonature.core.ref_geo.dem import get_sampler, metadata_mtime
+
+# nombre de décimales gardées pour les coordonnées (en degrés : environ 1 mm)
+COORDINATES_PRECISION = 8
+# nombre maximal de géométries d'une requête
+MAX_GEOMETRIES = 1000
+
+# zonages et altitudes des géométries ; avec le MNT local (USE_DEM_SAMPLER), la requête
+# renvoie la géométrie dans la projection du MNT au lieu de l'altitude
+# (projection locale lue dans gn_commons.t_parameters, comme ref_geo.fct_get_area_intersection)
+GEO_INFO_QUERY = """
+    WITH i AS (
+        SELECT
+            i.geom_key,
+            public.st_setsrid(public.st_geomfromwkb(decode(i.wkb, 'hex')), 4326) AS geom
+        FROM unnest(CAST(:keys AS text[]), CAST(:wkbs AS text[])) AS i(geom_key, wkb)
+    ),
+    g AS (
+        SELECT
+            i.geom_key,
+            i.geom,
+            public.st_transform(
+                i.geom, CAST(gn_commons.get_default_parameter('local_srid', NULL) AS integer)
+            ) AS geom_local
+        FROM i
+    )
+    SELECT
+        g.geom_key,
+        (
+            SELECT json_agg(json_build_object(
+                'id_area', a.id_area,
+                'id_type', a.id_type,
+                'area_code', a.area_code,
+                'area_name', a.area_name
+            ))
+            FROM ref_geo.l_areas a
+            WHERE public.st_intersects(g.geom_local, a.geom)
+                AND (CAST(:id_type AS integer) IS NULL OR a.id_type = :id_type)
+                AND a.enable = true
+        ) AS areas,
+        {altitude}
+    FROM g
+    {altitude_join}
+"""
+ALTITUDE_COLUMNS = "alt.altitude_min, alt.altitude_max"
+ALTITUDE_JOIN = "LEFT JOIN LATERAL ref_geo.fct_get_altitude_intersection(g.geom) alt ON true"
+DEM_GEOM_COLUMN = "public.st_asbinary(public.st_transform(g.geom, :dem_srid)) AS geom_dem"
+
+
+class GeoInfoCache:
+    """
+    LRU cache of the areas and altitudes of the geometries, shared by the threads of a process
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, max_size):
+        if max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+geo_info_cache = GeoInfoCache()
+
+
+def _round_coordinates(*coordinates):
+    return tuple(
+        tuple(round(value, COORDINATES_PRECISION) for value in values) for values in coordinates
+    )
+
+
+def normalize_geometry(geometry):
+    """
+    Return the WKB (hex) of a GeoJSON geometry (dict or string) with rounded coordinates
+
+    Raises:
+        GeonatureApiError: the geometry is not a valid GeoJSON geometry
+    """
+    try:
+        if isinstance(geometry, str):
+            geometry = json.loads(geometry)
+        geom = transform(_round_coordinates, shape(geometry))
+    except Exception as e:
+        raise GeonatureApiError("Invalid geometry: {}".format(e), 400)
+    return wkb.dumps(geom, hex=True)
+
+
+def altitude_source():
+    """
+    Source of the altitudes: PostgreSQL or the DEM exported at a given date
+    (the altitudes cached before a new export of the DEM are not used)
+    """
+    if not current_app.config.get("USE_DEM_SAMPLER", False):
+        return "db"
+    return "dem{}".format(metadata_mtime() or "")
+
+
+def cache_key(geom_wkb, id_type=None, source=""):
+    return "{}:{}:{}".format(hashlib.sha1(geom_wkb.encode()).hexdigest(), id_type or "", source)
+
+
+def _query_geo_info(geometries, id_type=None):
+    """
+    Compute the areas and the altitudes of the geometries in one query
+
+    Parameters:
+        geometries (dict): {cache key: WKB (hex) of the geometry}
+    Returns:
+        dict: {cache key: {"areas": [...], "altitude": {...}}}
+    """
+    sampler = get_sampler()
+    if sampler is None:
+        query = GEO_INFO_QUERY.format(altitude=ALTITUDE_COLUMNS, altitude_join=ALTITUDE_JOIN)
+    else:
+        query = GEO_INFO_QUERY.format(altitude=DEM_GEOM_COLUMN, altitude_join="")
+    keys = list(geometries)
+    result = DB.engine.execute(
+        text(query),
+        keys=keys,
+        wkbs=[geometries[key] for key in keys],
+        id_type=id_type,
+        dem_srid=sampler.srid if sampler else None,
+    )
+    geo_info = {}
+    for row in result:
+        if sampler is None:
+            altitude = {"altitude_min": row.altitude_min, "altitude_max": row.altitude_max}
+        else:
+            altitude = sampler.altitude(wkb.loads(bytes(row.geom_dem)))
+        geo_info[row.geom_key] = {"areas": row.areas or [], "altitude": altitude}
+    return geo_info
+
+
+def get_altitude(geometry):
+    """
+    Return the altitude min/max of a GeoJSON geometry: {altitude_min, altitude_max}
+    """
+    sampler = get_sampler()
+    if sampler is None:
+        result = DB.engine.execute(
+            text(
+                """SELECT (ref_geo.fct_get_altitude_intersection(
+                st_setsrid(ST_GeomFromWKB(decode(:wkb, 'hex')), 4326))).*"""
+            ),
+            wkb=normalize_geometry(geometry),
+        ).first()
+        if result is None:
+            return {}
+        return {"altitude_min": result[0], "altitude_max": result[1]}
+    geom_dem = DB.engine.execute(
+        text(
+            """SELECT ST_AsBinary(ST_Transform(
+            st_setsrid(ST_GeomFromWKB(decode(:wkb, 'hex')), 4326), :dem_srid))"""
+        ),
+        wkb=normalize_geometry(geometry),
+        dem_srid=sampler.srid,
+    ).scalar()
+    return sampler.altitude(wkb.loads(bytes(geom_dem)))
+
+
+def get_geo_info(geometries, id_type=None):
+    """
+    Return the areas intersected by each geometry and its altitude min/max
+
+    Parameters:
+        geometries (dict): {id: GeoJSON geometry}
+        id_type (int): only return the areas of this type
+    Returns:
+        dict: {id: {"areas": [{id_area, id_type, area_code, area_name}],
+            "altitude": {altitude_min, altitude_max}}}
+    """
+    if len(geometries) > MAX_GEOMETRIES:
+        raise GeonatureApiError("Too many geometries (maximum {})".format(MAX_GEOMETRIES), 400)
+    keys = {}
+    missing = {}
+    results = {}
+    source = altitude_source()
+    for id_geom, geometry in geometries.items():
+        geom_wkb = normalize_geometry(geometry)
+        key = cache_key(geom_wkb, id_type, source)
+        keys[id_geom] = key
+        cached = geo_info_cache.get(key)
+        if cached is not None:
+            results[key] = cached
+        else:
+            missing[key] = geom_wkb
+    if missing:
+        computed = _query_geo_info(missing, id_type)
+        max_size = current_app.config.get("GEO_INFO_CACHE_SIZE", 0)
+        for key, value in computed.items():
+            geo_info_cache.set(key, value, max_size)
+        results.update(computed)
+    return {id_geom: results[key] for id_geom, key in keys.items()}
@@ -90,6 +90,67 @@ class ServerConfig(Schema):
 class MediasConfig(Schema):
     MEDIAS_SIZE_MAX = fields.Integer(missing=50000)
     THUMBNAIL_SIZES = fields.List(fields.Integer, missing=[200, 50])
+    # nombre de processus de création des thumbnails de chaque processus de l'API
+    THUMBNAIL_NB_PROCESSES = fields.Integer(missing=2)
+    # nombre max de créations de thumbnails en attente (au-delà, ils sont créés à l'affichage)
+    THUMBNAIL_MAX_PENDING = fields.Integer(missing=200)
+    # durée max (en secondes) d'attente de la création d'un thumbnail affiché
+    THUMBNAIL_TIMEOUT = fields.Integer(missing=60)
+    # durée (en secondes) de mise en cache des thumbnails par les navigateurs
+    THUMBNAIL_CACHE_MAX_AGE = fields.Integer(missing=3600)
+    # durée max (en secondes) du parcours des fichiers par la synchronisation des médias
+    # lancée après l'ajout ou la suppression d'un média (0 pour ne pas la limiter)
+    SYNC_TIME_BUDGET = fields.Integer(missing=2)
+
+
+class ExportJobsConfig(Schema):
+    # nombre de processus du pool d'export de chaque processus de l'API
+    NB_PROCESSES = fields.Integer(missing=2)
+    # nombre max d'exports exécutés en même temps (tous processus confondus)
+    MAX_RUNNING_JOBS = fields.Integer(missing=4)
+    # nombre max de lignes d'un export en tâche de fond
+    NB_MAX_ROWS = fields.Integer(missing=1000000)
+    # répertoire des fichiers exportés (relatif à BASE_DIR)
+    EXPORT_DIR = fields.String(missing="static/exports/jobs")
+    # durée de conservation (en jours) des exports et de leurs fichiers
+    RETENTION_DAYS = fields.Integer(missing=2)
+    # durée (en secondes) au-delà de laquelle un export en cours est considéré interrompu
+    TIMEOUT = fields.Integer(missing=3600 * 6)
+
+
+class MtdSyncConfig(Schema):
+    # nombre de requêtes simultanées au webservice MTD
+    NB_THREADS = fields.Integer(missing=4)
+    # délai (en secondes) de réponse du webservice MTD
+    TIMEOUT = fields.Integer(missing=30)
+    # délai minimal (en secondes) entre deux synchronisations d'un utilisateur
+    # lancées par la consultation des métadonnées
+    USER_SYNC_INTERVAL = fields.Integer(missing=3600)
+    # utilisateurs synchronisés par la commande `geonature sync_mtd` :
+    # ceux ayant consulté les métadonnées depuis ce nombre de jours
+    ACTIVE_USER_DAYS = fields.Integer(missing=30)
+
+
+class PdfExportsConfig(Schema):
+    # nombre de processus de rendu des PDF de chaque processus de l'API
+    NB_PROCESSES = fields.Integer(missing=2)
+    # délai max (en secondes) du rendu d'un PDF
+    TIMEOUT = fields.Integer(missing=120)
+    # durée de conservation (en jours) des PDF non demandés
+    RETENTION_DAYS = fields.Integer(missing=7)
+
+
+class QueryStatsConfig(Schema):
+    # mesure de la durée des requêtes des routes de la synthèse, de la validation et des exports
+    ENABLED = fields.Boolean(missing=False)
+    # durée (en ms) au-delà de laquelle une requête est lente (plan EXPLAIN enregistré)
+    SLOW_QUERY_MS = fields.Integer(missing=1000)
+    # délai minimal (en secondes) entre deux plans d'une même route et combinaison de filtres
+    EXPLAIN_INTERVAL = fields.Integer(missing=3600)
+    # nombre de plans gardés par route et combinaison de filtres
+    MAX_SAMPLES = fields.Integer(missing=5)
+    # délai (en secondes) entre deux enregistrements en base des durées mesurées
+    FLUSH_INTERVAL = fields.Integer(missing=60)
 
 
 class MetadataConfig(Schema):
@@ -115,6 +176,15 @@ class GnPySchemaConf(Schema):
     COOKIE_EXPIRATION = fields.Integer(missing=3600 * 24 * 7)
     COOKIE_AUTORENEW = fields.Boolean(missing=True)
     TRAP_ALL_EXCEPTIONS = fields.Boolean(missing=False)
+    # durée (en secondes) de mise en cache des permissions et des JDD autorisés d'un rôle
+    # (0 pour désactiver)
+    PERMISSIONS_CACHE_TTL = fields.Integer(missing=60)
+    # nombre de géométries dont les zonages et altitudes (routes /geo/info et /geo/info/batch)
+    # sont gardés en cache par chaque processus (0 pour désactiver)
+    GEO_INFO_CACHE_SIZE = fields.Integer(missing=10000)
+    # altitudes des routes de ref_geo lues dans le MNT exporté par `geonature export_dem`
+    # (nécessite numpy) au lieu de ref_geo.fct_get_altitude_intersection
+    USE_DEM_SAMPLER = fields.Boolean(missing=False)
 
     UPLOAD_FOLDER = fields.String(missing="static/medias")
     BASE_DIR = fields.String(
@@ -128,6 +198,10 @@ class GnPySchemaConf(Schema):
     USERSHUB = fields.Nested(UsersHubConfig, missing={})
     SERVER = fields.Nested(ServerConfig, missing={})
     MEDIAS = fields.Nested(MediasConfig, missing={})
+    EXPORT_JOBS = fields.Nested(ExportJobsConfig, missing={})
+    MTD_SYNC = fields.Nested(MtdSyncConfig, missing={})
+    PDF_EXPORTS = fields.Nested(PdfExportsConfig, missing={})
+    QUERY_STATS = fields.Nested(QueryStatsConfig, missing={})
 
     @post_load()
     def unwrap_usershub(self, data):
@@ -222,6 +296,21 @@ class Synthese(Schema):
     NB_MAX_OBS_MAP = fields.Integer(missing=50000)
     # clusteriser les layers sur la carte
     ENABLE_LEAFLET_CLUSTER = fields.Boolean(missing=True)
+    # Tuiles vectorielles (route /synthese/tiles/<z>/<x>/<y>.mvt) :
+    # zoom maximum jusqu'auquel les observations sont regroupées côté serveur
+    MVT_CLUSTER_MAX_ZOOM = fields.Integer(missing=11)
+    # nombre de cellules de regroupement sur le côté d'une tuile
+    MVT_CLUSTER_GRID = fields.Integer(missing=64)
+    # Autocomplétion des taxons (route /synthese/taxons_autocomplete) :
+    # durée (en secondes) entre deux mises à jour de l'index en mémoire des taxons
+    # présents dans la synthèse (0 pour chercher directement en base)
+    TAXONS_AUTOCOMPLETE_REFRESH = fields.Integer(missing=300)
+    # Export des statuts de protection (route /synthese/export_statuts) : durée (en secondes)
+    # entre deux lectures des tables de protection gardées en mémoire (0 : à chaque export)
+    PROTECTION_CACHE_REFRESH = fields.Integer(missing=3600)
+    # Statistiques de la synthèse : durée (en secondes) minimale entre deux recalculs
+    # en tâche de fond des JDD modifiés (0 : uniquement par la commande refresh_synthese_stats)
+    STATS_REFRESH_INTERVAL = fields.Integer(missing=300)
     # Nombre max d'observation dans les exports
     NB_MAX_OBS_EXPORT = fields.Integer(missing=50000)
     # Nombre des "dernières observations" affiché à l'arrive sur la synthese
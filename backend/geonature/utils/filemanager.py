@@ -82,10 +82,21 @@ def delete_recursively(path_folder, period=1, excluded_files=[]):
             log.error(e)
 
 
+def write_pdf(html, file_abs_path):
+    """
+    Write a rendered template as a pdf file
+    (without the Flask context: can be run by a process pool)
+    The file is written then renamed: a pdf is never read half written
+    """
+    html_file = HTML(string=html, base_url=__file__, encoding="utf-8")
+    tmp_path = "{}.{}.tmp".format(file_abs_path, os.getpid())
+    html_file.write_pdf(tmp_path)
+    os.replace(tmp_path, file_abs_path)
+    return file_abs_path
+
+
 def generate_pdf(template, data, filename):
     delete_recursively(str(BACKEND_DIR) + "/static/pdf/")
     template_rendered = render_template(template, data=data)
-    html_file = HTML(string=template_rendered, base_url=__file__, encoding="utf-8")
     file_abs_path = str(BACKEND_DIR) + "/static/pdf/" + filename
-    html_file.write_pdf(file_abs_path)
-    return file_abs_path
+    return write_pdf(template_rendered, file_abs_path)
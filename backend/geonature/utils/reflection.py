@@ -0,0 +1,73 @@
+"""
+    Registre des tables/vues reflétées (GenericTable, GenericTableGeo)
+
+    La création d'un GenericTable reflète le schéma de la base de données :
+    le registre garde les objets créés pour tout le processus
+    afin que cette rétro-ingénierie ne soit faite qu'une fois par relation.
+
+    Après une modification d'une vue (ajout d'une colonne à une vue d'export...)
+    lancer `geonature refresh_generic_tables` : les processus de l'API
+    reflètent à nouveau les relations à leur prochaine utilisation.
+"""
+import os
+import threading
+import time
+
+from geonature.utils.env import ROOT_DIR
+
+# fichier dont la date de modification indique la dernière demande de rafraîchissement
+REFRESH_MARKER_FILE = ROOT_DIR / "var" / "generic_tables.refresh"
+
+# {(class, args): (generic_table, load_time)}
+_GENERIC_TABLES = {}
+_GENERIC_TABLES_LOCK = threading.Lock()
+
+
+def _last_refresh_time():
+    try:
+        return os.path.getmtime(str(REFRESH_MARKER_FILE))
+    except OSError:
+        return 0
+
+
+def get_generic_table(generic_table_class, **kwargs):
+    """
+    Return the `generic_table_class` object (GenericTable, GenericTableGeo...)
+    built with `kwargs`, from the registry of the process if it exists
+
+    Ex:
+        export_view = get_generic_table(
+            GenericTableGeo,
+            tableName="v_synthese_for_export",
+            schemaName="gn_synthese",
+            engine=DB.engine,
+            geometry_field=None,
+            srid=current_app.config["LOCAL_SRID"],
+        )
+    """
+    key = (generic_table_class, tuple(sorted(kwargs.items())))
+    cached = _GENERIC_TABLES.get(key)
+    if cached is not None and cached[1] >= _last_refresh_time():
+        return cached[0]
+    load_time = time.time()
+    generic_table = generic_table_class(**kwargs)
+    with _GENERIC_TABLES_LOCK:
+        _GENERIC_TABLES[key] = (generic_table, load_time)
+    return generic_table
+
+
+def clear_generic_tables():
+    """
+    Empty the registry of the current process
+    """
+    with _GENERIC_TABLES_LOCK:
+        _GENERIC_TABLES.clear()
+
+
+def refresh_generic_tables():
+    """
+    Ask all the processes (API, export jobs...) to reflect again the generic tables
+    """
+    REFRESH_MARKER_FILE.parent.mkdir(parents=True, exist_ok=True)
+    REFRESH_MARKER_FILE.touch()
+    clear_generic_tables()
@@ -1,6 +1,9 @@
-import ast
 import datetime
+import json
 import logging
+import os
+import shutil
+import tempfile
 import zipfile
 
 from collections import OrderedDict
@@ -43,80 +46,84 @@ class FionaShapeService:
     """
     Service to create shapefiles from sqlalchemy models
 
+    All the state (open files, flags) belong to the instance and the files
+    are written in a temporary directory owned by the instance:
+    several exports can run at the same time in threads and workers.
+
     How to use:
-    FionaShapeService.create_shapes_struct(**args)
-    FionaShapeService.create_features(**args)
-    FionaShapeService.save_and_zip_shapefiles()
+    with FionaShapeService(**args) as shape_service:
+        shape_service.create_features_generic(**args)
+        zip_path = shape_service.save_and_zip_shapefiles()
     """
 
-    @classmethod
-    def create_shapes_struct(cls, db_cols, srid, dir_path, file_name, col_mapping=None):
+    def __init__(self, db_cols, srid, file_name, dir_path=None, col_mapping=None):
         """
-        Create three shapefiles (point, line, polygon) with the attributes give by db_cols
+        Prepare three shapefiles (point, line, polygon) with the attributes give by db_cols
+        The files are only created when the first feature of their type is written
+
         Parameters:
             db_cols (list): columns from a SQLA model (model.__mapper__.c)
             srid (int): epsg code
-            dir_path (str): directory path
             file_name (str): file of the shapefiles
+            dir_path (str): parent directory of the temporary directory
+                (default: the system temp directory)
             col_mapping (dict): mapping between SQLA class attributes and 'beatifiul' columns name
-
-        Returns:
-            void
         """
         log.warning(
             "WARNING: utilsgemetry will soon be removed from GeoNature.\nPlease use utils_flask_sqla_geo instead\n"
         )
-        cls.db_cols = db_cols
-        cls.source_crs = from_epsg(srid)
-        cls.dir_path = dir_path
-        cls.file_name = file_name
+        self.db_cols = db_cols
+        self.source_crs = from_epsg(srid)
+        self.file_name = file_name
+        self.dir_path = tempfile.mkdtemp(prefix="gn_shapefiles_", dir=dir_path)
 
-        cls.columns = []
+        self.columns = []
         # if we want to change to columns name of the SQLA class
         # in the export shapefiles structures
         shp_properties = OrderedDict()
-        if col_mapping:
-            for db_col in db_cols:
-                if not db_col.type.__class__.__name__ == "Geometry":
-                    shp_properties.update(
-                        {
-                            col_mapping.get(db_col.key): FIONA_MAPPING.get(
-                                db_col.type.__class__.__name__.lower()
-                            )
-                        }
-                    )
-                    cls.columns.append(col_mapping.get(db_col.key))
-        else:
-            for db_col in db_cols:
-                if not db_col.type.__class__.__name__ == "Geometry":
-                    shp_properties.update(
-                        {db_col.key: FIONA_MAPPING.get(db_col.type.__class__.__name__.lower())}
-                    )
-                    cls.columns.append(db_col.key)
-
-        cls.polygon_schema = {"geometry": "MultiPolygon", "properties": shp_properties}
-        cls.point_schema = {"geometry": "Point", "properties": shp_properties}
-        cls.polyline_schema = {"geometry": "LineString", "properties": shp_properties}
-
-        cls.file_point = cls.dir_path + "/POINT_" + cls.file_name
-        cls.file_poly = cls.dir_path + "/POLYGON_" + cls.file_name
-        cls.file_line = cls.dir_path + "/POLYLINE_" + cls.file_name
-        # boolean to check if features are register in the shapefile
-        cls.point_feature = False
-        cls.polygon_feature = False
-        cls.polyline_feature = False
-        cls.point_shape = fiona.open(
-            cls.file_point, "w", "ESRI Shapefile", cls.point_schema, crs=cls.source_crs
-        )
-        cls.polygone_shape = fiona.open(
-            cls.file_poly, "w", "ESRI Shapefile", cls.polygon_schema, crs=cls.source_crs
-        )
-        cls.polyline_shape = fiona.open(
-            cls.file_line, "w", "ESRI Shapefile", cls.polyline_schema, crs=cls.source_crs,
-        )
+        for db_col in db_cols:
+            if not db_col.type.__class__.__name__ == "Geometry":
+                col_name = col_mapping.get(db_col.key) if col_mapping else db_col.key
+                shp_properties.update(
+                    {col_name: FIONA_MAPPING.get(db_col.type.__class__.__name__.lower())}
+                )
+                self.columns.append(col_name)
+
+        self.schemas = {
+            "POINT": {"geometry": "Point", "properties": shp_properties},
+            "POLYGON": {"geometry": "MultiPolygon", "properties": shp_properties},
+            "POLYLINE": {"geometry": "LineString", "properties": shp_properties},
+        }
+        # opened fiona collections by shape format
+        self.shapes = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close_files()
+        # on error the temporary files are useless
+        if exc_type is not None:
+            self.delete_files()
+
+    def get_shape(self, shape_format):
+        """
+        Return the fiona collection of the shape format (POINT, POLYGON, POLYLINE)
+        Open it at the first call
+        """
+        shape = self.shapes.get(shape_format)
+        if shape is None:
+            shape = fiona.open(
+                "{}/{}_{}.shp".format(self.dir_path, shape_format, self.file_name),
+                "w",
+                "ESRI Shapefile",
+                self.schemas[shape_format],
+                crs=self.source_crs,
+            )
+            self.shapes[shape_format] = shape
+        return shape
 
-    @classmethod
-    def create_feature(cls, data, geom):
+    def create_feature(self, data, geom):
         """
         Create a feature (a record of the shapefile) for the three shapefiles
         by serializing an SQLAlchemy object
@@ -136,22 +143,22 @@ class FionaShapeService:
             geom_wkt = to_shape(geom)
             geom_geojson = mapping(geom_wkt)
             feature = {"geometry": geom_geojson, "properties": data}
-            cls.write_a_feature(feature, geom_wkt)
+            self.write_a_feature(feature, geom_geojson["type"])
         except AssertionError:
-            cls.close_files()
+            self.close_files()
             raise GeonatureApiError("Cannot create a shapefile record whithout a Geometry")
         except Exception as e:
-            cls.close_files()
+            self.close_files()
             raise GeonatureApiError(e)
 
-    @classmethod
-    def create_features_generic(cls, view, data, geom_col, geojson_col=None):
+    def create_features_generic(self, view, data, geom_col, geojson_col=None):
         """
         Create the features of the shapefiles by serializing the datas from a GenericTable (non mapped table)
 
         Parameters:
             view (GenericTable): the GenericTable object
-            data (list): Array of SQLA model
+            data (iterable): SQLA rows - could be a server side cursor (Query.yield_per)
+                the rows are written one by one and never kept in memory
             geom_col (str): name of the WKB geometry column of the SQLA Model
             geojson_col (str): name of the geojson column if present. If None create the geojson from geom_col with shapely
                                for performance reason its better to use geojson_col rather than geom_col
@@ -163,107 +170,93 @@ class FionaShapeService:
         log.warning(
             "WARNING: utilsgemetry will soon be removed from GeoNature.\nPlease use utils_flask_sqla_geo instead\n"
         )
-        # if the geojson col is not given
-        # build it with shapely via the WKB col
-        if geojson_col is None:
-            for d in data:
-                geom = getattr(d, geom_col)
-                geom_wkt = to_shape(geom)
-                geom_geojson = mapping(geom_wkt)
-                feature = {
-                    "geometry": geom_geojson,
-                    "properties": view.as_dict(d, columns=cls.columns),
-                }
-                cls.write_a_feature(feature, geom_wkt)
-        else:
-            for d in data:
-                geom_geojson = ast.literal_eval(getattr(d, geojson_col))
-                feature = {
-                    "geometry": geom_geojson,
-                    "properties": view.as_dict(d, columns=cls.columns),
-                }
-                if geom_geojson["type"] == "Point":
-                    cls.point_shape.write(feature)
-                    cls.point_feature = True
-                elif geom_geojson["type"] == "Polygon" or geom_geojson["type"] == "MultiPolygon":
-                    cls.polygone_shape.write(feature)
-                    cls.polygon_feature = True
-                else:
-                    cls.polyline_shape.write(feature)
-                    cls.polyline_feature = True
-
-    @classmethod
-    def write_a_feature(cls, feature, geom_wkt):
+        for d in data:
+            # if the geojson col is not given
+            # build it with shapely via the WKB col
+            if geojson_col is None:
+                geom_geojson = mapping(to_shape(getattr(d, geom_col)))
+            else:
+                geom_geojson = json.loads(getattr(d, geojson_col))
+            feature = {
+                "geometry": geom_geojson,
+                "properties": view.as_dict(d, columns=self.columns),
+            }
+            self.write_a_feature(feature, geom_geojson["type"])
+
+    def write_a_feature(self, feature, geom_type):
         """
-            write a feature by checking the type of the shape given
+            write a feature in the shapefile matching its geometry type
         """
-        log.warning(
-            "WARNING: utilsgemetry will soon be removed from GeoNature.\nPlease use utils_flask_sqla_geo instead\n"
-        )
-        if isinstance(geom_wkt, Point):
-            cls.point_shape.write(feature)
-            cls.point_feature = True
-        elif isinstance(geom_wkt, Polygon) or isinstance(geom_wkt, MultiPolygon):
-            cls.polygone_shape.write(feature)
-            cls.polygon_feature = True
+        if geom_type == "Point":
+            self.get_shape("POINT").write(feature)
+        elif geom_type in ("Polygon", "MultiPolygon"):
+            self.get_shape("POLYGON").write(feature)
         else:
-            cls.polyline_shape.write(feature)
-            cls.polyline_feature = True
+            self.get_shape("POLYLINE").write(feature)
 
-    @classmethod
-    def save_and_zip_shapefiles(cls):
+    def save_and_zip_shapefiles(self):
         """
         Save and zip the files
         Only zip files where there is at least on feature
+        Each shapefile is added to the archive as soon as it is closed
+        (the headers of a shapefile are only written on close)
 
         Returns:
-            void
+            str: path of the zip file
         """
         log.warning(
             "WARNING: utilsgemetry will soon be removed from GeoNature.\nPlease use utils_flask_sqla_geo instead\n"
         )
-        cls.close_files()
-
-        format_to_save = []
-        if cls.point_feature:
-            format_to_save = ["POINT"]
-        if cls.polygon_feature:
-            format_to_save.append("POLYGON")
-        if cls.polyline_feature:
-            format_to_save.append("POLYLINE")
-
-        zip_path = cls.dir_path + "/" + cls.file_name + ".zip"
-        zp_file = zipfile.ZipFile(zip_path, mode="w")
-
-        for shape_format in format_to_save:
-            final_file_name = cls.dir_path + "/" + shape_format + "_" + cls.file_name
-            final_file_name = "{dir_path}/{shape_format}_{file_name}/{shape_format}_{file_name}".format(
-                dir_path=cls.dir_path, shape_format=shape_format, file_name=cls.file_name,
-            )
-            extentions = ("dbf", "shx", "shp", "prj")
-            for ext in extentions:
-                zp_file.write(
-                    final_file_name + "." + ext, shape_format + "_" + cls.file_name + "." + ext,
-                )
-        zp_file.close()
-
-    @classmethod
-    def close_files(cls):
+        zip_path = "{}/{}.zip".format(self.dir_path, self.file_name)
+        with zipfile.ZipFile(zip_path, mode="w", compression=zipfile.ZIP_DEFLATED) as zp_file:
+            for shape_format, shape in self.shapes.items():
+                shape.close()
+                final_file_name = "{}_{}".format(shape_format, self.file_name)
+                for ext in ("dbf", "shx", "shp", "prj", "cpg"):
+                    file_path = "{}/{}.{}".format(self.dir_path, final_file_name, ext)
+                    if not os.path.exists(file_path):
+                        # seul le fichier d'encodage est optionnel
+                        if ext == "cpg":
+                            continue
+                        raise GeonatureApiError(
+                            "Missing file {} of the shapefile".format(file_path)
+                        )
+                    zp_file.write(file_path, final_file_name + "." + ext)
+                    # the file is in the zip: free the disk space
+                    os.unlink(file_path)
+        return zip_path
+
+    def close_files(self):
         log.warning(
             "WARNING: utilsgemetry will soon be removed from GeoNature.\nPlease use utils_flask_sqla_geo instead\n"
         )
-        cls.point_shape.close()
-        cls.polygone_shape.close()
-        cls.polyline_shape.close()
+        for shape in self.shapes.values():
+            if not shape.closed:
+                shape.close()
+
+    def delete_files(self):
+        """
+        Delete the temporary directory of the export
+        """
+        shutil.rmtree(self.dir_path, ignore_errors=True)
+
 
+def create_shapes_generic(
+    view, srid, db_cols, data, file_name, geom_col, geojson_col, dir_path=None
+):
+    """
+    Create the zipped shapefiles of a GenericTable in a temporary directory
 
-def create_shapes_generic(view, srid, db_cols, data, dir_path, file_name, geom_col, geojson_col):
+    Returns:
+        FionaShapeService: call `delete_files()` once the zip (`zip_path`) is sent
+    """
     log.warning(
         "WARNING: utilsgemetry will soon be removed from GeoNature.\nPlease use utils_flask_sqla_geo instead\n"
     )
-    FionaShapeService.create_shapes_struct(db_cols, srid, dir_path, file_name)
-    FionaShapeService.create_features_generic(view, data, geom_col, geojson_col)
-    FionaShapeService.save_and_zip_shapefiles()
+    with FionaShapeService(db_cols, srid, file_name, dir_path=dir_path) as shape_service:
+        shape_service.create_features_generic(view, data, geom_col, geojson_col)
+        shape_service.zip_path = shape_service.save_and_zip_shapefiles()
+    return shape_service
 
 
 def shapeserializable(cls):
@@ -290,7 +283,7 @@ def shapeserializable(cls):
         columns (list): columns to be serialize
 
         Returns:
-            void
+            str: path of the zip file
         """
         log.warning(
             "WARNING: utilsgemetry will soon be removed from GeoNature.\nPlease use utils_flask_sqla_geo instead\n"
@@ -301,19 +294,17 @@ def shapeserializable(cls):
         file_name = file_name or datetime.datetime.now().strftime("%Y_%m_%d_%Hh%Mm%S")
 
         if columns:
-            db_cols = [db_col for db_col in db_col in cls.__mapper__.c if db_col.key in columns]
+            db_cols = [db_col for db_col in cls.__mapper__.c if db_col.key in columns]
         else:
             db_cols = cls.__mapper__.c
 
-        FionaShapeService.create_shapes_struct(
+        with FionaShapeService(
             db_cols=db_cols, dir_path=dir_path, file_name=file_name, srid=srid
-        )
-        for d in data:
-            d = d.as_dict(columns)
-            geom = getattr(d, geom_col)
-            FionaShapeService.create_feature(d, geom)
-
-        FionaShapeService.save_and_zip_shapefiles()
+        ) as shape_service:
+            for d in data:
+                geom = getattr(d, geom_col)
+                shape_service.create_feature(d.as_dict(columns), geom)
+            return shape_service.save_and_zip_shapefiles()
 
     cls.as_shape = to_shape_fn
     return cls
@@ -0,0 +1,109 @@
+"""
+    Pagination par curseur (keyset) et dénombrement des résultats
+
+    Avec LIMIT/OFFSET, PostgreSQL parcourt toutes les lignes des pages précédentes :
+    le temps de réponse augmente avec le numéro de la page.
+    La pagination par curseur filtre sur la clé de tri de la dernière ligne renvoyée
+    ((date_min, id) < (:date_min, :id)) et utilise un index sur cette clé.
+"""
+import base64
+import json
+
+from dateutil import parser
+from sqlalchemy import tuple_
+
+from geonature.utils.env import DB
+from geonature.utils.errors import GeonatureApiError
+
+COUNT_MODES = ("exact", "estimate", "none")
+
+
+def encode_cursor(values):
+    """
+    Return an opaque cursor from the values of the sort key of a row
+    """
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor, nb_values):
+    """
+    Return the values of the sort key from an opaque cursor
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        assert isinstance(values, list) and len(values) == nb_values
+    except Exception:
+        raise GeonatureApiError("Invalid cursor", 400)
+    return values
+
+
+def paginate_keyset(q, key_columns, cursor=None, limit=100, order="desc", value_parsers=None):
+    """
+    Order the query on `key_columns` and return the page after the `cursor`
+
+    Parameters:
+        q (Query): the query to paginate
+        key_columns (list): the columns of the sort key, the last ones must make it unique
+            (ex: [TRelevesOccurrence.date_min, TRelevesOccurrence.id_releve_occtax])
+        cursor (str): the cursor returned with the previous page (None or '' for the first page)
+        limit (int): number of rows of the page
+        order (str): asc or desc
+        value_parsers (list<callable>): functions to parse the values of the cursor
+            (the dates are serialized as string)
+    Returns:
+        tuple: (rows, next_cursor) - next_cursor is None on the last page
+    """
+    if cursor:
+        values = decode_cursor(cursor, len(key_columns))
+        if value_parsers:
+            values = [
+                parse(value) if parse and value is not None else value
+                for parse, value in zip(value_parsers, values)
+            ]
+        key = tuple_(*key_columns)
+        q = q.filter(key < tuple_(*values) if order == "desc" else key > tuple_(*values))
+    q = q.order_by(*[col.desc() if order == "desc" else col.asc() for col in key_columns])
+    # une ligne de plus pour savoir s'il y a une page suivante
+    rows = q.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_row = rows[-1]
+        next_cursor = encode_cursor([getattr(last_row, col.key) for col in key_columns])
+    return rows, next_cursor
+
+
+def parse_datetime(value):
+    return parser.parse(value)
+
+
+def estimate_count(q):
+    """
+    Return the number of rows of the query estimated by the planner (EXPLAIN)
+    without running it: instantaneous but approximative
+    """
+    compiled = q.statement.compile(dialect=DB.engine.dialect)
+    plan = (
+        DB.session.connection()
+        .execute("EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params)
+        .scalar()
+    )
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def count_results(q, count_mode):
+    """
+    Count the results of the query according to `count_mode`:
+        - exact: SELECT count(*)
+        - estimate: planner estimation
+        - none: not counted (None)
+    """
+    if count_mode not in COUNT_MODES:
+        raise GeonatureApiError("count must be one of {}".format(", ".join(COUNT_MODES)), 400)
+    if count_mode == "exact":
+        return q.order_by(None).count()
+    if count_mode == "estimate":
+        return estimate_count(q.order_by(None))
+    return None
@@ -13,7 +13,8 @@ from flask import Response
 from werkzeug.datastructures import Headers
 
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy import MetaData
+from sqlalchemy import MetaData, Table
+from sqlalchemy.exc import NoSuchTableError
 
 from geojson import Feature, FeatureCollection
 
@@ -23,6 +24,7 @@ from geoalchemy2.shape import to_shape
 from geonature.utils.env import DB
 from geonature.utils.errors import GeonatureApiError
 from geonature.utils.utilsgeometry import create_shapes_generic
+from geonature.utils.reflection import get_generic_table
 
 log = logging.getLogger()
 
@@ -136,15 +138,14 @@ class GenericTable:
         log.warning(
             "WARNING: Utilssqlalchemy will soon be removed from GeoNature.\nPlease use utils_flask_sqla instead\n"
         )
+        # seule la relation demandée est reflétée (et non tout le schéma)
         meta = MetaData(schema=schemaName, bind=DB.engine)
-        meta.reflect(views=True)
-
         try:
-            self.tableDef = meta.tables["{}.{}".format(schemaName, tableName)]
-        except KeyError:
+            self.tableDef = Table(tableName, meta, autoload=True)
+        except NoSuchTableError:
             raise KeyError(
                 "table {}.{} doesn't exists".format(schemaName, tableName)
-            ) from KeyError
+            ) from NoSuchTableError
 
         # Test geometry field
         if geometry_field:
@@ -199,13 +200,13 @@ class GenericTable:
             db_cols (list): columns from a SQLA model (model.__mapper__.c)
             geojson_col (str): the geojson (from st_asgeojson()) column of the mapped table if exist
                             if None, take the geom_col (WKB) to generate geometry with shapely
-            data (list<Model>): list of data of the shapefiles
-            dir_path (str): directory path
+            data (iterable<Model>): data of the shapefiles (could be a server side cursor)
+            dir_path (str): parent of the temporary directory (default: system temp directory)
             file_name (str): name of the file
         Returns
-            Void (create a shapefile)
+            FionaShapeService: the service with the path of the zip (`zip_path`)
         """
-        create_shapes_generic(
+        return create_shapes_generic(
             view=self,
             db_cols=db_cols,
             srid=self.srid,
@@ -235,7 +236,12 @@ class GenericQuery:
         self.filters = filters
         self.limit = limit
         self.offset = offset
-        self.view = GenericTable(tableName, schemaName, geometry_field)
+        self.view = get_generic_table(
+            GenericTable,
+            tableName=tableName,
+            schemaName=schemaName,
+            geometry_field=geometry_field,
+        )
 
     def build_query_filters(self, query, parameters):
         """
@@ -0,0 +1,106 @@
+"""
+    Helpers to stream large responses (exports) chunk by chunk
+    instead of building the whole file in memory
+"""
+import csv
+import io
+import os
+
+from flask import Response, stream_with_context
+from werkzeug.datastructures import Headers
+
+# nombre de lignes écrites avant d'envoyer un morceau au client
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def generate_csv_content_stream(columns, data, separator=";", chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Generator which yield the csv content by chunk of `chunk_size` lines
+    The header is yielded alone so the client receive the first bytes
+    before the first row is fetched
+
+    Parameters:
+        columns (list<str>): columns of the csv
+        data (iterable<dict>): rows (could be a generator)
+        separator (str): csv separator
+        chunk_size (int): number of lines per chunk
+    """
+    fp = io.StringIO()
+    writer = csv.DictWriter(
+        fp, columns, delimiter=separator, quoting=csv.QUOTE_ALL, extrasaction="ignore"
+    )
+    writer.writeheader()
+    yield fp.getvalue()
+    fp.seek(0)
+    fp.truncate(0)
+
+    nb_lines = 0
+    for line in data:
+        writer.writerow(line)
+        nb_lines += 1
+        if nb_lines % chunk_size == 0:
+            yield fp.getvalue()
+            fp.seek(0)
+            fp.truncate(0)
+    # remaining lines
+    last_chunk = fp.getvalue()
+    if last_chunk:
+        yield last_chunk
+
+
+def stream_csv_resp(filename, data, columns, separator=";", chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Same as utils_flask_sqla.response.to_csv_resp but the content is streamed
+    Memory stay constant whatever the number of rows if `data` is a generator
+    (use a server side cursor: Query.yield_per())
+
+    The request context is kept during the whole generation
+    so the SQLA session is not removed before the end of the stream
+    """
+    headers = Headers()
+    headers.add("Content-Type", "text/plain")
+    headers.add("Content-Disposition", "attachment", filename="export_%s.csv" % filename)
+    return Response(
+        stream_with_context(generate_csv_content_stream(columns, data, separator, chunk_size)),
+        headers=headers,
+    )
+
+
+def stream_file_resp(file_path, filename, mimetype, on_close=None, chunk_size=64 * 1024):
+    """
+    Stream a file from the disk by chunk of `chunk_size` bytes
+
+    Parameters:
+        file_path (str): path of the file to send
+        filename (str): name of the attachment
+        mimetype (str): mimetype of the response
+        on_close (callable): called once the file is sent (or the client disconnected)
+            eg: to delete the temporary files of an export
+    """
+
+    def generate():
+        try:
+            with open(file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(chunk_size), b""):
+                    yield chunk
+        finally:
+            if on_close:
+                on_close()
+
+    headers = Headers()
+    headers.add("Content-Disposition", "attachment", filename=filename)
+    headers.add("Content-Length", str(os.path.getsize(file_path)))
+    return Response(generate(), mimetype=mimetype, headers=headers, direct_passthrough=True)
+
+
+def stream_shapefiles_resp(shape_service, file_name):
+    """
+    Send the zipped shapefiles of a FionaShapeService
+    and delete its temporary directory once sent
+    """
+    return stream_file_resp(
+        shape_service.zip_path,
+        file_name + ".zip",
+        "application/zip",
+        on_close=shape_service.delete_files,
+    )
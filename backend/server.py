@@ -126,6 +126,11 @@ def get_app(config, _app=None, with_external_mods=True, with_flask_admin=True):
 
         app.register_blueprint(routes, url_prefix="/exports")
 
+        # Exports en attente lors du redémarrage de l'API
+        from geonature.core.gn_exports import jobs as export_jobs
+
+        export_jobs.init_app(app)
+
         from geonature.core.auth.routes import routes
 
         app.register_blueprint(routes, url_prefix="/gn_auth")
@@ -138,6 +143,11 @@ def get_app(config, _app=None, with_external_mods=True, with_flask_admin=True):
 
         app.register_blueprint(routes, url_prefix="/gn_commons")
 
+        # Mesure de la durée des requêtes de la synthèse, de la validation et des exports
+        from geonature.core.gn_synthese.utils import query_stats
+
+        query_stats.init_app(app)
+
         # Errors
         from geonature.core.errors import routes
 
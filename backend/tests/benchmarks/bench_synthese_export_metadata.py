@@ -0,0 +1,125 @@
+"""
+Benchmark of the search of the datasets of /synthese/export_metadata
+
+Compare the historical query (join of the filtered observations with
+gn_synthese.v_metadata_for_export and DISTINCT id_dataset) with get_search_datasets
+(correlated EXISTS per dataset) followed by the metadata of these datasets only.
+
+The fixture is built by duplicating an existing synthese row NB_ROWS times
+inside a transaction which is rolled back at the end: the database is left untouched.
+The searches are done as an administrator (CRUVED scope 3) without filter and with
+a date filter.
+
+Usage (from the backend directory, in the GeoNature virtualenv):
+
+    python tests/benchmarks/bench_synthese_export_metadata.py [nb_rows]
+"""
+import sys
+import time
+
+from flask import current_app
+from sqlalchemy import distinct, text
+from utils_flask_sqla.generic import GenericTable
+
+from geonature.utils.env import load_config, get_config_file_path, DB
+from geonature.utils.reflection import get_generic_table
+import server
+
+NB_ROWS = 200000
+
+COPY_SYNTHESE_ROW = """
+INSERT INTO gn_synthese.synthese (
+    id_source, id_dataset, cd_nom, nom_cite, date_min, date_max,
+    the_geom_4326, the_geom_point, the_geom_local, observers, id_digitiser
+)
+SELECT
+    id_source, id_dataset, cd_nom, nom_cite, date_min, date_max,
+    the_geom_4326, the_geom_point, the_geom_local, observers, id_digitiser
+FROM gn_synthese.synthese, generate_series(1, :nb_rows)
+WHERE id_synthese = (SELECT id_synthese FROM gn_synthese.synthese LIMIT 1)
+"""
+
+
+class Admin:
+    id_role = None
+    id_organisme = None
+    value_filter = "3"
+
+
+def metadata_id_column(metadata_view):
+    return getattr(
+        metadata_view.tableDef.columns,
+        current_app.config["SYNTHESE"]["EXPORT_METADATA_ID_DATASET_COL"],
+    )
+
+
+def legacy_path(metadata_view, filters):
+    from geonature.core.gn_synthese.models import VSyntheseForWebApp
+    from geonature.core.gn_synthese.utils import query as synthese_query
+
+    q = DB.session.query(distinct(VSyntheseForWebApp.id_dataset), metadata_view.tableDef).join(
+        metadata_view.tableDef,
+        metadata_id_column(metadata_view) == VSyntheseForWebApp.id_dataset,
+    )
+    q = synthese_query.filter_query_all_filters(VSyntheseForWebApp, q, dict(filters), Admin())
+    return [metadata_view.as_dict(d) for d in q.all()]
+
+
+def exists_path(metadata_view, filters):
+    from geonature.core.gn_synthese.routes import get_search_datasets
+
+    id_datasets = get_search_datasets(Admin(), dict(filters))
+    if not id_datasets:
+        return []
+    q = DB.session.query(metadata_view.tableDef).filter(
+        metadata_id_column(metadata_view).in_(id_datasets)
+    )
+    return [metadata_view.as_dict(d) for d in q.all()]
+
+
+def timeit(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main(nb_rows=NB_ROWS):
+    app = server.get_app(load_config(get_config_file_path()), with_external_mods=False)
+    with app.app_context():
+        conn = DB.engine.connect()
+        trans = conn.begin()
+        # the session works in the transaction of the benchmark
+        DB.session.remove()
+        DB.session.configure(bind=conn)
+        try:
+            conn.execute(text(COPY_SYNTHESE_ROW), nb_rows=nb_rows)
+            conn.execute(text("ANALYZE gn_synthese.synthese"))
+            metadata_view = get_generic_table(
+                GenericTable,
+                tableName="v_metadata_for_export",
+                schemaName="gn_synthese",
+                engine=DB.engine,
+            )
+            print("{} observations".format(nb_rows))
+            for name, filters in (
+                ("no filter", {}),
+                ("date filter", {"date_min": ["1900-01-01"]}),
+            ):
+                # warm up the cache of PostgreSQL
+                exists_path(metadata_view, filters)
+                legacy_time, legacy_rows = timeit(legacy_path, metadata_view, filters)
+                exists_time, exists_rows = timeit(exists_path, metadata_view, filters)
+                assert len(legacy_rows) == len(
+                    exists_rows
+                ), "the two paths must return the same rows"
+                print("{} ({} metadata rows)".format(name, len(exists_rows)))
+                print("    join + DISTINCT id_dataset       : {:.3f} s".format(legacy_time))
+                print("    EXISTS per dataset + metadata    : {:.3f} s".format(exists_time))
+        finally:
+            DB.session.remove()
+            trans.rollback()
+            conn.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else NB_ROWS)
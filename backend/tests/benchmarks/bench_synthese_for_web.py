@@ -0,0 +1,128 @@
+"""
+Benchmark of the /synthese/for_web serialization
+
+Compare the historical path (st_asgeojson read as text, ast.literal_eval on each row
+and json.dumps of the whole FeatureCollection) with the features built by PostgreSQL
+(json_build_object) and sent as raw text.
+
+The fixture is built by duplicating an existing synthese row NB_ROWS times
+inside a transaction which is rolled back at the end: the database is left untouched.
+
+Usage (from the backend directory, in the GeoNature virtualenv):
+
+    python tests/benchmarks/bench_synthese_for_web.py [nb_rows]
+"""
+import ast
+import json
+import sys
+import time
+
+from sqlalchemy import select, text
+
+from geonature.utils.env import load_config, get_config_file_path, DB
+import server
+
+NB_ROWS = 50000
+
+COPY_SYNTHESE_ROW = """
+INSERT INTO gn_synthese.synthese (
+    id_source, id_dataset, cd_nom, nom_cite, date_min, date_max,
+    the_geom_4326, the_geom_point, the_geom_local, observers, id_digitiser
+)
+SELECT
+    id_source, id_dataset, cd_nom, nom_cite, date_min, date_max,
+    the_geom_4326, the_geom_point, the_geom_local, observers, id_digitiser
+FROM gn_synthese.synthese, generate_series(1, :nb_rows)
+WHERE id_synthese = (
+    SELECT id_synthese FROM gn_synthese.synthese WHERE the_geom_4326 IS NOT NULL LIMIT 1
+)
+"""
+
+
+def legacy_path(conn, limit):
+    from geonature.core.gn_synthese.models import VSyntheseForWebApp
+
+    query = (
+        select(
+            [
+                VSyntheseForWebApp.id_synthese,
+                VSyntheseForWebApp.date_min,
+                VSyntheseForWebApp.lb_nom,
+                VSyntheseForWebApp.cd_nom,
+                VSyntheseForWebApp.nom_vern,
+                VSyntheseForWebApp.st_asgeojson,
+                VSyntheseForWebApp.observers,
+                VSyntheseForWebApp.dataset_name,
+                VSyntheseForWebApp.url_source,
+                VSyntheseForWebApp.entity_source_pk_value,
+                VSyntheseForWebApp.unique_id_sinp,
+            ]
+        )
+        .where(VSyntheseForWebApp.the_geom_4326.isnot(None))
+        .order_by(VSyntheseForWebApp.date_min.desc())
+        .limit(limit)
+    )
+    features = []
+    for r in conn.execute(query):
+        properties = {
+            "id": r["id_synthese"],
+            "date_min": str(r["date_min"]),
+            "cd_nom": r["cd_nom"],
+            "nom_vern_or_lb_nom": r["nom_vern"] if r["nom_vern"] else r["lb_nom"],
+            "lb_nom": r["lb_nom"],
+            "dataset_name": r["dataset_name"],
+            "observers": r["observers"],
+            "url_source": r["url_source"],
+            "unique_id_sinp": str(r["unique_id_sinp"]),
+            "entity_source_pk_value": r["entity_source_pk_value"],
+        }
+        geojson = ast.literal_eval(r["st_asgeojson"])
+        geojson["properties"] = properties
+        features.append(geojson)
+    return json.dumps({"data": {"type": "FeatureCollection", "features": features}})
+
+
+def sql_path(conn, limit):
+    from geonature.core.gn_synthese.models import VSyntheseForWebApp
+    from geonature.core.gn_synthese.routes import build_for_web_feature
+
+    query = (
+        select([build_for_web_feature()])
+        .where(VSyntheseForWebApp.the_geom_4326.isnot(None))
+        .order_by(VSyntheseForWebApp.date_min.desc())
+        .limit(limit)
+    )
+    features = ",".join(r[0] for r in conn.execute(query))
+    return '{"data": {"type": "FeatureCollection", "features": [' + features + "]}}"
+
+
+def timeit(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main(nb_rows=NB_ROWS):
+    app = server.get_app(load_config(get_config_file_path()), with_external_mods=False)
+    with app.app_context():
+        conn = DB.engine.connect()
+        trans = conn.begin()
+        try:
+            conn.execute(text(COPY_SYNTHESE_ROW), nb_rows=nb_rows)
+            # warm up the cache of PostgreSQL
+            sql_path(conn, nb_rows)
+            legacy_time, legacy_result = timeit(legacy_path, conn, nb_rows)
+            sql_time, sql_result = timeit(sql_path, conn, nb_rows)
+            nb_legacy = len(json.loads(legacy_result)["data"]["features"])
+            nb_sql = len(json.loads(sql_result)["data"]["features"])
+            assert nb_legacy == nb_sql, "the two paths must return the same features"
+            print("{} features".format(nb_sql))
+            print("python (ast.literal_eval + json.dumps) : {:.3f} s".format(legacy_time))
+            print("postgresql (json_build_object)         : {:.3f} s".format(sql_time))
+        finally:
+            trans.rollback()
+            conn.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else NB_ROWS)
@@ -0,0 +1,113 @@
+"""
+Benchmark of the import of a table in the synthese (geonature import_synthese_from_table)
+
+Compare the historical loop (gn_synthese.import_row_from_table with LIMIT/OFFSET,
+one batch after another) with the import by primary key ranges run by a pool of workers.
+
+A source table of NB_ROWS rows is built in the schema gn_imports by duplicating
+an existing synthese row with new uuids. The imported observations and the source
+table are deleted at the end (the workers commit their batches: the benchmark
+cannot be run in a transaction rolled back at the end).
+The historical loop is quadratic: limit its number of rows with `legacy_rows`.
+
+Usage (from the backend directory, in the GeoNature virtualenv):
+
+    python tests/benchmarks/bench_synthese_import.py [nb_rows] [nb_workers] [legacy_rows]
+"""
+import sys
+import time
+
+from sqlalchemy import text
+
+from geonature.utils.env import load_config, get_config_file_path, DB
+import server
+
+NB_ROWS = 1000000
+NB_WORKERS = 4
+LEGACY_ROWS = 20000
+BATCH_SIZE = 1000
+
+CREATE_SOURCE_TABLE = """
+CREATE SCHEMA IF NOT EXISTS gn_imports;
+DROP TABLE IF EXISTS gn_imports.bench_synthese_import;
+CREATE TABLE gn_imports.bench_synthese_import AS
+SELECT
+    n AS id_import,
+    CASE WHEN n <= :legacy_rows THEN 'legacy' ELSE 'pool' END AS import_method,
+    uuid_generate_v4() AS unique_id_sinp,
+    s.id_source, s.id_dataset, s.cd_nom, s.nom_cite, s.date_min, s.date_max,
+    s.the_geom_4326, s.the_geom_point, s.the_geom_local, s.observers, s.id_digitiser
+FROM gn_synthese.synthese s, generate_series(1, :nb_rows + :legacy_rows) n
+WHERE s.id_synthese = (SELECT id_synthese FROM gn_synthese.synthese LIMIT 1);
+ALTER TABLE gn_imports.bench_synthese_import ADD PRIMARY KEY (id_import);
+ANALYZE gn_imports.bench_synthese_import;
+"""
+
+CLEAN = """
+DELETE FROM gn_synthese.synthese
+WHERE unique_id_sinp IN (SELECT unique_id_sinp FROM gn_imports.bench_synthese_import);
+DROP TABLE gn_imports.bench_synthese_import;
+"""
+
+
+def legacy_loop(nb_rows, limit=BATCH_SIZE):
+    offset = 0
+    while offset < nb_rows:
+        DB.engine.execution_options(autocommit=True).execute(
+            text(
+                """SELECT gn_synthese.import_row_from_table(
+                    'import_method', 'legacy', 'gn_imports.bench_synthese_import', :limit, :offset
+                )"""
+            ),
+            limit=limit,
+            offset=offset,
+        )
+        offset += limit
+
+
+def pool_import(nb_workers):
+    from geonature.core.gn_synthese.utils.process import import_from_table
+
+    return import_from_table(
+        "gn_imports",
+        "bench_synthese_import",
+        "import_method",
+        "pool",
+        limit=BATCH_SIZE,
+        nb_workers=nb_workers,
+        progress=None,
+    )
+
+
+def timeit(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main(nb_rows=NB_ROWS, nb_workers=NB_WORKERS, legacy_rows=LEGACY_ROWS):
+    app = server.get_app(load_config(get_config_file_path()), with_external_mods=False)
+    with app.app_context():
+        DB.engine.execution_options(autocommit=True).execute(
+            text(CREATE_SOURCE_TABLE), nb_rows=nb_rows, legacy_rows=legacy_rows
+        )
+        try:
+            legacy_time, _ = timeit(legacy_loop, legacy_rows)
+            pool_time, nb_imported = timeit(pool_import, nb_workers)
+            assert nb_imported == nb_rows, "all the rows must be imported"
+            print(
+                "LIMIT/OFFSET loop      : {} rows in {:.1f} s ({:.0f} rows/s)".format(
+                    legacy_rows, legacy_time, legacy_rows / legacy_time
+                )
+            )
+            print(
+                "key ranges, {} workers : {} rows in {:.1f} s ({:.0f} rows/s)".format(
+                    nb_workers, nb_rows, pool_time, nb_rows / pool_time
+                )
+            )
+        finally:
+            DB.engine.execution_options(autocommit=True).execute(text(CLEAN))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:4]])
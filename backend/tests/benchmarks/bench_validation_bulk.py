@@ -0,0 +1,104 @@
+"""
+Benchmark of the validation of a selection of observations
+
+Compare the historical path of POST /validation/<id_synthese> (a query for the uuid,
+an insert and a commit per observation) with insert_validations
+(one query for all the uuids and one INSERT ... SELECT unnest(uuids)).
+
+The fixture is built by duplicating an existing synthese row NB_ROWS times
+inside a transaction which is rolled back at the end: the database is left untouched.
+In this transaction the commits of the historical path only flush the session:
+with real commits (one WAL flush per observation) it is even slower.
+
+Usage (from the backend directory, in the GeoNature virtualenv,
+with the VALIDATION module installed):
+
+    python tests/benchmarks/bench_validation_bulk.py [nb_rows]
+"""
+import datetime
+import sys
+import time
+
+from sqlalchemy import func, select, text
+
+from geonature.utils.env import load_config, get_config_file_path, DB
+import server
+
+NB_ROWS = 10000
+
+COPY_SYNTHESE_ROW = """
+INSERT INTO gn_synthese.synthese (
+    id_source, id_dataset, cd_nom, nom_cite, date_min, date_max,
+    the_geom_4326, the_geom_point, the_geom_local, observers, id_digitiser, unique_id_sinp
+)
+SELECT
+    id_source, id_dataset, cd_nom, nom_cite, date_min, date_max,
+    the_geom_4326, the_geom_point, the_geom_local, observers, id_digitiser, uuid_generate_v4()
+FROM gn_synthese.synthese, generate_series(1, :nb_rows)
+WHERE id_synthese = (SELECT id_synthese FROM gn_synthese.synthese LIMIT 1)
+RETURNING id_synthese
+"""
+
+
+def legacy_path(id_syntheses, id_status, id_validator):
+    from geonature.core.gn_synthese.models import Synthese
+    from geonature.core.gn_commons.models import TValidations
+
+    for id_synthese in id_syntheses:
+        uuid = DB.session.query(Synthese.unique_id_sinp).filter(
+            Synthese.id_synthese == int(id_synthese)
+        )
+        DB.session.add(
+            TValidations(
+                uuid, id_status, id_validator, "benchmark", datetime.datetime.now(), False
+            )
+        )
+        DB.session.commit()
+
+
+def bulk_path(id_syntheses, id_status, id_validator):
+    from validation.backend.query import insert_validations
+
+    results = insert_validations(id_syntheses, id_status, id_validator, "benchmark")
+    DB.session.commit()
+    return results
+
+
+def timeit(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main(nb_rows=NB_ROWS):
+    app = server.get_app(load_config(get_config_file_path()))
+    with app.app_context():
+        conn = DB.engine.connect()
+        trans = conn.begin()
+        # the session works in the transaction of the benchmark: its commits are not real
+        DB.session.remove()
+        DB.session.configure(bind=conn)
+        try:
+            id_syntheses = [r[0] for r in conn.execute(text(COPY_SYNTHESE_ROW), nb_rows=nb_rows)]
+            id_status = conn.execute(
+                select([func.ref_nomenclatures.get_id_nomenclature("STATUT_VALID", "1")])
+            ).scalar()
+            id_validator = conn.execute(
+                text("SELECT min(id_role) FROM utilisateurs.t_roles")
+            ).scalar()
+
+            legacy_time, _ = timeit(legacy_path, id_syntheses, id_status, id_validator)
+            bulk_time, results = timeit(bulk_path, id_syntheses, id_status, id_validator)
+            nb_validated = len([r for r in results if r["status"] == "validated"])
+            assert nb_validated == nb_rows, "all the observations must be validated"
+            print("{} observations".format(nb_rows))
+            print("one query and one commit per observation : {:.3f} s".format(legacy_time))
+            print("insert_validations                       : {:.3f} s".format(bulk_time))
+        finally:
+            DB.session.remove()
+            trans.rollback()
+            conn.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else NB_ROWS)
@@ -68,6 +68,17 @@ class TestAPIMedias:
         )
         assert response.status_code == 200
 
+    def _get_thumbnail(self, id_media):
+        url = "/gn_commons/media/thumbnails/{}/50".format(id_media)
+        response = self.client.get(url)
+        assert response.status_code == 200
+        assert response.mimetype == "image/jpeg"
+        etag = response.headers["ETag"]
+        assert "max-age" in response.headers["Cache-Control"]
+
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+
     def _delete_media(self, id_media):
         response = self.client.delete(
         '/gn_commons/media/' + str(id_media),
@@ -82,11 +93,50 @@ class TestAPIMedias:
     def test_media_action(self, config):
         data = self._save_media(config)
         self._get_media(data["id_media"])
+        self._get_thumbnail(data["id_media"])
         self._update_media(data)
         self._get_media(data["id_media"])
         self._delete_media(data["id_media"])
 
 
+def test_make_thumbnails(tmp_path):
+    from PIL import Image
+    from geonature.core.gn_commons.thumbnails import make_thumbnails
+
+    thumbnails = [
+        (50, str(tmp_path / "1_thumbnail_50.jpg")),
+        (200, str(tmp_path / "1_thumbnail_200.jpg")),
+    ]
+    make_thumbnails(str(Path(BACKEND_DIR, "tests/test.jpg")), thumbnails)
+    source_width, source_height = Image.open(str(Path(BACKEND_DIR, "tests/test.jpg"))).size
+    for height, path in thumbnails:
+        width, thumb_height = Image.open(path).size
+        assert thumb_height == min(height, source_height)
+        assert abs(width / thumb_height - source_width / source_height) < 0.05
+
+
+def test_scan_upload_dir(tmp_path):
+    from geonature.core.gn_commons.medias_sync import scan_upload_dir
+
+    (tmp_path / "1").mkdir()
+    (tmp_path / "thumbnails" / "1").mkdir(parents=True)
+    (tmp_path / "1" / "12_photo.jpg").write_bytes(b"")
+    (tmp_path / "1" / "deleted_10_photo.jpg").write_bytes(b"")
+    (tmp_path / "thumbnails" / "1" / "12_thumbnail_50.jpg").write_bytes(b"")
+
+    manifest, nb_read, complete = scan_upload_dir(str(tmp_path), {})
+    assert complete and nb_read == 4
+    assert manifest["1"]["files"] == {"12_photo.jpg": 12}
+    assert manifest[os.path.join("thumbnails", "1")]["files"] == {"12_thumbnail_50.jpg": 12}
+
+    # seuls les répertoires modifiés sont relus
+    (tmp_path / "1" / "13_photo.jpg").write_bytes(b"")
+    os.utime(str(tmp_path / "1"), (1, 1))
+    manifest, nb_read, complete = scan_upload_dir(str(tmp_path), manifest)
+    assert nb_read == 1
+    assert manifest["1"]["files"] == {"12_photo.jpg": 12, "13_photo.jpg": 13}
+
+
 @pytest.mark.usefixtures("client_class")
 class TestAPIGNCommons:
     def _create_config_files(self):
@@ -12,6 +12,12 @@ from geonature.core.gn_monitoring.config_manager import generate_config
 from pypnnomenclature.models import TNomenclatures
 
 from geonature.utils.env import DB
+from geonature.utils.utilssqlalchemy import GenericTable
+from geonature.utils.reflection import (
+    get_generic_table,
+    clear_generic_tables,
+    refresh_generic_tables,
+)
 
 
 @pytest.mark.usefixtures("client_class")
@@ -45,3 +51,21 @@ class TestAPICore:
             query_string=query_string,
         )
         assert response.status_code == 200
+
+    def test_generic_table_registry(self):
+        clear_generic_tables()
+        view = get_generic_table(
+            GenericTable, tableName="v_synthese_for_web_app", schemaName="gn_synthese"
+        )
+        assert "id_synthese" in view.tableDef.columns
+        # only the requested relation is reflected
+        assert list(view.tableDef.metadata.tables) == ["gn_synthese.v_synthese_for_web_app"]
+        same_view = get_generic_table(
+            GenericTable, tableName="v_synthese_for_web_app", schemaName="gn_synthese"
+        )
+        assert same_view is view
+        refresh_generic_tables()
+        new_view = get_generic_table(
+            GenericTable, tableName="v_synthese_for_web_app", schemaName="gn_synthese"
+        )
+        assert new_view is not view
@@ -6,6 +6,9 @@ from sqlalchemy.sql import func
 from .bootstrap_test import app, post_json, json_of_response, get_token
 
 from geonature.core.users import routes as users
+from geonature.core.gn_meta import models as meta_models
+from geonature.core.gn_meta.models import TDatasets, clear_user_datasets_cache
+from geonature.core.gn_permissions.models import VUsersPermissions
 
 
 @pytest.mark.usefixtures("client_class")
@@ -70,6 +73,59 @@ class TestGnMeta:
             and dataset_list["data"][0]["id_dataset"] == 1
         )
 
+    def test_user_datasets_cache(self):
+        """
+        The allowed datasets of a user are the same with the cache, the query
+        and the select used as semi-join
+        """
+        clear_user_datasets_cache()
+        user = VUsersPermissions.query.filter_by(id_role=2).first()
+        ids_dataset = TDatasets.get_user_datasets(user)
+        from_query = {d.id_dataset for d in TDatasets.get_user_datasets(user, only_query=True)}
+        from_select = {
+            r[0] for r in meta_models.DB.session.execute(TDatasets.select_user_datasets(user))
+        }
+        assert set(ids_dataset) == from_query == from_select
+        if current_app.config["PERMISSIONS_CACHE_TTL"] > 0:
+            assert len(meta_models._USER_DATASETS_CACHE) == 1
+            # a modified dataset invalidate the cache
+            version = meta_models._user_datasets_version
+            meta_models._invalidate_user_datasets_cache(meta_models.DB.session)
+            assert meta_models._user_datasets_version == version
+            meta_models.DB.session.info["user_datasets_changed"] = True
+            meta_models._invalidate_user_datasets_cache(meta_models.DB.session)
+            assert meta_models._user_datasets_version == version + 1
+            assert len(meta_models._USER_DATASETS_CACHE) == 0
+        assert set(TDatasets.get_user_datasets(user)) == set(ids_dataset)
+
+    def test_objects_cruved(self):
+        """
+        The bulk CRUVED of the datasets is the CRUVED of each dataset
+        """
+        user = VUsersPermissions.query.filter_by(id_role=2).first()
+        ids_user, ids_organism = TDatasets.get_user_actor_ids(user)
+        assert ids_user == set(TDatasets.get_user_datasets(user, only_user=True))
+        assert ids_organism == set(TDatasets.get_user_datasets(user))
+        datasets = TDatasets.query.all()
+        for user_cruved in ({"C": "1", "R": "2", "U": "3", "V": "0"}, {"R": "1", "E": "2"}):
+            objects_cruved = TDatasets.get_objects_cruved(
+                user_cruved, [d.id_dataset for d in datasets], ids_user, ids_organism
+            )
+            for d in datasets:
+                assert objects_cruved[d.id_dataset] == d.get_object_cruved(
+                    user_cruved, d.id_dataset, ids_user, ids_organism
+                )
+
+    def test_af_and_ds_metadata(self):
+        token = get_token(self.client, login="admin", password="admin")
+        self.client.set_cookie("/", "token", token)
+        response = self.client.get(url_for("gn_meta.get_af_and_ds_metadata"))
+        assert response.status_code == 200
+        for af in json_of_response(response)["data"]:
+            assert set(af["cruved"]) == set("CRUVED")
+            for dataset in af["datasets"]:
+                assert dataset["id_acquisition_framework"] == af["id_acquisition_framework"]
+
     # def test_mtd_interraction(self):
     #     from geonature.core.gn_meta.mtd_utils import (
     #         post_jdd_from_user,
@@ -201,3 +257,156 @@ class TestGnMeta:
             self.client, url_for("gn_meta.post_acquisition_framework"), json_dict=one_ca
         )
         assert response.status_code == 200
+
+
+def test_fetch_mtd_documents():
+    """
+    Conditional fetch of the MTD documents on a local stub of the web service
+    """
+    import threading
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from geonature.core.gn_meta.mtd_sync import fetch_documents
+
+    documents = {"/etag": b"<af>1</af>", "/hash": b"<jdd>1</jdd>"}
+    requests_count = {}
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_count[self.path] = requests_count.get(self.path, 0) + 1
+            content = documents.get(self.path)
+            if content is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+            etag = '"{}"'.format(len(content) + content.count(b"2"))
+            # seul /etag gère les requêtes conditionnelles
+            if self.path == "/etag" and self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            if self.path == "/etag":
+                self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        base_url = "http://127.0.0.1:{}".format(server.server_port)
+        urls = [base_url + path for path in ("/etag", "/hash", "/missing")]
+
+        fetched, errors = fetch_documents(urls, {}, nb_threads=3, timeout=5)
+        assert set(errors) == {base_url + "/missing"}
+        assert all(d.changed for d in fetched.values())
+        assert fetched[base_url + "/etag"].etag is not None
+        states = {
+            url: {"etag": d.etag, "last_modified": d.last_modified, "content_hash": d.content_hash}
+            for url, d in fetched.items()
+        }
+
+        # documents non modifiés : 304 (ETag) ou même sha256
+        unchanged, _ = fetch_documents(urls[:2], states, nb_threads=2, timeout=5)
+        assert not any(d.changed for d in unchanged.values())
+        assert unchanged[base_url + "/etag"].content is None
+        assert unchanged[base_url + "/hash"].content == documents["/hash"]
+
+        documents["/etag"] = b"<af>2</af>"
+        documents["/hash"] = b"<jdd>2</jdd>"
+        changed, _ = fetch_documents(urls[:2], states, nb_threads=2, timeout=5)
+        assert all(d.changed for d in changed.values())
+        assert changed[base_url + "/etag"].content == documents["/etag"]
+        assert requests_count["/etag"] == requests_count["/hash"] == 3
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_mtd_update_changed_dates():
+    """
+    The dates of the MTD documents are compared with the date columns by day
+    """
+    import datetime
+    from types import SimpleNamespace
+    from geonature.core.gn_meta.mtd_sync import _parse_date, _update_changed
+
+    af = SimpleNamespace(acquisition_framework_start_date=datetime.date(2020, 1, 15))
+    values = {"acquisition_framework_start_date": _parse_date("2020-01-15T00:00:00")}
+    assert not _update_changed(af, values)
+    values = {"acquisition_framework_start_date": _parse_date("2020-02-01")}
+    assert _update_changed(af, values)
+    assert af.acquisition_framework_start_date == datetime.date(2020, 2, 1)
+
+
+def test_pdf_export_rights():
+    """
+    The rights on a cached PDF are those of the cruved filter of the metadata
+    """
+    from types import SimpleNamespace
+    from geonature.core.gn_meta.routes import is_allowed_to_export
+
+    actors = [(10, None, 1), (None, 5, 1)]
+
+    def user(value_filter, id_role=1, id_organisme=None):
+        return SimpleNamespace(
+            value_filter=value_filter, id_role=id_role, id_organisme=id_organisme
+        )
+
+    assert is_allowed_to_export(user("3"), None, actors)
+    assert not is_allowed_to_export(user("0", id_role=10), None, actors)
+    assert is_allowed_to_export(user("1", id_role=10), None, actors)
+    assert is_allowed_to_export(user("1"), 1, actors)
+    assert not is_allowed_to_export(user("1", id_organisme=5), None, actors)
+    assert is_allowed_to_export(user("2", id_organisme=5), None, actors)
+    # un utilisateur sans organisme n'a pas les droits des acteurs sans organisme
+    assert not is_allowed_to_export(user("2"), None, actors)
+
+
+def test_pdf_cache(tmp_path, monkeypatch):
+    """
+    A pdf is rendered once per version, concurrent requests wait for the same rendering
+    """
+    import threading
+    import time
+    from geonature.core.gn_meta import pdf_exports
+
+    monkeypatch.setattr(pdf_exports, "PDF_DIR", tmp_path)
+    nb_renders = []
+
+    def render_html():
+        nb_renders.append(1)
+        time.sleep(0.2)
+        return "<html><body><p>Jeu de données</p></body></html>"
+
+    paths = []
+    # les threads n'ont pas le contexte d'application du test
+    test_app = current_app._get_current_object()
+
+    def export():
+        with test_app.app_context():
+            paths.append(pdf_exports.get_pdf("jdd_1", "v1", render_html))
+
+    threads = [threading.Thread(target=export) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(nb_renders) == 1
+    assert len(set(paths)) == 1
+    with open(paths[0], "rb") as f:
+        assert f.read(4) == b"%PDF"
+
+    # version inchangée : servi depuis le disque
+    assert pdf_exports.get_pdf("jdd_1", "v1", render_html) == paths[0]
+    assert len(nb_renders) == 1
+
+    # nouvelle version : l'ancienne est supprimée
+    new_path = pdf_exports.get_pdf("jdd_1", "v2", render_html)
+    assert len(nb_renders) == 2
+    assert [str(p) for p in tmp_path.iterdir()] == [new_path]
+    assert pdf_exports.get_pdf("jdd_2", "v1", lambda: None) is None
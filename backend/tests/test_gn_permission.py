@@ -26,7 +26,10 @@ from geonature.core.gn_permissions.tools import (
     user_from_token,
     get_user_from_token_and_raise,
     cruved_scope_for_user_in_module,
+    get_all_user_permissions,
+    clear_user_permissions_cache,
 )
+from geonature.core.gn_permissions import tools as permissions_tools
 from geonature.core.gn_permissions.decorators import get_max_perm
 from geonature.core.gn_permissions.models import VUsersPermissions
 
@@ -103,6 +106,20 @@ class TestGnPermissionsTools:
         assert herited == False
         assert cruved == {"C": 4, "R": 4, "U": 4, "V": 4, "E": 4, "D": 4}
 
+    def test_user_permissions_cache(self):
+        clear_user_permissions_cache()
+        perms = get_all_user_permissions(9)
+        assert len(perms) > 0
+        if current_app.config["PERMISSIONS_CACHE_TTL"] > 0:
+            assert 9 in permissions_tools._USER_PERMISSIONS_CACHE
+            # same list served from the cache
+            assert get_all_user_permissions(9) is perms
+        clear_user_permissions_cache(9)
+        assert 9 not in permissions_tools._USER_PERMISSIONS_CACHE
+        # the cruved computed from the cache is the same as from the view
+        cruved, herited = cruved_scope_for_user_in_module(id_role=9, module_code="GEONATURE")
+        assert cruved == {"C": "3", "R": "3", "U": "3", "V": "3", "E": "3", "D": "3"}
+
 
 @pytest.mark.usefixtures("client_class")
 class TestGnPermissionsView:
@@ -1,6 +1,11 @@
 import json
 import pytest
 from flask import url_for, session, Response, request
+from sqlalchemy import func, select
+
+from geonature.utils.env import DB
+from geonature.core.gn_commons.models import TValidations
+
 from .bootstrap_test import app, releve_data, post_json, json_of_response, get_token
 
 
@@ -29,3 +34,33 @@ class TestValidation:
         response_key = data["data"]["features"][0]["properties"].keys()
         for c in mandatory_columns:
             assert c in response_key
+
+    def test_post_status_bulk(self):
+        token = get_token(self.client)
+        self.client.set_cookie("/", "token", token)
+        response = self.client.get(url_for("validation.get_synthese_data"))
+        id_synthese = json_of_response(response)["data"]["features"][0]["properties"][
+            "id_synthese"
+        ]
+        id_status = DB.session.execute(
+            select([func.ref_nomenclatures.get_id_nomenclature("STATUT_VALID", "1")])
+        ).scalar()
+
+        response = post_json(
+            self.client,
+            url_for("validation.post_status_bulk"),
+            {
+                "id_synthese": [id_synthese, 999999999, "abc"],
+                "statut": id_status,
+                "comment": "test bulk",
+            },
+        )
+        assert response.status_code == 200
+        data = json_of_response(response)
+        assert data["nb_validated"] == 1
+        assert [r["status"] for r in data["results"]] == ["validated", "not_found", "invalid"]
+        assert data["results"][0]["id_validation"] is not None
+
+        validation = TValidations.query.get(data["results"][0]["id_validation"])
+        assert validation.id_nomenclature_valid_status == id_status
+        assert validation.validation_comment == "test bulk"
@@ -40,6 +40,40 @@ class TestApiModulePrOcctax:
         assert len(json_data["items"]["features"]) == 1
         assert json_data["items"]["features"][0]["properties"]["observers_txt"] == "test"
 
+    def test_get_releves_keyset(self):
+        """
+        test de la pagination par curseur de la liste des relevés
+        """
+        token = get_token(self.client)
+        self.client.set_cookie("/", "token", token)
+
+        response = self.client.get(
+            url_for("pr_occtax.getReleves"), query_string={"cursor": "", "limit": 1}
+        )
+        assert response.status_code == 200
+        json_data = json_of_response(response)
+        assert "next_cursor" in json_data
+        assert json_data["total"] is None
+        assert len(json_data["items"]["features"]) <= 1
+        if json_data["next_cursor"]:
+            first_id = json_data["items"]["features"][0]["id"]
+            response = self.client.get(
+                url_for("pr_occtax.getReleves"),
+                query_string={"cursor": json_data["next_cursor"], "limit": 1},
+            )
+            assert response.status_code == 200
+            next_page = json_of_response(response)
+            assert next_page["items"]["features"][0]["id"] != first_id
+
+        response = self.client.get(
+            url_for("pr_occtax.getReleves"), query_string={"cursor": "invalid"}
+        )
+        assert response.status_code == 400
+
+        response = self.client.get(url_for("pr_occtax.getRelevesCount"))
+        assert response.status_code == 200
+        assert json_of_response(response)["total"] >= 0
+
     def test_insert_update_delete_releves(self, releve_data):
         token = get_token(self.client)
         self.client.set_cookie("/", "token", token)
@@ -103,6 +137,35 @@ class TestApiModulePrOcctax:
 
         assert response.status_code == 200
 
+    def test_insert_releves_bulk(self, releve_data):
+        token = get_token(self.client)
+        self.client.set_cookie("/", "token", token)
+
+        releve_data["properties"]["unique_id_sinp_grp"] = "8f7c8b6e-3b7e-4b8e-9a2c-6d1f0c4b2a11"
+        invalid = {"geometry": None, "properties": dict(releve_data["properties"])}
+        features = {"type": "FeatureCollection", "features": [releve_data, invalid]}
+
+        response = post_json(self.client, url_for("pr_occtax.insertReleves"), features)
+        assert response.status_code == 200
+        results = json_of_response(response)
+        assert [r["status"] for r in results] == ["created", "error"]
+        assert "geometry" in results[1]["errors"]
+        id_releve = results[0]["id_releve_occtax"]
+
+        # lot renvoyé : le relevé n'est pas inséré à nouveau
+        response = post_json(self.client, url_for("pr_occtax.insertReleves"), [releve_data])
+        results = json_of_response(response)
+        assert results[0]["status"] == "existing"
+        assert results[0]["id_releve_occtax"] == id_releve
+
+        response = self.client.get(url_for("pr_occtax.getOneReleve", id_releve=id_releve))
+        releve = json_of_response(response)["releve"]["properties"]
+        assert len(releve["t_occurrences_occtax"]) == 1
+        assert [o["id_role"] for o in releve["observers"]] == [1]
+
+        response = self.client.delete(url_for("pr_occtax.deleteOneReleve", id_releve=id_releve))
+        assert response.status_code == 200
+
     def test_get_export_sinp(self):
         token = get_token(self.client)
         self.client.set_cookie("/", "token", token)
@@ -1,6 +1,13 @@
+import json
+
 import pytest
 
 from flask import url_for, current_app
+from shapely import wkt
+from sqlalchemy.sql import text
+
+from geonature.utils.env import DB
+from geonature.core.ref_geo.utils import geo_info_cache
 
 from .bootstrap_test import app, post_json, json_of_response
 
@@ -17,6 +24,90 @@ class TestRefGeo:
         data = json_of_response(response)
         assert data.get("altitude") is not None
 
+    def test_geoinfo_batch(self):
+        other_point = {"type": "Point", "coordinates": [6.86, 45.83]}
+        data = {
+            "geometries": [
+                {"id": "a", "geometry": geojson["geometry"]},
+                {"id": "b", "geometry": other_point},
+                {"id": "c", "geometry": geojson["geometry"]},
+            ]
+        }
+        response = post_json(self.client, url_for("ref_geo.getGeoInfoBatch"), data)
+
+        assert response.status_code == 200
+        data = json_of_response(response)
+        assert set(data) == {"a", "b", "c"}
+        assert data["a"] == data["c"]
+        # calcul sans le cache identique
+        geo_info_cache.clear()
+        single = json_of_response(post_json(self.client, url_for("ref_geo.getGeoInfo"), geojson))
+        assert data["a"] == single
+        # zonages identiques à ceux de la fonction de la base
+        expected = DB.engine.execute(
+            text(
+                """SELECT (ref_geo.fct_get_area_intersection(
+                st_setsrid(ST_GeomFromGeoJSON(:geom), 4326))).id_area"""
+            ),
+            geom=json.dumps(other_point),
+        )
+        assert sorted(a["id_area"] for a in data["b"]["areas"]) == sorted(r[0] for r in expected)
+
+    def test_dem_sampler(self, tmp_path):
+        pytest.importorskip("numpy")
+        from geonature.core.ref_geo.dem import DemSampler, export_dem
+
+        # raster de 10 x 10 pixels de 10 m découpé en tuiles de 5 x 5 (comme raster2pgsql)
+        # avec un pixel sans donnée et des altitudes à .5 (arrondi au pair le plus proche)
+        values = [[row * 10 + col + 0.3 for col in range(10)] for row in range(10)]
+        values[0][0] = -9999
+        values[0][1] = 2.5
+        values[1][0] = -2.5
+        fixture = """
+            CREATE TEMP TABLE dem_fixture AS
+            SELECT ST_Tile(ST_SetValues(
+                ST_AddBand(ST_MakeEmptyRaster(10, 10, 1000, 2000, 10, -10, 0, 0, 2154),
+                    '32BF'::text, 0, -9999),
+                1, 1, 1, CAST(:values AS double precision[][])
+            ), 5, 5) AS rast
+        """
+        expected_query = """
+            SELECT min((altitude).val)::integer, max((altitude).val)::integer
+            FROM (
+                SELECT ST_DumpAsPolygons(ST_Clip(rast, 1, ST_GeomFromText(:wkt, 2154), true))
+                    AS altitude
+                FROM dem_fixture
+                WHERE ST_Intersects(rast, ST_GeomFromText(:wkt, 2154))
+            ) a
+        """
+        geometries = [
+            "POINT(1001 1999)",
+            "POINT(1042 1957)",
+            "POINT(1015 1995)",
+            "POINT(1005 1985)",
+            "LINESTRING(1003 1985, 1097 1985)",
+            "LINESTRING(1055 1998, 1055 1903)",
+            "POLYGON((1012 1988, 1083 1991, 1071 1917, 1014 1930, 1012 1988))",
+            "POLYGON((1001 1999, 1099 1999, 1099 1901, 1001 1901, 1001 1999),"
+            "(1031 1969, 1069 1969, 1069 1931, 1031 1931, 1031 1969))",
+            "POLYGON((1500 1500, 1600 1500, 1600 1600, 1500 1500))",
+        ]
+        conn = DB.engine.connect()
+        trans = conn.begin()
+        try:
+            conn.execute(text(fixture), values=values)
+            export_dem(tmp_path, "dem_fixture", conn)
+            sampler = DemSampler.load(tmp_path)
+            for geometry in geometries:
+                expected = conn.execute(text(expected_query), wkt=geometry).first()
+                altitude = sampler.altitude(wkt.loads(geometry))
+                assert (altitude["altitude_min"], altitude["altitude_max"]) == tuple(
+                    expected
+                ), geometry
+        finally:
+            trans.rollback()
+            conn.close()
+
     def test_area_intersection(self):
         response = post_json(self.client, url_for("ref_geo.getAreasIntersection"), geojson)
 
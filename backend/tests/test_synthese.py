@@ -1,3 +1,6 @@
+import io
+import zipfile
+
 from flask import current_app
 from werkzeug.datastructures import ImmutableDict
 
@@ -71,6 +74,43 @@ class TestSynthese:
         data = json_of_response(response)
         assert len(data["data"]) >= 2
 
+    def test_filter_cd_ref_parent(self):
+        from sqlalchemy import select, text
+        from geonature.utils.env import DB
+        from geonature.core.gn_synthese.models import TaxrefTree
+        from geonature.core.gn_synthese.utils.taxref_tree import descendants_clause
+
+        token = get_token(self.client)
+        self.client.set_cookie("/", "token", token)
+        id_famille = DB.session.execute(
+            select([TaxrefTree.id_famille]).where(TaxrefTree.cd_nom == 713776)
+        ).scalar()
+        assert id_famille is not None
+
+        # mêmes descendants que taxonomie.find_all_taxons_children
+        children = {
+            r[0]
+            for r in DB.session.execute(
+                text("SELECT DISTINCT cd_ref FROM taxonomie.find_all_taxons_children(:ids)"),
+                {"ids": [id_famille]},
+            )
+        }
+        descendants = {
+            r[0]
+            for r in DB.session.execute(
+                select([TaxrefTree.cd_ref]).where(descendants_clause([id_famille])).distinct()
+            )
+        }
+        assert descendants == children
+
+        response = self.client.get(
+            url_for("gn_synthese.get_observations_for_web"),
+            query_string={"cd_ref_parent": id_famille},
+        )
+        assert response.status_code == 200
+        data = json_of_response(response)
+        assert 713776 in [f["properties"]["cd_nom"] for f in data["data"]["features"]]
+
     def test_get_synthese_data_cruved(self):
         # test cruved
         token = get_token(self.client, login="partenaire", password="admin")
@@ -96,6 +136,23 @@ class TestSynthese:
         # le requete doit etre OK marlgré la geom NULL
         assert response.status_code == 200
 
+    def test_get_tile(self):
+        token = get_token(self.client)
+        self.client.set_cookie("/", "token", token)
+        # clustered tile
+        response = self.client.get(url_for("gn_synthese.get_observations_tile", z=2, x=2, y=1))
+        assert response.status_code == 200
+        assert response.mimetype == "application/vnd.mapbox-vector-tile"
+        # tile with one feature per observation
+        response = self.client.get(
+            url_for("gn_synthese.get_observations_tile", z=14, x=8424, y=5917),
+            query_string={"cd_ref": 209902},
+        )
+        assert response.status_code == 200
+        # invalid tile
+        response = self.client.get(url_for("gn_synthese.get_observations_tile", z=1, x=4, y=0))
+        assert response.status_code == 400
+
     def test_export(self):
         token = get_token(self.client, login="admin", password="admin")
         self.client.set_cookie("/", "token", token)
@@ -125,6 +182,41 @@ class TestSynthese:
             query_string={"export_format": "shapefile"},
         )
         assert response.status_code == 200
+        assert response.mimetype == "application/zip"
+        # the zip is read from a temporary directory owned by the request
+        with zipfile.ZipFile(io.BytesIO(response.get_data())) as zp_file:
+            assert any(name.endswith(".shp") for name in zp_file.namelist())
+
+    def test_export_job(self):
+        token = get_token(self.client, login="admin", password="admin")
+        self.client.set_cookie("/", "token", token)
+        response = post_json(
+            self.client,
+            url_for("gn_synthese.enqueue_export_observations"),
+            json_dict=[1, 2, 3],
+            query_string={"export_format": "csv"},
+        )
+        assert response.status_code == 200
+        job = json_of_response(response)
+        assert job["module_code"] == "SYNTHESE"
+        assert job["status"] in ("pending", "running", "done")
+
+        response = self.client.get(
+            url_for("gn_exports.get_export_job", id_export_job=job["id_export_job"])
+        )
+        assert response.status_code == 200
+        assert json_of_response(response)["id_export_job"] == job["id_export_job"]
+        response = self.client.get(url_for("gn_exports.get_export_jobs"))
+        assert job["id_export_job"] in [
+            j["id_export_job"] for j in json_of_response(response)
+        ]
+        # a job of another user is not visible
+        token = get_token(self.client, login="agent", password="admin")
+        self.client.set_cookie("/", "token", token)
+        response = self.client.get(
+            url_for("gn_exports.get_export_job", id_export_job=job["id_export_job"])
+        )
+        assert response.status_code == 404
 
     def test_export_status(self):
         token = get_token(self.client)
@@ -133,6 +225,8 @@ class TestSynthese:
         response = self.client.post(url_for("gn_synthese.export_status"))
 
         assert response.status_code == 200
+        header = response.get_data(as_text=True).splitlines()[0]
+        assert header.split(";")[:3] == ['"nom_complet"', '"nom_vern"', '"cd_nom"']
 
     def test_export_metadata(self):
         token = get_token(self.client)
@@ -142,6 +236,54 @@ class TestSynthese:
 
         assert response.status_code == 200
 
+    def test_query_stats(self):
+        from geonature.core.gn_synthese.utils.query_stats import fingerprint, explain, NO_FILTER
+
+        assert fingerprint({"date_min": "2020-01-01", "cd_nom": [1], "limit": 10}) == (
+            "cd_nom,date_min"
+        )
+        assert fingerprint({"observers": "", "limit": 10}) == NO_FILTER
+
+        # le plan est calculé en lecture seule : une fonction qui écrit échoue
+        assert explain("SELECT 1", {}, 1000)[0]["Plan"]
+        with pytest.raises(Exception, match="read-only"):
+            explain("SELECT gn_synthese.refresh_dataset_stats(ARRAY[-1])", {}, 1000)
+
+        token = get_token(self.client)
+        self.client.set_cookie("/", "token", token)
+
+        response = self.client.get(url_for("gn_synthese.get_query_stats"))
+
+        assert response.status_code == 200
+        assert isinstance(json_of_response(response), list)
+
+    def test_query_stats_measure(self):
+        from sqlalchemy import event
+        from geonature.utils.env import DB
+        from geonature.core.gn_synthese.models import TQueryStats
+        from geonature.core.gn_synthese.utils import query_stats
+
+        # requêtes chronométrées hors requête HTTP (exports en tâche de fond)
+        listeners = [
+            ("before_cursor_execute", query_stats._before_cursor_execute),
+            ("after_cursor_execute", query_stats._after_cursor_execute),
+        ]
+        engine = DB.engine
+        added = [listener for listener in listeners if not event.contains(engine, *listener)]
+        for name, fn in added:
+            event.listen(engine, name, fn)
+        try:
+            with query_stats.measure("export_job.TEST", {"cd_nom": [1], "limit": 10}):
+                DB.session.execute("SELECT 1").scalar()
+        finally:
+            for name, fn in added:
+                event.remove(engine, name, fn)
+
+        stats = TQueryStats.query.filter_by(endpoint="export_job.TEST", fingerprint="cd_nom").one()
+        assert stats.nb_queries >= 1
+        DB.session.delete(stats)
+        DB.session.commit()
+
     def test_general_stat(self):
         token = get_token(self.client)
         self.client.set_cookie("/", "token", token)
@@ -150,6 +292,75 @@ class TestSynthese:
 
         assert response.status_code == 200
 
+    def test_taxons_autocomplete(self):
+        from geonature.core.gn_synthese.utils.taxons_index import trigrams_set, similarity
+        from geonature.utils.env import DB
+
+        search_name = "lynx bor"
+        response = self.client.get(
+            url_for("gn_synthese.get_autocomplete_taxons_synthese"),
+            query_string={"search_name": search_name},
+        )
+        assert response.status_code == 200
+        index_result = json_of_response(response)
+
+        # même résultat que la requête SQL
+        config = current_app.config["SYNTHESE"]
+        refresh = config["TAXONS_AUTOCOMPLETE_REFRESH"]
+        config["TAXONS_AUTOCOMPLETE_REFRESH"] = 0
+        try:
+            response = self.client.get(
+                url_for("gn_synthese.get_autocomplete_taxons_synthese"),
+                query_string={"search_name": search_name},
+            )
+        finally:
+            config["TAXONS_AUTOCOMPLETE_REFRESH"] = refresh
+        sql_result = json_of_response(response)
+        assert sorted((t["cd_nom"], t["search_name"]) for t in index_result) == sorted(
+            (t["cd_nom"], t["search_name"]) for t in sql_result
+        )
+
+        for a, b in [("Lynx boreal", "lynx bor"), ("Vulpes vulpes", "vulpe")]:
+            pg_similarity = DB.session.execute(
+                "SELECT similarity(:a, :b)", {"a": a, "b": b}
+            ).scalar()
+            assert similarity(trigrams_set(a), trigrams_set(b)) == pytest.approx(pg_similarity)
+
+    def test_dataset_stats(self):
+        from sqlalchemy import distinct, func
+        from geonature.utils.env import DB
+        from geonature.core.gn_synthese.models import Synthese
+        from geonature.core.gn_synthese.utils.stats import refresh_all_stats, refresh_dirty_stats
+
+        # les routes n'attendent pas le recalcul des JDD modifiés (tâche de fond)
+        refresh_dirty_stats()
+        id_dataset = DB.session.query(Synthese.id_dataset).first()[0]
+        # les statistiques des JDD sont celles de la synthèse
+        response = self.client.get(
+            url_for("gn_synthese.get_taxa_count"), query_string={"id_dataset": id_dataset}
+        )
+        assert response.status_code == 200
+        nb_taxa = DB.session.query(func.count(distinct(Synthese.cd_nom))).filter(
+            Synthese.id_dataset == id_dataset
+        )
+        assert json_of_response(response) == [nb_taxa.scalar()]
+
+        response = self.client.get(
+            url_for("gn_synthese.get_observation_count"), query_string={"id_dataset": id_dataset}
+        )
+        assert response.status_code == 200
+        nb_obs = DB.session.query(func.count(Synthese.cd_nom)).filter(
+            Synthese.id_dataset == id_dataset
+        )
+        assert json_of_response(response) == [nb_obs.scalar()]
+
+        # recalcul complet par lots identique
+        refresh_all_stats(batch_size=2)
+        response = self.client.get(
+            url_for("gn_synthese.get_taxa_count"), query_string={"id_dataset": id_dataset}
+        )
+        assert json_of_response(response) == [nb_taxa.scalar()]
+
     def test_get_one_synthese_reccord(self):
         token = get_token(self.client)
         self.client.set_cookie("/", "token", token)
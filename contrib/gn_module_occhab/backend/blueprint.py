@@ -1,7 +1,7 @@
 import datetime
 import json
 
-from flask import Blueprint, current_app, session, send_from_directory, request, render_template
+from flask import Blueprint, current_app, session, request, render_template
 from geojson import FeatureCollection, Feature
 from geoalchemy2.shape import from_shape
 from pypnusershub.db.models import User
@@ -17,9 +17,13 @@ from utils_flask_sqla_geo.generic import GenericTableGeo
 
 from geonature.core.gn_permissions import decorators as permissions
 from geonature.core.gn_permissions.tools import get_or_fetch_user_cruved
-from geonature.utils.env import DB, ROOT_DIR
+from geonature.utils.env import DB
 from geonature.utils.errors import GeonatureApiError
 from geonature.utils import filemanager
+from geonature.utils.reflection import get_generic_table
+from geonature.utils.utilsgeometry import create_shapes_generic
+from geonature.utils.utilsstream import stream_shapefiles_resp, DEFAULT_CHUNK_SIZE
+from geonature.core.gn_exports.jobs import register_export, enqueue_export_job, ExportQuery
 
 from .models import OneStation, TStationsOcchab, THabitatsOcchab, DefaultNomenclaturesValue
 from .query import filter_query_with_cruved
@@ -184,29 +188,22 @@ def get_all_habitats(info_role):
     return FeatureCollection(feature_list)
 
 
-@blueprint.route("/export_stations/<export_format>", methods=["POST"])
-@permissions.check_cruved_scope("E", True, module_code="OCCHAB")
-def export_all_habitats(info_role, export_format='csv',):
+@register_export("OCCHAB")
+def build_export_query(info_role, params):
     """
-        Download all stations
-        The route is in post to avoid a too large query string
-
-        .. :quickref: Occhab;
+        Build the query of the stations export
+        (used by the export route and the export job queue)
 
+        params: {'idsStation': list of the exported id_station}
     """
-
-    data = request.get_json()
-
-    export_view = GenericTableGeo(
+    export_view = get_generic_table(
+        GenericTableGeo,
         tableName="v_export_sinp",
         schemaName="pr_occhab",
         engine=DB.engine,
         geometry_field=None,
         srid=current_app.config["LOCAL_SRID"],
     )
-
-    file_name = datetime.datetime.now().strftime("%Y_%m_%d_%Hh%Mm%S")
-    file_name = filemanager.removeDisallowedFilenameChars(file_name)
     db_cols_for_shape = []
     columns_to_serialize = []
     for db_col in export_view.db_cols:
@@ -214,9 +211,38 @@ def export_all_habitats(info_role, export_format='csv',):
             if db_col.key != 'geometry':
                 db_cols_for_shape.append(db_col)
             columns_to_serialize.append(db_col.key)
-    results = DB.session.query(export_view.tableDef).filter(
-        export_view.tableDef.columns.id_station.in_(data['idsStation'])
-    ).limit(
+    q = DB.session.query(export_view.tableDef).filter(
+        export_view.tableDef.columns.id_station.in_(params['idsStation'])
+    )
+    return ExportQuery(
+        export_view=export_view,
+        query=q,
+        columns=columns_to_serialize,
+        db_cols=db_cols_for_shape,
+        geom_col=None,
+        geojson_col="geojson",
+        geojson_4326_col=None,
+    )
+
+
+@blueprint.route("/export_stations/<export_format>", methods=["POST"])
+@permissions.check_cruved_scope("E", True, module_code="OCCHAB")
+def export_all_habitats(info_role, export_format='csv',):
+    """
+        Download all stations
+        The route is in post to avoid a too large query string
+
+        .. :quickref: Occhab;
+
+    """
+
+    export_query = build_export_query(info_role, request.get_json())
+    export_view = export_query.export_view
+    columns_to_serialize = export_query.columns
+
+    file_name = datetime.datetime.now().strftime("%Y_%m_%d_%Hh%Mm%S")
+    file_name = filemanager.removeDisallowedFilenameChars(file_name)
+    results = export_query.query.limit(
         blueprint.config['NB_MAX_EXPORT']
     )
     if export_format == 'csv':
@@ -244,19 +270,17 @@ def export_all_habitats(info_role, export_format='csv',):
         )
     else:
         try:
-            filemanager.delete_recursively(
-                str(ROOT_DIR / "backend/static/shapefiles"), excluded_files=[".gitkeep"]
-            )
-
-            dir_path = str(ROOT_DIR / "backend/static/shapefiles")
-            export_view.as_shape(
-                db_cols=db_cols_for_shape,
-                data=results,
-                geojson_col="geojson",
-                dir_path=dir_path,
+            # the shapefiles are written in a temporary directory owned by the request
+            shape_service = create_shapes_generic(
+                view=export_view,
+                srid=export_view.srid,
+                db_cols=export_query.db_cols,
+                data=results.yield_per(DEFAULT_CHUNK_SIZE),
                 file_name=file_name,
+                geom_col=None,
+                geojson_col=export_query.geojson_col,
             )
-            return send_from_directory(dir_path, file_name + ".zip", as_attachment=True)
+            return stream_shapefiles_resp(shape_service, file_name)
         except GeonatureApiError as e:
             message = str(e)
 
@@ -268,6 +292,22 @@ def export_all_habitats(info_role, export_format='csv',):
         )
 
 
+@blueprint.route("/export_stations/<export_format>/jobs", methods=["POST"])
+@permissions.check_cruved_scope("E", True, module_code="OCCHAB")
+@json_resp
+def enqueue_export_habitats(info_role, export_format):
+    """
+        Run the stations export in background (export job queue)
+        Same parameters as /export_stations.
+        Follow the job and download its file with the /exports/jobs routes
+
+        .. :quickref: Occhab;
+
+    """
+    job = enqueue_export_job(info_role, 'OCCHAB', export_format, request.get_json())
+    return job.as_status()
+
+
 @blueprint.route("/defaultNomenclatures", methods=["GET"])
 @json_resp
 def getDefaultNomenclatures():
@@ -62,8 +62,8 @@ def filter_query_with_cruved(
         if user.value_filter == "1":
             q = q.filter(or_(*ors_filters))
         elif user.value_filter == "2":
-            allowed_datasets = TDatasets.get_user_datasets(
-                user, only_query=True).exists()
-            ors_filters.append(allowed_datasets)
+            ors_filters.append(
+                model_id_dataset_column.in_(TDatasets.select_user_datasets(user))
+            )
             q = q.filter(or_(*ors_filters))
     return q
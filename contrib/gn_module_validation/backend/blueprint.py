@@ -1,7 +1,6 @@
 
 import ast
 import logging
-import datetime
 from operator import itemgetter
 from sqlalchemy import select
 from flask import Blueprint, request
@@ -13,12 +12,11 @@ from pypnnomenclature.models import TNomenclatures, BibNomenclaturesTypes
 
 from geonature.utils.env import DB
 from geonature.utils.utilssqlalchemy import test_is_uuid
-from geonature.core.gn_synthese.models import Synthese
 from geonature.core.gn_synthese.utils.query_select_sqla import SyntheseQuery
 from geonature.core.gn_permissions import decorators as permissions
-from geonature.core.gn_commons.models import TValidations
 
 from .models import VSyntheseValidation
+from .query import insert_validations
 
 blueprint = Blueprint("validation", __name__)
 log = logging.getLogger()
@@ -179,50 +177,70 @@ def post_status(info_role, id_synthese):
         if id_validation_status == "":
             return "Aucun statut de validation n'est sélectionné", 400
 
-        id_synthese = id_synthese.split(",")
-
-        for id in id_synthese:
-            # t_validations.id_validation:
-
-            # t_validations.uuid_attached_row:
-            uuid = DB.session.query(Synthese.unique_id_sinp).filter(
-                Synthese.id_synthese == int(id)
-            )
-
-            # t_validations.id_validator:
-            id_validator = info_role.id_role
-
-            # t_validations.validation_date
-            val_date = datetime.datetime.now()
-
-            # t_validations.validation_auto
-            val_auto = False
-
-            # insert values in t_validations
-            addValidation = TValidations(
-                uuid,
-                id_validation_status,
-                id_validator,
-                validation_comment,
-                val_date,
-                val_auto,
-            )
-
-            DB.session.add(addValidation)
-            DB.session.commit()
-
+        insert_validations(
+            id_synthese.split(","),
+            id_validation_status,
+            info_role.id_role,
+            validation_comment,
+        )
+        DB.session.commit()
         DB.session.close()
 
         return data
 
     except Exception as e:
         log.error(e)
+        DB.session.rollback()
         return (
             'INTERNAL SERVER ERROR ("post_status() error"): contactez l\'administrateur du site',
             500,
         )
 
 
+@blueprint.route("/bulk", methods=["POST"])
+@permissions.check_cruved_scope("C", True, module_code="VALIDATION")
+@json_resp
+def post_status_bulk(info_role):
+    """
+    Validate a selection of observations in one transaction
+
+    .. :quickref: Validation;
+
+    Posted json:
+        - id_synthese (list<int>): the observations to validate
+        - statut (int): id_nomenclature of the validation status
+        - comment (str)
+
+    Returns
+    -------
+    dict
+        the posted status and comment, the number of validated observations
+        and a result per id_synthese (validated, not_found, no_uuid or invalid)
+    """
+    data = request.get_json() or {}
+    id_validation_status = data.get("statut")
+    if id_validation_status in (None, ""):
+        return "Aucun statut de validation n'est sélectionné", 400
+    id_syntheses = data.get("id_synthese")
+    if not isinstance(id_syntheses, list):
+        return "id_synthese doit être une liste", 400
+
+    try:
+        results = insert_validations(
+            id_syntheses, id_validation_status, info_role.id_role, data.get("comment")
+        )
+        DB.session.commit()
+    except Exception:
+        DB.session.rollback()
+        raise
+    return {
+        "statut": id_validation_status,
+        "comment": data.get("comment"),
+        "nb_validated": len([r for r in results if r["status"] == "validated"]),
+        "results": results,
+    }
+
+
 @blueprint.route("/definitions", methods=["GET"])
 @permissions.check_cruved_scope("R", True, module_code="VALIDATION")
 @json_resp
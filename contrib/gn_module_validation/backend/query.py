@@ -3,7 +3,21 @@ import datetime
 from flask import current_app, request
 from shapely.wkt import loads
 from geoalchemy2.shape import from_shape
-from sqlalchemy import func, or_, and_
+from sqlalchemy import (
+    func,
+    or_,
+    and_,
+    any_,
+    bindparam,
+    cast,
+    literal,
+    select,
+    Integer,
+    Boolean,
+    Unicode,
+    DateTime,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
 from sqlalchemy.orm import aliased
 
 from utils_flask_sqla_geo.utilsgeometry import circle_from_point
@@ -17,6 +31,7 @@ from geonature.core.gn_synthese.models import (
     CorAreaSynthese,
 )
 from geonature.core.gn_meta.models import TDatasets, TAcquisitionFramework
+from geonature.core.gn_commons.models import TValidations
 
 from geonature.core.gn_synthese.utils.query import (
     filter_query_with_cruved,
@@ -114,3 +129,92 @@ def filter_query_all_filters(model, q, filters, user):
             col = getattr(model.__table__.columns, colname)
             q = q.filter(col.in_(value))
     return q
+
+
+def insert_validations(
+    id_syntheses, id_nomenclature_valid_status, id_validator, validation_comment
+):
+    """
+    Insert the validation of several observations in gn_commons.t_validations
+    with two queries (and not two queries and a commit per observation):
+        - the uuids of all the observations are read with one query
+        - all the validations are inserted with one INSERT ... SELECT unnest(uuids)
+    The caller commits the transaction
+
+    parameters:
+        - id_syntheses (list): the id_synthese to validate (int or str)
+        - id_nomenclature_valid_status (int): the validation status
+        - id_validator (int): id_role of the validator
+        - validation_comment (str)
+    return:
+        list<dict>: a result per id_synthese, in the order of id_syntheses:
+            {"id_synthese": ..., "status": "validated" | "not_found" | "no_uuid" | "invalid",
+             "id_validation": ...}
+    """
+    results = []
+    ids = []
+    for id_synthese in id_syntheses:
+        try:
+            id_synthese = int(id_synthese)
+        except (TypeError, ValueError):
+            results.append({"id_synthese": id_synthese, "status": "invalid"})
+            continue
+        results.append({"id_synthese": id_synthese, "status": "not_found"})
+        ids.append(id_synthese)
+    if not ids:
+        return results
+
+    # un seul paramètre tableau, quel que soit le nombre d'observations
+    uuid_by_id = dict(
+        DB.session.execute(
+            select([Synthese.id_synthese, Synthese.unique_id_sinp]).where(
+                Synthese.id_synthese
+                == any_(bindparam("ids", value=ids, type_=ARRAY(Integer)))
+            )
+        ).fetchall()
+    )
+    uuids = list({uuid for uuid in uuid_by_id.values() if uuid is not None})
+
+    id_validation_by_uuid = {}
+    if uuids:
+        validations = TValidations.__table__
+        insert_query = validations.insert().from_select(
+            [
+                validations.c.uuid_attached_row,
+                validations.c.id_nomenclature_valid_status,
+                validations.c.id_validator,
+                validations.c.validation_comment,
+                validations.c.validation_date,
+                validations.c.validation_auto,
+            ],
+            select(
+                [
+                    func.unnest(
+                        cast(
+                            bindparam("uuids", value=[str(u) for u in uuids]),
+                            ARRAY(UUID(as_uuid=True)),
+                        )
+                    ),
+                    literal(id_nomenclature_valid_status, Integer),
+                    literal(id_validator, Integer),
+                    literal(validation_comment, Unicode),
+                    literal(datetime.datetime.now(), DateTime),
+                    literal(False, Boolean),
+                ]
+            ),
+        ).returning(validations.c.id_validation, validations.c.uuid_attached_row)
+        id_validation_by_uuid = {
+            str(r.uuid_attached_row): r.id_validation
+            for r in DB.session.execute(insert_query)
+        }
+
+    for result in results:
+        if result["status"] != "not_found" or result["id_synthese"] not in uuid_by_id:
+            continue
+        uuid = uuid_by_id[result["id_synthese"]]
+        if uuid is None:
+            result["status"] = "no_uuid"
+        else:
+            result["status"] = "validated"
+            result["id_validation"] = id_validation_by_uuid[str(uuid)]
+    return results
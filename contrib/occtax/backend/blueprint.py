@@ -6,12 +6,12 @@ from flask import (
     request,
     current_app,
     session,
-    send_from_directory,
     redirect,
     make_response,
     Response,
     render_template,
 )
+from werkzeug.datastructures import MultiDict
 from sqlalchemy import or_, func, distinct
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm import joinedload
@@ -21,13 +21,18 @@ from geoalchemy2.shape import from_shape
 
 from utils_flask_sqla_geo.utilsgeometry import remove_third_dimension
 
-from geonature.utils.env import DB, ROOT_DIR
+from geonature.utils.env import DB
 from pypnusershub.db.models import User
 from pypnusershub.db.tools import InsufficientRightsError
 from utils_flask_sqla_geo.generic import GenericTableGeo
 from utils_flask_sqla.generic import testDataType
 
 from geonature.utils import filemanager
+from geonature.utils.reflection import get_generic_table
+from geonature.utils.utilsgeometry import create_shapes_generic
+from geonature.utils.utilsstream import stream_shapefiles_resp
+from geonature.utils.utilspagination import paginate_keyset, count_results, parse_datetime
+from geonature.core.gn_exports.jobs import register_export, enqueue_export_job, ExportQuery
 from .models import (
     TRelevesOccurrence,
     TOccurrencesOccurrence,
@@ -41,6 +46,7 @@ from .repositories import (
     get_query_occtax_filters,
     get_query_occtax_order,
 )
+from .bulk import insert_releves
 from .schemas import OccurrenceSchema, ReleveCruvedSchema, ReleveSchema
 from .utils import get_nomenclature_filters
 from utils_flask_sqla.response import to_csv_resp, to_json_resp, csv_resp, json_resp
@@ -63,6 +69,15 @@ def getReleves(info_role):
 
     .. :quickref: Occtax;
 
+    :query int limit: number of releves per page
+    :query int offset: page number (LIMIT/OFFSET pagination)
+    :query str cursor: opaque cursor of the page (keyset pagination on
+        (date_min, id_releve_occtax), empty for the first page).
+        The response gives the `next_cursor` of the following page.
+        The orderby and offset parameters are ignored
+    :query str count: how to count the total <'exact', 'estimate', 'none'>
+        (default: 'exact' with offset, 'none' with cursor). The exact count
+        can be requested asynchronously with /releves/count
     """
 
     releve_repository = ReleveRepository(TRelevesOccurrence)
@@ -78,16 +93,28 @@ def getReleves(info_role):
         if (parameters.get("order", "desc")).lower() == "asc"
         else "desc",  # asc or desc
     }
+    keyset = "cursor" in parameters
 
     # Filters
     q = get_query_occtax_filters(parameters, TRelevesOccurrence, q)
-    query_without_limit = q
-    # Order by
-    q = get_query_occtax_order(orderby, TRelevesOccurrence, q)
-    data = q.limit(limit).offset(page * limit).all()
-
     # Pour obtenir le nombre de résultat de la requete sans le LIMIT
-    nb_results_without_limit = query_without_limit.count()
+    nb_results_without_limit = count_results(
+        q, parameters.get("count", "none" if keyset else "exact")
+    )
+    next_cursor = None
+    if keyset:
+        data, next_cursor = paginate_keyset(
+            q,
+            [TRelevesOccurrence.date_min, TRelevesOccurrence.id_releve_occtax],
+            cursor=parameters.get("cursor"),
+            limit=limit,
+            order=orderby["order"],
+            value_parsers=[parse_datetime, None],
+        )
+    else:
+        # Order by
+        q = get_query_occtax_order(orderby, TRelevesOccurrence, q)
+        data = q.limit(limit).offset(page * limit).all()
 
     user = info_role
     user_cruved = get_or_fetch_user_cruved(
@@ -116,10 +143,29 @@ def getReleves(info_role):
         "total_filtered": len(data),
         "page": page,
         "limit": limit,
+        "next_cursor": next_cursor,
         "items": FeatureCollection(featureCollection),
     }
 
 
+@blueprint.route("/releves/count", methods=["GET"])
+@permissions.check_cruved_scope("R", True, module_code="OCCTAX")
+@json_resp
+def getRelevesCount(info_role):
+    """
+    Exact number of releves matching the filters of /releves
+    Allow to display the first page before the count is done
+
+    .. :quickref: Occtax;
+
+    :query str count: <'exact', 'estimate'> (default: 'exact')
+    """
+    releve_repository = ReleveRepository(TRelevesOccurrence)
+    q = releve_repository.get_filtered_query(info_role)
+    q = get_query_occtax_filters(request.args, TRelevesOccurrence, q)
+    return {"total": count_results(q, request.args.get("count", "exact"))}
+
+
 @blueprint.route("/occurrences", methods=["GET"])
 @permissions.check_cruved_scope("R", module_code="OCCTAX")
 @json_resp
@@ -214,14 +260,16 @@ def getOneReleve(id_releve, info_role):
 def getViewReleveOccurrence(info_role):
     """
     Deprecated
+
+    :query str cursor: opaque cursor of the page (keyset pagination on
+        (date_min, id_releve_occtax, id_occurrence_occtax), empty for the first page)
+    :query str count: how to count the total <'exact', 'estimate', 'none'> (default: 'exact')
     """
     releve_repository = ReleveRepository(VReleveOccurrence)
     q = releve_repository.get_filtered_query(info_role)
 
     parameters = request.args
 
-    nbResultsWithoutFilter = DB.session.query(VReleveOccurrence).count()
-
     limit = int(parameters.get("limit")) if parameters.get("limit") else 100
     page = int(parameters.get("offset")) if parameters.get("offset") else 0
 
@@ -231,22 +279,40 @@ def getViewReleveOccurrence(info_role):
             col = getattr(VReleveOccurrence.__table__.columns, param)
             q = q.filter(col == parameters[param])
 
-    # Order by
-    if "orderby" in parameters:
-        if parameters.get("orderby") in VReleveOccurrence.__table__.columns:
-            orderCol = getattr(VReleveOccurrence.__table__.columns, parameters["orderby"])
+    # le total est celui des résultats filtrés (et non plus de toute la vue)
+    nbResultsWithoutFilter = count_results(q, parameters.get("count", "exact"))
+
+    next_cursor = None
+    if "cursor" in parameters:
+        data, next_cursor = paginate_keyset(
+            q,
+            [
+                VReleveOccurrence.date_min,
+                VReleveOccurrence.id_releve_occtax,
+                VReleveOccurrence.id_occurrence_occtax,
+            ],
+            cursor=parameters.get("cursor"),
+            limit=limit,
+            order="asc" if parameters.get("order") == "asc" else "desc",
+            value_parsers=[parse_datetime, None, None],
+        )
+    else:
+        # Order by
+        if "orderby" in parameters:
+            if parameters.get("orderby") in VReleveOccurrence.__table__.columns:
+                orderCol = getattr(VReleveOccurrence.__table__.columns, parameters["orderby"])
 
-        if "order" in parameters:
-            if parameters["order"] == "desc":
-                orderCol = orderCol.desc()
+            if "order" in parameters:
+                if parameters["order"] == "desc":
+                    orderCol = orderCol.desc()
 
-        q = q.order_by(orderCol)
+            q = q.order_by(orderCol)
 
-    try:
-        data = q.limit(limit).offset(page * limit).all()
-    except Exception as e:
-        DB.session.rollback()
-        raise
+        try:
+            data = q.limit(limit).offset(page * limit).all()
+        except Exception as e:
+            DB.session.rollback()
+            raise
 
     user = info_role
     user_cruved = get_or_fetch_user_cruved(
@@ -267,6 +333,7 @@ def getViewReleveOccurrence(info_role):
         return {
             "items": FeatureCollection(featureCollection),
             "total": nbResultsWithoutFilter,
+            "next_cursor": next_cursor,
         }
     return {"message": "not found"}, 404
 
@@ -398,6 +465,35 @@ def insertOrUpdateOneReleve(info_role):
     return releve.get_geofeature()
 
 
+@blueprint.route("/releves/bulk", methods=["POST"])
+@permissions.check_cruved_scope("C", True, module_code="OCCTAX")
+@json_resp
+def insertReleves(info_role):
+    """
+    Post several new Occtax releves at once (Releve + Occurrence + Counting + observers)
+    Used by the mobile applications to synchronize the releves of a field day
+
+    .. :quickref: Occtax; Post several Occtax releves
+
+    **Request JSON object:** a FeatureCollection (or a list of features)
+    with the format of the route /releve.
+    A releve whose unique_id_sinp_grp already exists is not inserted again.
+    The medias are not inserted.
+
+    :returns: list of {index, id_releve_occtax, unique_id_sinp_grp,
+        status <'created', 'existing', 'error'>, errors} in the order of the features
+    """
+    data = request.get_json()
+    features = data.get("features") if isinstance(data, dict) else data
+    if not isinstance(features, list):
+        raise GeonatureApiError("A list of features is expected", 400)
+    if len(features) > blueprint.config["MAX_BULK_RELEVES"]:
+        raise GeonatureApiError(
+            "Too many releves (maximum {})".format(blueprint.config["MAX_BULK_RELEVES"]), 400
+        )
+    return insert_releves(features, info_role)
+
+
 def releveHandler(request, *, releve, info_role):
 
     # Test des droits d'édition du relevé
@@ -715,43 +811,73 @@ def getDefaultNomenclatures():
     return {d[0]: d[1] for d in data}
 
 
-@blueprint.route("/export", methods=["GET"])
-@permissions.check_cruved_scope(
-    "E",
-    True,
-    module_code="OCCTAX",
-    redirect_on_expiration=current_app.config.get("URL_APPLICATION"),
-)
-def export(info_role):
-    """Export data from pr_occtax.v_export_occtax view (parameter)
-
-    .. :quickref: Occtax; Export data from pr_occtax.v_export_occtax
-
-    :query str format: format of the export ('csv', 'geojson', 'shapefile')
-
+@register_export("OCCTAX")
+def build_export_query(info_role, params):
+    """
+    Build the query of the export of the pr_occtax.v_export_occtax view
+    (used by the export route and the export job queue)
+
+    Parameters:
+        info_role (VUsersPermissions): the user with its CRUVED scope for the E action
+        params (dict): the filters of the export (query string as dict of list)
+    Returns:
+        ExportQuery
     """
-    export_view_name = blueprint.config["export_view_name"]
     export_geom_column = blueprint.config["export_geom_columns_name"]
     export_columns = blueprint.config["export_columns"]
-    export_srid = blueprint.config["export_srid"]
 
-    export_view = GenericTableGeo(
-        tableName=export_view_name,
+    export_view = get_generic_table(
+        GenericTableGeo,
+        tableName=blueprint.config["export_view_name"],
         schemaName="pr_occtax",
         engine=DB.engine,
         geometry_field=export_geom_column,
-        srid=export_srid,
+        srid=blueprint.config["export_srid"],
     )
 
     releve_repository = ReleveRepository(export_view)
     q = releve_repository.get_filtered_query(info_role, from_generic_table=True)
     q = get_query_occtax_filters(
-        request.args,
+        MultiDict(params),
         export_view,
         q,
         from_generic_table=True,
         obs_txt_column=blueprint.config["export_observer_txt_column"],
     )
+    return ExportQuery(
+        export_view=export_view,
+        query=q,
+        columns=(
+            export_columns
+            if len(export_columns) > 0
+            else [db_col.key for db_col in export_view.db_cols]
+        ),
+        db_cols=[db_col for db_col in export_view.db_cols if db_col.key in export_columns],
+        geom_col=export_geom_column,
+        geojson_col=None,
+        geojson_4326_col=None,
+    )
+
+
+@blueprint.route("/export", methods=["GET"])
+@permissions.check_cruved_scope(
+    "E",
+    True,
+    module_code="OCCTAX",
+    redirect_on_expiration=current_app.config.get("URL_APPLICATION"),
+)
+def export(info_role):
+    """Export data from pr_occtax.v_export_occtax view (parameter)
+
+    .. :quickref: Occtax; Export data from pr_occtax.v_export_occtax
+
+    :query str format: format of the export ('csv', 'geojson', 'shapefile')
+
+    """
+    export_query = build_export_query(info_role, request.args.to_dict(flat=False))
+    export_view = export_query.export_view
+    export_columns = blueprint.config["export_columns"]
+    q = export_query.query
 
     data = q.all()
 
@@ -760,12 +886,9 @@ def export(info_role):
 
     export_format = request.args["format"] if "format" in request.args else "geojson"
     if export_format == "csv":
-        columns = (
-            export_columns
-            if len(export_columns) > 0
-            else [db_col.key for db_col in export_view.db_cols]
+        return to_csv_resp(
+            file_name, [export_view.as_dict(d) for d in data], export_query.columns, ";"
         )
-        return to_csv_resp(file_name, [export_view.as_dict(d) for d in data], columns, ";")
     elif export_format == "geojson":
         results = FeatureCollection(
             [export_view.as_geofeature(d, columns=export_columns) for d in data]
@@ -775,16 +898,17 @@ def export(info_role):
         )
     else:
         try:
-            filemanager.delete_recursively(
-                str(ROOT_DIR / "backend/static/shapefiles"), excluded_files=[".gitkeep"]
+            # the shapefiles are written in a temporary directory owned by the request
+            shape_service = create_shapes_generic(
+                view=export_view,
+                srid=export_view.srid,
+                db_cols=export_query.db_cols,
+                data=data,
+                file_name=file_name,
+                geom_col=export_query.geom_col,
+                geojson_col=None,
             )
-            db_cols = [db_col for db_col in export_view.db_cols if db_col.key in export_columns]
-            dir_path = str(ROOT_DIR / "backend/static/shapefiles")
-            export_view.as_shape(
-                db_cols=db_cols, data=data, dir_path=dir_path, file_name=file_name
-            )
-
-            return send_from_directory(dir_path, file_name + ".zip", as_attachment=True)
+            return stream_shapefiles_resp(shape_service, file_name)
 
         except GeonatureApiError as e:
             message = str(e)
@@ -794,3 +918,22 @@ def export(info_role):
             error=message,
             redirect=current_app.config["URL_APPLICATION"] + "/#/occtax",
         )
+
+
+@blueprint.route("/export/jobs", methods=["POST"])
+@permissions.check_cruved_scope("E", True, module_code="OCCTAX")
+@json_resp
+def enqueue_export(info_role):
+    """Run the export in background (export job queue)
+
+    .. :quickref: Occtax;
+
+    Same parameters as /export.
+    Follow the job and download its file with the /exports/jobs routes
+
+    :query str format: format of the export ('csv', 'geojson', 'shapefile')
+    """
+    params = request.args.to_dict(flat=False)
+    export_format = params.pop("format", ["geojson"])[0]
+    job = enqueue_export_job(info_role, "OCCTAX", export_format, params)
+    return job.as_status()
@@ -0,0 +1,284 @@
+"""
+    Insertion en masse de relevés Occtax (synchronisation des applications mobiles)
+
+    Chaque relevé (feature GeoJSON) est validé par les schémas marshmallow du module
+    (ReleveSchema, OccurrenceSchema, CountingSchema) puis l'ensemble des relevés valides
+    est inséré en une transaction par des INSERT multi-lignes (un par table et par lot) :
+    relevés, observateurs, occurrences puis dénombrements. Les observateurs sont insérés
+    avant les dénombrements : le trigger d'insertion dans la synthèse les lit.
+    Les identifiants des lignes insérées sont retrouvés par leur UUID (RETURNING),
+    générés par l'API s'ils ne sont pas fournis.
+
+    Un relevé dont l'UUID (unique_id_sinp_grp) existe déjà n'est pas inséré à nouveau :
+    l'application mobile peut renvoyer un lot interrompu.
+    Si l'insertion du lot échoue (contrainte de la base), les relevés sont insérés
+    un par un (SAVEPOINT) pour renvoyer l'erreur de chacun.
+    Les médias des dénombrements ne sont pas insérés (comme la route /releve).
+"""
+import uuid
+
+from sqlalchemy.exc import DBAPIError
+
+from geonature.utils.env import DB
+from geonature.core.gn_meta.models import TDatasets
+from .models import (
+    TRelevesOccurrence,
+    TOccurrencesOccurrence,
+    CorCountingOccurrence,
+    corRoleRelevesOccurrence,
+)
+from .schemas import ReleveSchema
+
+# nombre maximal de lignes d'un INSERT multi-lignes
+BATCH_SIZE = 1000
+
+RELEVES = TRelevesOccurrence.__table__
+OCCURRENCES = TOccurrencesOccurrence.__table__
+COUNTINGS = CorCountingOccurrence.__table__
+OBSERVERS = corRoleRelevesOccurrence.__table__
+
+# colonnes renseignées par le client (sans clé primaire, parent, ni colonnes calculées)
+RELEVE_COLUMNS = set(RELEVES.c.keys()) - {"id_releve_occtax", "id_digitiser", "geom_local"}
+OCCURRENCE_COLUMNS = set(OCCURRENCES.c.keys()) - {"id_occurrence_occtax", "id_releve_occtax"}
+COUNTING_COLUMNS = set(COUNTINGS.c.keys()) - {"id_counting_occtax", "id_occurrence_occtax"}
+
+
+def _uuid(value=None):
+    """
+    Normalized UUID (as returned by the database), a new one if value is empty
+    """
+    return str(uuid.UUID(str(value))) if value else str(uuid.uuid4())
+
+
+def _clean(data, columns, nested=()):
+    """
+    Keep only the columns and the nested objects of a model
+    (the mobile applications also send the unknown or read only properties)
+    """
+    return {k: v for k, v in data.items() if k in columns or k in nested}
+
+
+class BulkReleve:
+    """
+    Validated releve of a bulk insertion and its rows
+    """
+
+    def __init__(self, index, feature, id_digitiser):
+        self.index = index
+        self.errors = {}
+        self.releve = None
+        self.observers = []
+        self.occurrences = []
+        self.countings = []
+
+        properties = (feature or {}).get("properties")
+        if not isinstance(properties, dict):
+            self.errors = {"properties": ["Missing properties"]}
+            return
+        if properties.get("id_releve_occtax") is not None:
+            self.errors = {"id_releve_occtax": ["Only new releves can be inserted"]}
+            return
+        if not feature.get("geometry"):
+            self.errors = {"geometry": ["Missing geometry"]}
+            return
+
+        data = _clean(properties, RELEVE_COLUMNS, ("observers", "t_occurrences_occtax"))
+        data["t_occurrences_occtax"] = [
+            dict(
+                _clean(occ, OCCURRENCE_COLUMNS, ("cor_counting_occtax",)),
+                cor_counting_occtax=[
+                    _clean(cnt, COUNTING_COLUMNS) for cnt in occ.get("cor_counting_occtax") or []
+                ],
+            )
+            for occ in data.get("t_occurrences_occtax") or []
+        ]
+        data["geom_4326"] = feature["geometry"]
+        schema = ReleveSchema()
+        self.errors = schema.validate(data)
+        if self.errors:
+            return
+
+        occurrences = data.pop("t_occurrences_occtax")
+        observers = data.pop("observers", None) or []
+        self.releve = dict(
+            data,
+            unique_id_sinp_grp=_uuid(data.get("unique_id_sinp_grp")),
+            id_digitiser=id_digitiser,
+            geom_4326=schema.fields["geom_4326"].deserialize(data["geom_4326"]),
+        )
+        self.uuid = self.releve["unique_id_sinp_grp"]
+        for id_role in dict.fromkeys(
+            o["id_role"] if isinstance(o, dict) else o for o in observers
+        ):
+            self.observers.append(
+                {
+                    "unique_id_cor_role_releve": _uuid(),
+                    "releve_uuid": self.uuid,
+                    "id_role": id_role,
+                }
+            )
+        for occ in occurrences:
+            countings = occ.pop("cor_counting_occtax")
+            occ["unique_id_occurence_occtax"] = _uuid(occ.get("unique_id_occurence_occtax"))
+            self.occurrences.append(dict(occ, releve_uuid=self.uuid))
+            for cnt in countings:
+                cnt["unique_id_sinp_occtax"] = _uuid(cnt.get("unique_id_sinp_occtax"))
+                self.countings.append(dict(cnt, occurrence_uuid=occ["unique_id_occurence_occtax"]))
+
+
+def _insert_rows(table, rows, uuid_column, id_column):
+    """
+    Insert the rows with multi-rows INSERT statements
+
+    The rows are grouped by their columns (the missing columns take their default value)
+
+    Returns:
+        dict: {uuid: id} of the inserted rows
+    """
+    by_columns = {}
+    for row in rows:
+        by_columns.setdefault(tuple(sorted(row)), []).append(row)
+    ids = {}
+    for group in by_columns.values():
+        for i in range(0, len(group), BATCH_SIZE):
+            result = DB.session.execute(
+                table.insert()
+                .values(group[i : i + BATCH_SIZE])
+                .returning(table.c[uuid_column], table.c[id_column])
+            )
+            ids.update((str(row[0]), row[1]) for row in result)
+    return ids
+
+
+def _insert(releves):
+    """
+    Insert the releves, their observers, occurrences and countings
+
+    Returns:
+        dict: {unique_id_sinp_grp: id_releve_occtax}
+    """
+    releve_ids = _insert_rows(
+        RELEVES, [r.releve for r in releves], "unique_id_sinp_grp", "id_releve_occtax"
+    )
+    observers = [
+        {
+            "unique_id_cor_role_releve": o["unique_id_cor_role_releve"],
+            "id_releve_occtax": releve_ids[o["releve_uuid"]],
+            "id_role": o["id_role"],
+        }
+        for r in releves
+        for o in r.observers
+    ]
+    if observers:
+        _insert_rows(OBSERVERS, observers, "unique_id_cor_role_releve", "id_releve_occtax")
+    occurrence_ids = _insert_rows(
+        OCCURRENCES,
+        [
+            dict(
+                {k: v for k, v in occ.items() if k != "releve_uuid"},
+                id_releve_occtax=releve_ids[occ["releve_uuid"]],
+            )
+            for r in releves
+            for occ in r.occurrences
+        ],
+        "unique_id_occurence_occtax",
+        "id_occurrence_occtax",
+    )
+    countings = [
+        dict(
+            {k: v for k, v in cnt.items() if k != "occurrence_uuid"},
+            id_occurrence_occtax=occurrence_ids[cnt["occurrence_uuid"]],
+        )
+        for r in releves
+        for cnt in r.countings
+    ]
+    if countings:
+        _insert_rows(COUNTINGS, countings, "unique_id_sinp_occtax", "id_counting_occtax")
+    return releve_ids
+
+
+def insert_releves(features, info_role):
+    """
+    Insert new releves in one transaction
+
+    Parameters:
+        features (list): GeoJSON features of the releves (same format as the route /releve)
+        info_role: user (with its "C" scope as value_filter)
+    Returns:
+        list<dict>: for each feature (in the same order):
+            {index, id_releve_occtax, unique_id_sinp_grp,
+            status: <'created', 'existing', 'error'>, errors}
+    """
+    releves = [
+        BulkReleve(index, feature, info_role.id_role) for index, feature in enumerate(features)
+    ]
+    results = [
+        {
+            "index": r.index,
+            "id_releve_occtax": None,
+            "unique_id_sinp_grp": None if r.releve is None else r.uuid,
+            "status": "error" if r.errors else "created",
+            "errors": r.errors or None,
+        }
+        for r in releves
+    ]
+    valid = [r for r in releves if not r.errors]
+
+    if info_role.value_filter in ("0", "1", "2"):
+        allowed_datasets = set(TDatasets.get_user_datasets(info_role))
+        for r in valid:
+            if r.releve.get("id_dataset") not in allowed_datasets:
+                results[r.index]["status"] = "error"
+                results[r.index]["errors"] = {
+                    "id_dataset": [
+                        "User {} has no right in dataset {}".format(
+                            info_role.id_role, r.releve.get("id_dataset")
+                        )
+                    ]
+                }
+    # UUID en double dans le lot
+    seen = set()
+    for r in valid:
+        if results[r.index]["status"] == "created":
+            if r.uuid in seen:
+                results[r.index]["status"] = "error"
+                results[r.index]["errors"] = {"unique_id_sinp_grp": ["Duplicated in the request"]}
+            seen.add(r.uuid)
+    # relevés déjà insérés (lot renvoyé)
+    existing = {}
+    if seen:
+        existing = {
+            str(row[0]): row[1]
+            for row in DB.session.query(
+                TRelevesOccurrence.unique_id_sinp_grp, TRelevesOccurrence.id_releve_occtax
+            ).filter(TRelevesOccurrence.unique_id_sinp_grp.in_(list(seen)))
+        }
+    to_insert = []
+    for r in valid:
+        if results[r.index]["status"] != "created":
+            continue
+        if r.uuid in existing:
+            results[r.index]["status"] = "existing"
+            results[r.index]["id_releve_occtax"] = existing[r.uuid]
+        else:
+            to_insert.append(r)
+
+    releve_ids = {}
+    if to_insert:
+        try:
+            with DB.session.begin_nested():
+                releve_ids = _insert(to_insert)
+        except DBAPIError:
+            # erreur de la base sur le lot : insertion relevé par relevé
+            for r in to_insert:
+                try:
+                    with DB.session.begin_nested():
+                        releve_ids.update(_insert([r]))
+                except DBAPIError as e:
+                    results[r.index]["status"] = "error"
+                    results[r.index]["errors"] = {"_database": [str(e.orig).strip()]}
+    for r in to_insert:
+        if r.uuid in releve_ids:
+            results[r.index]["id_releve_occtax"] = releve_ids[r.uuid]
+    DB.session.commit()
+    return results
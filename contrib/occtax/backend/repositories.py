@@ -91,10 +91,9 @@ class ReleveRepository:
     def filter_query_with_autorization(self, user):
         q = DB.session.query(self.model)
         if user.value_filter == "2":
-            allowed_datasets = TDatasets.get_user_datasets(user)
             q = q.filter(
                 or_(
-                    self.model.id_dataset.in_(tuple(allowed_datasets)),
+                    self.model.id_dataset.in_(TDatasets.select_user_datasets(user)),
                     self.model.observers.any(id_role=user.id_role),
                     self.model.id_digitiser == user.id_role,
                 )
@@ -121,10 +120,11 @@ class ReleveRepository:
                 == corRoleRelevesOccurrence.id_releve_occtax,
             )
             if user.value_filter == "2":
-                allowed_datasets = TDatasets.get_user_datasets(user)
                 q = q.filter(
                     or_(
-                        self.model.tableDef.columns.id_dataset.in_(tuple(allowed_datasets)),
+                        self.model.tableDef.columns.id_dataset.in_(
+                            TDatasets.select_user_datasets(user)
+                        ),
                         corRoleRelevesOccurrence.id_role == user.id_role,
                         self.model.tableDef.columns.id_digitiser == user.id_role,
                     )
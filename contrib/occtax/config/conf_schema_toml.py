@@ -165,6 +165,7 @@ class GnModuleSchemaConf(Schema):
     default_maplist_columns = fields.List(fields.Dict(), missing=default_map_list_conf)
     available_maplist_column = fields.List(fields.Dict(), missing=available_maplist_column)
     MAX_EXPORT_NUMBER = fields.Integer(missing=50000)
+    MAX_BULK_RELEVES = fields.Integer(missing=1000)
     ENABLE_GPS_TOOL = fields.Boolean(missing=True)
     ENABLE_UPLOAD_TOOL = fields.Boolean(missing=True)
     DATE_FORM_WITH_TODAY = fields.Boolean(missing=True)
@@ -0,0 +1,5 @@
+-- Mise à jour du schéma pr_occtax du module Occtax (GeoNature 2.5.5 vers 2.6.0)
+
+-- Index de la pagination par curseur (keyset) des relevés Occtax
+CREATE INDEX i_t_releves_occtax_date_min_id_releve_occtax
+    ON pr_occtax.t_releves_occtax USING btree (date_min, id_releve_occtax);
@@ -604,6 +604,7 @@ CREATE INDEX i_t_releves_occtax_id_nomenclature_tech_collect_campanule ON pr_occ
 CREATE INDEX i_t_releves_occtax_id_nomenclature_grp_typ ON pr_occtax.t_releves_occtax USING btree (id_nomenclature_grp_typ);
 CREATE INDEX i_t_releves_occtax_geom_local ON pr_occtax.t_releves_occtax USING gist (geom_local);
 CREATE INDEX i_t_releves_occtax_date_max ON pr_occtax.t_releves_occtax USING btree (date_max);
+CREATE INDEX i_t_releves_occtax_date_min_id_releve_occtax ON pr_occtax.t_releves_occtax USING btree (date_min, id_releve_occtax);
 
 CREATE INDEX i_t_occurrences_occtax_id_releve_occtax ON pr_occtax.t_occurrences_occtax USING btree (id_releve_occtax);
 CREATE INDEX i_t_occurrences_occtax_id_nomenclature_obs_technique ON pr_occtax.t_occurrences_occtax USING btree (id_nomenclature_obs_technique);
@@ -32,4 +32,32 @@ CREATE SEQUENCE t_config_exports_id_export_seq
     NO MAXVALUE
     CACHE 1;
 ALTER SEQUENCE t_config_exports_id_export_seq OWNED BY t_config_exports.id_export;
-ALTER TABLE ONLY t_config_exports ALTER COLUMN id_export SET DEFAULT nextval('t_config_exports_id_export_seq'::regclass);
\ No newline at end of file
+ALTER TABLE ONLY t_config_exports ALTER COLUMN id_export SET DEFAULT nextval('t_config_exports_id_export_seq'::regclass);
+
+CREATE TABLE t_export_jobs (
+    id_export_job serial NOT NULL,
+    id_role integer NOT NULL,
+    module_code character varying(50) NOT NULL,
+    export_format character varying(20) NOT NULL,
+    params jsonb,
+    user_permissions jsonb,
+    status character varying(20) NOT NULL DEFAULT 'pending',
+    nb_rows_total integer,
+    nb_rows_done integer DEFAULT 0,
+    file_name character varying(255),
+    file_path character varying(500),
+    error_message text,
+    meta_create_date timestamp without time zone DEFAULT now(),
+    start_date timestamp without time zone,
+    end_date timestamp without time zone,
+    CONSTRAINT pk_t_export_jobs PRIMARY KEY (id_export_job),
+    CONSTRAINT fk_t_export_jobs_id_role FOREIGN KEY (id_role)
+        REFERENCES utilisateurs.t_roles (id_role) ON UPDATE CASCADE ON DELETE CASCADE,
+    CONSTRAINT check_t_export_jobs_status CHECK (status IN ('pending', 'running', 'done', 'error'))
+);
+COMMENT ON TABLE t_export_jobs IS 'Exports (Synthese, Occtax, Occhab...) run in background by the export job queue';
+COMMENT ON COLUMN t_export_jobs.params IS 'Parameters (filters) of the export';
+COMMENT ON COLUMN t_export_jobs.user_permissions IS 'CRUVED scope of the user when the export was requested';
+COMMENT ON COLUMN t_export_jobs.nb_rows_done IS 'Number of rows already written (progress of the export)';
+CREATE INDEX i_t_export_jobs_status ON t_export_jobs (status, meta_create_date);
+CREATE INDEX i_t_export_jobs_id_role ON t_export_jobs (id_role);
@@ -522,6 +522,34 @@ INSERT INTO gn_commons.t_modules(module_code, module_label, module_picto, module
 ('METADATA', 'Metadonnées', 'fa-book', 'Module de gestion des métadonnées', 'metadata', '_self', TRUE, TRUE, 'http://docs.geonature.fr/user-manual.html#metadonnees')
 ;
 
+------------------------
+--SYNCHRONISATION MTD--
+------------------------
+CREATE TABLE gn_meta.t_mtd_sync_users (
+    id_role integer NOT NULL,
+    id_organism integer,
+    request_date timestamp without time zone DEFAULT now(),
+    sync_date timestamp without time zone,
+    sync_error text,
+    CONSTRAINT pk_t_mtd_sync_users PRIMARY KEY (id_role),
+    CONSTRAINT fk_t_mtd_sync_users_id_role FOREIGN KEY (id_role)
+        REFERENCES utilisateurs.t_roles (id_role) ON UPDATE CASCADE ON DELETE CASCADE
+);
+COMMENT ON TABLE gn_meta.t_mtd_sync_users IS 'Users whose datasets and acquisition frameworks are synchronized from the MTD web service';
+COMMENT ON COLUMN gn_meta.t_mtd_sync_users.request_date IS 'Last consultation of the metadata by the user';
+COMMENT ON COLUMN gn_meta.t_mtd_sync_users.sync_error IS 'Error of the last synchronization (NULL if it succeeded)';
+
+CREATE TABLE gn_meta.t_mtd_sync_documents (
+    url character varying(500) NOT NULL,
+    etag character varying(255),
+    last_modified character varying(100),
+    content_hash character varying(64),
+    sync_date timestamp without time zone,
+    CONSTRAINT pk_t_mtd_sync_documents PRIMARY KEY (url)
+);
+COMMENT ON TABLE gn_meta.t_mtd_sync_documents IS 'Validators (ETag, Last-Modified) and sha256 of the last XML documents synchronized from the MTD web service';
+
+
 -----------------------
 --LINK WITH T_MODULES--
 -----------------------
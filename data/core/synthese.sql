@@ -119,6 +119,61 @@ END;
 $$;
 
 
+CREATE OR REPLACE FUNCTION gn_synthese.refresh_taxref_tree() RETURNS void
+    LANGUAGE plpgsql
+    AS $$
+-- Numérote l'arbre des taxons valides de TAXREF (cd_taxsup) en intervalles (nested set) :
+-- les descendants d'un taxon sont les taxons dont le lft est compris dans ]lft, rgt] du taxon
+-- À relancer après une mise à jour de TAXREF
+-- USAGE : SELECT gn_synthese.refresh_taxref_tree();
+BEGIN
+  DELETE FROM gn_synthese.taxref_tree;
+  WITH RECURSIVE valid AS (
+    SELECT cd_nom, cd_taxsup, id_rang FROM taxonomie.taxref WHERE cd_nom = cd_ref
+  ),
+  tree AS (
+    SELECT v.cd_nom, ARRAY[v.cd_nom] AS path,
+      CASE WHEN v.id_rang = 'KD' THEN v.cd_nom END AS id_regne,
+      CASE WHEN v.id_rang = 'PH' THEN v.cd_nom END AS id_embranchement,
+      CASE WHEN v.id_rang = 'CL' THEN v.cd_nom END AS id_classe,
+      CASE WHEN v.id_rang = 'OR' THEN v.cd_nom END AS id_ordre,
+      CASE WHEN v.id_rang = 'FM' THEN v.cd_nom END AS id_famille
+    FROM valid v
+    WHERE NOT EXISTS (
+      SELECT 1 FROM valid p WHERE p.cd_nom = v.cd_taxsup AND p.cd_nom <> v.cd_nom
+    )
+    UNION ALL
+    SELECT v.cd_nom, t.path || v.cd_nom,
+      CASE WHEN v.id_rang = 'KD' THEN v.cd_nom ELSE t.id_regne END,
+      CASE WHEN v.id_rang = 'PH' THEN v.cd_nom ELSE t.id_embranchement END,
+      CASE WHEN v.id_rang = 'CL' THEN v.cd_nom ELSE t.id_classe END,
+      CASE WHEN v.id_rang = 'OR' THEN v.cd_nom ELSE t.id_ordre END,
+      CASE WHEN v.id_rang = 'FM' THEN v.cd_nom ELSE t.id_famille END
+    FROM valid v
+    JOIN tree t ON v.cd_taxsup = t.cd_nom
+    WHERE v.cd_nom <> ALL(t.path)
+  ),
+  -- parcours en profondeur (préfixe) : tri sur le chemin depuis la racine
+  numbered AS (
+    SELECT tree.*, row_number() OVER (ORDER BY path) AS lft FROM tree
+  ),
+  -- nombre de taxons de chaque sous-arbre (taxon compris)
+  sizes AS (
+    SELECT unnest(path) AS cd_ref, count(*) AS nb FROM tree GROUP BY 1
+  )
+  INSERT INTO gn_synthese.taxref_tree (
+    cd_nom, cd_ref, lft, rgt, id_regne, id_embranchement, id_classe, id_ordre, id_famille
+  )
+  SELECT t.cd_nom, n.cd_nom, n.lft, n.lft + s.nb - 1,
+    n.id_regne, n.id_embranchement, n.id_classe, n.id_ordre, n.id_famille
+  FROM numbered n
+  JOIN sizes s ON s.cd_ref = n.cd_nom
+  JOIN taxonomie.taxref t ON t.cd_ref = n.cd_nom;
+  ANALYZE gn_synthese.taxref_tree;
+END;
+$$;
+
+
 ------------------------
 --TABLES AND SEQUENCES--
 ------------------------
@@ -257,6 +312,69 @@ CREATE TABLE gn_synthese.cor_area_taxon (
   last_date timestamp without time zone NOT NULL
 );
 
+CREATE TABLE gn_synthese.taxref_tree (
+  cd_nom integer NOT NULL,
+  cd_ref integer NOT NULL,
+  lft integer NOT NULL,
+  rgt integer NOT NULL,
+  id_regne integer,
+  id_embranchement integer,
+  id_classe integer,
+  id_ordre integer,
+  id_famille integer
+);
+COMMENT ON TABLE gn_synthese.taxref_tree IS 'Intervalles (nested set) de l''arbre des taxons de TAXREF, calculés par gn_synthese.refresh_taxref_tree()';
+COMMENT ON COLUMN gn_synthese.taxref_tree.lft IS 'Rang du taxon valide (cd_ref) dans le parcours en profondeur de l''arbre : les descendants ont un lft dans ]lft, rgt]';
+COMMENT ON COLUMN gn_synthese.taxref_tree.rgt IS 'lft du dernier descendant du taxon valide (cd_ref)';
+
+CREATE TABLE gn_synthese.t_dataset_stats (
+  id_dataset integer NOT NULL,
+  nb_obs integer NOT NULL
+);
+COMMENT ON TABLE gn_synthese.t_dataset_stats IS 'Nombre d''observations de la synthèse par JDD, calculé par gn_synthese.refresh_dataset_stats()';
+
+CREATE TABLE gn_synthese.cor_dataset_taxon_stats (
+  id_dataset integer NOT NULL,
+  cd_nom integer NOT NULL,
+  nb_obs integer NOT NULL
+);
+COMMENT ON TABLE gn_synthese.cor_dataset_taxon_stats IS 'Nombre d''observations de la synthèse par JDD et taxon, calculé par gn_synthese.refresh_dataset_stats()';
+
+CREATE TABLE gn_synthese.cor_dataset_observers_stats (
+  id_dataset integer NOT NULL,
+  observers character varying(1000) NOT NULL,
+  nb_obs integer NOT NULL
+);
+COMMENT ON TABLE gn_synthese.cor_dataset_observers_stats IS 'Nombre d''observations de la synthèse par JDD et observateurs, calculé par gn_synthese.refresh_dataset_stats()';
+
+CREATE TABLE gn_synthese.t_dataset_stats_dirty (
+  id_dataset integer NOT NULL
+);
+COMMENT ON TABLE gn_synthese.t_dataset_stats_dirty IS 'JDD dont les observations ont été modifiées depuis le dernier calcul de leurs statistiques';
+
+CREATE TABLE gn_synthese.t_query_stats (
+  endpoint character varying(255) NOT NULL,
+  fingerprint character varying(1000) NOT NULL,
+  nb_queries bigint NOT NULL DEFAULT 0,
+  total_ms double precision NOT NULL DEFAULT 0,
+  max_ms double precision NOT NULL DEFAULT 0,
+  nb_slow bigint NOT NULL DEFAULT 0,
+  last_date timestamp without time zone
+);
+COMMENT ON TABLE gn_synthese.t_query_stats IS 'Durée des requêtes des routes de la synthèse, de la validation et des exports par route et combinaison de filtres (paramètre QUERY_STATS)';
+COMMENT ON COLUMN gn_synthese.t_query_stats.fingerprint IS 'Noms des filtres utilisés (sans leurs valeurs), triés';
+
+CREATE TABLE gn_synthese.t_query_samples (
+  id_sample serial NOT NULL,
+  endpoint character varying(255) NOT NULL,
+  fingerprint character varying(1000) NOT NULL,
+  sample_date timestamp without time zone NOT NULL DEFAULT now(),
+  duration_ms double precision NOT NULL,
+  statement text NOT NULL,
+  plan jsonb
+);
+COMMENT ON TABLE gn_synthese.t_query_samples IS 'Plans EXPLAIN (ANALYZE, BUFFERS) des requêtes lentes des routes de la synthèse, de la validation et des exports';
+
 
 ---------------
 --PRIMARY KEY--
@@ -276,6 +394,30 @@ ALTER TABLE ONLY cor_observer_synthese ADD CONSTRAINT pk_cor_observer_synthese P
 ALTER TABLE cor_area_taxon
   ADD CONSTRAINT pk_cor_area_taxon PRIMARY KEY (id_area, cd_nom);
 
+ALTER TABLE ONLY gn_synthese.taxref_tree
+  ADD CONSTRAINT pk_taxref_tree PRIMARY KEY (cd_nom);
+
+ALTER TABLE ONLY gn_synthese.t_dataset_stats
+  ADD CONSTRAINT pk_t_dataset_stats PRIMARY KEY (id_dataset);
+
+ALTER TABLE ONLY gn_synthese.cor_dataset_taxon_stats
+  ADD CONSTRAINT pk_cor_dataset_taxon_stats PRIMARY KEY (id_dataset, cd_nom);
+
+ALTER TABLE ONLY gn_synthese.cor_dataset_observers_stats
+  ADD CONSTRAINT pk_cor_dataset_observers_stats PRIMARY KEY (id_dataset, observers);
+
+ALTER TABLE ONLY gn_synthese.t_dataset_stats_dirty
+  ADD CONSTRAINT pk_t_dataset_stats_dirty PRIMARY KEY (id_dataset);
+
+ALTER TABLE ONLY gn_synthese.t_query_stats
+  ADD CONSTRAINT pk_t_query_stats PRIMARY KEY (endpoint, fingerprint);
+
+ALTER TABLE ONLY gn_synthese.t_query_samples
+  ADD CONSTRAINT pk_t_query_samples PRIMARY KEY (id_sample);
+
+CREATE INDEX i_t_query_samples_endpoint_fingerprint
+  ON gn_synthese.t_query_samples (endpoint, fingerprint, sample_date);
+
 ---------------
 --FOREIGN KEY--
 ---------------
@@ -385,6 +527,16 @@ ALTER TABLE cor_area_taxon
       REFERENCES ref_geo.l_areas (id_area) MATCH SIMPLE
       ON UPDATE CASCADE ON DELETE NO ACTION;
 
+ALTER TABLE ONLY gn_synthese.t_dataset_stats
+    ADD CONSTRAINT fk_t_dataset_stats_id_dataset FOREIGN KEY (id_dataset) REFERENCES gn_meta.t_datasets(id_dataset) ON UPDATE CASCADE ON DELETE CASCADE;
+
+ALTER TABLE ONLY gn_synthese.cor_dataset_taxon_stats
+    ADD CONSTRAINT fk_cor_dataset_taxon_stats_id_dataset FOREIGN KEY (id_dataset) REFERENCES gn_meta.t_datasets(id_dataset) ON UPDATE CASCADE ON DELETE CASCADE;
+
+ALTER TABLE ONLY gn_synthese.cor_dataset_observers_stats
+    ADD CONSTRAINT fk_cor_dataset_observers_stats_id_dataset FOREIGN KEY (id_dataset) REFERENCES gn_meta.t_datasets(id_dataset) ON UPDATE CASCADE ON DELETE CASCADE;
+
+
 ---------------
 --CONSTRAINTS--
 ---------------
@@ -536,6 +688,8 @@ CREATE INDEX i_synthese_the_geom_4326 ON synthese USING gist (the_geom_4326);
 
 CREATE INDEX i_synthese_the_geom_point ON synthese USING gist (the_geom_point);
 
+CREATE INDEX i_taxref_tree_lft ON gn_synthese.taxref_tree USING btree (lft);
+
 CREATE UNIQUE INDEX i_unique_cd_ref_vm_min_max_for_taxons ON gn_synthese.vm_min_max_for_taxons USING btree (cd_ref);
 
 --REFRESH MATERIALIZED VIEW CONCURRENTLY gn_synthese.vm_min_max_for_taxons;
@@ -718,66 +872,111 @@ END;
 $$;
 
 
+CREATE OR REPLACE FUNCTION gn_synthese.refresh_dataset_stats(my_id_datasets integer[] DEFAULT NULL) RETURNS void
+    LANGUAGE plpgsql
+    AS $$
+-- Calcule les statistiques par JDD de la synthèse (nombre d'observations, taxons, observateurs)
+-- des JDD my_id_datasets, ou de tous les JDD si my_id_datasets est NULL
+-- USAGE : SELECT gn_synthese.refresh_dataset_stats(ARRAY[1, 2]);
+BEGIN
+  DELETE FROM gn_synthese.t_dataset_stats_dirty
+  WHERE my_id_datasets IS NULL OR id_dataset = ANY(my_id_datasets);
+  DELETE FROM gn_synthese.t_dataset_stats
+  WHERE my_id_datasets IS NULL OR id_dataset = ANY(my_id_datasets);
+  DELETE FROM gn_synthese.cor_dataset_taxon_stats
+  WHERE my_id_datasets IS NULL OR id_dataset = ANY(my_id_datasets);
+  DELETE FROM gn_synthese.cor_dataset_observers_stats
+  WHERE my_id_datasets IS NULL OR id_dataset = ANY(my_id_datasets);
+
+  INSERT INTO gn_synthese.t_dataset_stats (id_dataset, nb_obs)
+  SELECT id_dataset, count(*)
+  FROM gn_synthese.synthese
+  WHERE id_dataset IS NOT NULL AND (my_id_datasets IS NULL OR id_dataset = ANY(my_id_datasets))
+  GROUP BY id_dataset;
+
+  INSERT INTO gn_synthese.cor_dataset_taxon_stats (id_dataset, cd_nom, nb_obs)
+  SELECT id_dataset, cd_nom, count(*)
+  FROM gn_synthese.synthese
+  WHERE id_dataset IS NOT NULL AND cd_nom IS NOT NULL
+    AND (my_id_datasets IS NULL OR id_dataset = ANY(my_id_datasets))
+  GROUP BY id_dataset, cd_nom;
+
+  INSERT INTO gn_synthese.cor_dataset_observers_stats (id_dataset, observers, nb_obs)
+  SELECT id_dataset, observers, count(*)
+  FROM gn_synthese.synthese
+  WHERE id_dataset IS NOT NULL AND observers IS NOT NULL
+    AND (my_id_datasets IS NULL OR id_dataset = ANY(my_id_datasets))
+  GROUP BY id_dataset, observers;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION gn_synthese.fct_tri_mark_dataset_stats_dirty() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+-- Marque les JDD dont les statistiques sont à recalculer (cf gn_synthese.refresh_dataset_stats)
+-- ON CONFLICT DO NOTHING : pas d'erreur si le JDD est déjà marqué. L'insertion attend
+-- la fin d'un recalcul en cours du JDD (suppression de sa ligne) : le recalcul n'est fait
+-- que par la commande geonature refresh_synthese_stats, un JDD par transaction
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.id_dataset IS NOT NULL THEN
+    INSERT INTO gn_synthese.t_dataset_stats_dirty (id_dataset) VALUES (OLD.id_dataset)
+    ON CONFLICT DO NOTHING;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.id_dataset IS NOT NULL THEN
+    INSERT INTO gn_synthese.t_dataset_stats_dirty (id_dataset) VALUES (NEW.id_dataset)
+    ON CONFLICT DO NOTHING;
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+
 ---------
 --VIEWS--
 ---------
 
 -- Vue de l'arbre taxonomique des taxons présents dans la Synthèse (jusqu'à la famille)
 CREATE OR REPLACE VIEW gn_synthese.v_tree_taxons_synthese AS
- WITH cd_famille AS (
-         SELECT t_1.cd_ref,
-            t_1.lb_nom AS nom_latin,
-            t_1.nom_vern AS nom_francais,
-            t_1.cd_nom,
-            t_1.id_rang,
-            t_1.regne,
-            t_1.phylum,
-            t_1.classe,
-            t_1.ordre,
-            t_1.famille,
-            t_1.lb_nom
-           FROM taxonomie.taxref t_1
-          WHERE (t_1.lb_nom::text IN ( SELECT DISTINCT t_2.famille
+ WITH RECURSIVE cd_noms AS (
+  -- cd_nom distincts de la synthèse (parcours de l'index i_synthese_cd_nom)
+         ( SELECT synthese.cd_nom
+           FROM gn_synthese.synthese
+          ORDER BY synthese.cd_nom
+         LIMIT 1)
+        UNION ALL
+         SELECT ( SELECT s.cd_nom
                    FROM gn_synthese.synthese s
-                     JOIN taxonomie.taxref t_2 ON t_2.cd_nom = s.cd_nom))
-        ), cd_regne AS (
-         SELECT DISTINCT taxref.cd_nom,
-            taxref.regne
-           FROM taxonomie.taxref
-          WHERE taxref.id_rang::text = 'KD'::text AND taxref.cd_nom = taxref.cd_ref
+                  WHERE s.cd_nom > c.cd_nom
+                  ORDER BY s.cd_nom
+                 LIMIT 1) AS cd_nom
+           FROM cd_noms c
+          WHERE c.cd_nom IS NOT NULL
+        ), familles AS (
+         SELECT DISTINCT tt.id_famille,
+            tt.id_regne,
+            tt.id_embranchement,
+            tt.id_classe,
+            tt.id_ordre
+           FROM cd_noms c
+             JOIN gn_synthese.taxref_tree tt ON tt.cd_nom = c.cd_nom
+          WHERE tt.id_famille IS NOT NULL
         )
  SELECT t.cd_ref,
-    t.nom_latin,
-    t.nom_francais,
-    t.id_regne,
-    t.nom_regne,
-    COALESCE(t.id_embranchement, t.id_regne) AS id_embranchement,
-    COALESCE(t.nom_embranchement, ' Sans embranchement dans taxref'::character varying) AS nom_embranchement,
-    COALESCE(t.id_classe, t.id_embranchement) AS id_classe,
-    COALESCE(t.nom_classe, ' Sans classe dans taxref'::character varying) AS nom_classe,
-    COALESCE(t.desc_classe, ' Sans classe dans taxref'::character varying) AS desc_classe,
-    COALESCE(t.id_ordre, t.id_classe) AS id_ordre,
-    COALESCE(t.nom_ordre, ' Sans ordre dans taxref'::character varying) AS nom_ordre
-   FROM ( SELECT DISTINCT t_1.cd_ref,
-            t_1.nom_latin,
-            t_1.nom_francais,
-            ( SELECT DISTINCT r.cd_nom
-                   FROM cd_regne r
-                  WHERE r.regne::text = t_1.regne::text) AS id_regne,
-            t_1.regne AS nom_regne,
-            ph.cd_nom AS id_embranchement,
-            t_1.phylum AS nom_embranchement,
-            t_1.phylum AS desc_embranchement,
-            cl.cd_nom AS id_classe,
-            t_1.classe AS nom_classe,
-            t_1.classe AS desc_classe,
-            ord.cd_nom AS id_ordre,
-            t_1.ordre AS nom_ordre
-           FROM cd_famille t_1
-             LEFT JOIN taxonomie.taxref ph ON ph.id_rang::text = 'PH'::text AND ph.cd_nom = ph.cd_ref AND ph.lb_nom::text = t_1.phylum::text AND NOT t_1.phylum IS NULL
-             LEFT JOIN taxonomie.taxref cl ON cl.id_rang::text = 'CL'::text AND cl.cd_nom = cl.cd_ref AND cl.lb_nom::text = t_1.classe::text AND NOT t_1.classe IS NULL
-             LEFT JOIN taxonomie.taxref ord ON ord.id_rang::text = 'OR'::text AND ord.cd_nom = ord.cd_ref AND ord.lb_nom::text = t_1.ordre::text AND NOT t_1.ordre IS NULL) t
-  ORDER BY t.id_regne, (COALESCE(t.id_embranchement, t.id_regne)), (COALESCE(t.id_classe, t.id_embranchement)), (COALESCE(t.id_ordre, t.id_classe));
+    t.lb_nom AS nom_latin,
+    t.nom_vern AS nom_francais,
+    f.id_regne,
+    t.regne AS nom_regne,
+    COALESCE(f.id_embranchement, f.id_regne) AS id_embranchement,
+    COALESCE(t.phylum, ' Sans embranchement dans taxref'::character varying) AS nom_embranchement,
+    COALESCE(f.id_classe, f.id_embranchement) AS id_classe,
+    COALESCE(t.classe, ' Sans classe dans taxref'::character varying) AS nom_classe,
+    COALESCE(t.classe, ' Sans classe dans taxref'::character varying) AS desc_classe,
+    COALESCE(f.id_ordre, f.id_classe) AS id_ordre,
+    COALESCE(t.ordre, ' Sans ordre dans taxref'::character varying) AS nom_ordre
+   FROM familles f
+     JOIN taxonomie.taxref t ON t.cd_nom = f.id_famille
+  ORDER BY f.id_regne, (COALESCE(f.id_embranchement, f.id_regne)), (COALESCE(f.id_classe, f.id_embranchement)), (COALESCE(f.id_ordre, f.id_classe));
 COMMENT ON VIEW gn_synthese.v_tree_taxons_synthese IS 'Vue destinée à l''arbre taxonomique de la synthese. S''arrête  à la famille pour des questions de performances';
 
 
@@ -1107,6 +1306,12 @@ CREATE TRIGGER tri_update_cor_area_taxon_update_cd_nom
   FOR EACH ROW
   EXECUTE PROCEDURE gn_synthese.fct_tri_update_cd_nom();
 
+CREATE TRIGGER tri_mark_dataset_stats_dirty
+  AFTER INSERT OR DELETE OR UPDATE OF id_dataset, cd_nom, observers
+  ON gn_synthese.synthese
+  FOR EACH ROW
+  EXECUTE PROCEDURE gn_synthese.fct_tri_mark_dataset_stats_dirty();
+
 --------
 --DATA--
 --------
@@ -1154,8 +1359,9 @@ BEGIN
 
 
   -- Import des données dans une table temporaire pour faciliter le traitement
-  DROP TABLE IF EXISTS tmp_process_import;
-  CREATE TABLE tmp_process_import (
+  -- (table temporaire propre à la session : des imports peuvent être faits en parallèle)
+  DROP TABLE IF EXISTS pg_temp.tmp_process_import;
+  CREATE TEMP TABLE tmp_process_import (
       id_synthese int,
       datain jsonb,
       action char(1)
@@ -1317,3 +1523,7 @@ CREATE OR REPLACE FUNCTION gn_synthese.import_row_from_table(
   $BODY$
     LANGUAGE plpgsql VOLATILE
     COST 100;
+
+
+-- Calcul des intervalles de l'arbre de TAXREF
+SELECT gn_synthese.refresh_taxref_tree();
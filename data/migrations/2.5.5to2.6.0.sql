@@ -0,0 +1,463 @@
+-- File d'attente des exports en tâche de fond
+SET search_path = gn_exports, pg_catalog;
+
+
+CREATE TABLE t_export_jobs (
+    id_export_job serial NOT NULL,
+    id_role integer NOT NULL,
+    module_code character varying(50) NOT NULL,
+    export_format character varying(20) NOT NULL,
+    params jsonb,
+    user_permissions jsonb,
+    status character varying(20) NOT NULL DEFAULT 'pending',
+    nb_rows_total integer,
+    nb_rows_done integer DEFAULT 0,
+    file_name character varying(255),
+    file_path character varying(500),
+    error_message text,
+    meta_create_date timestamp without time zone DEFAULT now(),
+    start_date timestamp without time zone,
+    end_date timestamp without time zone,
+    CONSTRAINT pk_t_export_jobs PRIMARY KEY (id_export_job),
+    CONSTRAINT fk_t_export_jobs_id_role FOREIGN KEY (id_role)
+        REFERENCES utilisateurs.t_roles (id_role) ON UPDATE CASCADE ON DELETE CASCADE,
+    CONSTRAINT check_t_export_jobs_status CHECK (status IN ('pending', 'running', 'done', 'error'))
+);
+COMMENT ON TABLE t_export_jobs IS 'Exports (Synthese, Occtax, Occhab...) run in background by the export job queue';
+COMMENT ON COLUMN t_export_jobs.params IS 'Parameters (filters) of the export';
+COMMENT ON COLUMN t_export_jobs.user_permissions IS 'CRUVED scope of the user when the export was requested';
+COMMENT ON COLUMN t_export_jobs.nb_rows_done IS 'Number of rows already written (progress of the export)';
+CREATE INDEX i_t_export_jobs_status ON t_export_jobs (status, meta_create_date);
+CREATE INDEX i_t_export_jobs_id_role ON t_export_jobs (id_role);
+
+
+-- Arbre de TAXREF numéroté en intervalles (filtre "descendants d'un taxon" de la Synthèse)
+CREATE TABLE gn_synthese.taxref_tree (
+  cd_nom integer NOT NULL,
+  cd_ref integer NOT NULL,
+  lft integer NOT NULL,
+  rgt integer NOT NULL,
+  id_regne integer,
+  id_embranchement integer,
+  id_classe integer,
+  id_ordre integer,
+  id_famille integer
+);
+COMMENT ON TABLE gn_synthese.taxref_tree IS 'Intervalles (nested set) de l''arbre des taxons de TAXREF, calculés par gn_synthese.refresh_taxref_tree()';
+COMMENT ON COLUMN gn_synthese.taxref_tree.lft IS 'Rang du taxon valide (cd_ref) dans le parcours en profondeur de l''arbre : les descendants ont un lft dans ]lft, rgt]';
+COMMENT ON COLUMN gn_synthese.taxref_tree.rgt IS 'lft du dernier descendant du taxon valide (cd_ref)';
+ALTER TABLE ONLY gn_synthese.taxref_tree
+  ADD CONSTRAINT pk_taxref_tree PRIMARY KEY (cd_nom);
+CREATE INDEX i_taxref_tree_lft ON gn_synthese.taxref_tree USING btree (lft);
+
+CREATE OR REPLACE FUNCTION gn_synthese.refresh_taxref_tree() RETURNS void
+    LANGUAGE plpgsql
+    AS $$
+-- Numérote l'arbre des taxons valides de TAXREF (cd_taxsup) en intervalles (nested set) :
+-- les descendants d'un taxon sont les taxons dont le lft est compris dans ]lft, rgt] du taxon
+-- À relancer après une mise à jour de TAXREF
+-- USAGE : SELECT gn_synthese.refresh_taxref_tree();
+BEGIN
+  DELETE FROM gn_synthese.taxref_tree;
+  WITH RECURSIVE valid AS (
+    SELECT cd_nom, cd_taxsup, id_rang FROM taxonomie.taxref WHERE cd_nom = cd_ref
+  ),
+  tree AS (
+    SELECT v.cd_nom, ARRAY[v.cd_nom] AS path,
+      CASE WHEN v.id_rang = 'KD' THEN v.cd_nom END AS id_regne,
+      CASE WHEN v.id_rang = 'PH' THEN v.cd_nom END AS id_embranchement,
+      CASE WHEN v.id_rang = 'CL' THEN v.cd_nom END AS id_classe,
+      CASE WHEN v.id_rang = 'OR' THEN v.cd_nom END AS id_ordre,
+      CASE WHEN v.id_rang = 'FM' THEN v.cd_nom END AS id_famille
+    FROM valid v
+    WHERE NOT EXISTS (
+      SELECT 1 FROM valid p WHERE p.cd_nom = v.cd_taxsup AND p.cd_nom <> v.cd_nom
+    )
+    UNION ALL
+    SELECT v.cd_nom, t.path || v.cd_nom,
+      CASE WHEN v.id_rang = 'KD' THEN v.cd_nom ELSE t.id_regne END,
+      CASE WHEN v.id_rang = 'PH' THEN v.cd_nom ELSE t.id_embranchement END,
+      CASE WHEN v.id_rang = 'CL' THEN v.cd_nom ELSE t.id_classe END,
+      CASE WHEN v.id_rang = 'OR' THEN v.cd_nom ELSE t.id_ordre END,
+      CASE WHEN v.id_rang = 'FM' THEN v.cd_nom ELSE t.id_famille END
+    FROM valid v
+    JOIN tree t ON v.cd_taxsup = t.cd_nom
+    WHERE v.cd_nom <> ALL(t.path)
+  ),
+  -- parcours en profondeur (préfixe) : tri sur le chemin depuis la racine
+  numbered AS (
+    SELECT tree.*, row_number() OVER (ORDER BY path) AS lft FROM tree
+  ),
+  -- nombre de taxons de chaque sous-arbre (taxon compris)
+  sizes AS (
+    SELECT unnest(path) AS cd_ref, count(*) AS nb FROM tree GROUP BY 1
+  )
+  INSERT INTO gn_synthese.taxref_tree (
+    cd_nom, cd_ref, lft, rgt, id_regne, id_embranchement, id_classe, id_ordre, id_famille
+  )
+  SELECT t.cd_nom, n.cd_nom, n.lft, n.lft + s.nb - 1,
+    n.id_regne, n.id_embranchement, n.id_classe, n.id_ordre, n.id_famille
+  FROM numbered n
+  JOIN sizes s ON s.cd_ref = n.cd_nom
+  JOIN taxonomie.taxref t ON t.cd_ref = n.cd_nom;
+  ANALYZE gn_synthese.taxref_tree;
+END;
+$$;
+
+SELECT gn_synthese.refresh_taxref_tree();
+
+DROP VIEW gn_synthese.v_tree_taxons_synthese;
+-- Vue de l'arbre taxonomique des taxons présents dans la Synthèse (jusqu'à la famille)
+CREATE OR REPLACE VIEW gn_synthese.v_tree_taxons_synthese AS
+ WITH RECURSIVE cd_noms AS (
+  -- cd_nom distincts de la synthèse (parcours de l'index i_synthese_cd_nom)
+         ( SELECT synthese.cd_nom
+           FROM gn_synthese.synthese
+          ORDER BY synthese.cd_nom
+         LIMIT 1)
+        UNION ALL
+         SELECT ( SELECT s.cd_nom
+                   FROM gn_synthese.synthese s
+                  WHERE s.cd_nom > c.cd_nom
+                  ORDER BY s.cd_nom
+                 LIMIT 1) AS cd_nom
+           FROM cd_noms c
+          WHERE c.cd_nom IS NOT NULL
+        ), familles AS (
+         SELECT DISTINCT tt.id_famille,
+            tt.id_regne,
+            tt.id_embranchement,
+            tt.id_classe,
+            tt.id_ordre
+           FROM cd_noms c
+             JOIN gn_synthese.taxref_tree tt ON tt.cd_nom = c.cd_nom
+          WHERE tt.id_famille IS NOT NULL
+        )
+ SELECT t.cd_ref,
+    t.lb_nom AS nom_latin,
+    t.nom_vern AS nom_francais,
+    f.id_regne,
+    t.regne AS nom_regne,
+    COALESCE(f.id_embranchement, f.id_regne) AS id_embranchement,
+    COALESCE(t.phylum, ' Sans embranchement dans taxref'::character varying) AS nom_embranchement,
+    COALESCE(f.id_classe, f.id_embranchement) AS id_classe,
+    COALESCE(t.classe, ' Sans classe dans taxref'::character varying) AS nom_classe,
+    COALESCE(t.classe, ' Sans classe dans taxref'::character varying) AS desc_classe,
+    COALESCE(f.id_ordre, f.id_classe) AS id_ordre,
+    COALESCE(t.ordre, ' Sans ordre dans taxref'::character varying) AS nom_ordre
+   FROM familles f
+     JOIN taxonomie.taxref t ON t.cd_nom = f.id_famille
+  ORDER BY f.id_regne, (COALESCE(f.id_embranchement, f.id_regne)), (COALESCE(f.id_classe, f.id_embranchement)), (COALESCE(f.id_ordre, f.id_classe));
+COMMENT ON VIEW gn_synthese.v_tree_taxons_synthese IS 'Vue destinée à l''arbre taxonomique de la synthese. S''arrête  à la famille pour des questions de performances';
+
+
+-- Statistiques par JDD de la synthèse (routes general_stats, taxa_count, observation_count, taxa_distribution)
+CREATE TABLE gn_synthese.t_dataset_stats (
+  id_dataset integer NOT NULL,
+  nb_obs integer NOT NULL
+);
+COMMENT ON TABLE gn_synthese.t_dataset_stats IS 'Nombre d''observations de la synthèse par JDD, calculé par gn_synthese.refresh_dataset_stats()';
+
+CREATE TABLE gn_synthese.cor_dataset_taxon_stats (
+  id_dataset integer NOT NULL,
+  cd_nom integer NOT NULL,
+  nb_obs integer NOT NULL
+);
+COMMENT ON TABLE gn_synthese.cor_dataset_taxon_stats IS 'Nombre d''observations de la synthèse par JDD et taxon, calculé par gn_synthese.refresh_dataset_stats()';
+
+CREATE TABLE gn_synthese.cor_dataset_observers_stats (
+  id_dataset integer NOT NULL,
+  observers character varying(1000) NOT NULL,
+  nb_obs integer NOT NULL
+);
+COMMENT ON TABLE gn_synthese.cor_dataset_observers_stats IS 'Nombre d''observations de la synthèse par JDD et observateurs, calculé par gn_synthese.refresh_dataset_stats()';
+
+CREATE TABLE gn_synthese.t_dataset_stats_dirty (
+  id_dataset integer NOT NULL
+);
+COMMENT ON TABLE gn_synthese.t_dataset_stats_dirty IS 'JDD dont les observations ont été modifiées depuis le dernier calcul de leurs statistiques';
+
+ALTER TABLE ONLY gn_synthese.t_dataset_stats
+  ADD CONSTRAINT pk_t_dataset_stats PRIMARY KEY (id_dataset);
+
+ALTER TABLE ONLY gn_synthese.cor_dataset_taxon_stats
+  ADD CONSTRAINT pk_cor_dataset_taxon_stats PRIMARY KEY (id_dataset, cd_nom);
+
+ALTER TABLE ONLY gn_synthese.cor_dataset_observers_stats
+  ADD CONSTRAINT pk_cor_dataset_observers_stats PRIMARY KEY (id_dataset, observers);
+
+ALTER TABLE ONLY gn_synthese.t_dataset_stats_dirty
+  ADD CONSTRAINT pk_t_dataset_stats_dirty PRIMARY KEY (id_dataset);
+
+ALTER TABLE ONLY gn_synthese.t_dataset_stats
+    ADD CONSTRAINT fk_t_dataset_stats_id_dataset FOREIGN KEY (id_dataset) REFERENCES gn_meta.t_datasets(id_dataset) ON UPDATE CASCADE ON DELETE CASCADE;
+
+ALTER TABLE ONLY gn_synthese.cor_dataset_taxon_stats
+    ADD CONSTRAINT fk_cor_dataset_taxon_stats_id_dataset FOREIGN KEY (id_dataset) REFERENCES gn_meta.t_datasets(id_dataset) ON UPDATE CASCADE ON DELETE CASCADE;
+
+ALTER TABLE ONLY gn_synthese.cor_dataset_observers_stats
+    ADD CONSTRAINT fk_cor_dataset_observers_stats_id_dataset FOREIGN KEY (id_dataset) REFERENCES gn_meta.t_datasets(id_dataset) ON UPDATE CASCADE ON DELETE CASCADE;
+
+CREATE OR REPLACE FUNCTION gn_synthese.refresh_dataset_stats(my_id_datasets integer[] DEFAULT NULL) RETURNS void
+    LANGUAGE plpgsql
+    AS $$
+-- Calcule les statistiques par JDD de la synthèse (nombre d'observations, taxons, observateurs)
+-- des JDD my_id_datasets, ou de tous les JDD si my_id_datasets est NULL
+-- USAGE : SELECT gn_synthese.refresh_dataset_stats(ARRAY[1, 2]);
+BEGIN
+  DELETE FROM gn_synthese.t_dataset_stats_dirty
+  WHERE my_id_datasets IS NULL OR id_dataset = ANY(my_id_datasets);
+  DELETE FROM gn_synthese.t_dataset_stats
+  WHERE my_id_datasets IS NULL OR id_dataset = ANY(my_id_datasets);
+  DELETE FROM gn_synthese.cor_dataset_taxon_stats
+  WHERE my_id_datasets IS NULL OR id_dataset = ANY(my_id_datasets);
+  DELETE FROM gn_synthese.cor_dataset_observers_stats
+  WHERE my_id_datasets IS NULL OR id_dataset = ANY(my_id_datasets);
+
+  INSERT INTO gn_synthese.t_dataset_stats (id_dataset, nb_obs)
+  SELECT id_dataset, count(*)
+  FROM gn_synthese.synthese
+  WHERE id_dataset IS NOT NULL AND (my_id_datasets IS NULL OR id_dataset = ANY(my_id_datasets))
+  GROUP BY id_dataset;
+
+  INSERT INTO gn_synthese.cor_dataset_taxon_stats (id_dataset, cd_nom, nb_obs)
+  SELECT id_dataset, cd_nom, count(*)
+  FROM gn_synthese.synthese
+  WHERE id_dataset IS NOT NULL AND cd_nom IS NOT NULL
+    AND (my_id_datasets IS NULL OR id_dataset = ANY(my_id_datasets))
+  GROUP BY id_dataset, cd_nom;
+
+  INSERT INTO gn_synthese.cor_dataset_observers_stats (id_dataset, observers, nb_obs)
+  SELECT id_dataset, observers, count(*)
+  FROM gn_synthese.synthese
+  WHERE id_dataset IS NOT NULL AND observers IS NOT NULL
+    AND (my_id_datasets IS NULL OR id_dataset = ANY(my_id_datasets))
+  GROUP BY id_dataset, observers;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION gn_synthese.fct_tri_mark_dataset_stats_dirty() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+-- Marque les JDD dont les statistiques sont à recalculer (cf gn_synthese.refresh_dataset_stats)
+-- ON CONFLICT DO NOTHING : pas d'erreur si le JDD est déjà marqué. L'insertion attend
+-- la fin d'un recalcul en cours du JDD (suppression de sa ligne) : le recalcul n'est fait
+-- que par la commande geonature refresh_synthese_stats, un JDD par transaction
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.id_dataset IS NOT NULL THEN
+    INSERT INTO gn_synthese.t_dataset_stats_dirty (id_dataset) VALUES (OLD.id_dataset)
+    ON CONFLICT DO NOTHING;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.id_dataset IS NOT NULL THEN
+    INSERT INTO gn_synthese.t_dataset_stats_dirty (id_dataset) VALUES (NEW.id_dataset)
+    ON CONFLICT DO NOTHING;
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER tri_mark_dataset_stats_dirty
+  AFTER INSERT OR DELETE OR UPDATE OF id_dataset, cd_nom, observers
+  ON gn_synthese.synthese
+  FOR EACH ROW
+  EXECUTE PROCEDURE gn_synthese.fct_tri_mark_dataset_stats_dirty();
+
+SELECT gn_synthese.refresh_dataset_stats();
+
+
+-- Import dans la synthèse : table de travail temporaire (propre à la session)
+-- pour permettre des imports en parallèle (commande geonature import_synthese_from_table)
+DROP TABLE IF EXISTS public.tmp_process_import;
+
+CREATE OR REPLACE FUNCTION gn_synthese.import_json_row(datain jsonb, datageojson text DEFAULT NULL::text)
+ RETURNS boolean
+ LANGUAGE plpgsql
+AS $function$
+  DECLARE
+    insert_columns text;
+    select_columns text;
+    update_columns text;
+
+    geom geometry;
+    geom_data jsonb;
+    local_srid int;
+
+   postgis_maj_num_version int;
+BEGIN
+
+
+  -- Import des données dans une table temporaire pour faciliter le traitement
+  -- (table temporaire propre à la session : des imports peuvent être faits en parallèle)
+  DROP TABLE IF EXISTS pg_temp.tmp_process_import;
+  CREATE TEMP TABLE tmp_process_import (
+      id_synthese int,
+      datain jsonb,
+      action char(1)
+  );
+  INSERT INTO tmp_process_import (datain)
+  SELECT datain;
+
+  postgis_maj_num_version := (SELECT split_part(version, '.', 1)::int FROM pg_available_extension_versions WHERE name = 'postgis' AND installed = true);
+
+  -- Cas ou la geométrie est passée en geojson
+  IF NOT datageojson IS NULL THEN
+    geom := (SELECT ST_setsrid(ST_GeomFromGeoJSON(datageojson), 4326));
+    local_srid := (SELECT parameter_value FROM gn_commons.t_parameters WHERE parameter_name = 'local_srid');
+    geom_data := (
+        SELECT json_build_object(
+            'the_geom_4326',geom,
+            'the_geom_point',(SELECT ST_centroid(geom)),
+            'the_geom_local',(SELECT ST_transform(geom, local_srid))
+        )
+    );
+
+    UPDATE tmp_process_import d
+      SET datain = d.datain || geom_data;
+  END IF;
+
+-- ############ TEST
+
+  -- colonne unique_id_sinp exists
+  IF EXISTS (
+        SELECT 1 FROM jsonb_object_keys(datain) column_name WHERE column_name =  'unique_id_sinp'
+    ) IS FALSE THEN
+        RAISE NOTICE 'Column unique_id_sinp is mandatory';
+        RETURN FALSE;
+  END IF ;
+
+-- ############ mapping colonnes
+
+  WITH import_col AS (
+    SELECT jsonb_object_keys(datain) AS column_name
+  ), synt_col AS (
+      SELECT column_name, column_default, CASE WHEN data_type = 'USER-DEFINED' THEN udt_name ELSE data_type END as data_type
+      FROM information_schema.columns
+      WHERE table_schema || '.' || table_name = 'gn_synthese.synthese'
+  )
+  SELECT
+      string_agg(s.column_name, ',')  as insert_columns,
+      string_agg(
+          CASE
+              WHEN NOT column_default IS NULL THEN
+              'COALESCE(' || gn_synthese.import_json_row_format_insert_data(i.column_name, data_type::varchar, postgis_maj_num_version) || ', ' || column_default || ') as ' || i.column_name
+          ELSE gn_synthese.import_json_row_format_insert_data(i.column_name, data_type::varchar, postgis_maj_num_version)
+          END, ','
+      ) as select_columns ,
+      string_agg(
+          s.column_name || '=' ||
+          CASE
+            WHEN NOT column_default IS NULL
+            	THEN  'COALESCE(' || gn_synthese.import_json_row_format_insert_data(i.column_name, data_type::varchar, postgis_maj_num_version) || ', ' || column_default || ') '
+  			ELSE gn_synthese.import_json_row_format_insert_data(i.column_name, data_type::varchar, postgis_maj_num_version)
+          END
+      , ',')
+  INTO insert_columns, select_columns, update_columns
+  FROM synt_col s
+  JOIN import_col i
+  ON i.column_name = s.column_name;
+
+  -- ############# IMPORT DATA
+  IF EXISTS (
+      SELECT 1
+      FROM   gn_synthese.synthese
+      WHERE  unique_id_sinp = (datain->>'unique_id_sinp')::uuid
+  ) IS TRUE THEN
+    -- Update
+    EXECUTE ' WITH i_row AS (
+          UPDATE gn_synthese.synthese s SET ' || update_columns ||
+          ' FROM  tmp_process_import
+          WHERE s.unique_id_sinp =  (datain->>''unique_id_sinp'')::uuid
+          RETURNING s.id_synthese, s.unique_id_sinp
+          )
+          UPDATE tmp_process_import d SET id_synthese = i_row.id_synthese
+          FROM i_row
+          WHERE unique_id_sinp = i_row.unique_id_sinp
+          ' ;
+  ELSE
+    -- Insert
+    EXECUTE 'WITH i_row AS (
+          INSERT INTO gn_synthese.synthese ( ' || insert_columns || ')
+          SELECT ' || select_columns ||
+          ' FROM tmp_process_import
+          RETURNING id_synthese, unique_id_sinp
+          )
+          UPDATE tmp_process_import d SET id_synthese = i_row.id_synthese
+          FROM i_row
+          WHERE unique_id_sinp = i_row.unique_id_sinp
+          ' ;
+  END IF;
+
+  -- Import des cor_observers
+  DELETE FROM gn_synthese.cor_observer_synthese
+  USING tmp_process_import
+  WHERE cor_observer_synthese.id_synthese = tmp_process_import.id_synthese;
+
+  IF jsonb_typeof(datain->'ids_observers') = 'array' THEN
+    INSERT INTO gn_synthese.cor_observer_synthese (id_synthese, id_role)
+    SELECT DISTINCT id_synthese, (jsonb_array_elements(t.datain->'ids_observers'))::text::int
+    FROM tmp_process_import t;
+  END IF;
+
+  RETURN TRUE;
+  END;
+$function$
+;
+
+
+-- Synchronisation en tâche de fond des métadonnées du webservice MTD
+CREATE TABLE gn_meta.t_mtd_sync_users (
+    id_role integer NOT NULL,
+    id_organism integer,
+    request_date timestamp without time zone DEFAULT now(),
+    sync_date timestamp without time zone,
+    sync_error text,
+    CONSTRAINT pk_t_mtd_sync_users PRIMARY KEY (id_role),
+    CONSTRAINT fk_t_mtd_sync_users_id_role FOREIGN KEY (id_role)
+        REFERENCES utilisateurs.t_roles (id_role) ON UPDATE CASCADE ON DELETE CASCADE
+);
+COMMENT ON TABLE gn_meta.t_mtd_sync_users IS 'Users whose datasets and acquisition frameworks are synchronized from the MTD web service';
+COMMENT ON COLUMN gn_meta.t_mtd_sync_users.request_date IS 'Last consultation of the metadata by the user';
+COMMENT ON COLUMN gn_meta.t_mtd_sync_users.sync_error IS 'Error of the last synchronization (NULL if it succeeded)';
+
+CREATE TABLE gn_meta.t_mtd_sync_documents (
+    url character varying(500) NOT NULL,
+    etag character varying(255),
+    last_modified character varying(100),
+    content_hash character varying(64),
+    sync_date timestamp without time zone,
+    CONSTRAINT pk_t_mtd_sync_documents PRIMARY KEY (url)
+);
+COMMENT ON TABLE gn_meta.t_mtd_sync_documents IS 'Validators (ETag, Last-Modified) and sha256 of the last XML documents synchronized from the MTD web service';
+
+CREATE TABLE gn_synthese.t_query_stats (
+  endpoint character varying(255) NOT NULL,
+  fingerprint character varying(1000) NOT NULL,
+  nb_queries bigint NOT NULL DEFAULT 0,
+  total_ms double precision NOT NULL DEFAULT 0,
+  max_ms double precision NOT NULL DEFAULT 0,
+  nb_slow bigint NOT NULL DEFAULT 0,
+  last_date timestamp without time zone
+);
+COMMENT ON TABLE gn_synthese.t_query_stats IS 'Durée des requêtes des routes de la synthèse, de la validation et des exports par route et combinaison de filtres (paramètre QUERY_STATS)';
+COMMENT ON COLUMN gn_synthese.t_query_stats.fingerprint IS 'Noms des filtres utilisés (sans leurs valeurs), triés';
+
+CREATE TABLE gn_synthese.t_query_samples (
+  id_sample serial NOT NULL,
+  endpoint character varying(255) NOT NULL,
+  fingerprint character varying(1000) NOT NULL,
+  sample_date timestamp without time zone NOT NULL DEFAULT now(),
+  duration_ms double precision NOT NULL,
+  statement text NOT NULL,
+  plan jsonb
+);
+COMMENT ON TABLE gn_synthese.t_query_samples IS 'Plans EXPLAIN (ANALYZE, BUFFERS) des requêtes lentes des routes de la synthèse, de la validation et des exports';
+
+ALTER TABLE ONLY gn_synthese.t_query_stats
+  ADD CONSTRAINT pk_t_query_stats PRIMARY KEY (endpoint, fingerprint);
+
+ALTER TABLE ONLY gn_synthese.t_query_samples
+  ADD CONSTRAINT pk_t_query_samples PRIMARY KEY (id_sample);
+
+CREATE INDEX i_t_query_samples_endpoint_fingerprint
+  ON gn_synthese.t_query_samples (endpoint, fingerprint, sample_date);